@@ -41,7 +41,6 @@ import shutil
 import time
 import stat
 import errno
-import re
 import random
 import logging
 import tempfile
@@ -60,6 +59,7 @@ from ganeti import ssconf
 from ganeti import serializer
 from ganeti import netutils
 from ganeti import runtime
+from ganeti import compat
 
 
 _BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
@@ -76,9 +76,6 @@ _IES_STATUS_FILE = "status"
 _IES_PID_FILE = "pid"
 _IES_CA_FILE = "ca"
 
-#: Valid LVS output line regex
-_LVSLINE_REGEX = re.compile("^ *([^|]+)\|([^|]+)\|([0-9.]+)\|([^|]{6})\|?$")
-
 
 class RPCFail(Exception):
   """Class denoting RPC failure.
@@ -463,6 +460,7 @@ def GetNodeInfo(vgname, hypervisor_type):
   return outputarray
 
 
+@bdev.SharedLVMInventory
 def VerifyNode(what, cluster_name):
   """Verify the status of the local node.
 
@@ -707,22 +705,16 @@ def GetVolumeList(vg_names):
 
   """
   lvs = {}
-  sep = '|'
-  if not vg_names:
-    vg_names = []
-  result = utils.RunCmd(["lvs", "--noheadings", "--units=m", "--nosuffix",
-                         "--separator=%s" % sep,
-                         "-ovg_name,lv_name,lv_size,lv_attr"] + vg_names)
-  if result.failed:
-    _Fail("Failed to list logical volumes, lvs output: %s", result.output)
-
-  for line in result.stdout.splitlines():
-    line = line.strip()
-    match = _LVSLINE_REGEX.match(line)
-    if not match:
-      logging.error("Invalid line returned from lvs output: '%s'", line)
+  try:
+    info = bdev.LogicalVolume.GetLVInfo(vg_names)
+  except errors.GenericError, err:
+    _Fail("Failed to list logical volumes: %s", err)
+
+  for (vg_name, name, size, attr, _, _, _, _, _) in info:
+    if len(attr) != 6:
+      logging.error("Invalid attributes returned for LV %s/%s: '%s'",
+                    vg_name, name, attr)
       continue
-    vg_name, name, size, attr = match.groups()
     inactive = attr[4] == '-'
     online = attr[5] == 'o'
     virtual = attr[0] == 'v'
@@ -765,12 +757,10 @@ def NodeVolumes():
     multiple times.
 
   """
-  result = utils.RunCmd(["lvs", "--noheadings", "--units=m", "--nosuffix",
-                         "--separator=|",
-                         "--options=lv_name,lv_size,devices,vg_name"])
-  if result.failed:
-    _Fail("Failed to list logical volumes, lvs output: %s",
-          result.output)
+  try:
+    info = bdev.LogicalVolume.GetLVInfo()
+  except errors.GenericError, err:
+    _Fail("Failed to list logical volumes: %s", err)
 
   def parse_dev(dev):
     return dev.split('(')[0]
@@ -778,17 +768,10 @@ def NodeVolumes():
   def handle_dev(dev):
     return [parse_dev(x) for x in dev.split(",")]
 
-  def map_line(line):
-    line = [v.strip() for v in line]
-    return [{'name': line[0], 'size': line[1],
-             'dev': dev, 'vg': line[3]} for dev in handle_dev(line[2])]
-
   all_devs = []
-  for line in result.stdout.splitlines():
-    if line.count('|') >= 3:
-      all_devs.extend(map_line(line.split('|')))
-    else:
-      logging.warning("Strange line in the output from lvs: '%s'", line)
+  for (vg_name, name, size, _, _, _, _, _, devices) in info:
+    all_devs.extend([{'name': name, 'size': size, 'dev': dev, 'vg': vg_name}
+                     for dev in handle_dev(devices)])
   return all_devs
 
 
@@ -1086,6 +1069,7 @@ def _GatherAndLinkBlockDevs(instance):
   return block_devices
 
 
+@bdev.SharedLVMInventory
 def StartInstance(instance):
   """Start an instance.
 
@@ -1237,6 +1221,7 @@ def MigrationInfo(instance):
   return info
 
 
+@bdev.SharedLVMInventory
 def AcceptInstance(instance, info, target):
   """Prepare the node to accept an instance.
 
@@ -1308,6 +1293,7 @@ def MigrateInstance(instance, target, live):
     _Fail("Failed to migrate instance: %s", err, exc=True)
 
 
+@bdev.SharedLVMInventory
 def BlockdevCreate(disk, size, owner, on_primary, info):
   """Creates a block device for an instance.
 
@@ -1390,6 +1376,7 @@ def _WipeDevice(path, offset, size):
           result.fail_reason, result.output)
 
 
+@bdev.SharedLVMInventory
 def BlockdevWipe(disk, offset, size):
   """Wipes a block device.
 
@@ -1418,6 +1405,7 @@ def BlockdevWipe(disk, offset, size):
   _WipeDevice(rdev.dev_path, offset, size)
 
 
+@bdev.SharedLVMInventory
 def BlockdevPauseResumeSync(disks, pause):
   """Pause or resume the sync of the block device.
 
@@ -1453,6 +1441,7 @@ def BlockdevPauseResumeSync(disks, pause):
   return success
 
 
+@bdev.SharedLVMInventory
 def BlockdevRemove(disk):
   """Remove a block device.
 
@@ -1545,6 +1534,7 @@ def _RecursiveAssembleBD(disk, owner, as_primary):
   return result
 
 
+@bdev.SharedLVMInventory
 def BlockdevAssemble(disk, owner, as_primary, idx):
   """Activate a block device for an instance.
 
@@ -1570,6 +1560,7 @@ def BlockdevAssemble(disk, owner, as_primary, idx):
   return result
 
 
+@bdev.SharedLVMInventory
 def BlockdevShutdown(disk):
   """Shut down a block device.
 
@@ -1608,6 +1599,7 @@ def BlockdevShutdown(disk):
     _Fail("; ".join(msgs))
 
 
+@bdev.SharedLVMInventory
 def BlockdevAddchildren(parent_cdev, new_cdevs):
   """Extend a mirrored block device.
 
@@ -1627,6 +1619,7 @@ def BlockdevAddchildren(parent_cdev, new_cdevs):
   parent_bdev.AddChildren(new_bdevs)
 
 
+@bdev.SharedLVMInventory
 def BlockdevRemovechildren(parent_cdev, new_cdevs):
   """Shrink a mirrored block device.
 
@@ -1656,6 +1649,8 @@ def BlockdevRemovechildren(parent_cdev, new_cdevs):
   parent_bdev.RemoveChildren(devs)
 
 
+@bdev.SharedDRBDSnapshot
+@bdev.SharedLVMInventory
 def BlockdevGetmirrorstatus(disks):
   """Get the mirroring status of a list of devices.
 
@@ -1678,6 +1673,8 @@ def BlockdevGetmirrorstatus(disks):
   return stats
 
 
+@bdev.SharedDRBDSnapshot
+@bdev.SharedLVMInventory
 def BlockdevGetmirrorstatusMulti(disks):
   """Get the mirroring status of a list of devices.
 
@@ -1745,6 +1742,8 @@ def _OpenRealBD(disk):
   return real_disk
 
 
+@bdev.SharedDRBDSnapshot
+@bdev.SharedLVMInventory
 def BlockdevFind(disk):
   """Check if a device is activated.
 
@@ -1768,6 +1767,7 @@ def BlockdevFind(disk):
   return rbd.GetSyncStatus()
 
 
+@bdev.SharedLVMInventory
 def BlockdevGetsize(disks):
   """Computes the size of the given disks.
 
@@ -1794,6 +1794,7 @@ def BlockdevGetsize(disks):
   return result
 
 
+@bdev.SharedLVMInventory
 def BlockdevExport(disk, dest_node, dest_path, cluster_name):
   """Export a block device to a remote node.
 
@@ -1882,6 +1883,89 @@ def UploadFile(file_name, data, mode, uid, gid, atime, mtime):
                       atime=atime, mtime=mtime)
 
 
+def _ApplyConfigDelta(data, delta):
+  """Applies configuration changes to a serialized configuration.
+
+  @type data: dict
+  @param data: the configuration, modified in place
+  @type delta: list or tuple
+  @param delta: the changed and removed entries, see
+      C{config._ComputeConfigDelta}
+
+  """
+  (changed, removed) = delta
+
+  for (key, subkey, value) in changed:
+    if subkey is None:
+      data[key] = value
+    else:
+      data.setdefault(key, {})[subkey] = value
+
+  for (key, subkey) in removed:
+    if subkey is None:
+      data.pop(key, None)
+    else:
+      data.get(key, {}).pop(subkey, None)
+
+
+def UploadConfigDelta(file_name, base_serial, data, checksum, mode, uid, gid):
+  """Applies changes to the configuration file.
+
+  The changes are only applied if the current configuration file has the
+  serial number they are based on; the result is written atomically and only
+  if it matches the given checksum. In all other cases the master has to
+  upload the complete file.
+
+  @type file_name: str
+  @param file_name: the configuration file name
+  @type base_serial: int
+  @param base_serial: the serial number the changes are based on
+  @type data: list or tuple
+  @param data: the compressed, serialized changes
+  @type checksum: str
+  @param checksum: the SHA1 checksum of the resulting file
+  @type mode: int
+  @param mode: the mode to give the file
+  @type uid: string
+  @param uid: the owner of the file
+  @type gid: string
+  @param gid: the group of the file
+  @rtype: None
+
+  """
+  if file_name != constants.CLUSTER_CONF_FILE:
+    _Fail("Filename passed to UploadConfigDelta is not the configuration"
+          " file: '%s'", file_name)
+
+  if not (isinstance(uid, basestring) and isinstance(gid, basestring)):
+    _Fail("Invalid username/groupname type")
+
+  try:
+    config = serializer.Load(utils.ReadFile(file_name))
+  except EnvironmentError, err:
+    _Fail("Can't read configuration file: %s", err)
+  except ValueError, err:
+    _Fail("Can't parse configuration file: %s", err)
+
+  if config.get("serial_no", None) != base_serial:
+    _Fail("Configuration has serial number %s, changes are based on %s",
+          config.get("serial_no", None), base_serial)
+
+  _ApplyConfigDelta(config, serializer.LoadJson(_Decompress(data)))
+
+  raw_data = serializer.Dump(config)
+
+  if compat.sha1_hash(raw_data).hexdigest() != checksum:
+    _Fail("Checksum mismatch after applying configuration changes")
+
+  getents = runtime.GetEnts()
+  uid = getents.LookupUser(uid)
+  gid = getents.LookupGroup(gid)
+
+  utils.SafeWriteFile(file_name, None,
+                      data=raw_data, mode=mode, uid=uid, gid=gid)
+
+
 def RunOob(oob_program, command, node, timeout):
   """Executes oob_program with given command on given node.
 
@@ -2177,6 +2261,7 @@ def OSCoreEnv(os_name, inst_os, os_params, debug=0):
   return result
 
 
+@bdev.SharedLVMInventory
 def OSEnvironment(instance, inst_os, debug=0):
   """Calculate the environment for an os script.
 
@@ -2239,6 +2324,7 @@ def OSEnvironment(instance, inst_os, debug=0):
   return result
 
 
+@bdev.SharedLVMInventory
 def BlockdevGrow(disk, amount, dryrun):
   """Grow a stack of block devices.
 
@@ -2267,6 +2353,7 @@ def BlockdevGrow(disk, amount, dryrun):
     _Fail("Failed to grow block device: %s", err, exc=True)
 
 
+@bdev.SharedLVMInventory
 def BlockdevSnapshot(disk):
   """Create a snapshot copy of a block device.
 
@@ -2430,6 +2517,7 @@ def RemoveExport(export):
     _Fail("Error while removing the export: %s", err, exc=True)
 
 
+@bdev.SharedLVMInventory
 def BlockdevRename(devlist):
   """Rename a list of block devices.
 
@@ -2635,6 +2723,7 @@ def JobQueueRename(old, new):
   utils.RenameFile(old, new, mkdir=True)
 
 
+@bdev.SharedLVMInventory
 def BlockdevClose(instance_name, disks):
   """Closes the given block devices.
 
@@ -2955,6 +3044,7 @@ def _CreateImportExportStatusDir(prefix):
                                   (prefix, utils.TimestampForFilename())))
 
 
+@bdev.SharedLVMInventory
 def StartImportExportDaemon(mode, opts, host, port, instance, ieio, ieioargs):
   """Starts an import or export daemon.
 
@@ -3166,6 +3256,7 @@ def _FindDisks(nodes_ip, disks):
   return bdevs
 
 
+@bdev.SharedLVMInventory
 def DrbdDisconnectNet(nodes_ip, disks):
   """Disconnects the network on a list of drbd devices.
 
@@ -3181,6 +3272,7 @@ def DrbdDisconnectNet(nodes_ip, disks):
             err, exc=True)
 
 
+@bdev.SharedLVMInventory
 def DrbdAttachNet(nodes_ip, disks, instance_name, multimaster):
   """Attaches the network on a list of drbd devices.
 
@@ -3243,6 +3335,7 @@ def DrbdAttachNet(nodes_ip, disks, instance_name, multimaster):
         _Fail("Can't change to primary mode: %s", err)
 
 
+@bdev.SharedLVMInventory
 def DrbdWaitSync(nodes_ip, disks):
   """Wait until DRBDs have synchronized.
 
@@ -3314,12 +3407,18 @@ class HooksRunner(object):
   on the master side.
 
   """
-  def __init__(self, hooks_base_dir=None):
+  def __init__(self, hooks_base_dir=None, max_parallel=1, timeout=None):
     """Constructor for hooks runner.
 
     @type hooks_base_dir: str or None
     @param hooks_base_dir: if not None, this overrides the
         L{constants.HOOKS_BASE_DIR} (useful for unittests)
+    @type max_parallel: int
+    @param max_parallel: how many hooks of a directory may run at the
+        same time
+    @type timeout: int or None
+    @param timeout: if not None, timeout in seconds after which a hook
+        is killed and reported as failed
 
     """
     if hooks_base_dir is None:
@@ -3327,6 +3426,8 @@ class HooksRunner(object):
     # yeah, _BASE_DIR is not valid for attributes, we use it like a
     # constant
     self._BASE_DIR = hooks_base_dir # pylint: disable-msg=C0103
+    self._max_parallel = max_parallel
+    self._timeout = timeout
 
   def RunHooks(self, hpath, phase, env):
     """Run the scripts in the hooks directory.
@@ -3340,11 +3441,12 @@ class HooksRunner(object):
     @type env: dict
     @param env: dictionary with the environment for the hook
     @rtype: list
-    @return: list of 3-element tuples:
+    @return: list of 4-element tuples:
       - script path
       - script result, either L{constants.HKR_SUCCESS} or
         L{constants.HKR_FAIL}
       - output of the script
+      - how long the script ran (seconds), C{None} if it wasn't run
 
     @raise errors.ProgrammerError: for invalid input
         parameters
@@ -3368,9 +3470,12 @@ class HooksRunner(object):
       # warning at every operation
       return results
 
-    runparts_results = utils.RunParts(dir_name, env=env, reset_env=True)
+    runparts_results = utils.RunParts(dir_name, env=env, reset_env=True,
+                                      timeout=self._timeout,
+                                      max_parallel=self._max_parallel)
 
     for (relname, relstatus, runresult)  in runparts_results:
+      duration = None
       if relstatus == constants.RUNPARTS_SKIP:
         rrval = constants.HKR_SKIP
         output = ""
@@ -3383,7 +3488,11 @@ class HooksRunner(object):
         else:
           rrval = constants.HKR_SUCCESS
         output = utils.SafeEncode(runresult.output.strip())
-      results.append(("%s/%s" % (subdir, relname), rrval, output))
+        if runresult.timed_out:
+          output = ("Hook script %s\n%s" %
+                    (runresult.fail_reason, output)).strip()
+        duration = runresult.duration
+      results.append(("%s/%s" % (subdir, relname), rrval, output, duration))
 
     return results
 
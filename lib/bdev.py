@@ -366,6 +366,107 @@ class BlockDev(object):
              self.major, self.minor, self.dev_path))
 
 
+class LVMInventory(object):
+  """Inventory of the LVM objects on this node.
+
+  The logical volumes, volume groups and physical volumes are each listed
+  with a single LVM command, run the first time the respective kind of
+  objects is needed. If listing the logical volumes fails, the error is
+  raised again on later lookups without running the command again. Lines
+  of the C{lvs} output which can't be parsed are logged and skipped.
+
+  """
+  LV_FIELDS = ["vg_name", "lv_name", "lv_size", "lv_attr", "lv_kernel_major",
+               "lv_kernel_minor", "vg_extent_size", "stripes", "devices"]
+  VG_FIELDS = ["vg_name", "vg_free", "vg_attr", "vg_size"]
+  PV_FIELDS = ["pv_name", "vg_name", "pv_free", "pv_attr"]
+
+  def __init__(self, _get_info_fn=None):
+    """Initializes this class.
+
+    """
+    if _get_info_fn is None:
+      _get_info_fn = LogicalVolume._GetVolumeInfo # pylint: disable-msg=W0212
+
+    self._get_info_fn = _get_info_fn
+    self._lvs = None
+    self._lvs_error = None
+    self._lv_by_name = None
+    self._vgs = None
+    self._pvs = None
+
+  def GetLVs(self, vg_names=None):
+    """Returns the logical volumes.
+
+    Since some of the fields are segment fields, multi-segment logical
+    volumes are listed once per segment.
+
+    @type vg_names: list
+    @param vg_names: if given, only the logical volumes in these volume
+        groups are returned; unless all logical volumes have already been
+        listed, only these volume groups are queried
+    @rtype: list
+    @return: list of lists with the fields from L{LV_FIELDS}
+
+    """
+    if vg_names and self._lvs is None:
+      # Don't query other volume groups just for these
+      return self._get_info_fn("lvs", self.LV_FIELDS, names=vg_names,
+                               skip_invalid=True)
+
+    if self._lvs_error is not None:
+      raise self._lvs_error
+    if self._lvs is None:
+      try:
+        self._lvs = self._get_info_fn("lvs", self.LV_FIELDS,
+                                      skip_invalid=True)
+      except errors.GenericError, err:
+        self._lvs_error = err
+        raise
+
+    if vg_names:
+      return [row for row in self._lvs if row[0] in vg_names]
+
+    return self._lvs
+
+  def FindLV(self, vg_name, lv_name):
+    """Returns the information about one logical volume.
+
+    For multi-segment logical volumes the last segment is returned.
+
+    @rtype: list or None
+    @return: the fields from L{LV_FIELDS}, or C{None} if the logical volume
+        does not exist
+
+    """
+    if self._lv_by_name is None:
+      self._lv_by_name = dict(((row[0], row[1]), row)
+                              for row in self.GetLVs())
+    return self._lv_by_name.get((vg_name, lv_name), None)
+
+  def GetVGs(self):
+    """Returns the volume groups.
+
+    @rtype: list
+    @return: list of lists with the fields from L{VG_FIELDS}
+
+    """
+    if self._vgs is None:
+      self._vgs = self._get_info_fn("vgs", self.VG_FIELDS)
+    return self._vgs
+
+  def GetPVs(self):
+    """Returns the physical volumes.
+
+    @rtype: list
+    @return: list of lists with the fields from L{PV_FIELDS}
+
+    """
+    if self._pvs is None:
+      self._pvs = self._get_info_fn("pvs", self.PV_FIELDS)
+    return self._pvs
+
+
 class LogicalVolume(BlockDev):
   """Logical Volume block device.
 
@@ -374,6 +475,9 @@ class LogicalVolume(BlockDev):
   _INVALID_NAMES = frozenset([".", "..", "snapshot", "pvmove"])
   _INVALID_SUBSTRINGS = frozenset(["_mlog", "_mimage"])
 
+  _shared_inventory_active = False
+  _shared_inventory = None
+
   def __init__(self, unique_id, children, size):
     """Attaches to a LV device.
 
@@ -431,17 +535,22 @@ class LogicalVolume(BlockDev):
       result = utils.RunCmd(cmd + ["-i%d" % stripes_arg] + [vg_name] + pvlist)
       if not result.failed:
         break
+    cls._InvalidateInventory()
     if result.failed:
       _ThrowError("LV create failed (%s): %s",
                   result.fail_reason, result.output)
     return LogicalVolume(unique_id, children, size)
 
   @staticmethod
-  def _GetVolumeInfo(lvm_cmd, fields):
+  def _GetVolumeInfo(lvm_cmd, fields, names=None, skip_invalid=False):
     """Returns LVM Volumen infos using lvm_cmd
 
     @param lvm_cmd: Should be one of "pvs", "vgs" or "lvs"
     @param fields: Fields to return
+    @param names: Names of the objects to list (e.g. volume groups for
+        "lvs"), all objects are listed if empty
+    @param skip_invalid: Whether to log and skip lines which can't be
+        parsed instead of failing
     @return: A list of dicts each with the parsed fields
 
     """
@@ -451,6 +560,8 @@ class LogicalVolume(BlockDev):
     sep = "|"
     cmd = [lvm_cmd, "--noheadings", "--nosuffix", "--units=m", "--unbuffered",
            "--separator=%s" % sep, "-o%s" % ",".join(fields)]
+    if names:
+      cmd.extend(names)
 
     result = utils.RunCmd(cmd)
     if result.failed:
@@ -462,6 +573,10 @@ class LogicalVolume(BlockDev):
       splitted_fields = line.strip().split(sep)
 
       if len(fields) != len(splitted_fields):
+        if skip_invalid:
+          logging.error("Invalid line returned from %s output: '%s'",
+                        lvm_cmd, line)
+          continue
         raise errors.CommandError("Can't parse %s output: line '%s'" %
                                   (lvm_cmd, line))
 
@@ -469,6 +584,76 @@ class LogicalVolume(BlockDev):
 
     return data
 
+  def _GetSingleLVInfo(self):
+    """Runs C{lvs} for this logical volume only.
+
+    @rtype: tuple or None
+    @return: the attributes, major and minor number, extent size and number
+        of stripes, or C{None} if the logical volume can't be found
+
+    """
+    result = utils.RunCmd(["lvs", "--noheadings", "--separator=,",
+                           "--units=m", "--nosuffix",
+                           "-olv_attr,lv_kernel_major,lv_kernel_minor,"
+                           "vg_extent_size,stripes", self.dev_path])
+    if result.failed:
+      logging.error("Can't find LV %s: %s, %s",
+                    self.dev_path, result.fail_reason, result.output)
+      return None
+    # the output can (and will) have multiple lines for multi-segment
+    # LVs, as the 'stripes' parameter is a segment one, so we take
+    # only the last entry, which is the one we're interested in; note
+    # that with LVM2 anyway the 'stripes' value must be constant
+    # across segments, so this is a no-op actually
+    out = result.stdout.splitlines()
+    if not out: # totally empty result? splitlines() returns at least
+                # one line for any non-empty string
+      logging.error("Can't parse LVS output, no lines? Got '%s'", str(out))
+      return None
+    out = out[-1].strip().rstrip(',')
+    out = out.split(",")
+    if len(out) != 5:
+      logging.error("Can't parse LVS output, len(%s) != 5", str(out))
+      return None
+    return tuple(out)
+
+  @staticmethod
+  def _GetInventory():
+    """Returns an inventory of the LVM objects.
+
+    While a shared inventory is active (see L{SharedLVMInventory}), the same
+    inventory is returned to all callers until it is invalidated.
+
+    @rtype: L{LVMInventory}
+
+    """
+    if not LogicalVolume._shared_inventory_active:
+      return LVMInventory()
+
+    if LogicalVolume._shared_inventory is None:
+      LogicalVolume._shared_inventory = LVMInventory()
+
+    return LogicalVolume._shared_inventory
+
+  @staticmethod
+  def _InvalidateInventory():
+    """Discards the shared inventory after LVM objects have been modified.
+
+    """
+    LogicalVolume._shared_inventory = None
+
+  @classmethod
+  def GetLVInfo(cls, vg_names=None):
+    """Get the information about logical volumes.
+
+    @param vg_names: list of volume group names, if empty all will be returned
+    @rtype: list
+    @return: list of lists with the fields from L{LVMInventory.LV_FIELDS},
+        one per segment of each logical volume
+
+    """
+    return cls._GetInventory().GetLVs(vg_names=vg_names)
+
   @classmethod
   def GetPVInfo(cls, vg_names, filter_allocatable=True):
     """Get the free space info for PVs in a volume group.
@@ -481,8 +666,7 @@ class LogicalVolume(BlockDev):
 
     """
     try:
-      info = cls._GetVolumeInfo("pvs", ["pv_name", "vg_name", "pv_free",
-                                        "pv_attr"])
+      info = cls._GetInventory().GetPVs()
     except errors.GenericError, err:
       logging.error("Can't get PV information: %s", err)
       return None
@@ -512,8 +696,7 @@ class LogicalVolume(BlockDev):
 
     """
     try:
-      info = cls._GetVolumeInfo("vgs", ["vg_name", "vg_free", "vg_attr",
-                                        "vg_size"])
+      info = cls._GetInventory().GetVGs()
     except errors.GenericError, err:
       logging.error("Can't get VG information: %s", err)
       return None
@@ -553,6 +736,7 @@ class LogicalVolume(BlockDev):
       return
     result = utils.RunCmd(["lvremove", "-f", "%s/%s" %
                            (self._vg_name, self._lv_name)])
+    self._InvalidateInventory()
     if result.failed:
       _ThrowError("Can't lvremove: %s - %s", result.fail_reason, result.output)
 
@@ -568,6 +752,7 @@ class LogicalVolume(BlockDev):
                                    " volume groups (from %s to to %s)" %
                                    (self._vg_name, new_vg))
     result = utils.RunCmd(["lvrename", new_vg, self._lv_name, new_name])
+    self._InvalidateInventory()
     if result.failed:
       _ThrowError("Failed to rename the logical volume: %s", result.output)
     self._lv_name = new_name
@@ -582,31 +767,28 @@ class LogicalVolume(BlockDev):
 
     """
     self.attached = False
-    result = utils.RunCmd(["lvs", "--noheadings", "--separator=,",
-                           "--units=m", "--nosuffix",
-                           "-olv_attr,lv_kernel_major,lv_kernel_minor,"
-                           "vg_extent_size,stripes", self.dev_path])
-    if result.failed:
-      logging.error("Can't find LV %s: %s, %s",
-                    self.dev_path, result.fail_reason, result.output)
-      return False
-    # the output can (and will) have multiple lines for multi-segment
-    # LVs, as the 'stripes' parameter is a segment one, so we take
-    # only the last entry, which is the one we're interested in; note
-    # that with LVM2 anyway the 'stripes' value must be constant
-    # across segments, so this is a no-op actually
-    out = result.stdout.splitlines()
-    if not out: # totally empty result? splitlines() returns at least
-                # one line for any non-empty string
-      logging.error("Can't parse LVS output, no lines? Got '%s'", str(out))
-      return False
-    out = out[-1].strip().rstrip(',')
-    out = out.split(",")
-    if len(out) != 5:
-      logging.error("Can't parse LVS output, len(%s) != 5", str(out))
+    # Listing all logical volumes only pays off if the listing is shared
+    # with other lookups
+    if not self._shared_inventory_active:
+      info = self._GetSingleLVInfo()
+    else:
+      try:
+        row = self._GetInventory().FindLV(self._vg_name, self._lv_name)
+      except errors.GenericError, err:
+        logging.warning("Can't list logical volumes, looking up %s on its"
+                        " own: %s", self.dev_path, err)
+        info = self._GetSingleLVInfo()
+      else:
+        if row is None:
+          logging.error("Can't find LV %s", self.dev_path)
+          return False
+        # the inventory returns the last segment of multi-segment LVs, as
+        # the 'stripes' parameter is a segment one; note that with LVM2
+        # anyway the 'stripes' value must be constant across segments
+        info = tuple(row[3:8])
+    if info is None:
       return False
-
-    status, major, minor, pe_size, stripes = out
+    (status, major, minor, pe_size, stripes) = info
     if len(status) != 6:
       logging.error("lvs lv_attr is not 6 characters (%s)", status)
       return False
@@ -647,6 +829,7 @@ class LogicalVolume(BlockDev):
 
     """
     result = utils.RunCmd(["lvchange", "-ay", self.dev_path])
+    self._InvalidateInventory()
     if result.failed:
       _ThrowError("Can't activate lv %s: %s", self.dev_path, result.output)
 
@@ -732,6 +915,7 @@ class LogicalVolume(BlockDev):
 
     result = utils.RunCmd(["lvcreate", "-L%dm" % size, "-s",
                            "-n%s" % snap_name, self.dev_path])
+    self._InvalidateInventory()
     if result.failed:
       _ThrowError("command: %s error: %s - %s",
                   result.cmd, result.fail_reason, result.output)
@@ -778,6 +962,8 @@ class LogicalVolume(BlockDev):
     for alloc_policy in "contiguous", "cling", "normal":
       result = utils.RunCmd(cmd + ["--alloc", alloc_policy, self.dev_path])
       if not result.failed:
+        if not dryrun:
+          self._InvalidateInventory()
         return
     _ThrowError("Can't grow LV %s: %s", self.dev_path, result.output)
 
@@ -887,6 +1073,80 @@ class DRBD8Status(object):
       self.est_time = None
 
 
+class DRBD8ProcSnapshot(object):
+  """Contents of /proc/drbd at a given point in time.
+
+  The data is only parsed on demand, and at most once per minor.
+
+  """
+  def __init__(self, lines):
+    """Initializes this class.
+
+    @type lines: list
+    @param lines: lines read from /proc/drbd
+
+    """
+    self.lines = lines
+    self._version = None
+    self._minor_lines = None
+    self._status = {}
+
+  def GetVersion(self):
+    """Returns the DRBD version, see L{BaseDRBD._GetVersion}.
+
+    """
+    if self._version is None:
+      self._version = BaseDRBD._GetVersion(self.lines)
+    return self._version
+
+  def _GetMinorLines(self):
+    """Returns the joined lines of all minors.
+
+    """
+    if self._minor_lines is None:
+      self._minor_lines = BaseDRBD._MassageProcData(self.lines)
+    return self._minor_lines
+
+  def GetMinors(self):
+    """Returns the list of minors in /proc/drbd.
+
+    """
+    return self._GetMinorLines().keys()
+
+  def GetMinorStatus(self, minor):
+    """Returns the status of a minor.
+
+    @rtype: L{DRBD8Status} or None
+    @return: the status, or None if the minor is not in /proc/drbd
+
+    """
+    status = self._status.get(minor)
+    if status is None:
+      line = self._GetMinorLines().get(minor)
+      if line is None:
+        return None
+      status = DRBD8Status(line)
+      self._status[minor] = status
+    return status
+
+  def GetAllMinorsStatus(self):
+    """Returns the status of all minors in /proc/drbd.
+
+    Minors whose status can't be parsed are logged and left out.
+
+    @rtype: dict
+    @return: dictionary of minor to L{DRBD8Status}
+
+    """
+    result = {}
+    for minor in self.GetMinors():
+      try:
+        result[minor] = self.GetMinorStatus(minor)
+      except errors.BlockDeviceError, err:
+        logging.warning("Can't get status of DRBD minor %s: %s", minor, err)
+    return result
+
+
 class BaseDRBD(BlockDev): # pylint: disable-msg=W0223
   """Base DRBD class.
 
@@ -907,6 +1167,10 @@ class BaseDRBD(BlockDev): # pylint: disable-msg=W0223
   _STATUS_FILE = "/proc/drbd"
   _USERMODE_HELPER_FILE = "/sys/module/drbd/parameters/usermode_helper"
 
+  # Snapshot of /proc/drbd shared by all devices, see L{SharedDRBDSnapshot}
+  _shared_snapshot_active = False
+  _shared_snapshot = None
+
   @staticmethod
   def _GetProcData(filename=_STATUS_FILE):
     """Return data from /proc/drbd.
@@ -924,6 +1188,24 @@ class BaseDRBD(BlockDev): # pylint: disable-msg=W0223
       _ThrowError("Can't read any data from %s", filename)
     return data
 
+  @classmethod
+  def _GetProcSnapshot(cls):
+    """Returns a snapshot of /proc/drbd.
+
+    While a shared snapshot is active (see L{SharedDRBDSnapshot}), the file
+    is read only once and the same snapshot is returned to all callers.
+
+    @rtype: L{DRBD8ProcSnapshot}
+
+    """
+    if not BaseDRBD._shared_snapshot_active:
+      return DRBD8ProcSnapshot(cls._GetProcData())
+
+    if BaseDRBD._shared_snapshot is None:
+      BaseDRBD._shared_snapshot = DRBD8ProcSnapshot(cls._GetProcData())
+
+    return BaseDRBD._shared_snapshot
+
   @classmethod
   def _MassageProcData(cls, data):
     """Transform the output of _GetProdData into a nicer form.
@@ -1011,7 +1293,7 @@ class BaseDRBD(BlockDev): # pylint: disable-msg=W0223
     """Compute the list of used DRBD devices.
 
     """
-    data = cls._GetProcData()
+    data = cls._GetProcSnapshot().lines
 
     used_devs = {}
     for line in data:
@@ -1112,7 +1394,7 @@ class DRBD8(BaseDRBD):
         children = []
     super(DRBD8, self).__init__(unique_id, children, size)
     self.major = self._DRBD_MAJOR
-    version = self._GetVersion(self._GetProcData())
+    version = self._GetProcSnapshot().GetVersion()
     if version['k_major'] != 8 :
       _ThrowError("Mismatch in DRBD kernel version and requested ganeti"
                   " usage: kernel is %s.%s, ganeti wants 8.x",
@@ -1539,10 +1821,20 @@ class DRBD8(BaseDRBD):
     """
     if self.minor is None:
       _ThrowError("drbd%d: GetStats() called while not attached", self._aminor)
-    proc_info = self._MassageProcData(self._GetProcData())
-    if self.minor not in proc_info:
+    status = self._GetProcSnapshot().GetMinorStatus(self.minor)
+    if status is None:
       _ThrowError("drbd%d: can't find myself in /proc", self.minor)
-    return DRBD8Status(proc_info[self.minor])
+    return status
+
+  @classmethod
+  def GetAllMinorsStatus(cls):
+    """Returns the status of all minors in /proc/drbd.
+
+    @rtype: dict
+    @return: dictionary of minor to L{DRBD8Status}
+
+    """
+    return cls._GetProcSnapshot().GetAllMinorsStatus()
 
   def GetSyncStatus(self):
     """Returns the sync status of the device.
@@ -1900,9 +2192,8 @@ class DRBD8(BaseDRBD):
       raise errors.ProgrammerError("Invalid setup for the drbd device")
     # check that the minor is unused
     aminor = unique_id[4]
-    proc_info = cls._MassageProcData(cls._GetProcData())
-    if aminor in proc_info:
-      status = DRBD8Status(proc_info[aminor])
+    status = cls._GetProcSnapshot().GetMinorStatus(aminor)
+    if status is not None:
       in_use = status.is_in_use
     else:
       in_use = False
@@ -2202,6 +2493,53 @@ if constants.ENABLE_FILE_STORAGE or constants.ENABLE_SHARED_FILE_STORAGE:
   DEV_MAP[constants.LD_FILE] = FileStorage
 
 
+def SharedLVMInventory(fn):
+  """Decorator sharing one LVM inventory during a function call.
+
+  While the decorated function runs, all logical volumes are looked up in
+  the same L{LVMInventory}, so that each of the C{lvs}, C{vgs} and C{pvs}
+  commands is run at most once. Modifications done through
+  L{LogicalVolume} discard the inventory, which is then read again when
+  next needed.
+
+  """
+  def wrapper(*args, **kwargs):
+    # pylint: disable-msg=W0212
+    if LogicalVolume._shared_inventory_active:
+      return fn(*args, **kwargs)
+
+    LogicalVolume._shared_inventory_active = True
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      LogicalVolume._shared_inventory_active = False
+      LogicalVolume._shared_inventory = None
+  return wrapper
+
+
+def SharedDRBDSnapshot(fn):
+  """Decorator sharing one snapshot of /proc/drbd during a function call.
+
+  While the decorated function runs, all DRBD devices use the same parsed
+  contents of /proc/drbd, which is read at most once. This must only be used
+  for functions which neither modify DRBD devices nor wait for their state to
+  change.
+
+  """
+  def wrapper(*args, **kwargs):
+    # pylint: disable-msg=W0212
+    if BaseDRBD._shared_snapshot_active:
+      return fn(*args, **kwargs)
+
+    BaseDRBD._shared_snapshot_active = True
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      BaseDRBD._shared_snapshot_active = False
+      BaseDRBD._shared_snapshot = None
+  return wrapper
+
+
 def FindDevice(dev_type, unique_id, children, size):
   """Search for an existing, assembled device.
 
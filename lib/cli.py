@@ -98,6 +98,7 @@ __all__ = [
   "IGNORE_SECONDARIES_OPT",
   "IGNORE_SIZE_OPT",
   "INTERVAL_OPT",
+  "LIVE_DATA_MAX_AGE_OPT",
   "MAC_PREFIX_OPT",
   "MAINTAIN_NODE_HEALTH_OPT",
   "MASTER_NETDEV_OPT",
@@ -1204,6 +1205,13 @@ FORCE_FILTER_OPT = cli_option("-F", "--filter", dest="force_filter",
                               help=("Whether command argument should be treated"
                                     " as filter"))
 
+LIVE_DATA_MAX_AGE_OPT = cli_option("--cached", dest="live_data_max_age",
+                                   type="int", default=None,
+                                   metavar="<seconds>",
+                                   help=("Accept live data cached by the"
+                                         " master daemon if not older than"
+                                         " this many seconds"))
+
 NO_REMEMBER_OPT = cli_option("--no-remember",
                              dest="no_remember",
                              action="store_true", default=False,
@@ -2605,7 +2613,8 @@ def _WarnUnknownFields(fdefs):
 
 
 def GenericList(resource, fields, names, unit, separator, header, cl=None,
-                format_override=None, verbose=False, force_filter=False):
+                format_override=None, verbose=False, force_filter=False,
+                live_data_max_age=None):
   """Generic implementation for listing all items of a resource.
 
   @param resource: One of L{constants.QR_VIA_LUXI}
@@ -2628,6 +2637,9 @@ def GenericList(resource, fields, names, unit, separator, header, cl=None,
     indexed by field name, contents like L{_DEFAULT_FORMAT_QUERY}
   @type verbose: boolean
   @param verbose: whether to use verbose field descriptions or not
+  @type live_data_max_age: int or None
+  @param live_data_max_age: Maximum age of cached live data to accept, see
+    L{luxi.Client.Query}
 
   """
   if cl is None:
@@ -2649,7 +2661,8 @@ def GenericList(resource, fields, names, unit, separator, header, cl=None,
   else:
     filter_ = qlang.MakeSimpleFilter("name", names)
 
-  response = cl.Query(resource, fields, filter_)
+  response = cl.Query(resource, fields, filter_,
+                      live_data_max_age=live_data_max_age)
 
   found_unknown = _WarnUnknownFields(response.fields)
 
@@ -513,6 +513,9 @@ def ListLocks(opts, args): # pylint: disable-msg=W0613
     "pending": (_DashIfNone(_FormatPending), False),
     }
 
+  for name in ["wait_time", "wait_p99", "hold_time", "hold_p99"]:
+    fmtoverride[name] = (lambda value: "%.3f" % value, True)
+
   while True:
     ret = GenericList(constants.QR_LOCK, selected_fields, None, None,
                       opts.separator, not opts.no_headers,
@@ -521,6 +524,9 @@ def ListLocks(opts, args): # pylint: disable-msg=W0613
     if ret != constants.EXIT_SUCCESS:
       return ret
 
+    if opts.reset_stats:
+      GetClient().ResetLockStats()
+
     if not opts.interval:
       break
 
@@ -530,6 +536,29 @@ def ListLocks(opts, args): # pylint: disable-msg=W0613
   return 0
 
 
+def ShowQueueStats(opts, args): # pylint: disable-msg=W0613
+  """Show job queue statistics.
+
+  @param opts: the command line options selected by the user
+  @type args: list
+  @param args: should be an empty list
+  @rtype: int
+  @return: the desired exit code
+
+  """
+  cl = GetClient()
+  stats = cl.QueryQueueStats()
+
+  for group in sorted(stats.keys()):
+    ToStdout("%s:", group)
+    for (name, value) in sorted(stats[group].items()):
+      if isinstance(value, float):
+        value = "%.3f" % value
+      ToStdout("  %s: %s", name, value)
+
+  return 0
+
+
 commands = {
   'delay': (
     Delay, [ArgUnknown(min=1, max=1)],
@@ -596,8 +625,16 @@ commands = {
     "", "Test a few aspects of the job queue"),
   "locks": (
     ListLocks, ARGS_NONE,
-    [NOHDR_OPT, SEP_OPT, FIELDS_OPT, INTERVAL_OPT, VERBOSE_OPT],
-    "[--interval N]", "Show a list of locks in the master daemon"),
+    [NOHDR_OPT, SEP_OPT, FIELDS_OPT, INTERVAL_OPT, VERBOSE_OPT,
+     cli_option("--reset-stats", default=False, action="store_true",
+                dest="reset_stats",
+                help="Reset the lock statistics after showing them"),
+     ],
+    "[--interval N] [--reset-stats]",
+    "Show a list of locks in the master daemon"),
+  "queue-stats": (
+    ShowQueueStats, ARGS_NONE, [],
+    "", "Show job queue statistics"),
   }
 
 #: dictionary with aliases for commands
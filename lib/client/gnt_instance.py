@@ -57,6 +57,14 @@ _SHUTDOWN_NODES_TAGS_MODES = (
     _SHUTDOWN_NODES_SEC_BY_TAGS)
 
 
+MULTI_ALLOC_OPT = cli_option("--multi-allocate", default=False,
+                             action="store_true", dest="multi_allocate",
+                             help=("Allocate all instances using the same"
+                                   " iallocator in one request (the"
+                                   " iallocator must support the"
+                                   " \"multi-allocate\" mode)"))
+
+
 #: default list of options for L{ListInstances}
 _LIST_DEF_FIELDS = [
   "name", "hypervisor", "os", "pnode", "status", "oper_ram",
@@ -220,7 +228,8 @@ def ListInstances(opts, args):
   return GenericList(constants.QR_INSTANCE, selected_fields, args, opts.units,
                      opts.separator, not opts.no_headers,
                      format_override=fmtoverride, verbose=opts.verbose,
-                     force_filter=opts.force_filter)
+                     force_filter=opts.force_filter,
+                     live_data_max_age=opts.live_data_max_age)
 
 
 def ListInstanceFields(opts, args):
@@ -265,7 +274,11 @@ def BatchCreate(opts, args):
     }
 
   Note that I{primary_node} and I{secondary_node} have precedence over
-  I{iallocator}.
+  I{iallocator}. With C{--multi-allocate}, instances using the same
+  iallocator and hypervisor are allocated in one request, which then submits
+  one creation job per instance; if that request fails (e.g. because the
+  iallocator doesn't support it), one creation job per instance is submitted
+  instead.
 
   @param opts: the command line options selected by the user
   @type args: list
@@ -332,6 +345,9 @@ def BatchCreate(opts, args):
 
   jex = JobExecutor(opts=opts)
 
+  # Instances placed by an iallocator, grouped by iallocator and hypervisor
+  alloc_ops = {}
+
   # Iterate over the instances and do:
   #  * Populate the specs with default value
   #  * Validate the instance specs
@@ -393,11 +409,65 @@ def BatchCreate(opts, args):
                                   file_storage_dir=specs['file_storage_dir'],
                                   file_driver=specs['file_driver'])
 
-    jex.QueueJob(name, op)
+    if opts.multi_allocate and specs['primary_node'] is None:
+      alloc_ops.setdefault((specs['iallocator'], hypervisor), []).append(op)
+    else:
+      jex.QueueJob(name, op)
+
+  retcode = constants.EXIT_SUCCESS
+
+  if alloc_ops:
+    # Allocating is quick, wait for it to learn the creation jobs
+    alloc_groups = sorted(alloc_ops.items())
+    alloc_jex = JobExecutor(cl=jex.cl, opts=opts)
+    for ((iallocator, _), ops) in alloc_groups:
+      # The opcodes are kept unchanged for creating instances one by one
+      instances = []
+      for op in ops:
+        inst_op = opcodes.OpCode.LoadOpCode(op.__getstate__())
+        inst_op.iallocator = None
+        instances.append(inst_op)
+      alloc_jex.QueueJob("allocation using %s" % iallocator,
+                         opcodes.OpInstanceMultiAlloc(iallocator=iallocator,
+                                                      instances=instances,
+                                                      allow_failure=True))
+
+    for ((_, ops), (success, result)) in zip(alloc_groups,
+                                             alloc_jex.GetResults()):
+      if not success:
+        ToStderr("Allocating instances %s in one request failed, creating"
+                 " them one by one",
+                 utils.CommaJoin(op.instance_name for op in ops))
+        for op in ops:
+          jex.QueueJob(op.instance_name, op)
+        continue
+
+      (result, ) = result
+
+      failed = result[opcodes.OpInstanceMultiAlloc.FAILED_KEY]
+      if failed:
+        ToStderr("Instances which could not be allocated: %s",
+                 utils.CommaJoin(failed))
+        retcode = constants.EXIT_FAILURE
+
+      if opts.dry_run:
+        for (iname, nodes) in \
+            result[opcodes.OpInstanceMultiAlloc.ALLOCATABLE_KEY]:
+          ToStdout("%s: %s", iname, utils.CommaJoin(nodes))
+        continue
+
+      for (iname, (status, job_id)) in \
+          zip(result[opcodes.OpInstanceMultiAlloc.ALLOCATABLE_KEY],
+              result[constants.JOB_IDS_KEY]):
+        jex.AddJobId(iname, status, job_id)
+
+  if jex.queue:
+    jex.SubmitPending()
+
   # we never want to wait, just show the submitted job IDs
   jex.WaitOrShow(False)
 
-  return 0
+  return retcode
 
 
 def ReinstallInstance(opts, args):
@@ -1365,7 +1435,8 @@ commands = {
     "[...] -t disk-type -n node[:secondary-node] -o os-type <name>",
     "Creates and adds a new instance to the cluster"),
   'batch-create': (
-    BatchCreate, [ArgFile(min=1, max=1)], [DRY_RUN_OPT, PRIORITY_OPT],
+    BatchCreate, [ArgFile(min=1, max=1)],
+    [DRY_RUN_OPT, PRIORITY_OPT, MULTI_ALLOC_OPT],
     "<instances.json>",
     "Create a bunch of instances based on specs in the file."),
   'console': (
@@ -1398,7 +1469,7 @@ commands = {
   'list': (
     ListInstances, ARGS_MANY_INSTANCES,
     [NOHDR_OPT, SEP_OPT, USEUNITS_OPT, FIELDS_OPT, VERBOSE_OPT,
-     FORCE_FILTER_OPT],
+     FORCE_FILTER_OPT, LIVE_DATA_MAX_AGE_OPT],
     "[<instance>...]",
     "Lists the instances and their status. The available fields can be shown"
     " using the \"list-fields\" command (see the man page for details)."
@@ -236,7 +236,8 @@ def ListNodes(opts, args):
   return GenericList(constants.QR_NODE, selected_fields, args, opts.units,
                      opts.separator, not opts.no_headers,
                      format_override=fmtoverride, verbose=opts.verbose,
-                     force_filter=opts.force_filter)
+                     force_filter=opts.force_filter,
+                     live_data_max_age=opts.live_data_max_age)
 
 
 def ListNodeFields(opts, args):
@@ -861,7 +862,7 @@ commands = {
   'list': (
     ListNodes, ARGS_MANY_NODES,
     [NOHDR_OPT, SEP_OPT, USEUNITS_OPT, FIELDS_OPT, VERBOSE_OPT,
-     FORCE_FILTER_OPT],
+     FORCE_FILTER_OPT, LIVE_DATA_MAX_AGE_OPT],
     "[nodes...]",
     "Lists the nodes in the cluster. The available fields can be shown using"
     " the \"list-fields\" command (see the man page for details)."
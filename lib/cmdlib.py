@@ -60,12 +60,13 @@ from ganeti import opcodes
 from ganeti import ht
 
 import ganeti.masterd.instance # pylint: disable-msg=W0611
+import ganeti.masterd.iallocator # pylint: disable-msg=W0611
 
 
 def _SupportsOob(cfg, node):
   """Tells if node supports OOB.
 
-  @type cfg: L{config.ConfigWriter}
+  @type cfg: L{config.ConfigWriter} or L{config.ConfigSnapshot}
   @param cfg: The cluster configuration
   @type node: L{objects.Node}
   @param node: The node
@@ -478,11 +479,16 @@ class _QueryBase:
   #: Attribute holding field definitions
   FIELDS = None
 
-  def __init__(self, filter_, fields, use_locking):
+  def __init__(self, filter_, fields, use_locking, live_data_max_age=None):
     """Initializes this class.
 
+    @type live_data_max_age: None or number
+    @param live_data_max_age: Maximum age of cached live data of nodes to
+      accept, or C{None} to always query the nodes
+
     """
     self.use_locking = use_locking
+    self.live_data_max_age = live_data_max_age
 
     self.query = query.Query(self.FIELDS, fields, filter_=filter_,
                              namefield="name")
@@ -545,12 +551,18 @@ class _QueryBase:
     """
     raise NotImplementedError()
 
-  def NewStyleQuery(self, lu):
+  def NewStyleQuery(self, lu, limit=None, cursor=None):
     """Collect data and execute query.
 
+    @type limit: None or int
+    @param limit: Maximum number of results to return
+    @type cursor: None or string
+    @param cursor: Cursor returned with the previous page of results
+
     """
     return query.GetQueryResponse(self.query, self._GetQueryData(lu),
-                                  sort_by_name=self.sort_by_name)
+                                  sort_by_name=self.sort_by_name,
+                                  limit=limit, cursor=cursor)
 
   def OldStyleQuery(self, lu):
     """Collect data and execute query.
@@ -2827,7 +2839,8 @@ class LUClusterVerifyGroup(LogicalUnit, _VerifyErrors):
           # overrides self.bad
           lu_result = 1
           continue
-        for script, hkr, output in res.payload:
+        for entry in res.payload:
+          (script, hkr, output) = entry[:3]
           test = hkr == constants.HKR_FAIL
           self._ErrorIf(test, self.ENODEHOOKS, node_name,
                         "Script %s failed, output:", script)
@@ -4148,7 +4161,8 @@ class _NodeQuery(_QueryBase):
     """Computes the list of nodes and their attributes.
 
     """
-    all_info = lu.cfg.GetAllNodesInfo()
+    cfg = lu.cfg.GetConfigSnapshot()
+    all_info = cfg.GetAllNodesInfo()
 
     nodenames = self._GetNames(lu, all_info.keys(), locking.LEVEL_NODE)
 
@@ -4157,19 +4171,22 @@ class _NodeQuery(_QueryBase):
       # filter out non-vm_capable nodes
       toquery_nodes = [name for name in nodenames if all_info[name].vm_capable]
 
-      node_data = lu.rpc.call_node_info(toquery_nodes, lu.cfg.GetVGName(),
-                                        lu.cfg.GetHypervisorType())
+      node_data = lu.rpc.call_node_info(toquery_nodes, cfg.GetVGName(),
+                                        cfg.GetHypervisorType(),
+                                        max_age=self.live_data_max_age)
       live_data = dict((name, nresult.payload)
                        for (name, nresult) in node_data.items()
                        if not nresult.fail_msg and nresult.payload)
+      live_data_age = dict((name, node_data[name].age) for name in live_data)
     else:
       live_data = None
+      live_data_age = None
 
     if query.NQ_INST in self.requested_data:
       node_to_primary = dict([(name, set()) for name in nodenames])
       node_to_secondary = dict([(name, set()) for name in nodenames])
 
-      inst_data = lu.cfg.GetAllInstancesInfo()
+      inst_data = cfg.GetAllInstancesInfo()
 
       for inst in inst_data.values():
         if inst.primary_node in node_to_primary:
@@ -4182,20 +4199,21 @@ class _NodeQuery(_QueryBase):
       node_to_secondary = None
 
     if query.NQ_OOB in self.requested_data:
-      oob_support = dict((name, bool(_SupportsOob(lu.cfg, node)))
+      oob_support = dict((name, bool(_SupportsOob(cfg, node)))
                          for name, node in all_info.iteritems())
     else:
       oob_support = None
 
     if query.NQ_GROUP in self.requested_data:
-      groups = lu.cfg.GetAllNodeGroupsInfo()
+      groups = cfg.GetAllNodeGroupsInfo()
     else:
       groups = {}
 
     return query.NodeQueryData([all_info[name] for name in nodenames],
-                               live_data, lu.cfg.GetMasterNode(),
+                               live_data, cfg.GetMasterNode(),
                                node_to_primary, node_to_secondary, groups,
-                               oob_support, lu.cfg.GetClusterInfo())
+                               oob_support, cfg.GetClusterInfo(),
+                               live_data_age=live_data_age)
 
 
 class LUNodeQuery(NoHooksLU):
@@ -4207,7 +4225,8 @@ class LUNodeQuery(NoHooksLU):
 
   def CheckArguments(self):
     self.nq = _NodeQuery(qlang.MakeSimpleFilter("name", self.op.names),
-                         self.op.output_fields, self.op.use_locking)
+                         self.op.output_fields, self.op.use_locking,
+                         live_data_max_age=self.op.live_data_max_age)
 
   def ExpandNames(self):
     self.nq.ExpandNames(self)
@@ -4405,8 +4424,9 @@ class _InstanceQuery(_QueryBase):
     """Computes the list of instances and their attributes.
 
     """
-    cluster = lu.cfg.GetClusterInfo()
-    all_info = lu.cfg.GetAllInstancesInfo()
+    cfg = lu.cfg.GetConfigSnapshot()
+    cluster = cfg.GetClusterInfo()
+    all_info = cfg.GetAllInstancesInfo()
 
     instance_names = self._GetNames(lu, all_info.keys(), locking.LEVEL_INSTANCE)
 
@@ -4417,13 +4437,16 @@ class _InstanceQuery(_QueryBase):
     bad_nodes = []
     offline_nodes = []
     wrongnode_inst = set()
+    live_data_age = {}
 
     # Gather data as requested
     if self.requested_data & set([query.IQ_LIVE, query.IQ_CONSOLE]):
       live_data = {}
-      node_data = lu.rpc.call_all_instances_info(nodes, hv_list)
-      for name in nodes:
-        result = node_data[name]
+
+      # Node results are processed as they arrive
+      def _ProcessNodeResult(result):
+        name = result.node
+        live_data_age[name] = result.age
         if result.offline:
           # offline nodes will be in both lists
           assert result.fail_msg
@@ -4443,6 +4466,10 @@ class _InstanceQuery(_QueryBase):
               logging.warning("Orphan instance '%s' found on node %s",
                               inst, name)
         # else no instance is alive
+
+      lu.rpc.call_all_instances_info(nodes, hv_list,
+                                     result_fn=_ProcessNodeResult,
+                                     max_age=self.live_data_max_age)
     else:
       live_data = {}
 
@@ -4467,9 +4494,10 @@ class _InstanceQuery(_QueryBase):
     else:
       consinfo = None
 
-    return query.InstanceQueryData(instance_list, lu.cfg.GetClusterInfo(),
+    return query.InstanceQueryData(instance_list, cluster,
                                    disk_usage, offline_nodes, bad_nodes,
-                                   live_data, wrongnode_inst, consinfo)
+                                   live_data, wrongnode_inst, consinfo,
+                                   live_data_age=live_data_age)
 
 
 class LUQuery(NoHooksLU):
@@ -4482,7 +4510,8 @@ class LUQuery(NoHooksLU):
   def CheckArguments(self):
     qcls = _GetQueryImplementation(self.op.what)
 
-    self.impl = qcls(self.op.filter, self.op.fields, False)
+    self.impl = qcls(self.op.filter, self.op.fields, False,
+                     live_data_max_age=self.op.live_data_max_age)
 
   def ExpandNames(self):
     self.impl.ExpandNames(self)
@@ -4491,7 +4520,8 @@ class LUQuery(NoHooksLU):
     self.impl.DeclareLocks(self, level)
 
   def Exec(self, feedback_fn):
-    return self.impl.NewStyleQuery(self)
+    return self.impl.NewStyleQuery(self, limit=self.op.limit,
+                                   cursor=self.op.cursor)
 
 
 class LUQueryFields(NoHooksLU):
@@ -5170,7 +5200,7 @@ class LUClusterQuery(NoHooksLU):
     """Return cluster config.
 
     """
-    cluster = self.cfg.GetClusterInfo()
+    cluster = self.cfg.GetConfigSnapshot().GetClusterInfo()
     os_hvp = {}
 
     # Filter just for enabled hypervisors
@@ -5247,18 +5277,19 @@ class LUClusterConfigQuery(NoHooksLU):
     """Dump a representation of the cluster config to the standard output.
 
     """
+    cfg = self.cfg.GetConfigSnapshot()
     values = []
     for field in self.op.output_fields:
       if field == "cluster_name":
-        entry = self.cfg.GetClusterName()
+        entry = cfg.GetClusterName()
       elif field == "master_node":
-        entry = self.cfg.GetMasterNode()
+        entry = cfg.GetMasterNode()
       elif field == "drain_flag":
         entry = os.path.exists(constants.JOB_QUEUE_DRAIN_FILE)
       elif field == "watcher_pause":
         entry = utils.ReadWatcherPauseFile(constants.WATCHER_PAUSEFILE)
       elif field == "volume_group_name":
-        entry = self.cfg.GetVGName()
+        entry = cfg.GetVGName()
       else:
         raise errors.ParameterError(field)
       values.append(entry)
@@ -6297,7 +6328,8 @@ class LUInstanceQuery(NoHooksLU):
 
   def CheckArguments(self):
     self.iq = _InstanceQuery(qlang.MakeSimpleFilter("name", self.op.names),
-                             self.op.output_fields, self.op.use_locking)
+                             self.op.output_fields, self.op.use_locking,
+                             live_data_max_age=self.op.live_data_max_age)
 
   def ExpandNames(self):
     self.iq.ExpandNames(self)
@@ -8770,6 +8802,212 @@ class LUInstanceCreate(LogicalUnit):
     return list(iobj.all_nodes)
 
 
+def _ComputeAllocSpec(cfg, op):
+  """Computes the iallocator input describing a new instance.
+
+  @type cfg: L{config.ConfigWriter}
+  @param cfg: Cluster configuration
+  @type op: L{opcodes.OpInstanceCreate}
+  @param op: Instance creation opcode
+  @rtype: dict
+  @return: Instance specification as used by the iallocator's
+    C{multi-allocate} mode
+
+  """
+  cluster = cfg.GetClusterInfo()
+
+  utils.ForceDictType(op.beparams, constants.BES_PARAMETER_TYPES)
+  be_full = cluster.SimpleFillBE(op.beparams)
+
+  nics = []
+  for nic in op.nics:
+    nicparams = {}
+    if nic.get(constants.INIC_MODE, None):
+      nicparams[constants.NIC_MODE] = nic[constants.INIC_MODE]
+    if nic.get(constants.INIC_LINK, None):
+      nicparams[constants.NIC_LINK] = nic[constants.INIC_LINK]
+    nics.append(objects.NIC(mac=nic.get(constants.INIC_MAC,
+                                        constants.VALUE_AUTO),
+                            ip=nic.get(constants.INIC_IP, None),
+                            nicparams=nicparams).ToDict())
+
+  default_vg = cfg.GetVGName()
+  disks = []
+  for disk in op.disks:
+    size = disk.get(constants.IDISK_SIZE, None)
+    try:
+      size = int(size)
+    except (TypeError, ValueError):
+      raise errors.OpPrereqError("Invalid disk size '%s' for instance %s" %
+                                 (size, op.instance_name), errors.ECODE_INVAL)
+    data_vg = disk.get(constants.IDISK_VG, default_vg)
+    disks.append({
+      constants.IDISK_SIZE: size,
+      constants.IDISK_MODE: disk.get(constants.IDISK_MODE,
+                                     constants.DISK_RDWR),
+      constants.IDISK_VG: data_vg,
+      constants.IDISK_METAVG: disk.get(constants.IDISK_METAVG, data_vg),
+      })
+
+  return {
+    "name": op.instance_name,
+    "disk_template": op.disk_template,
+    "tags": op.tags,
+    "os": op.os_type,
+    "vcpus": be_full[constants.BE_VCPUS],
+    "memory": be_full[constants.BE_MEMORY],
+    "disks": disks,
+    "nics": nics,
+    "hypervisor": op.hypervisor or cfg.GetHypervisorType(),
+    }
+
+
+class LUInstanceMultiAlloc(NoHooksLU):
+  """Allocates multiple instances in one iallocator request.
+
+  The instances are then created by one job each, running in parallel.
+
+  """
+  REQ_BGL = False
+
+  def CheckArguments(self):
+    """Check arguments.
+
+    """
+    if not self.op.instances:
+      raise errors.OpPrereqError("No instances to allocate",
+                                 errors.ECODE_INVAL)
+
+    for op in self.op.instances:
+      if op.mode != constants.INSTANCE_CREATE:
+        raise errors.OpPrereqError("Instance '%s': only creation of new"
+                                   " instances is supported, not '%s'" %
+                                   (op.instance_name, op.mode),
+                                   errors.ECODE_INVAL)
+      if op.iallocator is not None:
+        raise errors.OpPrereqError("Instance '%s' specifies an iallocator;"
+                                   " only the iallocator of the allocation"
+                                   " request is used" % op.instance_name,
+                                   errors.ECODE_INVAL)
+      if op.pnode is not None or op.snode is not None:
+        raise errors.OpPrereqError("Instance '%s' specifies nodes; they are"
+                                   " chosen by the iallocator" %
+                                   op.instance_name, errors.ECODE_INVAL)
+      if op.os_type is None or op.disk_template is None:
+        raise errors.OpPrereqError("Instance '%s' lacks a guest OS or disk"
+                                   " template" % op.instance_name,
+                                   errors.ECODE_INVAL)
+
+    names = [op.instance_name for op in self.op.instances]
+    duplicates = utils.FindDuplicates(names)
+    if duplicates:
+      raise errors.OpPrereqError("Duplicate instance names: %s" %
+                                 utils.CommaJoin(duplicates),
+                                 errors.ECODE_INVAL)
+
+    # The iallocator input contains the nodes' memory for one hypervisor only
+    default_hv = self.cfg.GetHypervisorType()
+    hypervisors = frozenset(op.hypervisor or default_hv
+                            for op in self.op.instances)
+    if len(hypervisors) > 1:
+      raise errors.OpPrereqError("All instances must use the same hypervisor,"
+                                 " but found %s" %
+                                 utils.CommaJoin(sorted(hypervisors)),
+                                 errors.ECODE_INVAL)
+
+    if self.op.iallocator is None:
+      self.op.iallocator = self.cfg.GetDefaultIAllocator()
+      if not self.op.iallocator:
+        raise errors.OpPrereqError("No iallocator given and no cluster-wide"
+                                   " default iallocator found",
+                                   errors.ECODE_INVAL)
+
+  def ExpandNames(self):
+    """Calculate the locks.
+
+    """
+    existing = (frozenset(self.cfg.GetInstanceList()) &
+                frozenset(op.instance_name for op in self.op.instances))
+    if existing:
+      raise errors.OpPrereqError("Instances already in the cluster: %s" %
+                                 utils.CommaJoin(utils.NiceSort(existing)),
+                                 errors.ECODE_EXISTS)
+
+    # The nodes are only used to compute the allocation, the instances are
+    # created (and their nodes locked exclusively) by separate jobs
+    self.share_locks[locking.LEVEL_NODE] = 1
+    self.needed_locks = {
+      locking.LEVEL_NODE: locking.ALL_SET,
+      }
+
+  def CheckPrereq(self):
+    """Runs the iallocator.
+
+    """
+    ial = IAllocator(self.cfg, self.rpc,
+                     mode=constants.IALLOCATOR_MODE_MULTI_ALLOC,
+                     instances=[_ComputeAllocSpec(self.cfg, op)
+                                for op in self.op.instances])
+
+    ial.Run(self.op.iallocator)
+
+    if not ial.success:
+      raise errors.OpPrereqError("Can't compute nodes using"
+                                 " iallocator '%s': %s" %
+                                 (self.op.iallocator, ial.info),
+                                 errors.ECODE_NORES)
+
+    (allocatable, failed) = ial.result
+
+    if failed:
+      if not self.op.allow_failure:
+        raise errors.OpPrereqError("Can't allocate instances %s using"
+                                   " iallocator '%s': %s" %
+                                   (utils.CommaJoin(failed),
+                                    self.op.iallocator, ial.info),
+                                   errors.ECODE_NORES)
+      self.LogWarning("Not creating instances which could not be"
+                      " allocated: %s", utils.CommaJoin(failed))
+
+    for (name, nodes) in allocatable:
+      self.LogInfo("Selected nodes for instance %s via iallocator %s: %s",
+                   name, self.op.iallocator, utils.CommaJoin(nodes))
+
+    self.allocatable = dict(allocatable)
+    self.failed = failed
+
+    self.dry_run_result = {
+      opcodes.OpInstanceMultiAlloc.ALLOCATABLE_KEY: allocatable,
+      opcodes.OpInstanceMultiAlloc.FAILED_KEY: failed,
+      }
+
+  def Exec(self, feedback_fn):
+    """Submits one job per allocated instance.
+
+    """
+    jobs = []
+    names = []
+
+    # Keep the order of the opcode
+    for op in self.op.instances:
+      nodes = self.allocatable.get(op.instance_name, None)
+      if nodes is None:
+        continue
+
+      op = opcodes.OpCode.LoadOpCode(op.__getstate__())
+      op.pnode = nodes[0]
+      if len(nodes) > 1:
+        op.snode = nodes[1]
+
+      jobs.append([op])
+      names.append(op.instance_name)
+
+    return ResultWithJobs(jobs, **{
+      opcodes.OpInstanceMultiAlloc.ALLOCATABLE_KEY: names,
+      opcodes.OpInstanceMultiAlloc.FAILED_KEY: self.failed,
+      })
+
+
 class LUInstanceConsole(NoHooksLU):
   """Connect to an instance's console.
 
@@ -11373,7 +11611,8 @@ class _GroupQuery(_QueryBase):
   def ExpandNames(self, lu):
     lu.needed_locks = {}
 
-    self._all_groups = lu.cfg.GetAllNodeGroupsInfo()
+    self._cfg = lu.cfg.GetConfigSnapshot()
+    self._all_groups = self._cfg.GetAllNodeGroupsInfo()
     name_to_uuid = dict((g.name, g.uuid) for g in self._all_groups.values())
 
     if not self.names:
@@ -11417,7 +11656,7 @@ class _GroupQuery(_QueryBase):
     # instance->node. Hence, we will need to process nodes even if we only need
     # instance information.
     if do_nodes or do_instances:
-      all_nodes = lu.cfg.GetAllNodesInfo()
+      all_nodes = self._cfg.GetAllNodesInfo()
       group_to_nodes = dict((uuid, []) for uuid in self.wanted)
       node_to_group = {}
 
@@ -11427,7 +11666,7 @@ class _GroupQuery(_QueryBase):
           node_to_group[node.name] = node.group
 
       if do_instances:
-        all_instances = lu.cfg.GetAllInstancesInfo()
+        all_instances = self._cfg.GetAllInstancesInfo()
         group_to_instances = dict((uuid, []) for uuid in self.wanted)
 
         for instance in all_instances.values():
@@ -12079,7 +12318,7 @@ class IAllocator(object):
     This is the data that is independent of the actual operation.
 
     """
-    cfg = self.cfg
+    cfg = self.cfg.GetConfigSnapshot()
     cluster_info = cfg.GetClusterInfo()
     # cluster data
     data = {
@@ -12100,14 +12339,20 @@ class IAllocator(object):
       hypervisor_name = self.hypervisor
     elif self.mode == constants.IALLOCATOR_MODE_RELOC:
       hypervisor_name = cfg.GetInstanceInfo(self.name).hypervisor
+    elif self.mode == constants.IALLOCATOR_MODE_MULTI_ALLOC:
+      hypervisor_name = self.instances[0]["hypervisor"]
     else:
       hypervisor_name = cluster_info.enabled_hypervisors[0]
 
+    # Allocations in quick succession can use cached data; nodes whose
+    # memory or disk usage changed in the meantime are queried again
     node_data = self.rpc.call_node_info(node_list, cfg.GetVGName(),
-                                        hypervisor_name)
+                                        hypervisor_name,
+                                        max_age=self.rpc.LIVE_DATA_ANY_AGE)
     node_iinfo = \
       self.rpc.call_all_instances_info(node_list,
-                                       cluster_info.enabled_hypervisors)
+                                       cluster_info.enabled_hypervisors,
+                                       max_age=self.rpc.LIVE_DATA_ANY_AGE)
 
     data["nodegroups"] = self._ComputeNodeGroupData(cfg)
 
@@ -12267,26 +12512,32 @@ class IAllocator(object):
     done.
 
     """
-    disk_space = _ComputeDiskSize(self.disk_template, self.disks)
+    request = self._NewInstanceRequest(dict((key, getattr(self, key))
+                                            for (key, _) in
+                                            self._ALLOC_KEYDATA))
 
-    if self.disk_template in constants.DTS_INT_MIRROR:
-      self.required_nodes = 2
-    else:
-      self.required_nodes = 1
+    self.required_nodes = request["required_nodes"]
 
-    request = {
-      "name": self.name,
-      "disk_template": self.disk_template,
-      "tags": self.tags,
-      "os": self.os,
-      "vcpus": self.vcpus,
-      "memory": self.memory,
-      "disks": self.disks,
-      "disk_space_total": disk_space,
-      "nics": self.nics,
-      "required_nodes": self.required_nodes,
-      "hypervisor": self.hypervisor,
-      }
+    return request
+
+  @classmethod
+  def _NewInstanceRequest(cls, spec):
+    """Builds the request data for a new instance.
+
+    @type spec: dict
+    @param spec: Instance specification, with the keys listed in
+      L{_ALLOC_KEYDATA}
+
+    """
+    request = dict((key, spec[key]) for (key, _) in cls._ALLOC_KEYDATA)
+
+    request["disk_space_total"] = _ComputeDiskSize(spec["disk_template"],
+                                                   spec["disks"])
+
+    if spec["disk_template"] in constants.DTS_INT_MIRROR:
+      request["required_nodes"] = 2
+    else:
+      request["required_nodes"] = 1
 
     return request
 
@@ -12353,6 +12604,15 @@ class IAllocator(object):
       "target_groups": self.target_groups,
       }
 
+  def _AddMultiAllocate(self):
+    """Get data for multi-allocate requests.
+
+    """
+    return {
+      "instances": [self._NewInstanceRequest(spec)
+                    for spec in self.instances],
+      }
+
   def _BuildInputData(self, fn, keydata):
     """Build input data structures.
 
@@ -12382,20 +12642,27 @@ class IAllocator(object):
                           opcodes.OpInstanceMigrate.OP_ID,
                           opcodes.OpInstanceReplaceDisks.OP_ID])
      })))
+  _ALLOC_KEYDATA = [
+    ("name", ht.TString),
+    ("memory", ht.TInt),
+    ("disks", ht.TListOf(ht.TDict)),
+    ("disk_template", ht.TString),
+    ("os", ht.TString),
+    ("tags", _STRING_LIST),
+    ("nics", ht.TListOf(ht.TDict)),
+    ("vcpus", ht.TInt),
+    ("hypervisor", ht.TString),
+    ]
+  _MULTI_ALLOC_RESULT = ht.TAnd(ht.TList, ht.TIsLength(2), ht.TItems([
+    # Instances which could be allocated and their nodes
+    ht.TListOf(ht.TAnd(ht.TList, ht.TIsLength(2),
+                       ht.TItems([ht.TNonEmptyString, _STRING_LIST]))),
+    # Instances which could not be allocated
+    _STRING_LIST,
+    ]))
   _MODE_DATA = {
     constants.IALLOCATOR_MODE_ALLOC:
-      (_AddNewInstance,
-       [
-        ("name", ht.TString),
-        ("memory", ht.TInt),
-        ("disks", ht.TListOf(ht.TDict)),
-        ("disk_template", ht.TString),
-        ("os", ht.TString),
-        ("tags", _STRING_LIST),
-        ("nics", ht.TListOf(ht.TDict)),
-        ("vcpus", ht.TInt),
-        ("hypervisor", ht.TString),
-        ], ht.TList),
+      (_AddNewInstance, _ALLOC_KEYDATA, ht.TList),
     constants.IALLOCATOR_MODE_RELOC:
       (_AddRelocateInstance,
        [("name", ht.TString), ("relocate_from", _STRING_LIST)],
@@ -12413,19 +12680,36 @@ class IAllocator(object):
         ("instances", _STRING_LIST),
         ("target_groups", _STRING_LIST),
         ], _JOBSET_LIST),
+     constants.IALLOCATOR_MODE_MULTI_ALLOC:
+      (_AddMultiAllocate, [
+        ("instances",
+         ht.TAnd(ht.TListOf(ht.TStrictDict(True, False,
+                                           dict(_ALLOC_KEYDATA))),
+                 ht.TTrue)),
+        ], _MULTI_ALLOC_RESULT),
     }
 
   def Run(self, name, validate=True, call_fn=None):
     """Run an instance allocator and return the results.
 
+    Allocators supporting it are kept running by the master daemon (see
+    L{masterd.iallocator}), others are run on the master node for every
+    request.
+
     """
     if call_fn is None:
-      call_fn = self.rpc.call_iallocator_runner
+      self.out_text = masterd.iallocator.Run(name, self.in_data)
+    else:
+      self.out_text = None
 
-    result = call_fn(self.cfg.GetMasterNode(), name, self.in_text)
-    result.Raise("Failure while running the iallocator script")
+    if self.out_text is None:
+      if call_fn is None:
+        call_fn = self.rpc.call_iallocator_runner
 
-    self.out_text = result.payload
+      result = call_fn(self.cfg.GetMasterNode(), name, self.in_text)
+      result.Raise("Failure while running the iallocator script")
+
+      self.out_text = result.payload
     if validate:
       self._ValidateResult()
 
@@ -12494,9 +12778,37 @@ class IAllocator(object):
                                       utils.CommaJoin(request_groups)))
       else:
         raise errors.ProgrammerError("Unhandled mode '%s'" % self.mode)
+    elif self.mode == constants.IALLOCATOR_MODE_MULTI_ALLOC:
+      self._CheckMultiAllocResult()
 
     self.out_data = rdict
 
+  def _CheckMultiAllocResult(self):
+    """Verifies the result of a multi-allocate request.
+
+    Every requested instance must be either allocated to the number of
+    nodes it requires or listed as failed.
+
+    """
+    required_nodes = dict((req["name"], req["required_nodes"])
+                          for req in self.in_data["request"]["instances"])
+
+    (allocatable, failed) = self.result
+
+    names = [name for (name, _) in allocatable] + failed
+    if (utils.FindDuplicates(names) or
+        frozenset(names) != frozenset(required_nodes)):
+      raise errors.OpExecError("Iallocator returned results for instances"
+                               " %s, but was asked for %s" %
+                               (utils.CommaJoin(names),
+                                utils.CommaJoin(required_nodes.keys())))
+
+    for (name, nodes) in allocatable:
+      if len(nodes) != required_nodes[name]:
+        raise errors.OpExecError("Iallocator returned %s node(s) for instance"
+                                 " '%s', required %s" %
+                                 (len(nodes), name, required_nodes[name]))
+
   @staticmethod
   def _NodesToGroups(node2group, groups, nodes):
     """Returns a list of unique group names for a list of nodes.
@@ -12543,16 +12855,24 @@ class LUTestAllocator(NoHooksLU):
     This checks the opcode parameters depending on the director and mode test.
 
     """
-    if self.op.mode == constants.IALLOCATOR_MODE_ALLOC:
+    if self.op.mode in (constants.IALLOCATOR_MODE_ALLOC,
+                        constants.IALLOCATOR_MODE_MULTI_ALLOC):
       for attr in ["memory", "disks", "disk_template",
                    "os", "tags", "nics", "vcpus"]:
         if not hasattr(self.op, attr):
           raise errors.OpPrereqError("Missing attribute '%s' on opcode input" %
                                      attr, errors.ECODE_INVAL)
-      iname = self.cfg.ExpandInstanceName(self.op.name)
-      if iname is not None:
-        raise errors.OpPrereqError("Instance '%s' already in the cluster" %
-                                   iname, errors.ECODE_EXISTS)
+      if self.op.mode == constants.IALLOCATOR_MODE_ALLOC:
+        names = [self.op.name]
+      elif self.op.instances:
+        names = self.op.instances
+      else:
+        raise errors.OpPrereqError("Missing instances", errors.ECODE_INVAL)
+      for name in names:
+        iname = self.cfg.ExpandInstanceName(name)
+        if iname is not None:
+          raise errors.OpPrereqError("Instance '%s' already in the cluster" %
+                                     iname, errors.ECODE_EXISTS)
       if not isinstance(self.op.nics, list):
         raise errors.OpPrereqError("Invalid parameter 'nics'",
                                    errors.ECODE_INVAL)
@@ -12611,6 +12931,21 @@ class LUTestAllocator(NoHooksLU):
                        vcpus=self.op.vcpus,
                        hypervisor=self.op.hypervisor,
                        )
+    elif self.op.mode == constants.IALLOCATOR_MODE_MULTI_ALLOC:
+      # All instances use the same specification
+      ial = IAllocator(self.cfg, self.rpc,
+                       mode=self.op.mode,
+                       instances=[{
+                         "name": name,
+                         "memory": self.op.memory,
+                         "disks": self.op.disks,
+                         "disk_template": self.op.disk_template,
+                         "os": self.op.os,
+                         "tags": self.op.tags,
+                         "nics": self.op.nics,
+                         "vcpus": self.op.vcpus,
+                         "hypervisor": self.op.hypervisor,
+                         } for name in self.op.instances])
     elif self.op.mode == constants.IALLOCATOR_MODE_RELOC:
       ial = IAllocator(self.cfg, self.rpc,
                        mode=self.op.mode,
@@ -43,6 +43,9 @@ You can use the provided ConfdFilterCallback to act as a filter, only passing
 "newer" answer to your callback, and filtering out outdated ones, or ones
 confirming what you already got.
 
+Several queries can be combined into one request with MakeBatchRequest; all
+of them are then answered from the same configuration version.
+
 """
 
 # pylint: disable-msg=E0203
@@ -461,6 +464,64 @@ class ConfdClientRequest(objects.ConfdRequest):
       raise errors.ConfdClientError("Invalid request type")
 
 
+def MakeBatchRequest(requests, **kwargs):
+  """Combines several requests into a single batch request.
+
+  The server answers all the contained queries from the same configuration,
+  so all answers carry the same serial number; use L{SplitBatchReply} to get
+  the individual answers.
+
+  @type requests: list of L{ConfdClientRequest}
+  @param requests: the requests to combine
+  @rtype: L{ConfdClientRequest}
+
+  """
+  query = []
+  for req in requests:
+    if req.type == constants.CONFD_REQ_BATCH:
+      raise errors.ConfdClientError("Batch requests can't be nested")
+    query.append([req.type, req.query])
+
+  return ConfdClientRequest(type=constants.CONFD_REQ_BATCH, query=query,
+                            **kwargs)
+
+
+def SplitBatchReply(up):
+  """Splits the reply to a batch request into the individual replies.
+
+  Upcalls for other requests, expired requests and failed batch requests are
+  returned unchanged.
+
+  @type up: L{ConfdUpcallPayload}
+  @param up: the upcall for the batch request
+  @rtype: list of L{ConfdUpcallPayload}
+  @return: one upcall per query in the batch, in the order of the queries
+
+  """
+  if (up.type != UPCALL_REPLY or
+      up.orig_request.type != constants.CONFD_REQ_BATCH or
+      up.server_reply.status != constants.CONFD_REPL_STATUS_OK):
+    return [up]
+
+  result = []
+  for ((req_type, req_query), (status, answer)) in \
+      zip(up.orig_request.query, up.server_reply.answer):
+    request = ConfdClientRequest(type=req_type, query=req_query,
+                                 rsalt=up.salt,
+                                 protocol=up.orig_request.protocol)
+    reply = objects.ConfdReply(protocol=up.server_reply.protocol,
+                               status=status, answer=answer,
+                               serial=up.server_reply.serial)
+    result.append(ConfdUpcallPayload(salt=up.salt, type=up.type,
+                                     orig_request=request,
+                                     server_reply=reply,
+                                     server_ip=up.server_ip,
+                                     server_port=up.server_port,
+                                     extra_args=up.extra_args,
+                                     client=up.client))
+  return result
+
+
 class ConfdFilterCallback:
   """Callback that calls another callback, but filters duplicate results.
 
@@ -471,13 +532,17 @@ class ConfdFilterCallback:
       with the same serial but different contents
 
   """
-  def __init__(self, callback, logger=None):
+  def __init__(self, callback, logger=None, split_batches=False):
     """Constructor for ConfdFilterCallback
 
     @type callback: f(L{ConfdUpcallPayload})
     @param callback: function to call when getting answers
     @type logger: logging.Logger
     @param logger: optional logger for internal conditions
+    @type split_batches: bool
+    @param split_batches: whether to pass up replies to batch requests as
+        one upcall per contained query (see L{SplitBatchReply}); replies are
+        filtered as a whole in any case
 
     """
     if not callable(callback):
@@ -485,6 +550,7 @@ class ConfdFilterCallback:
 
     self._callback = callback
     self._logger = logger
+    self._split_batches = split_batches
     # answers contains a dict of salt -> answer
     self._answers = {}
     self.consistent = {}
@@ -562,7 +628,13 @@ class ConfdFilterCallback:
     elif up.type == UPCALL_EXPIRE:
       self._HandleExpire(up)
 
-    if not filter_upcall:
+    if filter_upcall:
+      return
+
+    if self._split_batches:
+      for sub_up in SplitBatchReply(up):
+        self._callback(sub_up)
+    else:
       self._callback(up)
 
 
@@ -297,3 +297,49 @@ class InstancesIpsQuery(ConfdQuery):
     answer = self.reader.GetInstancesIps(link)
 
     return status, answer
+
+
+class BatchQuery(ConfdQuery):
+  """A query consisting of several other queries.
+
+  The query is a list of C{[type, query]} pairs; it returns the list of
+  C{[status, answer]} pairs of the individual queries, all answered from the
+  same configuration. Batch queries can't be nested.
+
+  """
+  def Exec(self, query):
+    """BatchQuery main execution.
+
+    """
+    if not isinstance(query, list):
+      logging.debug("Invalid batch query argument: not a list")
+      return QUERY_ARGUMENT_ERROR
+
+    answer = []
+    for subquery in query:
+      if not (isinstance(subquery, list) and len(subquery) == 2):
+        logging.debug("Invalid batch query item: %s", subquery)
+        return QUERY_ARGUMENT_ERROR
+
+      (req_type, req_query) = subquery
+      if req_type == constants.CONFD_REQ_BATCH or req_type not in QUERIES:
+        logging.debug("Invalid request type in batch query: %s", req_type)
+        return QUERY_ARGUMENT_ERROR
+
+      answer.append(list(QUERIES[req_type](self.reader).Exec(req_query)))
+
+    return constants.CONFD_REPL_STATUS_OK, answer
+
+
+#: Query classes by request type
+QUERIES = {
+  constants.CONFD_REQ_PING: PingQuery,
+  constants.CONFD_REQ_NODE_ROLE_BYNAME: NodeRoleQuery,
+  constants.CONFD_REQ_NODE_PIP_BY_INSTANCE_IP:
+    InstanceIpToNodePrimaryIpQuery,
+  constants.CONFD_REQ_CLUSTER_MASTER: ClusterMasterQuery,
+  constants.CONFD_REQ_NODE_PIP_LIST: NodesPipsQuery,
+  constants.CONFD_REQ_MC_PIP_LIST: MasterCandidatesPipsQuery,
+  constants.CONFD_REQ_INSTANCES_IPS_LIST: InstancesIpsQuery,
+  constants.CONFD_REQ_BATCH: BatchQuery,
+  }
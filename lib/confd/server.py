@@ -39,36 +39,70 @@ from ganeti import ssconf
 from ganeti.confd import querylib
 
 
+#: Maximum number of cached replies; the cache is flushed when it's full
+_REPLY_CACHE_SIZE = 4096
+
+
+def _NormalizeQuery(query):
+  """Converts a request's query into a hashable value.
+
+  Dictionaries equal regardless of their order map to the same value.
+  Non-string scalars keep their type, so that e.g. C{1} and C{True} are
+  distinct.
+
+  @param query: Query as decoded from JSON
+
+  """
+  if isinstance(query, dict):
+    return (dict, tuple(sorted((key, _NormalizeQuery(value))
+                               for (key, value) in query.items())))
+  elif isinstance(query, (list, tuple)):
+    return (list, tuple(_NormalizeQuery(value) for value in query))
+  elif isinstance(query, basestring):
+    return query
+  else:
+    return (query.__class__, query)
+
+
 class ConfdProcessor(object):
   """A processor for confd requests.
 
+  Replies only depend on the configuration, so they are cached in
+  serialized form, keyed on the request type, the query and the
+  configuration serial number. Only signing them with the client's salt is
+  done for every request.
+
   @ivar reader: confd SimpleConfigReader
   @ivar disabled: whether confd serving is disabled
 
   """
-  DISPATCH_TABLE = {
-    constants.CONFD_REQ_PING: querylib.PingQuery,
-    constants.CONFD_REQ_NODE_ROLE_BYNAME: querylib.NodeRoleQuery,
-    constants.CONFD_REQ_NODE_PIP_BY_INSTANCE_IP:
-      querylib.InstanceIpToNodePrimaryIpQuery,
-    constants.CONFD_REQ_CLUSTER_MASTER: querylib.ClusterMasterQuery,
-    constants.CONFD_REQ_NODE_PIP_LIST: querylib.NodesPipsQuery,
-    constants.CONFD_REQ_MC_PIP_LIST: querylib.MasterCandidatesPipsQuery,
-    constants.CONFD_REQ_INSTANCES_IPS_LIST: querylib.InstancesIpsQuery,
-    }
-
-  def __init__(self):
+  DISPATCH_TABLE = querylib.QUERIES
+
+  def __init__(self, hmac_key=None, cache_size=_REPLY_CACHE_SIZE):
     """Constructor for ConfdProcessor
 
+    @type hmac_key: string or None
+    @param hmac_key: HMAC key, read from L{constants.CONFD_HMAC_KEY} if
+        not given
+    @type cache_size: int
+    @param cache_size: Maximum number of cached replies
+
     """
     self.disabled = True
-    self.hmac_key = utils.ReadFile(constants.CONFD_HMAC_KEY)
+    if hmac_key is None:
+      hmac_key = utils.ReadFile(constants.CONFD_HMAC_KEY)
+    self.hmac_key = hmac_key
     self.reader = None
+    self._cache_size = cache_size
+    self._reply_cache = {}
+    self._cache_hits = 0
+    self._cache_misses = 0
     assert \
       not constants.CONFD_REQS.symmetric_difference(self.DISPATCH_TABLE), \
       "DISPATCH_TABLE is unaligned with CONFD_REQS"
 
   def Enable(self):
+    self.FlushCache()
     try:
       self.reader = ssconf.SimpleConfigReader()
       self.disabled = False
@@ -79,6 +113,43 @@ class ConfdProcessor(object):
   def Disable(self):
     self.disabled = True
     self.reader = None
+    self.FlushCache()
+
+  def FlushCache(self):
+    """Removes all cached replies.
+
+    Must be called whenever the configuration was reloaded.
+
+    """
+    self._reply_cache.clear()
+
+  def GetCacheStats(self):
+    """Returns the reply cache statistics.
+
+    @rtype: tuple; (int, int, int)
+    @return: Number of cache hits and misses since the statistics were last
+        reset and the number of cached replies
+
+    """
+    return (self._cache_hits, self._cache_misses, len(self._reply_cache))
+
+  def LogCacheStats(self):
+    """Logs and resets the reply cache statistics.
+
+    Nothing is logged if there were no requests since the last call.
+
+    """
+    (hits, misses, size) = self.GetCacheStats()
+    total = hits + misses
+    if not total:
+      return
+
+    logging.info("Reply cache: %d hits, %d misses (%.1f%% hit rate),"
+                 " %d cached replies", hits, misses, 100.0 * hits / total,
+                 size)
+
+    self._cache_hits = 0
+    self._cache_misses = 0
 
   def ExecQuery(self, payload_in, ip, port):
     """Process a single UDP request from a client.
@@ -96,8 +167,8 @@ class ConfdProcessor(object):
       return
     try:
       request = self.ExtractRequest(payload_in)
-      reply, rsalt = self.ProcessRequest(request)
-      payload_out = self.PackReply(reply, rsalt)
+      reply_txt, rsalt = self.ProcessRequest(request)
+      payload_out = self.PackReply(reply_txt, rsalt)
       return payload_out
     except errors.ConfdRequestError, err:
       logging.info('Ignoring broken query from %s:%d: %s', ip, port, err)
@@ -138,8 +209,9 @@ class ConfdProcessor(object):
     """Process one ConfdRequest request, and produce an answer
 
     @type request: L{objects.ConfdRequest}
-    @rtype: (L{objects.ConfdReply}, string)
-    @return: tuple of reply and salt to add to the signature
+    @rtype: (string, string)
+    @return: tuple of serialized L{objects.ConfdReply} and salt to add to
+        the signature
 
     """
     logging.debug("Processing request: %s", request)
@@ -156,24 +228,41 @@ class ConfdProcessor(object):
       msg = "missing requested salt"
       raise errors.ConfdRequestError(msg)
 
-    query_object = self.DISPATCH_TABLE[request.type](self.reader)
-    status, answer = query_object.Exec(request.query)
-    reply = objects.ConfdReply(
-              protocol=constants.CONFD_PROTOCOL_VERSION,
-              status=status,
-              answer=answer,
-              serial=self.reader.GetConfigSerialNo(),
-              )
+    serial = self.reader.GetConfigSerialNo()
+    cache_key = (request.type, _NormalizeQuery(request.query), serial)
+
+    reply_txt = self._reply_cache.get(cache_key, None)
+    if reply_txt is None:
+      self._cache_misses += 1
+
+      query_object = self.DISPATCH_TABLE[request.type](self.reader)
+      status, answer = query_object.Exec(request.query)
+      reply = objects.ConfdReply(
+                protocol=constants.CONFD_PROTOCOL_VERSION,
+                status=status,
+                answer=answer,
+                serial=serial,
+                )
+
+      logging.debug("Sending reply: %s", reply)
+
+      reply_txt = serializer.DumpJson(reply.ToDict(), indent=False)
 
-    logging.debug("Sending reply: %s", reply)
+      if len(self._reply_cache) >= self._cache_size:
+        self._reply_cache.clear()
+      self._reply_cache[cache_key] = reply_txt
+    else:
+      self._cache_hits += 1
+      logging.debug("Sending cached reply: %s", reply_txt)
 
-    return (reply, rsalt)
+    return (reply_txt, rsalt)
 
-  def PackReply(self, reply, rsalt):
-    """Serialize and sign the given reply, with salt rsalt
+  def PackReply(self, reply_txt, rsalt):
+    """Sign the given serialized reply, with salt rsalt
 
-    @type reply: L{objects.ConfdReply}
+    @type reply_txt: string
+    @param reply_txt: serialized L{objects.ConfdReply}
     @type rsalt: string
 
     """
-    return serializer.DumpSigned(reply.ToDict(), self.hmac_key, rsalt)
+    return serializer.SignSerialized(reply_txt, self.hmac_key, rsalt)
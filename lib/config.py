@@ -38,6 +38,7 @@ import os
 import random
 import logging
 import time
+import threading
 
 from ganeti import errors
 from ganeti import locking
@@ -49,6 +50,7 @@ from ganeti import serializer
 from ganeti import uidpool
 from ganeti import netutils
 from ganeti import runtime
+from ganeti import compat
 
 
 _config_lock = locking.SharedLock("ConfigWriter")
@@ -56,6 +58,14 @@ _config_lock = locking.SharedLock("ConfigWriter")
 # job id used for resource management at config upgrade time
 _UPGRADE_CONFIG_JID = "jid-cfg-upgrade"
 
+# top-level configuration entries which are compared item by item when
+# computing configuration deltas
+_DELTA_CONTAINERS = frozenset([
+  "nodes",
+  "instances",
+  "nodegroups",
+  ])
+
 
 def _ValidateConfig(data):
   """Verifies that a configuration objects looks valid.
@@ -111,12 +121,11 @@ class TemporaryReservationManager:
     """
     assert callable(generate_one_fn)
 
-    all_elems = self.GetReserved()
-    all_elems.update(existing)
     retries = 64
     while retries > 0:
       new_resource = generate_one_fn()
-      if new_resource is not None and new_resource not in all_elems:
+      if (new_resource is not None and new_resource not in existing and
+          not self.Reserved(new_resource)):
         break
     else:
       raise errors.ConfigurationError("Not able generate new resource"
@@ -125,6 +134,49 @@ class TemporaryReservationManager:
     return new_resource
 
 
+def _ComputeConfigDelta(old_data, new_data):
+  """Computes the changes between two serialized configurations.
+
+  Top-level entries holding containers (nodes, instances, node groups)
+  are compared item by item, all other entries (e.g. the cluster object)
+  are compared as a whole.
+
+  @type old_data: dict
+  @param old_data: the previously distributed configuration
+  @type new_data: dict
+  @param new_data: the new configuration
+  @rtype: tuple; (list, list)
+  @return: a list of C{(key, subkey, value)} entries to be set and a list of
+      C{(key, subkey)} entries to be removed; C{subkey} is C{None} for
+      entries replaced as a whole
+
+  """
+  changed = []
+  removed = []
+
+  for key in sorted(set(old_data) | set(new_data)):
+    if key not in new_data:
+      removed.append((key, None))
+      continue
+
+    old_value = old_data.get(key, None)
+    new_value = new_data[key]
+
+    if old_value == new_value:
+      continue
+
+    if key in _DELTA_CONTAINERS and isinstance(old_value, dict):
+      for name in sorted(set(old_value) | set(new_value)):
+        if name not in new_value:
+          removed.append((key, name))
+        elif old_value.get(name, None) != new_value[name]:
+          changed.append((key, name, new_value[name]))
+    else:
+      changed.append((key, None, new_value))
+
+  return (changed, removed)
+
+
 def _MatchNameComponentIgnoreCase(short_name, names):
   """Wrapper around L{utils.text.MatchNameComponent}.
 
@@ -132,6 +184,434 @@ def _MatchNameComponentIgnoreCase(short_name, names):
   return utils.MatchNameComponent(short_name, names, case_sensitive=False)
 
 
+def _AddToIndex(index, key, value):
+  """Adds a value to the set stored under a key in an index.
+
+  """
+  index.setdefault(key, set()).add(value)
+
+
+def _RemoveFromIndex(index, key, value):
+  """Removes a value from the set stored under a key in an index.
+
+  Empty sets are removed from the index.
+
+  """
+  values = index.get(key)
+  if values is not None:
+    values.discard(value)
+    if not values:
+      del index[key]
+
+
+def _IncRef(counts, key):
+  """Increases the usage count of a key.
+
+  """
+  counts[key] = counts.get(key, 0) + 1
+
+
+def _DecRef(counts, key):
+  """Decreases the usage count of a key, removing it when unused.
+
+  """
+  if counts.get(key, 0) > 1:
+    counts[key] -= 1
+  else:
+    counts.pop(key, None)
+
+
+def _GetDRBDMinors(disk, result):
+  """Recursively gathers the DRBD minors used by a disk.
+
+  @type disk: L{objects.Disk}
+  @param disk: the disk at which to start searching
+  @type result: list
+  @param result: list to which (node, minor) tuples are appended
+
+  """
+  if disk.dev_type == constants.LD_DRBD8 and len(disk.logical_id) >= 5:
+    node_a, node_b, _, minor_a, minor_b = disk.logical_id[:5]
+    result.append((node_a, minor_a))
+    result.append((node_b, minor_b))
+  if disk.children:
+    for child in disk.children:
+      _GetDRBDMinors(child, result)
+
+
+class _ConfigIndex(object):
+  """Reverse lookup tables for the configuration data.
+
+  The tables are kept up to date by L{ConfigWriter} when it adds, removes or
+  renames objects, and rebuilt whenever the configuration is (re-)read.
+  Since L{ConfigWriter.Update} also saves modifications to other objects than
+  its target, updates to anything but an instance rebuild all tables.
+
+  @ivar node_pinst: node name to set of primary instance names
+  @ivar node_sinst: node name to set of secondary instance names
+  @ivar group_pinst: node group UUID to set of names of instances whose
+      primary node is in the group
+  @ivar group_inst: node group UUID to set of names of instances with any
+      node in the group
+  @ivar macs: MAC address to number of NICs using it
+  @ivar lvs: logical volume name to number of disks using it
+  @ivar ids: name or UUID to number of objects using it, including
+      logical volumes
+  @ivar drbd_minors: node name to dict of DRBD minor to list of instance
+      names using it
+
+  """
+  def __init__(self, data):
+    """Initializes this class.
+
+    @type data: L{objects.ConfigData}
+    @param data: configuration data
+
+    """
+    self.Rebuild(data)
+
+  def Rebuild(self, data):
+    """Rebuilds all tables from the configuration data.
+
+    @type data: L{objects.ConfigData}
+    @param data: configuration data
+
+    """
+    self.node_pinst = {}
+    self.node_sinst = {}
+    self.group_pinst = {}
+    self.group_inst = {}
+    self.macs = {}
+    self.lvs = {}
+    self.ids = {}
+    self.drbd_minors = {}
+    self._drbd_duplicates = set()
+    self._node_info = {}
+    self._instance_info = {}
+
+    if data.cluster.uuid:
+      _IncRef(self.ids, data.cluster.uuid)
+    for nodegroup in data.nodegroups.values():
+      self.AddNodeGroup(nodegroup)
+    for node in data.nodes.values():
+      self.AddNode(node)
+    for instance in data.instances.values():
+      self.AddInstance(instance)
+
+  def AddNodeGroup(self, nodegroup):
+    """Adds a node group to the tables.
+
+    """
+    if nodegroup.uuid:
+      _IncRef(self.ids, nodegroup.uuid)
+
+  def RemoveNodeGroup(self, nodegroup):
+    """Removes a node group from the tables.
+
+    """
+    if nodegroup.uuid:
+      _DecRef(self.ids, nodegroup.uuid)
+
+  def AddNode(self, node):
+    """Adds a node to the tables.
+
+    """
+    ids = [node.name]
+    if node.uuid:
+      ids.append(node.uuid)
+    for key in ids:
+      _IncRef(self.ids, key)
+    self._node_info[node.name] = (node.group, ids)
+
+  def RemoveNode(self, node_name):
+    """Removes a node from the tables.
+
+    """
+    (_, ids) = self._node_info.pop(node_name)
+    for key in ids:
+      _DecRef(self.ids, key)
+
+  def AddInstance(self, instance):
+    """Adds an instance to the tables.
+
+    What has been added is remembered, so that the instance can be removed
+    even after the object has been modified.
+
+    """
+    name = instance.name
+    pnode = instance.primary_node
+    snodes = instance.secondary_nodes
+    node_group = lambda node_name: self._node_info.get(node_name, (None,))[0]
+    pgroup = node_group(pnode)
+    groups = frozenset(node_group(node_name)
+                       for node_name in instance.all_nodes)
+    macs = [nic.mac for nic in instance.nics]
+    lvs = [lv_name
+           for lv_list in instance.MapLVsByNode().values()
+           for lv_name in lv_list]
+    ids = [name] + lvs
+    if instance.uuid:
+      ids.append(instance.uuid)
+    minors = []
+    for disk in instance.disks:
+      _GetDRBDMinors(disk, minors)
+
+    _AddToIndex(self.node_pinst, pnode, name)
+    for node_name in snodes:
+      _AddToIndex(self.node_sinst, node_name, name)
+    _AddToIndex(self.group_pinst, pgroup, name)
+    for group in groups:
+      _AddToIndex(self.group_inst, group, name)
+    for mac in macs:
+      _IncRef(self.macs, mac)
+    for lv_name in lvs:
+      _IncRef(self.lvs, lv_name)
+    for key in ids:
+      _IncRef(self.ids, key)
+    for (node_name, minor) in minors:
+      users = self.drbd_minors.setdefault(node_name, {}).setdefault(minor, [])
+      users.append(name)
+      if len(users) > 1:
+        self._drbd_duplicates.add((node_name, minor))
+
+    self._instance_info[name] = (pnode, snodes, pgroup, groups, macs, lvs, ids,
+                                 minors)
+
+  def RemoveInstance(self, instance_name):
+    """Removes an instance from the tables.
+
+    """
+    (pnode, snodes, pgroup, groups, macs, lvs, ids, minors) = \
+      self._instance_info.pop(instance_name)
+
+    _RemoveFromIndex(self.node_pinst, pnode, instance_name)
+    for node_name in snodes:
+      _RemoveFromIndex(self.node_sinst, node_name, instance_name)
+    _RemoveFromIndex(self.group_pinst, pgroup, instance_name)
+    for group in groups:
+      _RemoveFromIndex(self.group_inst, group, instance_name)
+    for mac in macs:
+      _DecRef(self.macs, mac)
+    for lv_name in lvs:
+      _DecRef(self.lvs, lv_name)
+    for key in ids:
+      _DecRef(self.ids, key)
+    for (node_name, minor) in minors:
+      node_minors = self.drbd_minors[node_name]
+      users = node_minors[minor]
+      users.remove(instance_name)
+      if len(users) < 2:
+        self._drbd_duplicates.discard((node_name, minor))
+      if not users:
+        del node_minors[minor]
+        if not node_minors:
+          del self.drbd_minors[node_name]
+
+  def GetDRBDMap(self, nodes):
+    """Returns the DRBD minors used on the given nodes.
+
+    @type nodes: list
+    @param nodes: node names
+    @rtype: dict
+    @return: dictionary of node_name: dict of minor: instance_name; the
+        dictionaries are copies and can be modified by the caller
+
+    """
+    result = {}
+    for node_name in nodes:
+      result[node_name] = dict((minor, users[0]) for (minor, users) in
+                               self.drbd_minors.get(node_name, {}).items())
+    return result
+
+  def GetDRBDDuplicates(self):
+    """Returns the DRBD minors used more than once.
+
+    @rtype: list
+    @return: list of (node_name, minor, instance_name, other_instance_name)
+
+    """
+    result = []
+    for (node_name, minor) in sorted(self._drbd_duplicates):
+      users = self.drbd_minors[node_name][minor]
+      for instance_name in users[1:]:
+        result.append((node_name, minor, instance_name, users[0]))
+    return result
+
+  def _GetTables(self):
+    """Returns all tables in a form suitable for comparison.
+
+    """
+    return {
+      "node primary instances": self.node_pinst,
+      "node secondary instances": self.node_sinst,
+      "node group primary instances": self.group_pinst,
+      "node group instances": self.group_inst,
+      "MAC addresses": self.macs,
+      "logical volumes": self.lvs,
+      "names and UUIDs": self.ids,
+      "DRBD minors": dict((node_name, dict((minor, sorted(users))
+                                           for (minor, users) in
+                                           node_minors.items()))
+                          for (node_name, node_minors) in
+                          self.drbd_minors.items()),
+      }
+
+  def Verify(self, data):
+    """Checks the tables against the configuration data.
+
+    @type data: L{objects.ConfigData}
+    @param data: configuration data
+    @rtype: list
+    @return: a list of error messages
+
+    """
+    current = self._GetTables()
+    expected = _ConfigIndex(data)._GetTables() # pylint: disable-msg=W0212
+
+    return ["configuration index of %s is out of date" % name
+            for name in sorted(expected)
+            if current[name] != expected[name]]
+
+
+class ConfigSnapshot(object):
+  """Read-only view of the configuration as of a certain serial number.
+
+  Snapshots are published by L{ConfigWriter} after every write and can be
+  used without acquiring the configuration lock. The returned objects are
+  shared between all users of the snapshot and must not be modified.
+
+  @ivar serial_no: serial number of the configuration in this snapshot
+
+  """
+  def __init__(self, data):
+    """Initializes this class.
+
+    @type data: L{objects.ConfigData}
+    @param data: configuration data, must not be used elsewhere
+
+    """
+    self._data = data
+    self.serial_no = data.serial_no
+
+    # Group members are not serialized
+    for node in data.nodes.values():
+      nodegroup = data.nodegroups.get(node.group, None)
+      if nodegroup is not None and node.name not in nodegroup.members:
+        nodegroup.members.append(node.name)
+
+  def GetClusterInfo(self):
+    """Returns information about the cluster.
+
+    @rtype: L{objects.Cluster}
+
+    """
+    return self._data.cluster
+
+  def GetClusterName(self):
+    """Get cluster name.
+
+    """
+    return self._data.cluster.cluster_name
+
+  def GetMasterNode(self):
+    """Get the hostname of the master node for this cluster.
+
+    """
+    return self._data.cluster.master_node
+
+  def GetHypervisorType(self):
+    """Get the hypervisor type for this cluster.
+
+    """
+    return self._data.cluster.enabled_hypervisors[0]
+
+  def GetVGName(self):
+    """Return the volume group name.
+
+    """
+    return self._data.cluster.volume_group_name
+
+  def GetNdParams(self, node):
+    """Get the node params populated with cluster defaults.
+
+    @type node: L{objects.Node}
+
+    """
+    return self._data.cluster.FillND(node, self.GetNodeGroup(node.group))
+
+  def GetNodeGroup(self, uuid):
+    """Lookup a node group.
+
+    @rtype: L{objects.NodeGroup} or None
+
+    """
+    return self._data.nodegroups.get(uuid, None)
+
+  def GetNodeGroupList(self):
+    """Get a list of node groups.
+
+    """
+    return self._data.nodegroups.keys()
+
+  def GetAllNodeGroupsInfo(self):
+    """Get the configuration of all node groups.
+
+    """
+    return dict(self._data.nodegroups)
+
+  def GetNodeInfo(self, node_name):
+    """Get the configuration of a node.
+
+    @rtype: L{objects.Node} or None
+
+    """
+    return self._data.nodes.get(node_name, None)
+
+  def GetNodeList(self):
+    """Return the list of nodes which are in the configuration.
+
+    """
+    return self._data.nodes.keys()
+
+  def GetAllNodesInfo(self):
+    """Get the configuration of all nodes.
+
+    """
+    return dict(self._data.nodes)
+
+  def ExpandNodeName(self, short_name):
+    """Attempt to expand an incomplete node name.
+
+    """
+    return _MatchNameComponentIgnoreCase(short_name, self.GetNodeList())
+
+  def GetInstanceInfo(self, instance_name):
+    """Returns information about an instance.
+
+    @rtype: L{objects.Instance} or None
+
+    """
+    return self._data.instances.get(instance_name, None)
+
+  def GetInstanceList(self):
+    """Get the list of instances.
+
+    """
+    return self._data.instances.keys()
+
+  def GetAllInstancesInfo(self):
+    """Get the configuration of all instances.
+
+    """
+    return dict(self._data.instances)
+
+  def ExpandInstanceName(self, short_name):
+    """Attempt to expand an incomplete instance name.
+
+    """
+    return _MatchNameComponentIgnoreCase(short_name, self.GetInstanceList())
+
+
 class ConfigWriter:
   """The interface to the cluster configuration.
 
@@ -144,6 +624,7 @@ class ConfigWriter:
     self.write_count = 0
     self._lock = _config_lock
     self._config_data = None
+    self._index = None
     self._offline = offline
     if cfg_file is None:
       self._cfg_file = constants.CLUSTER_CONF_FILE
@@ -163,7 +644,13 @@ class ConfigWriter:
     # file than after it was modified
     self._my_hostname = netutils.Hostname.GetSysName()
     self._last_cluster_serial = -1
+    self._last_dist_data = None
     self._cfg_id = None
+    # serialized configuration from which the next snapshot is built, and
+    # the last built snapshot along with the data it was built from
+    self._snapshot_source = None
+    self._snapshot = (None, None)
+    self._snapshot_lock = threading.Lock()
     self._OpenConfig(accept_foreign)
 
   # this method needs to be static, so that we can call it on the class
@@ -204,8 +691,8 @@ class ConfigWriter:
     This should check the current instances for duplicates.
 
     """
-    existing = self._AllMACs()
-    return self._temporary_ids.Generate(existing, self._GenerateOneMAC, ec_id)
+    return self._temporary_ids.Generate(self._AllMACs(), self._GenerateOneMAC,
+                                        ec_id)
 
   @locking.ssynchronized(_config_lock, shared=1)
   def ReserveMAC(self, mac, ec_id):
@@ -215,8 +702,7 @@ class ConfigWriter:
     check for potential collisions elsewhere.
 
     """
-    all_macs = self._AllMACs()
-    if mac in all_macs:
+    if mac in self._AllMACs():
       raise errors.ReservationError("mac already in use")
     else:
       self._temporary_macs.Reserve(ec_id, mac)
@@ -229,8 +715,7 @@ class ConfigWriter:
     @param lv_name: the logical volume name to reserve
 
     """
-    all_lvs = self._AllLVs()
-    if lv_name in all_lvs:
+    if lv_name in self._AllLVs():
       raise errors.ReservationError("LV already in use")
     else:
       self._temporary_lvs.Reserve(ec_id, lv_name)
@@ -247,33 +732,24 @@ class ConfigWriter:
                                             ec_id)
 
   def _AllLVs(self):
-    """Compute the list of all LVs.
+    """Return all LVs present in the config.
+
+    @rtype: dict
+    @return: dictionary of LV name to the number of disks using it
 
     """
-    lvnames = set()
-    for instance in self._config_data.instances.values():
-      node_data = instance.MapLVsByNode()
-      for lv_list in node_data.values():
-        lvnames.update(lv_list)
-    return lvnames
+    return self._index.lvs
+
+  def _AllIDs(self):
+    """Return all UUIDs and names present in the config.
 
-  def _AllIDs(self, include_temporary):
-    """Compute the list of all UUIDs and names we have.
+    This includes the names of logical volumes.
 
-    @type include_temporary: boolean
-    @param include_temporary: whether to include the _temporary_ids set
-    @rtype: set
-    @return: a set of IDs
+    @rtype: dict
+    @return: dictionary of ID to the number of objects using it
 
     """
-    existing = set()
-    if include_temporary:
-      existing.update(self._temporary_ids.GetReserved())
-    existing.update(self._AllLVs())
-    existing.update(self._config_data.instances.keys())
-    existing.update(self._config_data.nodes.keys())
-    existing.update([i.uuid for i in self._AllUUIDObjects() if i.uuid])
-    return existing
+    return self._index.ids
 
   def _GenerateUniqueID(self, ec_id):
     """Generate an unique UUID.
@@ -285,8 +761,7 @@ class ConfigWriter:
     @return: the unique id
 
     """
-    existing = self._AllIDs(include_temporary=False)
-    return self._temporary_ids.Generate(existing, utils.NewUUID, ec_id)
+    return self._temporary_ids.Generate(self._AllIDs(), utils.NewUUID, ec_id)
 
   @locking.ssynchronized(_config_lock, shared=1)
   def GenerateUniqueID(self, ec_id):
@@ -303,16 +778,11 @@ class ConfigWriter:
   def _AllMACs(self):
     """Return all MACs present in the config.
 
-    @rtype: list
-    @return: the list of all MACs
+    @rtype: dict
+    @return: dictionary of MAC to the number of NICs using it
 
     """
-    result = []
-    for instance in self._config_data.instances.values():
-      for nic in instance.nics:
-        result.append(nic.mac)
-
-    return result
+    return self._index.macs
 
   def _AllDRBDSecrets(self):
     """Return all DRBD secrets present in the config.
@@ -590,14 +1060,16 @@ class ConfigWriter:
   def VerifyConfig(self):
     """Verify function.
 
-    This is just a wrapper over L{_UnlockedVerifyConfig}.
+    This is a wrapper over L{_UnlockedVerifyConfig}, which also checks the
+    lookup tables used by this class.
 
     @rtype: list
     @return: a list of error messages; a non-empty list signifies
         configuration errors
 
     """
-    return self._UnlockedVerifyConfig()
+    return (self._UnlockedVerifyConfig() +
+            self._index.Verify(self._config_data))
 
   def _UnlockedSetDiskID(self, disk, node_name):
     """Convert the unique ID to the ID needed on the target nodes.
@@ -691,39 +1163,26 @@ class ConfigWriter:
     self._WriteConfig()
     return port
 
-  def _UnlockedComputeDRBDMap(self):
+  def _UnlockedComputeDRBDMap(self, nodes=None):
     """Compute the used DRBD minor/nodes.
 
+    @type nodes: list
+    @param nodes: if given, only compute the minors of these nodes
     @rtype: (dict, list)
     @return: dictionary of node_name: dict of minor: instance_name;
-        the returned dict will have all the nodes in it (even if with
-        an empty list), and a list of duplicates; if the duplicates
-        list is not empty, the configuration is corrupted and its caller
-        should raise an exception
-
-    """
-    def _AppendUsedPorts(instance_name, disk, used):
-      duplicates = []
-      if disk.dev_type == constants.LD_DRBD8 and len(disk.logical_id) >= 5:
-        node_a, node_b, _, minor_a, minor_b = disk.logical_id[:5]
-        for node, port in ((node_a, minor_a), (node_b, minor_b)):
-          assert node in used, ("Node '%s' of instance '%s' not found"
-                                " in node list" % (node, instance_name))
-          if port in used[node]:
-            duplicates.append((node, port, instance_name, used[node][port]))
-          else:
-            used[node][port] = instance_name
-      if disk.children:
-        for child in disk.children:
-          duplicates.extend(_AppendUsedPorts(instance_name, child, used))
-      return duplicates
+        the returned dict will have all the (requested) nodes in it (even
+        if with an empty list), and a list of duplicates; if the
+        duplicates list is not empty, the configuration is corrupted and
+        its caller should raise an exception
 
-    duplicates = []
-    my_dict = dict((node, {}) for node in self._config_data.nodes)
-    for instance in self._config_data.instances.itervalues():
-      for disk in instance.disks:
-        duplicates.extend(_AppendUsedPorts(instance.name, disk, my_dict))
+    """
+    if nodes is None:
+      nodes = self._config_data.nodes.keys()
+    my_dict = self._index.GetDRBDMap(nodes)
+    duplicates = self._index.GetDRBDDuplicates()
     for (node, minor), instance in self._temporary_drbds.iteritems():
+      if node not in my_dict:
+        continue
       if minor in my_dict[node] and my_dict[node][minor] != instance:
         duplicates.append((node, minor, instance, my_dict[node][minor]))
       else:
@@ -763,7 +1222,7 @@ class ConfigWriter:
     assert isinstance(instance, basestring), \
            "Invalid argument '%s' passed to AllocateDRBDMinor" % instance
 
-    d_map, duplicates = self._UnlockedComputeDRBDMap()
+    d_map, duplicates = self._UnlockedComputeDRBDMap(nodes=nodes)
     if duplicates:
       raise errors.ConfigurationError("Duplicate DRBD ports detected: %s" %
                                       str(duplicates))
@@ -834,6 +1293,34 @@ class ConfigWriter:
     """
     self._UnlockedReleaseDRBDMinors(instance)
 
+  def GetConfigSnapshot(self):
+    """Returns a snapshot of the configuration as last written.
+
+    This doesn't acquire the configuration lock and is meant for read-only
+    users such as queries. The snapshot is only built when first requested
+    after a write and then shared by all callers until the next write. Its
+    serial number can be compared with a later snapshot's to detect changes.
+
+    @rtype: L{ConfigSnapshot}
+
+    """
+    source = self._snapshot_source
+    (snapshot_source, snapshot) = self._snapshot
+
+    if snapshot_source is not source:
+      self._snapshot_lock.acquire()
+      try:
+        (snapshot_source, snapshot) = self._snapshot
+        if snapshot_source is not source:
+          data = objects.ConfigData.FromDict(serializer.Load(source))
+          data.UpgradeConfig()
+          snapshot = ConfigSnapshot(data)
+          self._snapshot = (source, snapshot)
+      finally:
+        self._snapshot_lock.release()
+
+    return snapshot
+
   @locking.ssynchronized(_config_lock, shared=1)
   def GetConfigVersion(self):
     """Get the configuration version.
@@ -971,6 +1458,7 @@ class ConfigWriter:
     group.UpgradeConfig()
 
     self._config_data.nodegroups[group.uuid] = group
+    self._index.AddNodeGroup(group)
     self._config_data.cluster.serial_no += 1
 
   @locking.ssynchronized(_config_lock)
@@ -989,6 +1477,7 @@ class ConfigWriter:
     assert len(self._config_data.nodegroups) != 1, \
             "Group '%s' is the only group, cannot be removed" % group_uuid
 
+    self._index.RemoveNodeGroup(self._config_data.nodegroups[group_uuid])
     del self._config_data.nodegroups[group_uuid]
     self._config_data.cluster.serial_no += 1
     self._WriteConfig()
@@ -1111,6 +1600,7 @@ class ConfigWriter:
     instance.serial_no = 1
     instance.ctime = instance.mtime = time.time()
     self._config_data.instances[instance.name] = instance
+    self._index.AddInstance(instance)
     self._config_data.cluster.serial_no += 1
     self._UnlockedReleaseDRBDMinors(instance.name)
     self._WriteConfig()
@@ -1124,7 +1614,8 @@ class ConfigWriter:
     """
     if not item.uuid:
       item.uuid = self._GenerateUniqueID(ec_id)
-    elif item.uuid in self._AllIDs(include_temporary=True):
+    elif (item.uuid in self._AllIDs() or
+          self._temporary_ids.Reserved(item.uuid)):
       raise errors.ConfigurationError("Cannot add '%s': UUID %s already"
                                       " in use" % (item.name, item.uuid))
 
@@ -1159,6 +1650,7 @@ class ConfigWriter:
     """
     if instance_name not in self._config_data.instances:
       raise errors.ConfigurationError("Unknown instance '%s'" % instance_name)
+    self._index.RemoveInstance(instance_name)
     del self._config_data.instances[instance_name]
     self._config_data.cluster.serial_no += 1
     self._WriteConfig()
@@ -1175,6 +1667,7 @@ class ConfigWriter:
     if old_name not in self._config_data.instances:
       raise errors.ConfigurationError("Unknown instance '%s'" % old_name)
     inst = self._config_data.instances[old_name]
+    self._index.RemoveInstance(old_name)
     del self._config_data.instances[old_name]
     inst.name = new_name
 
@@ -1192,6 +1685,7 @@ class ConfigWriter:
     self._config_data.cluster.serial_no += 1
 
     self._config_data.instances[inst.name] = inst
+    self._index.AddInstance(inst)
     self._WriteConfig()
 
   @locking.ssynchronized(_config_lock)
@@ -1301,6 +1795,7 @@ class ConfigWriter:
     node.ctime = node.mtime = time.time()
     self._UnlockedAddNodeToGroup(node.name, node.group)
     self._config_data.nodes[node.name] = node
+    self._index.AddNode(node)
     self._config_data.cluster.serial_no += 1
     self._WriteConfig()
 
@@ -1315,6 +1810,7 @@ class ConfigWriter:
       raise errors.ConfigurationError("Unknown node '%s'" % node_name)
 
     self._UnlockedRemoveNodeFromGroup(self._config_data.nodes[node_name])
+    self._index.RemoveNode(node_name)
     del self._config_data.nodes[node_name]
     self._config_data.cluster.serial_no += 1
     self._WriteConfig()
@@ -1367,14 +1863,8 @@ class ConfigWriter:
     @return: a tuple with two lists: the primary and the secondary instances
 
     """
-    pri = []
-    sec = []
-    for inst in self._config_data.instances.values():
-      if inst.primary_node == node_name:
-        pri.append(inst.name)
-      if node_name in inst.secondary_nodes:
-        sec.append(inst.name)
-    return (pri, sec)
+    return (list(self._index.node_pinst.get(node_name, [])),
+            list(self._index.node_sinst.get(node_name, [])))
 
   @locking.ssynchronized(_config_lock, shared=1)
   def GetNodeGroupInstances(self, uuid, primary_only=False):
@@ -1387,14 +1877,11 @@ class ConfigWriter:
 
     """
     if primary_only:
-      nodes_fn = lambda inst: [inst.primary_node]
+      index = self._index.group_pinst
     else:
-      nodes_fn = lambda inst: inst.all_nodes
+      index = self._index.group_inst
 
-    return frozenset(inst.name
-                     for inst in self._config_data.instances.values()
-                     for node_name in nodes_fn(inst)
-                     if self._UnlockedGetNodeInfo(node_name).group == uuid)
+    return frozenset(index.get(uuid, []))
 
   def _UnlockedGetNodeList(self):
     """Return the list of nodes which are in the configuration.
@@ -1615,9 +2102,14 @@ class ConfigWriter:
     data.UpgradeConfig()
 
     self._config_data = data
+    self._index = _ConfigIndex(data)
+    self._snapshot_source = raw_data
     # reset the last serial as -1 so that the next write will cause
     # ssconf update
     self._last_cluster_serial = -1
+    # the first distribution after (re-)reading the configuration always
+    # uploads the full file
+    self._last_dist_data = None
 
     # And finally run our (custom) config upgrade sequence
     self._UpgradeConfig()
@@ -1658,16 +2150,21 @@ class ConfigWriter:
       # serializing/deserializing the object.
       self._UnlockedAddNodeToGroup(node.name, node.group)
     if modified:
+      self._index.Rebuild(self._config_data)
       self._WriteConfig()
       # This is ok even if it acquires the internal lock, as _UpgradeConfig is
       # only called at config init time, without the lock held
       self.DropECReservations(_UPGRADE_CONFIG_JID)
 
-  def _DistributeConfig(self, feedback_fn):
+  def _DistributeConfig(self, feedback_fn, txt=None):
     """Distribute the configuration to the other nodes.
 
-    Currently, this only copies the configuration file. In the future,
-    it could be used to encapsulate the 2/3-phase update mechanism.
+    If the previously distributed configuration is known, only the changes
+    since then are sent to the master candidates; nodes which can not apply
+    them (e.g. because they missed an update) receive the full file.
+
+    @type txt: string or None
+    @param txt: the serialized configuration as written to disk
 
     """
     if self._offline:
@@ -1691,6 +2188,20 @@ class ConfigWriter:
       node_list.append(node_info.name)
       addr_list.append(node_info.primary_ip)
 
+    if txt is None:
+      new_data = None
+    else:
+      new_data = serializer.Load(txt)
+
+    if node_list and self._last_dist_data is not None and new_data is not None:
+      (node_list, addr_list) = self._DistributeConfigDelta(node_list, addr_list,
+                                                           new_data, txt)
+
+    self._last_dist_data = new_data
+
+    if not node_list:
+      return True
+
     result = rpc.RpcRunner.call_upload_file(node_list, self._cfg_file,
                                             address_list=addr_list)
     for to_node, to_result in result.items():
@@ -1707,6 +2218,48 @@ class ConfigWriter:
 
     return not bad
 
+  def _DistributeConfigDelta(self, node_list, addr_list, new_data, txt):
+    """Sends the configuration changes to the master candidates.
+
+    @type node_list: list
+    @param node_list: the names of the nodes to update
+    @type addr_list: list
+    @param addr_list: the addresses of the nodes to update
+    @type new_data: dict
+    @param new_data: the new configuration
+    @type txt: string
+    @param txt: the serialized configuration as written to disk
+    @rtype: tuple; (list, list)
+    @return: the names and addresses of the nodes which still need the
+        full configuration file
+
+    """
+    base_serial = self._last_dist_data.get("serial_no", None)
+    delta = _ComputeConfigDelta(self._last_dist_data, new_data)
+
+    # Sending the delta is pointless if it's not smaller than the file
+    if len(serializer.DumpJson(delta, indent=False)) >= len(txt):
+      return (node_list, addr_list)
+
+    checksum = compat.sha1_hash(txt).hexdigest()
+
+    result = rpc.RpcRunner.call_upload_config_delta(node_list, self._cfg_file,
+                                                    base_serial, delta,
+                                                    checksum,
+                                                    address_list=addr_list)
+
+    fallback_nodes = []
+    fallback_addrs = []
+    for (node_name, addr) in zip(node_list, addr_list):
+      msg = result[node_name].fail_msg
+      if msg:
+        logging.info("Sending configuration changes to node %s failed,"
+                     " uploading full file: %s", node_name, msg)
+        fallback_nodes.append(node_name)
+        fallback_addrs.append(addr)
+
+    return (fallback_nodes, fallback_addrs)
+
   def _WriteConfig(self, destination=None, feedback_fn=None):
     """Write the configuration data to persistent storage.
 
@@ -1744,9 +2297,10 @@ class ConfigWriter:
       os.close(fd)
 
     self.write_count += 1
+    self._snapshot_source = txt
 
     # and redistribute the config file to master candidates
-    self._DistributeConfig(feedback_fn)
+    self._DistributeConfig(feedback_fn, txt=txt)
 
     # Write ssconf files on all nodes (including locally)
     if self._last_cluster_serial < self._config_data.cluster.serial_no:
@@ -1944,6 +2498,12 @@ class ConfigWriter:
 
     if isinstance(target, objects.Instance):
       self._UnlockedReleaseDRBDMinors(target.name)
+      self._index.RemoveInstance(target.name)
+      self._index.AddInstance(target)
+    else:
+      # Modifications of other objects, e.g. the node group of nodes, are
+      # saved along with the target
+      self._index.Rebuild(self._config_data)
 
     self._WriteConfig(feedback_fn=feedback_fn)
 
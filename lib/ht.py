@@ -198,6 +198,16 @@ def TElemOf(target_list):
   return WithDesc("OneOf %s" % (utils.CommaJoin(target_list), ))(fn)
 
 
+def TInstanceOf(cls):
+  """Builds a function that checks if a given value is an instance of a class.
+
+  """
+  def fn(val):
+    return isinstance(val, cls)
+
+  return WithDesc("Instance of %s" % (cls.__name__, ))(fn)
+
+
 # Container types
 @WithDesc("List")
 def TList(val):
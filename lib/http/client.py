@@ -23,6 +23,8 @@
 """
 
 import logging
+import time
+import threading
 import pycurl
 from cStringIO import StringIO
 
@@ -267,37 +269,87 @@ class _PooledHttpClient:
     self.identity = identity
     self.client = client
     self.lastused = 0
+    self.lastused_time = None
 
   def __repr__(self):
     status = ["%s.%s" % (self.__class__.__module__, self.__class__.__name__),
               "id=%s" % self.identity,
               "lastuse=%s" % self.lastused,
+              "lastuse_time=%s" % self.lastused_time,
               repr(self.client)]
 
     return "<%s at %#x>" % (" ".join(status), id(self))
 
 
+class _PooledCurlMulti:
+  """Data structure for a pooled cURL multi handle.
+
+  cURL keeps finished connections in the connection cache of the multi handle
+  they were used with, from where they are re-used by any further request to
+  the same host.
+
+  """
+  def __init__(self, multi):
+    """Initializes this class.
+
+    @type multi: C{pycurl.CurlMulti}
+    @param multi: cURL multi handle
+
+    """
+    self.multi = multi
+    self.lastused = 0
+    self.lastused_time = None
+
+  def __repr__(self):
+    status = ["%s.%s" % (self.__class__.__module__, self.__class__.__name__),
+              "lastuse=%s" % self.lastused,
+              "lastuse_time=%s" % self.lastused_time]
+
+    return "<%s at %#x>" % (" ".join(status), id(self))
+
+
 class HttpClientPool:
   """A simple HTTP client pool.
 
-  Supports one pooled connection per identity (see
-  L{HttpClientRequest.identity}).
+  Keeps idle clients per identity (see L{HttpClientRequest.identity}) and the
+  cURL multi handles holding their open connections, so further requests to
+  the same host don't have to connect again. The pool can be shared between
+  threads; every multi handle is only used by one L{ProcessRequests} call and
+  every client by one request at a time. Before re-using a connection cURL
+  checks whether it was closed by the peer, and connects again if needed.
 
   """
   #: After how many generations to drop unused clients
   _MAX_GENERATIONS_DROP = 25
 
-  def __init__(self, curl_config_fn):
+  def __init__(self, curl_config_fn, max_idle_time=None, max_idle_clients=1):
     """Initializes this class.
 
     @type curl_config_fn: callable
     @param curl_config_fn: Function to configure cURL object after
                            initialization
+    @type max_idle_time: number or None
+    @param max_idle_time: If set, idle clients and connections are dropped
+                          after this many seconds instead of after a number of
+                          calls to L{ProcessRequests}; should be lower than the
+                          server's keep-alive timeout
+    @type max_idle_clients: int
+    @param max_idle_clients: Maximum number of idle clients per identity and
+                             of idle multi handles, and therefore of idle
+                             connections to a host
 
     """
+    assert max_idle_clients > 0
+
     self._curl_config_fn = curl_config_fn
+    self._max_idle_time = max_idle_time
+    self._max_idle_clients = max_idle_clients
+    self._lock = threading.Lock()
     self._generation = 0
+    # Identity to list of idle clients, most recently used last
     self._pool = {}
+    # Idle multi handles, most recently used last
+    self._multis = []
 
     # Create custom logger for HTTP client pool. Change logging level to
     # C{logging.NOTSET} to get more details.
@@ -318,9 +370,19 @@ class HttpClientPool:
     @param identity: Client identifier
 
     """
+    self._lock.acquire()
     try:
-      pclient  = self._pool.pop(identity)
-    except KeyError:
+      idle = self._pool.get(identity)
+      if idle:
+        pclient = idle.pop()
+        if not idle:
+          del self._pool[identity]
+      else:
+        pclient = None
+    finally:
+      self._lock.release()
+
+    if pclient is None:
       # Need to create new client
       client = self._GetHttpClientCreator()(self._curl_config_fn)
       pclient = _PooledHttpClient(identity, client)
@@ -341,34 +403,98 @@ class HttpClientPool:
     """
     pclient = self._Get(req.identity)
 
-    assert req.identity not in self._pool
-
     pclient.client.StartRequest(req)
     pclient.lastused = self._generation
 
     return pclient
 
-  def _Return(self, pclients):
-    """Returns HTTP clients to the pool.
+  def _GetMulti(self):
+    """Gets a cURL multi handle from the pool.
+
+    @rtype: L{_PooledCurlMulti}
 
     """
-    for pc in pclients:
-      self._logger.debug("Returning client %s to pool", pc)
-      assert pc.identity not in self._pool
-      assert pc not in self._pool.values()
-      self._pool[pc.identity] = pc
-
-    # Check for unused clients
-    for pc in self._pool.values():
-      if (pc.lastused + self._MAX_GENERATIONS_DROP) < self._generation:
-        self._logger.debug("Removing client %s which hasn't been used"
-                           " for %s generations",
-                           pc, self._MAX_GENERATIONS_DROP)
-        self._pool.pop(pc.identity, None)
-
-    assert compat.all(pc.lastused >= (self._generation -
-                                      self._MAX_GENERATIONS_DROP)
-                      for pc in self._pool.values())
+    self._lock.acquire()
+    try:
+      self._generation += 1
+
+      if self._multis:
+        pmulti = self._multis.pop()
+      else:
+        pmulti = None
+
+      generation = self._generation
+    finally:
+      self._lock.release()
+
+    if pmulti is None:
+      pmulti = _PooledCurlMulti(self._CreateCurlMultiHandle())
+      self._logger.debug("Created new multi handle %s", pmulti)
+
+    pmulti.lastused = generation
+
+    return pmulti
+
+  def _IsExpired(self, item, now):
+    """Returns whether an idle client or multi handle is unused for too long.
+
+    """
+    if self._max_idle_time is None:
+      return (item.lastused + self._MAX_GENERATIONS_DROP) < self._generation
+    else:
+      return (item.lastused_time + self._max_idle_time) < now
+
+  def _RemoveExpired(self, items, now):
+    """Returns the most recently used items which aren't expired.
+
+    """
+    keep = []
+
+    for item in items:
+      if self._IsExpired(item, now):
+        self._logger.debug("Removing %s which hasn't been used for too long",
+                           item)
+      else:
+        keep.append(item)
+
+    return keep[-self._max_idle_clients:]
+
+  def _Return(self, pmulti, pclients):
+    """Returns a cURL multi handle and HTTP clients to the pool.
+
+    """
+    now = time.time()
+
+    self._lock.acquire()
+    try:
+      for pc in pclients:
+        self._logger.debug("Returning client %s to pool", pc)
+        pc.lastused_time = now
+        idle = self._pool.setdefault(pc.identity, [])
+        assert pc not in idle
+        idle.append(pc)
+
+      assert pmulti not in self._multis
+      pmulti.lastused_time = now
+      self._multis.append(pmulti)
+
+      # Check for unused clients and multi handles; the latter are closed
+      # along with their connections
+      for (identity, idle) in self._pool.items():
+        keep = self._RemoveExpired(idle, now)
+        if keep:
+          self._pool[identity] = keep
+        else:
+          del self._pool[identity]
+
+      self._multis = self._RemoveExpired(self._multis, now)
+
+      assert compat.all(not self._IsExpired(item, now)
+                        for item in (self._multis +
+                                     [pc for idle in self._pool.values()
+                                      for pc in idle]))
+    finally:
+      self._lock.release()
 
   @staticmethod
   def _CreateCurlMultiHandle():
@@ -377,24 +503,28 @@ class HttpClientPool:
     """
     return pycurl.CurlMulti()
 
-  def ProcessRequests(self, requests):
+  def ProcessRequests(self, requests, done_fn=None, deadline=None):
     """Processes any number of HTTP client requests using pooled objects.
 
     @type requests: list of L{HttpClientRequest}
     @param requests: List of all requests
+    @type done_fn: callable or None
+    @param done_fn: Function called with every request as soon as it has
+        finished, in the order of completion
+    @type deadline: number or None
+    @param deadline: Absolute time (see C{time.time}) after which requests
+        still in progress are aborted and marked as failed
 
     """
-    multi = self._CreateCurlMultiHandle()
-
-    # For client cleanup
-    self._generation += 1
-
     assert compat.all((req.error is None and
                        req.success is None and
                        req.resp_status_code is None and
                        req.resp_body is None)
                       for req in requests)
 
+    pmulti = self._GetMulti()
+    multi = pmulti.multi
+
     curl_to_pclient = {}
     for req in requests:
       pclient = self._StartRequest(req)
@@ -406,8 +536,10 @@ class HttpClientPool:
 
     assert len(curl_to_pclient) == len(requests)
 
+    # Clients which mustn't be reused
+    discard = set()
     done_count = 0
-    while True:
+    while requests:
       (ret, _) = multi.perform()
       assert ret in (pycurl.E_MULTI_OK, pycurl.E_CALL_MULTI_PERFORM)
 
@@ -426,6 +558,8 @@ class HttpClientPool:
           pclient.client.Done(None)
           assert req.success
           assert not pclient.client.GetCurrentRequest()
+          if done_fn:
+            done_fn(req)
 
         for curl, errnum, errmsg in failed:
           multi.remove_handle(curl)
@@ -435,6 +569,9 @@ class HttpClientPool:
           pclient.client.Done("Error %s: %s" % (errnum, errmsg))
           assert req.error
           assert not pclient.client.GetCurrentRequest()
+          discard.add(pclient)
+          if done_fn:
+            done_fn(req)
 
         if remaining_messages == 0:
           break
@@ -447,13 +584,33 @@ class HttpClientPool:
       # Wait for I/O. The I/O timeout shouldn't be too long so that HTTP
       # timeouts, which are only evaluated in multi.perform, aren't
       # unnecessarily delayed.
-      multi.select(1.0)
+      if deadline is None:
+        select_timeout = 1.0
+      else:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          for (curl, pclient) in curl_to_pclient.items():
+            req = pclient.client.GetCurrentRequest()
+            if req is None:
+              continue
+            multi.remove_handle(curl)
+            done_count += 1
+            pclient.client.Done("Request didn't finish before the deadline")
+            discard.add(pclient)
+            if done_fn:
+              done_fn(req)
+          break
+        select_timeout = min(1.0, remaining)
+
+      multi.select(select_timeout)
 
     assert compat.all(pclient.client.GetCurrentRequest() is None
                       for pclient in curl_to_pclient.values())
 
-    # Return clients to pool
-    self._Return(curl_to_pclient.values())
+    # Return clients and the multi handle to the pool; clients of failed and
+    # aborted requests are in an unknown state and are replaced
+    self._Return(pmulti, [pclient for pclient in curl_to_pclient.values()
+                          if pclient not in discard])
 
     assert done_count == len(requests)
     assert compat.all(req.error is not None or
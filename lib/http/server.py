@@ -30,6 +30,8 @@ import socket
 import time
 import signal
 import asyncore
+import errno
+import select
 
 from ganeti import http
 from ganeti import utils
@@ -220,7 +222,8 @@ class HttpServerRequestExecutor(object):
   This class implements the server side of HTTP. It's based on code of
   Python's BaseHTTPServer, from both version 2.4 and 3k. It does not
   support non-ASCII character encodings. Keep-alive connections are
-  not supported.
+  only supported by pre-forked workers of a server with a keep-alive
+  timeout.
 
   """
   # The default request version.  This only affects responses up until
@@ -240,6 +243,9 @@ class HttpServerRequestExecutor(object):
   READ_TIMEOUT = 10
   CLOSE_TIMEOUT = 1
 
+  # Maximum number of requests on a persistent connection
+  MAX_KEEP_ALIVE_REQUESTS = 100
+
   def __init__(self, server, sock, client_addr):
     """Initializes this class.
 
@@ -248,12 +254,8 @@ class HttpServerRequestExecutor(object):
     self.sock = sock
     self.client_addr = client_addr
 
-    self.request_msg = http.HttpMessage()
-    self.response_msg = http.HttpMessage()
-
-    self.response_msg.start_line = \
-      http.HttpServerToClientStartLine(version=self.default_request_version,
-                                       code=None, reason=None)
+    self.request_msg = None
+    self.response_msg = None
 
     # Disable Python's timeout
     self.sock.settimeout(None)
@@ -265,6 +267,7 @@ class HttpServerRequestExecutor(object):
     try:
       request_msg_reader = None
       force_close = True
+      handed_over = False
       try:
         # Do the secret SSL handshake
         if self.server.using_ssl:
@@ -275,35 +278,98 @@ class HttpServerRequestExecutor(object):
             # Ignore rest
             return
 
-        try:
+        count = 0
+        while True:
+          count += 1
+
+          self._InitMessages()
+
+          request_msg_reader = None
+          force_close = True
+          keep_alive = False
           try:
-            request_msg_reader = self._ReadRequest()
-
-            # RFC2616, 14.23: All Internet-based HTTP/1.1 servers MUST respond
-            # with a 400 (Bad Request) status code to any HTTP/1.1 request
-            # message which lacks a Host header field.
-            if (self.request_msg.start_line.version == http.HTTP_1_1 and
-                http.HTTP_HOST not in self.request_msg.headers):
-              raise http.HttpBadRequest(message="Missing Host header")
-
-            self._HandleRequest()
-
-            # Only wait for client to close if we didn't have any exception.
-            force_close = False
-          except http.HttpException, err:
-            self._SetErrorStatus(err)
-        finally:
-          # Try to send a response
-          self._SendResponse()
+            try:
+              try:
+                request_msg_reader = self._ReadRequest()
+              except http.HttpError, err:
+                if count == 1:
+                  raise
+                # The client closed the persistent connection
+                logging.debug("Persistent connection from %s:%s closed: %s",
+                              client_addr[0], client_addr[1], err)
+                break
+
+              # RFC2616, 14.23: All Internet-based HTTP/1.1 servers MUST
+              # respond with a 400 (Bad Request) status code to any HTTP/1.1
+              # request message which lacks a Host header field.
+              if (self.request_msg.start_line.version == http.HTTP_1_1 and
+                  http.HTTP_HOST not in self.request_msg.headers):
+                raise http.HttpBadRequest(message="Missing Host header")
+
+              if (self.server.worker_process and
+                  self.server.IsolateRequest(self.request_msg.start_line.method,
+                                             self.request_msg.start_line.path)):
+                if not self.server.ForkRequest():
+                  # The request is handled by the child process
+                  handed_over = True
+                  return
+
+              self._HandleRequest()
+
+              # Only wait for client to close if we didn't have any exception.
+              force_close = False
+
+              keep_alive = bool(self.server.worker_process and
+                                self.server.keep_alive_timeout and
+                                not request_msg_reader.peer_will_close and
+                                count < self.MAX_KEEP_ALIVE_REQUESTS)
+            except http.HttpException, err:
+              self._SetErrorStatus(err)
+          finally:
+            if not handed_over:
+              # Try to send a response
+              self._SendResponse(keep_alive)
+
+          if not (keep_alive and self._WaitForNextRequest()):
+            break
       finally:
-        http.ShutdownConnection(sock, self.CLOSE_TIMEOUT, self.WRITE_TIMEOUT,
-                                request_msg_reader, force_close)
+        if handed_over:
+          # Leave the connection to the child process
+          self.sock.close()
+        else:
+          http.ShutdownConnection(sock, self.CLOSE_TIMEOUT, self.WRITE_TIMEOUT,
+                                  request_msg_reader, force_close)
 
       self.sock.close()
       self.sock = None
     finally:
       logging.debug("Disconnected %s:%s", client_addr[0], client_addr[1])
 
+  def _InitMessages(self):
+    """Prepares the messages for a new request.
+
+    """
+    self.request_msg = http.HttpMessage()
+    self.response_msg = http.HttpMessage()
+
+    self.response_msg.start_line = \
+      http.HttpServerToClientStartLine(version=self.default_request_version,
+                                       code=None, reason=None)
+
+  def _WaitForNextRequest(self):
+    """Waits for another request on a persistent connection.
+
+    @rtype: bool
+    @return: whether data arrived before the keep-alive timeout expired
+
+    """
+    if self.server.using_ssl and self.sock.pending():
+      return True
+
+    return (utils.WaitForFdCondition(self.sock, select.POLLIN,
+                                     self.server.keep_alive_timeout)
+            is not None)
+
   def _ReadRequest(self):
     """Reads a request sent by client.
 
@@ -358,9 +424,13 @@ class HttpServerRequestExecutor(object):
       # No reason to keep this any longer, even for exceptions
       handler_context.private = None
 
-  def _SendResponse(self):
+  def _SendResponse(self, keep_alive):
     """Sends the response to the client.
 
+    @type keep_alive: bool
+    @param keep_alive: whether the connection is kept open for further
+        requests
+
     """
     if self.response_msg.start_line.code is None:
       return
@@ -368,9 +438,18 @@ class HttpServerRequestExecutor(object):
     if not self.response_msg.headers:
       self.response_msg.headers = {}
 
+    if keep_alive:
+      connection = "keep-alive"
+
+      # Without a body the client would have to wait for the connection to
+      # be closed
+      if not self.response_msg.body:
+        self.response_msg.headers[http.HTTP_CONTENT_LENGTH] = 0
+    else:
+      connection = "close"
+
     self.response_msg.headers.update({
-      # TODO: Keep-alive is not supported
-      http.HTTP_CONNECTION: "close",
+      http.HTTP_CONNECTION: connection,
       http.HTTP_DATE: _DateTimeHeader(),
       http.HTTP_SERVER: http.HTTP_GANETI_VERSION,
       })
@@ -447,9 +526,13 @@ class HttpServer(http.HttpBase, asyncore.dispatcher):
   """
   MAX_CHILDREN = 20
 
+  # Number of connections handled by a pre-forked worker before it's replaced
+  MAX_WORKER_CONNECTIONS = 1000
+
   def __init__(self, mainloop, local_address, port,
                ssl_params=None, ssl_verify_peer=False,
-               request_executor_class=None):
+               request_executor_class=None, num_workers=None,
+               keep_alive_timeout=None):
     """Initializes the HTTP server
 
     @type mainloop: ganeti.daemon.Mainloop
@@ -466,6 +549,13 @@ class HttpServer(http.HttpBase, asyncore.dispatcher):
     @type request_executor_class: class
     @param request_executor_class: an class derived from the
         HttpServerRequestExecutor class
+    @type num_workers: int or None
+    @param num_workers: if set, the number of long-lived worker processes
+        accepting connections; otherwise a new child process is forked for
+        every connection
+    @type keep_alive_timeout: float or None
+    @param keep_alive_timeout: if set, how long (in seconds) workers wait for
+        further requests on a persistent connection
 
     """
     http.HttpBase.__init__(self)
@@ -479,6 +569,9 @@ class HttpServer(http.HttpBase, asyncore.dispatcher):
     self.mainloop = mainloop
     self.local_address = local_address
     self.port = port
+    self.num_workers = num_workers
+    self.keep_alive_timeout = keep_alive_timeout
+    self.worker_process = False
     family = netutils.IPAddress.GetAddressFamily(local_address)
     self.socket = self._CreateSocket(ssl_params, ssl_verify_peer, family)
 
@@ -486,6 +579,7 @@ class HttpServer(http.HttpBase, asyncore.dispatcher):
     self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
     self._children = []
+    self._stopping = False
     self.set_socket(self.socket)
     self.accepting = True
     mainloop.RegisterSignal(self)
@@ -494,9 +588,22 @@ class HttpServer(http.HttpBase, asyncore.dispatcher):
     self.socket.bind((self.local_address, self.port))
     self.socket.listen(1024)
 
+    if self.num_workers:
+      self._StartWorkers()
+
   def Stop(self):
+    self._stopping = True
+
+    if self.num_workers:
+      for pid in self._children:
+        utils.IgnoreProcessNotFound(os.kill, pid, signal.SIGTERM)
+
     self.socket.close()
 
+  def readable(self):
+    # With pre-forked workers, connections are accepted by the workers
+    return not self.num_workers
+
   def handle_accept(self):
     self._IncomingConnection()
 
@@ -504,6 +611,10 @@ class HttpServer(http.HttpBase, asyncore.dispatcher):
     if signum == signal.SIGCHLD:
       self._CollectChildren(True)
 
+      if self.num_workers and not self._stopping:
+        # Replace workers which exited
+        self._StartWorkers()
+
   def _CollectChildren(self, quick):
     """Checks whether any child processes are done
 
@@ -568,6 +679,121 @@ class HttpServer(http.HttpBase, asyncore.dispatcher):
     else:
       self._children.append(pid)
 
+  def _StartWorkers(self):
+    """Forks worker processes until the configured number is running.
+
+    """
+    while len(self._children) < self.num_workers:
+      pid = os.fork()
+      if pid == 0:
+        # Worker process
+        try:
+          self._RunWorker()
+        except Exception: # pylint: disable-msg=W0703
+          logging.exception("Error in worker process")
+          os._exit(1) # pylint: disable-msg=W0212
+        os._exit(0) # pylint: disable-msg=W0212
+      else:
+        self._children.append(pid)
+
+  def _RunWorker(self):
+    """Main loop of a pre-forked worker process.
+
+    The worker accepts connections on the listening socket shared with all
+    other workers, and exits after L{MAX_WORKER_CONNECTIONS} connections to be
+    replaced by a fresh process.
+
+    """
+    self.worker_process = True
+    self._children = []
+
+    # The signal handlers of the main loop are only valid in the parent
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD,
+                  lambda signum, frame: self._CollectChildren(True))
+    if hasattr(signal, "set_wakeup_fd"):
+      signal.set_wakeup_fd(-1)
+
+    # In case the handler code uses temporary files
+    utils.ResetTempfileModule()
+
+    # The listening socket is non-blocking for asyncore, workers wait in accept
+    self.socket.setblocking(1)
+
+    pid = os.getpid()
+    count = 0
+    while count < self.MAX_WORKER_CONNECTIONS:
+      try:
+        (connection, client_addr) = self.socket.accept()
+      except socket.error, err:
+        if err.args and err.args[0] in (errno.EINTR, errno.EAGAIN):
+          continue
+        raise
+
+      count += 1
+
+      try:
+        self.request_executor(self, connection, client_addr)
+      except Exception: # pylint: disable-msg=W0703
+        logging.exception("Error while handling request from %s:%s",
+                          client_addr[0], client_addr[1])
+        if os.getpid() != pid:
+          os._exit(1) # pylint: disable-msg=W0212
+
+      if os.getpid() != pid:
+        # The request was handled in a child process of the worker
+        os._exit(0) # pylint: disable-msg=W0212
+
+  def ForkRequest(self):
+    """Forks a child process to handle the current request.
+
+    Used by pre-forked workers for requests which must be isolated from the
+    long-lived worker process (see L{IsolateRequest}). The child process
+    handles the rest of the connection and exits, while the worker goes on
+    accepting connections.
+
+    @rtype: bool
+    @return: whether the caller is the child process
+
+    """
+    assert self.worker_process
+
+    self._CollectChildren(False)
+
+    pid = os.fork()
+    if pid == 0:
+      # Child process
+      self.worker_process = False
+      self._children = []
+      try:
+        self.socket.close()
+      except socket.error:
+        pass
+      self.socket = None
+
+      # In case the handler code uses temporary files
+      utils.ResetTempfileModule()
+
+      return True
+
+    self._children.append(pid)
+
+    return False
+
+  def IsolateRequest(self, method, path): # pylint: disable-msg=W0613,R0201
+    """Returns whether a request must be handled in a separate process.
+
+    Only used with pre-forked workers. Can be overridden by a subclass.
+
+    @type method: string
+    @param method: the request method
+    @type path: string
+    @param path: the request path
+
+    """
+    return False
+
   def PreHandleRequest(self, req):
     """Called before handling a request.
 
@@ -34,6 +34,8 @@ import errno
 import re
 import time
 import weakref
+import threading
+import collections
 
 try:
   # pylint: disable-msg=E0611
@@ -60,6 +62,19 @@ from ganeti import compat
 JOBQUEUE_THREADS = 25
 JOBS_PER_ARCHIVE_DIRECTORY = 10000
 
+#: Maximum delay (in seconds) before an asynchronous job file update is
+#: replicated; further updates of the same file within this time are coalesced
+REPLICATION_DELAY = 1.0
+
+#: Maximum delay (in seconds) before the job index is written after a job
+#: finished; the index is written once for all jobs finished within this time
+INDEX_WRITE_DELAY = 10.0
+
+# Budget for the cache of finished jobs (number of jobs and total size of
+# their files in bytes)
+FINISHED_JOBS_CACHE_SIZE = 1000
+FINISHED_JOBS_CACHE_BYTES = 64 * 1024 * 1024
+
 # member lock names to be passed to @ssynchronized decorator
 _LOCK = "_lock"
 _QUEUE = "_queue"
@@ -458,7 +473,7 @@ class _QueuedJob(object):
 
 
 class _OpExecCallbacks(mcpu.OpExecCbBase):
-  def __init__(self, queue, job, op):
+  def __init__(self, queue, job, op, lock_wait=None):
     """Initializes this class.
 
     @type queue: L{JobQueue}
@@ -467,6 +482,8 @@ class _OpExecCallbacks(mcpu.OpExecCbBase):
     @param job: Job object
     @type op: L{_QueuedOpCode}
     @param op: OpCode
+    @type lock_wait: L{_LockWait} or None
+    @param lock_wait: Lock wait to be released by L{NotifyLockRelease}
 
     """
     assert queue, "Queue is missing"
@@ -476,6 +493,7 @@ class _OpExecCallbacks(mcpu.OpExecCbBase):
     self._queue = queue
     self._job = job
     self._op = op
+    self._lock_wait = lock_wait
 
   def _CheckCancel(self):
     """Raises an exception to cancel the job if asked to.
@@ -547,6 +565,14 @@ class _OpExecCallbacks(mcpu.OpExecCbBase):
     # Cancel here if we were asked to
     self._CheckCancel()
 
+  def NotifyLockRelease(self):
+    """Reschedules the job after a lock it waited for has been released.
+
+    """
+    assert self._lock_wait, "Lock release notification not requested"
+
+    self._queue.lock_waits.Release(self._lock_wait)
+
   def SubmitManyJobs(self, jobs):
     """Submits jobs for processing.
 
@@ -804,6 +830,10 @@ class _OpExecContext:
     self.log_prefix = log_prefix
     self.summary = op.input.Summary()
 
+    # Set if the last attempt to acquire locks will be followed by a
+    # notification once a lock has been released
+    self.lock_wait = None
+
     self._timeout_strategy_factory = timeout_strategy_factory
     self._ResetTimeoutStrategy()
 
@@ -937,15 +967,22 @@ class _JobProcessor(object):
 
     timeout = opctx.GetNextLockTimeout()
 
+    lock_wait = _LockWait(self.job)
+    opctx.lock_wait = None
+
     try:
       # Make sure not to hold queue lock while calling ExecOpCode
       result = self.opexec_fn(op.input,
-                              _OpExecCallbacks(self.queue, self.job, op),
+                              _OpExecCallbacks(self.queue, self.job, op,
+                                               lock_wait=lock_wait),
                               timeout=timeout, priority=op.priority)
-    except mcpu.LockAcquireTimeout:
+    except mcpu.LockAcquireTimeout, err:
       assert timeout is not None, "Received timeout for blocking acquire"
       logging.debug("Couldn't acquire locks in %0.6fs", timeout)
 
+      if err.release_notify:
+        opctx.lock_wait = lock_wait
+
       assert op.status in (constants.OP_STATUS_WAITLOCK,
                            constants.OP_STATUS_CANCELING)
 
@@ -1122,6 +1159,138 @@ class _JobProcessor(object):
       queue.release()
 
 
+class _LockWait(object):
+  """Represents a job waiting for a lock to be released.
+
+  @ivar job: the waiting job
+  @ivar released: whether the lock has already been released
+
+  """
+  __slots__ = ["job", "released"]
+
+  def __init__(self, job):
+    """Initializes this class.
+
+    @type job: L{_QueuedJob}
+    @param job: Job object
+
+    """
+    self.job = job
+    self.released = False
+
+
+class _LockWaitRegistry(object):
+  """Keeps jobs waiting for locks off the worker pool.
+
+  A job whose attempt to acquire its locks timed out is parked here instead of
+  being deferred in the worker pool, where it would be retried right away. It
+  is added to the worker pool again once a lock it waited for has been
+  released (see L{locking.SharedLock.acquire}) or when it has been cancelled.
+
+  """
+  def __init__(self, enqueue_fn):
+    """Initializes this class.
+
+    @type enqueue_fn: callable
+    @param enqueue_fn: Function adding a list of jobs to the worker pool
+
+    """
+    self._enqueue_fn = enqueue_fn
+    self._lock = threading.Lock()
+
+    # Parked waits, indexed by job ID
+    self._parked = {}
+
+    self._parks = 0
+    self._wakeups = 0
+
+  def Park(self, lock_wait):
+    """Parks a job until a lock it waits for has been released.
+
+    @type lock_wait: L{_LockWait}
+    @rtype: bool
+    @return: Whether the job has been parked; if not, the lock has already been
+      released or the job is being cancelled and it should be scheduled again
+
+    """
+    job = lock_wait.job
+
+    self._lock.acquire()
+    try:
+      if (lock_wait.released or
+          job.CalcStatus() != constants.JOB_STATUS_WAITLOCK):
+        return False
+
+      assert job.id not in self._parked
+      self._parked[job.id] = lock_wait
+      self._parks += 1
+    finally:
+      self._lock.release()
+
+    logging.debug("Job %s parked until a lock is released", job.id)
+
+    return True
+
+  def Release(self, lock_wait):
+    """Notifies about the release of a lock a job waited for.
+
+    Can be called before the job has been parked.
+
+    @type lock_wait: L{_LockWait}
+
+    """
+    job = lock_wait.job
+
+    self._lock.acquire()
+    try:
+      lock_wait.released = True
+
+      if self._parked.get(job.id) is not lock_wait:
+        return
+
+      del self._parked[job.id]
+      self._wakeups += 1
+    finally:
+      self._lock.release()
+
+    self._enqueue_fn([job])
+
+  def Wakeup(self, job_id):
+    """Schedules a parked job again regardless of its locks.
+
+    @type job_id: string
+    @param job_id: Job ID
+
+    """
+    self._lock.acquire()
+    try:
+      lock_wait = self._parked.pop(job_id, None)
+      if lock_wait is None:
+        return
+
+      self._wakeups += 1
+    finally:
+      self._lock.release()
+
+    self._enqueue_fn([lock_wait.job])
+
+  def GetStats(self):
+    """Returns statistics about the parked jobs.
+
+    @rtype: dict
+
+    """
+    self._lock.acquire()
+    try:
+      return {
+        "parked": len(self._parked),
+        "parks": self._parks,
+        "wakeups": self._wakeups,
+        }
+    finally:
+      self._lock.release()
+
+
 class _JobQueueWorker(workerpool.BaseWorker):
   """The actual job workers.
 
@@ -1149,6 +1318,11 @@ class _JobQueueWorker(workerpool.BaseWorker):
                                     proc.ExecOpCode)
 
     if not _JobProcessor(queue, wrap_execop_fn, job)():
+      opctx = job.cur_opctx
+      if opctx and opctx.lock_wait and queue.lock_waits.Park(opctx.lock_wait):
+        # The job will be added again once a lock it waits for is released
+        return
+
       # Schedule again
       raise workerpool.DeferTask(priority=job.CalcPriority())
 
@@ -1194,6 +1368,671 @@ class _JobQueueWorkerPool(workerpool.WorkerPool):
     self.queue = queue
 
 
+class _DelayedFlusher(object):
+  """Flushes changes from a background thread after a delay.
+
+  Changes are only marked, so that many of them can be flushed at once. A
+  background thread calls the flush function once the oldest unflushed
+  change is older than the delay. At most one flush runs at any time.
+
+  """
+  def __init__(self, flush_fn, delay, name):
+    """Initializes this class.
+
+    @type flush_fn: callable
+    @param flush_fn: Function flushing all changes
+    @type delay: float
+    @param delay: Maximum delay for asynchronous flushes
+    @type name: string
+    @param name: Name of the background thread
+
+    """
+    self._flush_fn = flush_fn
+    self._delay = delay
+
+    self._lock = threading.Lock()
+    self._cond = threading.Condition(self._lock)
+    self._flush_lock = threading.Lock()
+
+    # Time of the oldest unflushed change, None if there is none
+    self._changed = None
+    self._stop = False
+
+    self._thread = threading.Thread(name=name, target=self._Run)
+    self._thread.setDaemon(True)
+
+  def Start(self):
+    """Starts the background thread.
+
+    """
+    self._thread.start()
+
+  def Shutdown(self):
+    """Stops the background thread and flushes pending changes.
+
+    """
+    self._lock.acquire()
+    try:
+      self._stop = True
+      self._cond.notifyAll()
+    finally:
+      self._lock.release()
+
+    if self._thread.isAlive():
+      self._thread.join()
+
+    self.Flush()
+
+  def Update(self, sync):
+    """Marks a change.
+
+    @type sync: boolean
+    @param sync: whether to flush immediately
+
+    """
+    self._lock.acquire()
+    try:
+      if self._changed is None:
+        self._changed = time.time()
+
+      if not sync:
+        self._cond.notifyAll()
+        return
+    finally:
+      self._lock.release()
+
+    self.Flush()
+
+  def Flush(self):
+    """Flushes if there have been changes.
+
+    If another thread is flushing at the same time, this waits for it to
+    finish first, so that changes are flushed in order.
+
+    """
+    self._flush_lock.acquire()
+    try:
+      self._lock.acquire()
+      try:
+        changed = self._changed
+        self._changed = None
+      finally:
+        self._lock.release()
+
+      if changed is not None:
+        self._flush_fn()
+    finally:
+      self._flush_lock.release()
+
+  def _Run(self):
+    """Background thread flushing changes once they're old enough.
+
+    """
+    while True:
+      self._lock.acquire()
+      try:
+        while not self._stop:
+          if self._changed is None:
+            self._cond.wait()
+            continue
+
+          remaining = self._changed + self._delay - time.time()
+          if remaining <= 0:
+            break
+
+          self._cond.wait(remaining)
+
+        if self._stop:
+          return
+      finally:
+        self._lock.release()
+
+      try:
+        self.Flush()
+      except Exception: # pylint: disable-msg=W0703
+        logging.exception("Error in background thread %s",
+                          self._thread.getName())
+
+
+class _JobFileReplicator(object):
+  """Replicates job queue files to the other master candidates.
+
+  Updates are collected per file, so that consecutive updates of the same
+  file are coalesced and only the newest contents are sent. All pending files
+  are sent to the nodes in a single RPC call, with at most one call in flight
+  at any time. Synchronous updates return once the file has been replicated,
+  asynchronous ones are sent by a background thread after at most
+  L{REPLICATION_DELAY} seconds.
+
+  """
+  def __init__(self, nodes_fn, check_fn, delay=REPLICATION_DELAY,
+               _update_fn=None):
+    """Initializes this class.
+
+    @type nodes_fn: callable
+    @param nodes_fn: Function returning the names and addresses of the nodes
+        to replicate to
+    @type check_fn: callable
+    @param check_fn: Function to verify the RPC result, see
+        L{JobQueue._CheckRpcResult}
+    @type delay: float
+    @param delay: Maximum delay for asynchronous updates
+
+    """
+    self._nodes_fn = nodes_fn
+    self._check_fn = check_fn
+
+    if _update_fn is None:
+      self._update_fn = rpc.RpcRunner.call_jobqueue_update_multi
+    else:
+      self._update_fn = _update_fn
+
+    self._lock = threading.Lock()
+
+    # File name -> (data, timestamp of oldest unreplicated update)
+    self._pending = {}
+
+    self._stats = {
+      "updates": 0,
+      "coalesced": 0,
+      "rpc_calls": 0,
+      "files_sent": 0,
+      "pending": 0,
+      "last_lag": 0.0,
+      "max_lag": 0.0,
+      "total_lag": 0.0,
+      }
+
+    self._flusher = _DelayedFlusher(self._SendPending, delay,
+                                    "JobFileReplicator")
+
+  def Start(self):
+    """Starts the background thread.
+
+    """
+    self._flusher.Start()
+
+  def Shutdown(self):
+    """Stops the background thread and sends all pending updates.
+
+    """
+    self._flusher.Shutdown()
+
+  def Update(self, file_name, data, sync):
+    """Schedules a file for replication.
+
+    @type file_name: str
+    @param file_name: the path of the file to be replicated
+    @type data: str
+    @param data: the new contents of the file
+    @type sync: boolean
+    @param sync: whether to wait for the file to be replicated
+
+    """
+    self._lock.acquire()
+    try:
+      self._stats["updates"] += 1
+
+      try:
+        (_, timestamp) = self._pending[file_name]
+      except KeyError:
+        timestamp = time.time()
+      else:
+        self._stats["coalesced"] += 1
+
+      self._pending[file_name] = (data, timestamp)
+    finally:
+      self._lock.release()
+
+    self._flusher.Update(sync)
+
+  def Flush(self):
+    """Sends all pending updates.
+
+    """
+    self._flusher.Flush()
+
+  def _SendPending(self):
+    """Sends all pending files to all nodes.
+
+    """
+    self._lock.acquire()
+    try:
+      pending = self._pending
+      self._pending = {}
+    finally:
+      self._lock.release()
+
+    if not pending:
+      return
+
+    files = [(file_name, data)
+             for (file_name, (data, _)) in sorted(pending.items())]
+
+    (names, addrs) = self._nodes_fn()
+    if names:
+      result = self._update_fn(names, addrs, files)
+      self._check_fn(result, names,
+                     "Updating %s" % utils.CommaJoin(pending.keys()))
+
+    now = time.time()
+    lag = max(now - timestamp for (_, timestamp) in pending.values())
+
+    self._lock.acquire()
+    try:
+      self._stats["rpc_calls"] += 1
+      self._stats["files_sent"] += len(files)
+      self._stats["last_lag"] = lag
+      self._stats["max_lag"] = max(lag, self._stats["max_lag"])
+      self._stats["total_lag"] += sum(now - timestamp
+                                      for (_, timestamp) in pending.values())
+    finally:
+      self._lock.release()
+
+  def GetStats(self):
+    """Returns replication statistics.
+
+    @rtype: dict
+
+    """
+    self._lock.acquire()
+    try:
+      stats = self._stats.copy()
+      stats["pending"] = len(self._pending)
+    finally:
+      self._lock.release()
+
+    return stats
+
+
+class _FinishedJobsCache(object):
+  """Least recently used cache of finished jobs.
+
+  Finished jobs no longer change until they are archived, so job objects
+  loaded from disk can be reused when they're queried again. The cache is
+  bounded by the number of jobs and by the total size of their job files.
+
+  Entries are ordered using a queue of access ticks; entries accessed again
+  leave an outdated tick in the queue, which is skipped when evicting and
+  dropped when the queue is compacted.
+
+  """
+  def __init__(self, max_entries=FINISHED_JOBS_CACHE_SIZE,
+               max_bytes=FINISHED_JOBS_CACHE_BYTES):
+    """Initializes this class.
+
+    @type max_entries: int
+    @param max_entries: Maximum number of cached jobs
+    @type max_bytes: int
+    @param max_bytes: Maximum total size of the cached jobs' files
+
+    """
+    self._max_entries = max_entries
+    self._max_bytes = max_bytes
+
+    self._lock = threading.Lock()
+
+    # Job ID -> [job, size, tick of last access]
+    self._entries = {}
+    # Tuples of (tick, job ID), oldest first
+    self._order = collections.deque()
+    self._tick = 0
+    self._bytes = 0
+    self._generation = 0
+
+    self._stats = {
+      "hits": 0,
+      "misses": 0,
+      "evictions": 0,
+      }
+
+  def _Touch(self, job_id, entry):
+    """Marks an entry as the most recently used one.
+
+    """
+    self._tick += 1
+    entry[2] = self._tick
+    self._order.append((self._tick, job_id))
+
+    if len(self._order) > 2 * len(self._entries) + 100:
+      self._order = collections.deque(sorted((tick, job_id)
+                                             for (job_id, (_, _, tick)) in
+                                             self._entries.items()))
+
+  def _EvictUnlocked(self):
+    """Removes the least recently used entries until the budget is kept.
+
+    """
+    while (len(self._entries) > self._max_entries or
+           self._bytes > self._max_bytes):
+      (tick, job_id) = self._order.popleft()
+      entry = self._entries.get(job_id, None)
+      if entry is None or entry[2] != tick:
+        # Outdated tick
+        continue
+      del self._entries[job_id]
+      self._bytes -= entry[1]
+      self._stats["evictions"] += 1
+
+  def GetGeneration(self):
+    """Returns the current generation.
+
+    The generation changes whenever entries are removed. It must be
+    retrieved before reading a job file and passed to L{Add}, so that a job
+    archived in the meantime is not added to the cache.
+
+    @rtype: int
+
+    """
+    self._lock.acquire()
+    try:
+      return self._generation
+    finally:
+      self._lock.release()
+
+  def Get(self, job_id):
+    """Returns a cached job.
+
+    @type job_id: string
+    @param job_id: Job ID
+    @rtype: L{_QueuedJob} or None
+
+    """
+    self._lock.acquire()
+    try:
+      entry = self._entries.get(job_id, None)
+      if entry is None:
+        self._stats["misses"] += 1
+        return None
+
+      self._stats["hits"] += 1
+      self._Touch(job_id, entry)
+      return entry[0]
+    finally:
+      self._lock.release()
+
+  def Add(self, job, size, generation):
+    """Adds a finished job to the cache.
+
+    @type job: L{_QueuedJob}
+    @param job: Job object
+    @type size: int
+    @param size: Size of the job file
+    @type generation: int
+    @param generation: Generation from before the job file was read, see
+        L{GetGeneration}
+
+    """
+    assert job.CalcStatus() in constants.JOBS_FINALIZED
+
+    if size > self._max_bytes:
+      return
+
+    self._lock.acquire()
+    try:
+      if generation != self._generation or job.id in self._entries:
+        return
+
+      entry = [job, size, None]
+      self._entries[job.id] = entry
+      self._bytes += size
+      self._Touch(job.id, entry)
+      self._EvictUnlocked()
+    finally:
+      self._lock.release()
+
+  def Remove(self, job_ids):
+    """Removes jobs from the cache.
+
+    @type job_ids: list of strings
+    @param job_ids: Job IDs
+
+    """
+    self._lock.acquire()
+    try:
+      self._generation += 1
+      for job_id in job_ids:
+        entry = self._entries.pop(job_id, None)
+        if entry is not None:
+          self._bytes -= entry[1]
+    finally:
+      self._lock.release()
+
+  def GetStats(self):
+    """Returns cache statistics.
+
+    @rtype: dict
+
+    """
+    self._lock.acquire()
+    try:
+      stats = self._stats.copy()
+      stats["entries"] = len(self._entries)
+      stats["bytes"] = self._bytes
+    finally:
+      self._lock.release()
+
+    return stats
+
+
+class _JobIndex(object):
+  """Index of the jobs in the queue directory.
+
+  The index contains the fields of all jobs needed for listing and
+  archiving them, so that the job files don't need to be read for it. It is
+  saved in L{constants.JOB_QUEUE_INDEX_FILE}. As unfinished jobs are
+  inspected whenever the queue is opened, the saved index is only written
+  when jobs are finished (see L{_JobIndexWriter}) or archived, and only its
+  entries for finished jobs, which no longer change, are used when loading
+  it.
+
+  """
+  FIELDS = frozenset(["id", "status", "priority", "received_ts", "start_ts",
+                      "end_ts", "summary"])
+
+  _VERSION = 1
+
+  def __init__(self):
+    """Initializes this class.
+
+    """
+    self._lock = threading.Lock()
+
+    # Job ID -> dict of field values
+    self._entries = {}
+
+  def __len__(self):
+    """Returns the number of jobs in the index.
+
+    """
+    return len(self._entries)
+
+  def Update(self, job):
+    """Updates the entry of a job.
+
+    @type job: L{_QueuedJob}
+    @param job: Job object
+    @rtype: bool
+    @return: Whether the entry changed
+
+    """
+    (status, priority, received_ts, start_ts, end_ts) = \
+      job.GetInfo(["status", "priority", "received_ts", "start_ts", "end_ts"])
+
+    self._lock.acquire()
+    try:
+      old = self._entries.get(job.id, None)
+      if old is None:
+        summary = job.GetInfo(["summary"])[0]
+      else:
+        # Opcodes can't change after submission
+        summary = old["summary"]
+
+      entry = {
+        "status": status,
+        "priority": priority,
+        "received_ts": received_ts,
+        "start_ts": start_ts,
+        "end_ts": end_ts,
+        "summary": summary,
+        }
+
+      if entry == old:
+        return False
+
+      self._entries[job.id] = entry
+      return True
+    finally:
+      self._lock.release()
+
+  def Remove(self, job_ids):
+    """Removes jobs from the index.
+
+    @type job_ids: list of strings
+    @param job_ids: Job IDs
+
+    """
+    self._lock.acquire()
+    try:
+      for job_id in job_ids:
+        self._entries.pop(job_id, None)
+    finally:
+      self._lock.release()
+
+  def GetJobIDs(self):
+    """Returns the IDs of all jobs in the index.
+
+    @rtype: list
+
+    """
+    self._lock.acquire()
+    try:
+      return self._entries.keys()
+    finally:
+      self._lock.release()
+
+  def GetInfo(self, job_id, fields):
+    """Returns information about a job.
+
+    @type job_id: string
+    @param job_id: Job ID
+    @type fields: list
+    @param fields: Names of fields to return, must be in L{FIELDS}
+    @rtype: list or None
+    @return: List with one element for each field, or C{None} if the job is
+        not in the index
+
+    """
+    self._lock.acquire()
+    try:
+      entry = self._entries.get(job_id, None)
+    finally:
+      self._lock.release()
+
+    if entry is None:
+      return None
+
+    row = []
+    for fname in fields:
+      if fname == "id":
+        row.append(job_id)
+      else:
+        row.append(entry[fname])
+    return row
+
+  def IsFinalized(self, job_id):
+    """Returns whether a job is known to be finished.
+
+    @type job_id: string
+    @param job_id: Job ID
+    @rtype: bool
+
+    """
+    self._lock.acquire()
+    try:
+      entry = self._entries.get(job_id, None)
+      return (entry is not None and
+              entry["status"] in constants.JOBS_FINALIZED)
+    finally:
+      self._lock.release()
+
+  def Serialize(self):
+    """Returns the serialized index.
+
+    Only entries of finished jobs are saved.
+
+    @rtype: string
+
+    """
+    self._lock.acquire()
+    try:
+      jobs = dict((job_id, entry)
+                  for (job_id, entry) in self._entries.items()
+                  if entry["status"] in constants.JOBS_FINALIZED)
+    finally:
+      self._lock.release()
+
+    return serializer.DumpJson({
+      "version": self._VERSION,
+      "jobs": jobs,
+      }, indent=False)
+
+  def Load(self, data, job_ids):
+    """Loads the entries of finished jobs from a saved index.
+
+    @type data: string
+    @param data: Serialized index, see L{Serialize}
+    @type job_ids: list of strings
+    @param job_ids: IDs of the jobs in the queue directory; entries of other
+        jobs, e.g. archived ones, are ignored
+
+    """
+    saved = serializer.LoadJson(data)
+    if saved.get("version", None) != self._VERSION:
+      raise errors.JobQueueError("Unsupported job index version %s" %
+                                 saved.get("version", None))
+
+    jobs = saved["jobs"]
+    entries = {}
+    for job_id in job_ids:
+      entry = jobs.get(job_id, None)
+      if entry is None or entry["status"] not in constants.JOBS_FINALIZED:
+        continue
+      if frozenset(entry.keys() + ["id"]) != self.FIELDS:
+        raise errors.JobQueueError("Invalid entry for job %s in job index" %
+                                   job_id)
+      entries[job_id] = entry
+
+    self._lock.acquire()
+    try:
+      self._entries.update(entries)
+    finally:
+      self._lock.release()
+
+
+class _JobIndexWriter(_DelayedFlusher):
+  """Writes the job index in the background.
+
+  Writing the index serializes the entries of all finished jobs, so it is
+  not written every time a job finishes. Instead the index is marked as
+  changed and written by a background thread after at most
+  L{INDEX_WRITE_DELAY} seconds. Losing a pending write is harmless, as jobs
+  missing from the saved index are loaded from their files when the queue is
+  opened.
+
+  """
+  def __init__(self, write_fn, delay=INDEX_WRITE_DELAY):
+    """Initializes this class.
+
+    @type write_fn: callable
+    @param write_fn: Function writing the index
+    @type delay: float
+    @param delay: Maximum delay for asynchronous writes
+
+    """
+    super(_JobIndexWriter, self).__init__(write_fn, delay, "JobIndexWriter")
+
+
 def _RequireOpenQueue(fn):
   """Decorator for "public" functions.
 
@@ -1242,6 +2081,9 @@ class JobQueue(object):
     """
     self.context = context
     self._memcache = weakref.WeakValueDictionary()
+    self._finished_jobs = _FinishedJobsCache()
+    self._index = _JobIndex()
+    self._index_write_lock = threading.Lock()
     self._my_hostname = netutils.Hostname.GetSysName()
 
     # The Big JobQueue lock. If a code block or method acquires it in shared
@@ -1273,16 +2115,26 @@ class JobQueue(object):
 
     # TODO: Check consistency across nodes
 
+    self._replicator = _JobFileReplicator(self._GetNodeIp,
+                                          self._CheckRpcResult)
+    self._replicator.Start()
+
+    self._index_writer = _JobIndexWriter(self._WriteJobIndexUnlocked)
+    self._index_writer.Start()
+
+    # Updated once the job index has been loaded
     self._queue_size = 0
-    self._UpdateQueueSizeUnlocked()
     self._drained = jstore.CheckDrainFlag()
 
     # Setup worker pool
     self._wpool = _JobQueueWorkerPool(self)
+    self.lock_waits = _LockWaitRegistry(self._EnqueueJobs)
     try:
       self._InspectQueue()
     except:
       self._wpool.TerminateWorkers()
+      self._index_writer.Shutdown()
+      self._replicator.Shutdown()
       raise
 
   @locking.ssynchronized(_LOCK)
@@ -1298,7 +2150,9 @@ class JobQueue(object):
 
     restartjobs = []
 
-    all_job_ids = self._GetJobIDsUnlocked()
+    all_job_ids = self._GetJobIDsFromDiskUnlocked()
+    self._LoadJobIndexUnlocked(all_job_ids)
+
     jobs_count = len(all_job_ids)
     lastinfo = time.time()
     for idx, job_id in enumerate(all_job_ids):
@@ -1309,12 +2163,18 @@ class JobQueue(object):
                      idx, jobs_count - 1, 100.0 * (idx + 1) / jobs_count)
         lastinfo = time.time()
 
+      # Finished jobs don't need to be loaded if they're in the saved index
+      if self._index.IsFinalized(job_id):
+        continue
+
       job = self._LoadJobUnlocked(job_id)
 
       # a failure in loading the job can cause 'None' to be returned
       if job is None:
         continue
 
+      self._index.Update(job)
+
       status = job.CalcStatus()
 
       if status == constants.JOB_STATUS_QUEUED:
@@ -1335,12 +2195,51 @@ class JobQueue(object):
 
         self.UpdateJobUnlocked(job)
 
+    self._UpdateQueueSizeUnlocked()
+    self._index_writer.Update(True)
+
     if restartjobs:
       logging.info("Restarting %s jobs", len(restartjobs))
       self._EnqueueJobs(restartjobs)
 
     logging.info("Job queue inspection finished")
 
+  def _LoadJobIndexUnlocked(self, job_ids):
+    """Loads the saved job index.
+
+    Errors are logged and ignored, as the index can be rebuilt from the job
+    files.
+
+    @type job_ids: list of strings
+    @param job_ids: IDs of the jobs in the queue directory
+
+    """
+    try:
+      data = utils.ReadFile(constants.JOB_QUEUE_INDEX_FILE)
+    except EnvironmentError, err:
+      if err.errno != errno.ENOENT:
+        logging.error("Can't read job index: %s", err)
+      return
+
+    try:
+      self._index.Load(data, job_ids)
+    except Exception: # pylint: disable-msg=W0703
+      logging.exception("Can't load job index, will rebuild it")
+
+  def _WriteJobIndexUnlocked(self):
+    """Writes the job index to disk and replicates it asynchronously.
+
+    Use L{_JobIndexWriter.Update} instead of calling this directly, so that
+    writes are coalesced.
+
+    """
+    self._index_write_lock.acquire()
+    try:
+      self._UpdateJobQueueFile(constants.JOB_QUEUE_INDEX_FILE,
+                               self._index.Serialize(), False)
+    finally:
+      self._index_write_lock.release()
+
   @locking.ssynchronized(_LOCK)
   @_RequireOpenQueue
   def AddNode(self, node):
@@ -1369,8 +2268,9 @@ class JobQueue(object):
     # Upload the whole queue excluding archived jobs
     files = [self._GetJobPath(job_id) for job_id in self._GetJobIDsUnlocked()]
 
-    # Upload current serial file
+    # Upload current serial file and job index
     files.append(constants.JOB_QUEUE_SERIAL_FILE)
+    files.append(constants.JOB_QUEUE_INDEX_FILE)
 
     for file_name in files:
       # Read file content
@@ -1437,9 +2337,10 @@ class JobQueue(object):
         names and the second one with the node addresses
 
     """
-    # TODO: Change to "tuple(map(list, zip(*self._nodes.items())))"?
-    name_list = self._nodes.keys()
-    addr_list = [self._nodes[name] for name in name_list]
+    # Take a snapshot, this is also called from the replication thread
+    nodes = self._nodes.items()
+    name_list = [name for (name, _) in nodes]
+    addr_list = [addr for (_, addr) in nodes]
     return name_list, addr_list
 
   def _UpdateJobQueueFile(self, file_name, data, replicate):
@@ -1453,17 +2354,15 @@ class JobQueue(object):
     @type data: str
     @param data: the new contents of the file
     @type replicate: boolean
-    @param replicate: whether to spread the changes to the remote nodes
+    @param replicate: whether to wait for the changes to be spread to the
+        remote nodes; if C{False}, the changes are replicated asynchronously
 
     """
     getents = runtime.GetEnts()
     utils.WriteFile(file_name, data=data, uid=getents.masterd_uid,
                     gid=getents.masterd_gid)
 
-    if replicate:
-      names, addrs = self._GetNodeIp()
-      result = rpc.RpcRunner.call_jobqueue_update(names, addrs, file_name, data)
-      self._CheckRpcResult(result, self._nodes, "Updating %s" % file_name)
+    self._replicator.Update(file_name, data, replicate)
 
   def _RenameFilesUnlocked(self, rename):
     """Renames a file locally and then replicate the change.
@@ -1475,6 +2374,9 @@ class JobQueue(object):
     @param rename: List containing tuples mapping old to new names
 
     """
+    # Pending updates must not re-create the renamed files on the nodes
+    self._replicator.Flush()
+
     # Rename them locally
     for old, new in rename:
       utils.RenameFile(old, new, mkdir=True)
@@ -1571,9 +2473,22 @@ class JobQueue(object):
   def _GetJobIDsUnlocked(self, sort=True):
     """Return all known job IDs.
 
-    The method only looks at disk because it's a requirement that all
-    jobs are present on disk (so in the _memcache we don't have any
-    extra IDs).
+    The method uses the job index, which contains all jobs present on
+    disk once the queue has been inspected (see L{_InspectQueue}).
+
+    @type sort: boolean
+    @param sort: perform sorting on the returned job ids
+    @rtype: list
+    @return: the list of job IDs
+
+    """
+    jlist = self._index.GetJobIDs()
+    if sort:
+      jlist = utils.NiceSort(jlist)
+    return jlist
+
+  def _GetJobIDsFromDiskUnlocked(self, sort=True):
+    """Return the IDs of all job files in the queue directory.
 
     @type sort: boolean
     @param sort: perform sorting on the returned job ids
@@ -1621,6 +2536,8 @@ class JobQueue(object):
         # non-archived case
         logging.exception("Can't parse job %s, will archive.", job_id)
         self._RenameFilesUnlocked([(old_path, new_path)])
+        self._finished_jobs.Remove([job_id])
+        self._index.Remove([job_id])
       return None
 
     self._memcache[job_id] = job
@@ -1639,6 +2556,19 @@ class JobQueue(object):
     @rtype: L{_QueuedJob} or None
     @return: either None or the job object
 
+    """
+    return self._ReadJobFromDisk(job_id, try_archived)[0]
+
+  def _ReadJobFromDisk(self, job_id, try_archived):
+    """Load the given job file from disk.
+
+    @type job_id: string
+    @param job_id: job identifier
+    @type try_archived: bool
+    @param try_archived: Whether to try loading an archived job
+    @rtype: tuple; (L{_QueuedJob} or None, int)
+    @return: the job object, or None, and the size of the job file
+
     """
     path_functions = [self._GetJobPath]
 
@@ -1659,7 +2589,7 @@ class JobQueue(object):
         break
 
     if not raw_data:
-      return None
+      return (None, 0)
 
     try:
       data = serializer.LoadJson(raw_data)
@@ -1667,14 +2597,15 @@ class JobQueue(object):
     except Exception, err: # pylint: disable-msg=W0703
       raise errors.JobFileCorrupted(err)
 
-    return job
+    return (job, len(raw_data))
 
   def SafeLoadJobFromDisk(self, job_id, try_archived):
     """Load the given job file from disk.
 
     Given a job file, read, load and restore it in a _QueuedJob format.
     In case of error reading the job, it gets returned as None, and the
-    exception is logged.
+    exception is logged. Finished jobs are kept in a cache, so the returned
+    job object must not be modified.
 
     @type job_id: string
     @param job_id: job identifier
@@ -1684,17 +2615,28 @@ class JobQueue(object):
     @return: either None or the job object
 
     """
+    job = self._finished_jobs.Get(job_id)
+    if job is not None:
+      return job
+
+    generation = self._finished_jobs.GetGeneration()
+
     try:
-      return self._LoadJobFromDisk(job_id, try_archived)
+      (job, size) = self._ReadJobFromDisk(job_id, try_archived)
     except (errors.JobFileCorrupted, EnvironmentError):
       logging.exception("Can't load/parse job %s", job_id)
       return None
 
+    if job is not None and job.CalcStatus() in constants.JOBS_FINALIZED:
+      self._finished_jobs.Add(job, size, generation)
+
+    return job
+
   def _UpdateQueueSizeUnlocked(self):
     """Update the queue size.
 
     """
-    self._queue_size = len(self._GetJobIDsUnlocked(sort=False))
+    self._queue_size = len(self._index)
 
   @locking.ssynchronized(_LOCK)
   @_RequireOpenQueue
@@ -1815,7 +2757,9 @@ class JobQueue(object):
     @type job: L{_QueuedJob}
     @param job: the changed job
     @type replicate: boolean
-    @param replicate: whether to replicate the change to remote nodes
+    @param replicate: whether to wait for the change to be replicated to
+        remote nodes (used for status changes); if C{False} the change is
+        replicated asynchronously (used for feedback messages)
 
     """
     if __debug__:
@@ -1827,6 +2771,10 @@ class JobQueue(object):
     logging.debug("Writing job %s to %s", job.id, filename)
     self._UpdateJobQueueFile(filename, data, replicate)
 
+    if self._index.Update(job) and job.end_timestamp is not None:
+      # Only entries of finished jobs are saved
+      self._index_writer.Update(False)
+
   def WaitForJobChanges(self, job_id, fields, prev_job_info, prev_log_serial,
                         timeout):
     """Waits for changes in a job.
@@ -1883,6 +2831,9 @@ class JobQueue(object):
       # allowed. The job can be archived anytime.
       self.UpdateJobUnlocked(job)
 
+      # A job waiting for locks must notice it's being cancelled
+      self.lock_waits.Wakeup(job_id)
+
     return (success, msg)
 
   @_RequireOpenQueue
@@ -1895,31 +2846,54 @@ class JobQueue(object):
     @return: Number of archived jobs
 
     """
-    archive_jobs = []
-    rename_files = []
+    archive_job_ids = []
     for job in jobs:
       if job.CalcStatus() not in constants.JOBS_FINALIZED:
         logging.debug("Job %s is not yet done", job.id)
         continue
 
-      archive_jobs.append(job)
+      archive_job_ids.append(job.id)
+
+    if not archive_job_ids:
+      return 0
 
-      old = self._GetJobPath(job.id)
-      new = self._GetArchivedJobPath(job.id)
+    count = self._ArchiveJobIDsUnlocked(archive_job_ids)
+    self._index_writer.Update(True)
+    return count
+
+  @_RequireOpenQueue
+  def _ArchiveJobIDsUnlocked(self, job_ids):
+    """Archives finished jobs.
+
+    The saved job index is not written, callers need to update it once all
+    jobs have been archived.
+
+    @type job_ids: list of strings
+    @param job_ids: IDs of finished jobs
+    @rtype: int
+    @return: Number of archived jobs
+
+    """
+    rename_files = []
+    for job_id in job_ids:
+      old = self._GetJobPath(job_id)
+      new = self._GetArchivedJobPath(job_id)
       rename_files.append((old, new))
 
     # TODO: What if 1..n files fail to rename?
     self._RenameFilesUnlocked(rename_files)
+    self._finished_jobs.Remove(job_ids)
+    self._index.Remove(job_ids)
 
     logging.debug("Successfully archived job(s) %s",
-                  utils.CommaJoin(job.id for job in archive_jobs))
+                  utils.CommaJoin(job_ids))
 
     # Since we haven't quite checked, above, if we succeeded or failed renaming
-    # the files, we update the cached queue size from the filesystem. When we
-    # get around to fix the TODO: above, we can use the number of actually
+    # the files, we update the cached queue size from the index. When we get
+    # around to fix the TODO: above, we can use the number of actually
     # archived jobs to fix this.
     self._UpdateQueueSizeUnlocked()
-    return len(archive_jobs)
+    return len(job_ids)
 
   @locking.ssynchronized(_LOCK)
   @_RequireOpenQueue
@@ -1975,27 +2949,34 @@ class JobQueue(object):
       if time.time() > end_time:
         break
 
-      # Returns None if the job failed to load
-      job = self._LoadJobUnlocked(job_id)
-      if job:
-        if job.end_timestamp is None:
-          if job.start_timestamp is None:
-            job_age = job.received_timestamp
-          else:
-            job_age = job.start_timestamp
+      # Only finished jobs can be archived
+      if not self._index.IsFinalized(job_id):
+        continue
+
+      (received_ts, start_ts, end_ts) = \
+        self._index.GetInfo(job_id, ["received_ts", "start_ts", "end_ts"])
+
+      if end_ts is None:
+        if start_ts is None:
+          job_age = received_ts
         else:
-          job_age = job.end_timestamp
+          job_age = start_ts
+      else:
+        job_age = end_ts
 
-        if age == -1 or now - job_age[0] > age:
-          pending.append(job)
+      if age == -1 or now - job_age[0] > age:
+        pending.append(job_id)
 
-          # Archive 10 jobs at a time
-          if len(pending) >= 10:
-            archived_count += self._ArchiveJobsUnlocked(pending)
-            pending = []
+        # Archive 10 jobs at a time
+        if len(pending) >= 10:
+          archived_count += self._ArchiveJobIDsUnlocked(pending)
+          pending = []
 
     if pending:
-      archived_count += self._ArchiveJobsUnlocked(pending)
+      archived_count += self._ArchiveJobIDsUnlocked(pending)
+
+    if archived_count:
+      self._index_writer.Update(True)
 
     return (archived_count, len(all_job_ids) - last_touched)
 
@@ -2019,7 +3000,16 @@ class JobQueue(object):
       job_ids = self._GetJobIDsUnlocked()
       list_all = True
 
+    # Use the job index if it contains all requested fields
+    use_index = _JobIndex.FIELDS.issuperset(fields)
+
     for job_id in job_ids:
+      if use_index:
+        row = self._index.GetInfo(job_id, fields)
+        if row is not None:
+          jobs.append(row)
+          continue
+
       job = self.SafeLoadJobFromDisk(job_id, True)
       if job is not None:
         jobs.append(job.GetInfo(fields))
@@ -2028,6 +3018,20 @@ class JobQueue(object):
 
     return jobs
 
+  def GetStats(self):
+    """Returns statistics about the job queue.
+
+    @rtype: dict
+    @return: dictionary with the name of a statistics group as key and a
+        dictionary of counters as value
+
+    """
+    return {
+      "replication": self._replicator.GetStats(),
+      "finished_jobs_cache": self._finished_jobs.GetStats(),
+      "lock_waits": self.lock_waits.GetStats(),
+      }
+
   @locking.ssynchronized(_LOCK)
   @_RequireOpenQueue
   def Shutdown(self):
@@ -2037,6 +3041,8 @@ class JobQueue(object):
 
     """
     self._wpool.TerminateWorkers()
+    self._index_writer.Shutdown()
+    self._replicator.Shutdown()
 
     self._queue_filelock.Close()
     self._queue_filelock = None
@@ -34,6 +34,8 @@ import logging
 import heapq
 import operator
 import itertools
+import bisect
+import time
 
 from ganeti import errors
 from ganeti import utils
@@ -47,6 +49,10 @@ _DELETED_TEXT = "deleted"
 
 _DEFAULT_PRIORITY = 0
 
+#: Upper bounds (in seconds) of the buckets used for lock wait and hold times,
+#: from one millisecond to about 17 minutes
+_STATS_BUCKETS = [0.001 * (2 ** i) for i in range(21)]
+
 
 def ssynchronized(mylock, shared=0):
   """Shared Synchronization decorator.
@@ -372,6 +378,164 @@ class _PipeConditionWithMode(PipeCondition):
     PipeCondition.__init__(self, lock)
 
 
+class _TimeHistogram(object):
+  """Histogram of durations.
+
+  Durations are counted in buckets with exponentially growing sizes, see
+  L{_STATS_BUCKETS}, which allows percentiles to be estimated without keeping
+  every value.
+
+  """
+  __slots__ = [
+    "count",
+    "total",
+    "maximum",
+    "_buckets",
+    ]
+
+  def __init__(self):
+    """Initializes this class.
+
+    """
+    self.count = 0
+    self.total = 0.0
+    self.maximum = 0.0
+    self._buckets = [0] * (len(_STATS_BUCKETS) + 1)
+
+  def Add(self, duration):
+    """Adds a duration.
+
+    @type duration: float
+    @param duration: Duration in seconds
+
+    """
+    self.count += 1
+    self.total += duration
+    self.maximum = max(self.maximum, duration)
+    self._buckets[bisect.bisect_left(_STATS_BUCKETS, duration)] += 1
+
+  def GetPercentile(self, fraction):
+    """Estimates a percentile.
+
+    @type fraction: float
+    @param fraction: Percentile as a fraction, e.g. 0.99
+    @rtype: float
+    @return: Upper bound of the bucket containing the percentile, but never
+      more than the longest duration
+
+    """
+    if not self.count:
+      return 0.0
+
+    # Number of values at or below the percentile
+    wanted = max(1, int(round(fraction * self.count)))
+
+    seen = 0
+    for (bound, count) in zip(_STATS_BUCKETS, self._buckets):
+      seen += count
+      if seen >= wanted:
+        return min(bound, self.maximum)
+
+    return self.maximum
+
+
+class _LockStats(object):
+  """Statistics about acquiring and holding a lock.
+
+  Callers must serialize access to instances of this class.
+
+  """
+  __slots__ = [
+    "_acquired_shared",
+    "_acquired_exclusive",
+    "_timeouts",
+    "_wait",
+    "_hold",
+    ]
+
+  def __init__(self):
+    """Initializes this class.
+
+    """
+    self.Reset()
+
+  def Reset(self):
+    """Resets all statistics.
+
+    """
+    self._acquired_shared = 0
+    self._acquired_exclusive = 0
+    self._timeouts = 0
+    self._wait = _TimeHistogram()
+    self._hold = _TimeHistogram()
+
+  def AddAcquire(self, shared, wait):
+    """Records a successful acquire.
+
+    @type shared: bool
+    @param shared: Whether the lock was acquired in shared mode
+    @type wait: float
+    @param wait: Time spent waiting for the lock
+
+    """
+    if shared:
+      self._acquired_shared += 1
+    else:
+      self._acquired_exclusive += 1
+    self._wait.Add(wait)
+
+  def AddTimeout(self, wait):
+    """Records an acquire which timed out.
+
+    @type wait: float
+    @param wait: Time spent waiting for the lock
+
+    """
+    self._timeouts += 1
+    self._wait.Add(wait)
+
+  def AddRelease(self, hold):
+    """Records a release.
+
+    @type hold: float
+    @param hold: Time the lock was held
+
+    """
+    self._hold.Add(hold)
+
+  def GetInfo(self):
+    """Returns the statistics.
+
+    @rtype: dict
+    @return: Statistics indexed by the name of the lock query field
+
+    """
+    return {
+      "acquired": self._acquired_shared + self._acquired_exclusive,
+      "acquired_shared": self._acquired_shared,
+      "acquired_exclusive": self._acquired_exclusive,
+      "timeouts": self._timeouts,
+      "wait_time": self._wait.total,
+      "wait_p99": self._wait.GetPercentile(0.99),
+      "hold_time": self._hold.total,
+      "hold_p99": self._hold.GetPercentile(0.99),
+      }
+
+
+def _CallReleaseFns(fns):
+  """Calls functions waiting for a lock to be released.
+
+  @type fns: list of callables
+  @param fns: Functions registered via L{SharedLock.acquire}
+
+  """
+  for fn in fns:
+    try:
+      fn()
+    except: # pylint: disable-msg=W0702
+      logging.exception("Error while notifying about lock release")
+
+
 class SharedLock(object):
   """Implements a shared lock.
 
@@ -393,13 +557,16 @@ class SharedLock(object):
   """
   __slots__ = [
     "__weakref__",
+    "__acquired_ts",
     "__deleted",
     "__exc",
     "__lock",
     "__pending",
     "__pending_by_prio",
     "__pending_shared",
+    "__release_fns",
     "__shr",
+    "__stats",
     "name",
     ]
 
@@ -432,6 +599,13 @@ class SharedLock(object):
     # is this lock in the deleted state?
     self.__deleted = False
 
+    # Functions to call on the next release, see L{acquire}
+    self.__release_fns = []
+
+    # Statistics and the time at which each owner acquired the lock
+    self.__stats = _LockStats()
+    self.__acquired_ts = {}
+
     # Register with lock monitor
     if monitor:
       monitor.RegisterLock(self)
@@ -489,7 +663,22 @@ class SharedLock(object):
       else:
         pending = None
 
-      return (self.name, mode, owner_names, pending)
+      if query.LQ_STATS in requested:
+        stats = self.__stats.GetInfo()
+      else:
+        stats = None
+
+      return (self.name, mode, owner_names, pending, stats)
+    finally:
+      self.__lock.release()
+
+  def ResetStats(self):
+    """Resets the lock statistics.
+
+    """
+    self.__lock.acquire()
+    try:
+      self.__stats.Reset()
     finally:
       self.__lock.release()
 
@@ -618,6 +807,42 @@ class SharedLock(object):
 
     return cond == prioqueue[0]
 
+  def __acquire_uncontended_unlocked(self, shared):
+    """Acquires the lock if nobody else holds or waits for it.
+
+    @param shared: whether to acquire in shared mode
+    @rtype: bool
+    @return: Whether the lock has been acquired
+
+    """
+    # We cannot acquire the lock if we already have it
+    assert not self.__is_owned(), ("double acquire() on a non-recursive lock"
+                                   " %s" % self.name)
+
+    # Remove empty entries from queue
+    self.__find_first_pending_queue()
+
+    # Check whether someone else holds the lock or there are pending acquires.
+    if self.__pending or not self.__can_acquire(shared):
+      return False
+
+    # Apparently not, can acquire lock directly.
+    self.__do_acquire(shared)
+    return True
+
+  def __record_acquire_unlocked(self, shared, wait_time, now):
+    """Updates the statistics and acquire time after an acquire.
+
+    @param shared: whether the lock was acquired in shared mode
+    @type wait_time: float
+    @param wait_time: How long the acquire took
+    @type now: float
+    @param now: Time the lock was acquired at
+
+    """
+    self.__stats.AddAcquire(shared, wait_time)
+    self.__acquired_ts[threading.currentThread()] = now
+
   def __acquire_unlocked(self, shared, timeout, priority):
     """Acquire a shared lock.
 
@@ -630,17 +855,7 @@ class SharedLock(object):
     """
     self.__check_deleted()
 
-    # We cannot acquire the lock if we already have it
-    assert not self.__is_owned(), ("double acquire() on a non-recursive lock"
-                                   " %s" % self.name)
-
-    # Remove empty entries from queue
-    self.__find_first_pending_queue()
-
-    # Check whether someone else holds the lock or there are pending acquires.
-    if not self.__pending and self.__can_acquire(shared):
-      # Apparently not, can acquire lock directly.
-      self.__do_acquire(shared)
+    if self.__acquire_uncontended_unlocked(shared):
       return True
 
     prioqueue = self.__pending_by_prio.get(priority, None)
@@ -699,8 +914,36 @@ class SharedLock(object):
 
     return False
 
+  def __add_release_fn_unlocked(self, release_fn):
+    """Registers a function to be called on the next release.
+
+    If the lock is neither held nor waited for, nobody is going to release it
+    and the function is returned to be called right away.
+
+    @rtype: list
+    @return: Functions to be called once the internal lock has been released
+
+    """
+    # Order is important: __find_first_pending_queue modifies __pending
+    (_, prioqueue) = self.__find_first_pending_queue()
+
+    if (prioqueue or self.__exc is not None or self.__shr) and \
+       not self.__deleted:
+      self.__release_fns.append(release_fn)
+      return []
+
+    return [release_fn]
+
+  def __pop_release_fns_unlocked(self):
+    """Returns and forgets all functions waiting for a release.
+
+    """
+    result = self.__release_fns
+    self.__release_fns = []
+    return result
+
   def acquire(self, shared=0, timeout=None, priority=None,
-              test_notify=None):
+              test_notify=None, release_fn=None):
     """Acquire a shared lock.
 
     @type shared: integer (0/1) used as a boolean
@@ -712,18 +955,71 @@ class SharedLock(object):
     @param priority: Priority for acquiring lock
     @type test_notify: callable or None
     @param test_notify: Special callback function for unittesting
+    @type release_fn: callable or None
+    @param release_fn: Function called once, without arguments, after the lock
+        has been released, downgraded, deleted or given up on by another
+        waiter while nobody held it; only used if the acquire times out
 
     """
     if priority is None:
       priority = _DEFAULT_PRIORITY
 
+    notify_fns = []
+    start = time.time()
+
     self.__lock.acquire()
     try:
       # We already got the lock, notify now
       if __debug__ and callable(test_notify):
         test_notify()
 
-      return self.__acquire_unlocked(shared, timeout, priority)
+      acquired = self.__acquire_unlocked(shared, timeout, priority)
+
+      now = time.time()
+
+      if acquired:
+        self.__record_acquire_unlocked(shared, now - start, now)
+      else:
+        self.__stats.AddTimeout(now - start)
+
+        if self.__exc is None and not self.__shr:
+          # Nobody holds the lock, so by giving up this acquire may have let
+          # other waiters get it
+          notify_fns.extend(self.__pop_release_fns_unlocked())
+
+        if release_fn:
+          notify_fns.extend(self.__add_release_fn_unlocked(release_fn))
+
+      return acquired
+    finally:
+      self.__lock.release()
+
+      _CallReleaseFns(notify_fns)
+
+  def _try_acquire(self, shared, now):
+    """Acquires the lock if nobody else holds or waits for it.
+
+    This grants an uncontended lock just like L{acquire}, but never waits and
+    doesn't measure how long the acquire took; the caller passes the current
+    time instead, so that it can be determined once for many locks. Deleted
+    locks are not acquired.
+
+    @type shared: integer (0/1) used as a boolean
+    @param shared: whether to acquire in shared mode
+    @type now: float
+    @param now: Current time, used for statistics
+    @rtype: bool
+    @return: Whether the lock has been acquired
+
+    """
+    self.__lock.acquire()
+    try:
+      if self.__deleted or not self.__acquire_uncontended_unlocked(shared):
+        return False
+
+      self.__record_acquire_unlocked(shared, 0.0, now)
+
+      return True
     finally:
       self.__lock.release()
 
@@ -733,6 +1029,8 @@ class SharedLock(object):
     Pending acquires in shared mode on the same priority will go ahead.
 
     """
+    notify_fns = []
+
     self.__lock.acquire()
     try:
       assert self.__is_owned(), "Lock must be owned"
@@ -762,6 +1060,8 @@ class SharedLock(object):
             # Notify
             cond.notifyAll()
 
+        notify_fns = self.__pop_release_fns_unlocked()
+
       assert not self.__is_exclusive()
       assert self.__is_sharer()
 
@@ -769,6 +1069,8 @@ class SharedLock(object):
     finally:
       self.__lock.release()
 
+      _CallReleaseFns(notify_fns)
+
   def release(self):
     """Release a Shared Lock.
 
@@ -776,6 +1078,8 @@ class SharedLock(object):
     before calling this function.
 
     """
+    notify_fns = []
+
     self.__lock.acquire()
     try:
       assert self.__is_exclusive() or self.__is_sharer(), \
@@ -787,6 +1091,10 @@ class SharedLock(object):
       else:
         self.__shr.remove(threading.currentThread())
 
+      acquired_ts = self.__acquired_ts.pop(threading.currentThread(), None)
+      if acquired_ts is not None:
+        self.__stats.AddRelease(time.time() - acquired_ts)
+
       # Notify topmost condition in queue
       (priority, prioqueue) = self.__find_first_pending_queue()
       if prioqueue:
@@ -797,9 +1105,13 @@ class SharedLock(object):
           # notified
           self.__pending_shared.pop(priority, None)
 
+      notify_fns = self.__pop_release_fns_unlocked()
+
     finally:
       self.__lock.release()
 
+      _CallReleaseFns(notify_fns)
+
   def delete(self, timeout=None, priority=None):
     """Delete a Shared Lock.
 
@@ -816,6 +1128,8 @@ class SharedLock(object):
     if priority is None:
       priority = _DEFAULT_PRIORITY
 
+    notify_fns = []
+
     self.__lock.acquire()
     try:
       assert not self.__is_sharer(), "Cannot delete() a lock while sharing it"
@@ -834,6 +1148,7 @@ class SharedLock(object):
       if acquired:
         self.__deleted = True
         self.__exc = None
+        self.__acquired_ts.pop(threading.currentThread(), None)
 
         assert not (self.__exc or self.__shr), "Found owner during deletion"
 
@@ -844,10 +1159,15 @@ class SharedLock(object):
 
         assert self.__deleted
 
+      # Either the lock is gone or this waiter gave up on it
+      notify_fns = self.__pop_release_fns_unlocked()
+
       return acquired
     finally:
       self.__lock.release()
 
+      _CallReleaseFns(notify_fns)
+
   def _release_save(self):
     shared = self.__is_sharer()
     self.release()
@@ -897,6 +1217,14 @@ class LockSet:
     # Lock monitor
     self.__monitor = monitor
 
+    # Statistics for the whole set, protected by their own lock
+    self.__stats = _LockStats()
+    self.__stats_lock = threading.Lock()
+
+    # Time at which each thread acquired its locks in this set; only accessed
+    # by the owning thread, like L{__owners}
+    self.__acquired_ts = {}
+
     # Used internally to guarantee coherency
     self.__lock = SharedLock(self._GetLockName("[lockset]"), monitor=monitor)
 
@@ -917,12 +1245,47 @@ class LockSet:
     # will be trouble.
     self.__owners = {}
 
+    # Register with lock monitor
+    if monitor:
+      monitor.RegisterLock(self)
+
   def _GetLockName(self, mname):
     """Returns the name for a member lock.
 
     """
     return "%s/%s" % (self.name, mname)
 
+  def GetInfo(self, requested):
+    """Retrieves information for querying locks.
+
+    The statistics describe acquiring and holding locks in this set as a
+    whole, the set itself doesn't have a mode, owners or pending acquires.
+
+    @type requested: set
+    @param requested: Requested information, see C{query.LQ_*}
+
+    """
+    if query.LQ_STATS in requested:
+      self.__stats_lock.acquire()
+      try:
+        stats = self.__stats.GetInfo()
+      finally:
+        self.__stats_lock.release()
+    else:
+      stats = None
+
+    return (self.name, None, None, None, stats)
+
+  def ResetStats(self):
+    """Resets the statistics of the set as a whole.
+
+    """
+    self.__stats_lock.acquire()
+    try:
+      self.__stats.Reset()
+    finally:
+      self.__stats_lock.release()
+
   def _get_lock(self):
     """Returns the lockset-internal lock.
 
@@ -967,6 +1330,14 @@ class LockSet:
         not self.__owners[threading.currentThread()]):
       del self.__owners[threading.currentThread()]
 
+      acquired_ts = self.__acquired_ts.pop(threading.currentThread(), None)
+      if acquired_ts is not None:
+        self.__stats_lock.acquire()
+        try:
+          self.__stats.AddRelease(time.time() - acquired_ts)
+        finally:
+          self.__stats_lock.release()
+
   def _list_owned(self):
     """Get the set of resource names owned by the current thread"""
     if self._is_owned():
@@ -1011,7 +1382,7 @@ class LockSet:
     return set(result)
 
   def acquire(self, names, timeout=None, shared=0, priority=None,
-              test_notify=None):
+              test_notify=None, release_fn=None):
     """Acquire a set of resource locks.
 
     @type names: list of strings (or string)
@@ -1026,6 +1397,9 @@ class LockSet:
     @param priority: Priority for acquiring locks
     @type test_notify: callable or None
     @param test_notify: Special callback function for unittesting
+    @type release_fn: callable or None
+    @param release_fn: Function called once the lock which caused the acquire
+        to time out has been released (see L{SharedLock.acquire})
 
     @return: Set of all locks successfully acquired or None in case of timeout
 
@@ -1043,6 +1417,34 @@ class LockSet:
     if priority is None:
       priority = _DEFAULT_PRIORITY
 
+    start = time.time()
+
+    result = self.__acquire(names, timeout, shared, priority, test_notify,
+                            release_fn)
+
+    now = time.time()
+
+    self.__stats_lock.acquire()
+    try:
+      if result is None:
+        self.__stats.AddTimeout(now - start)
+      else:
+        self.__stats.AddAcquire(shared, now - start)
+    finally:
+      self.__stats_lock.release()
+
+    if result is not None and self._is_owned():
+      self.__acquired_ts[threading.currentThread()] = now
+
+    return result
+
+  def __acquire(self, names, timeout, shared, priority, test_notify,
+                release_fn):
+    """Acquires a set of resource locks.
+
+    See L{acquire} for a description of the parameters.
+
+    """
     # We need to keep track of how long we spent waiting for a lock. The
     # timeout passed to this function is over all lock acquires.
     running_timeout = utils.RunningTimeout(timeout, False)
@@ -1054,7 +1456,8 @@ class LockSet:
           names = [names]
 
         return self.__acquire_inner(names, False, shared, priority,
-                                    running_timeout.Remaining, test_notify)
+                                    running_timeout.Remaining, test_notify,
+                                    release_fn)
 
       else:
         # If no names are given acquire the whole set by not letting new names
@@ -1067,14 +1470,16 @@ class LockSet:
         # anyway, though, so we'll get the list lock exclusively as well in
         # order to be able to do add() on the set while owning it.
         if not self.__lock.acquire(shared=shared, priority=priority,
-                                   timeout=running_timeout.Remaining()):
+                                   timeout=running_timeout.Remaining(),
+                                   release_fn=release_fn):
           raise _AcquireTimeout()
         try:
           # note we own the set-lock
           self._add_owned()
 
           return self.__acquire_inner(self.__names(), True, shared, priority,
-                                      running_timeout.Remaining, test_notify)
+                                      running_timeout.Remaining, test_notify,
+                                      release_fn)
         except:
           # We shouldn't have problems adding the lock to the owners list, but
           # if we did we'll try to release this lock and re-raise exception.
@@ -1087,7 +1492,7 @@ class LockSet:
       return None
 
   def __acquire_inner(self, names, want_all, shared, priority,
-                      timeout_fn, test_notify):
+                      timeout_fn, test_notify, release_fn):
     """Inner logic for acquiring a number of locks.
 
     @param names: Names of the locks to be acquired
@@ -1096,6 +1501,8 @@ class LockSet:
     @param timeout_fn: Function returning remaining timeout
     @param priority: Priority for acquiring locks
     @param test_notify: Special callback function for unittesting
+    @param release_fn: Function called once the lock on which the acquire
+        timed out has been released
 
     """
     acquire_list = []
@@ -1122,12 +1529,31 @@ class LockSet:
     acquired = set()
 
     try:
+      # Fast path: locks nobody holds or waits for are granted right away,
+      # without computing a timeout and timing each acquire separately. To
+      # keep the locking order, this stops at the first contended lock; it
+      # and all following locks are acquired one by one below.
+      now = time.time()
+      for (lname, lock) in acquire_list:
+        if not lock._try_acquire(shared, now):
+          break
+
+        try:
+          self._add_owned(name=lname)
+          acquired.add(lname)
+        except:
+          lock.release()
+          raise
+
+        if __debug__ and callable(test_notify):
+          test_notify(lname)
+
       # Now acquire_list contains a sorted list of resources and locks we
       # want.  In order to get them we loop on this (private) list and
       # acquire() them.  We gave no real guarantee they will still exist till
       # this is done but .acquire() itself is safe and will alert us if the
       # lock gets deleted.
-      for (lname, lock) in acquire_list:
+      for (lname, lock) in acquire_list[len(acquired):]:
         if __debug__ and callable(test_notify):
           test_notify_fn = lambda: test_notify(lname)
         else:
@@ -1139,7 +1565,8 @@ class LockSet:
           # raises LockError if the lock was deleted
           acq_success = lock.acquire(shared=shared, timeout=timeout,
                                      priority=priority,
-                                     test_notify=test_notify_fn)
+                                     test_notify=test_notify_fn,
+                                     release_fn=release_fn)
         except errors.LockError:
           if want_all:
             # We are acquiring all the set, it doesn't matter if this
@@ -1446,13 +1873,13 @@ class GanetiLockManager:
                               monitor=self._monitor),
       }
 
-  def QueryLocks(self, fields):
+  def QueryLocks(self, fields, limit=None, cursor=None):
     """Queries information from all locks.
 
     See L{LockMonitor.QueryLocks}.
 
     """
-    return self._monitor.QueryLocks(fields)
+    return self._monitor.QueryLocks(fields, limit=limit, cursor=cursor)
 
   def OldStyleQueryLocks(self, fields):
     """Queries information from all locks, returning old-style data.
@@ -1462,6 +1889,14 @@ class GanetiLockManager:
     """
     return self._monitor.OldStyleQueryLocks(fields)
 
+  def ResetLockStats(self):
+    """Resets the statistics of all locks.
+
+    See L{LockMonitor.ResetLockStats}.
+
+    """
+    return self._monitor.ResetLockStats()
+
   def _names(self, level):
     """List the lock names at the given level.
 
@@ -1515,7 +1950,8 @@ class GanetiLockManager:
     """
     return level == LEVEL_CLUSTER and (names is None or BGL in names)
 
-  def acquire(self, level, names, timeout=None, shared=0, priority=None):
+  def acquire(self, level, names, timeout=None, shared=0, priority=None,
+              release_fn=None):
     """Acquire a set of resource locks, at the same level.
 
     @type level: member of locking.LEVELS
@@ -1530,6 +1966,9 @@ class GanetiLockManager:
     @param timeout: Maximum time to acquire all locks
     @type priority: integer
     @param priority: Priority for acquiring lock
+    @type release_fn: callable or None
+    @param release_fn: Function called once the lock which caused the acquire
+        to time out has been released (see L{LockSet.acquire})
 
     """
     assert level in LEVELS, "Invalid locking level %s" % level
@@ -1549,7 +1988,8 @@ class GanetiLockManager:
 
     # Acquire the locks in the set.
     return self.__keyring[level].acquire(names, shared=shared, timeout=timeout,
-                                         priority=priority)
+                                         priority=priority,
+                                         release_fn=release_fn)
 
   def downgrade(self, level, names=None):
     """Downgrade a set of resource locks from exclusive to shared mode.
@@ -1642,7 +2082,7 @@ def _MonitorSortKey((num, item)):
   Sort by name, then by incoming order.
 
   """
-  (name, _, _, _) = item
+  (name, _, _, _, _) = item
 
   return (utils.NiceSortKey(name), num)
 
@@ -1703,17 +2143,21 @@ class LockMonitor(object):
     # Extract lock information and build query data
     return (qobj, query.LockQueryData(map(operator.itemgetter(1), lockinfo)))
 
-  def QueryLocks(self, fields):
+  def QueryLocks(self, fields, limit=None, cursor=None):
     """Queries information from all locks.
 
     @type fields: list of strings
     @param fields: List of fields to return
+    @type limit: None or int
+    @param limit: Maximum number of locks to return
+    @type cursor: None or string
+    @param cursor: Cursor returned with the previous page of locks
 
     """
     (qobj, ctx) = self._Query(fields)
 
     # Prepare query response
-    return query.GetQueryResponse(qobj, ctx)
+    return query.GetQueryResponse(qobj, ctx, limit=limit, cursor=cursor)
 
   def OldStyleQueryLocks(self, fields):
     """Queries information from all locks, returning old-style data.
@@ -1725,3 +2169,11 @@ class LockMonitor(object):
     (qobj, ctx) = self._Query(fields)
 
     return qobj.OldStyleQuery(ctx)
+
+  @ssynchronized(_LOCK_ATTR)
+  def ResetLockStats(self):
+    """Resets the statistics of all locks.
+
+    """
+    for lock in self._locks.keys():
+      lock.ResetStats()
@@ -66,6 +66,8 @@ REQ_QUERY_CONFIG_VALUES = "QueryConfigValues"
 REQ_QUERY_CLUSTER_INFO = "QueryClusterInfo"
 REQ_QUERY_TAGS = "QueryTags"
 REQ_QUERY_LOCKS = "QueryLocks"
+REQ_QUERY_QUEUE_STATS = "QueryQueueStats"
+REQ_RESET_LOCK_STATS = "ResetLockStats"
 REQ_QUEUE_SET_DRAIN_FLAG = "SetDrainFlag"
 REQ_SET_WATCHER_PAUSE = "SetWatcherPause"
 
@@ -499,7 +501,8 @@ class Client(object):
         break
     return result
 
-  def Query(self, what, fields, filter_):
+  def Query(self, what, fields, filter_, limit=None, cursor=None,
+            live_data_max_age=None):
     """Query for resources/items.
 
     @param what: One of L{constants.QR_VIA_LUXI}
@@ -507,13 +510,46 @@ class Client(object):
     @param fields: List of requested fields
     @type filter_: None or list
     @param filter_: Query filter
+    @type limit: None or int
+    @param limit: Maximum number of results to return
+    @type cursor: None or string
+    @param cursor: Cursor returned with the previous page of results
+    @type live_data_max_age: None or int
+    @param live_data_max_age: Maximum age (in seconds) of cached live data of
+      nodes to accept; by default nodes are queried
     @rtype: L{objects.QueryResponse}
 
     """
-    req = objects.QueryRequest(what=what, fields=fields, filter=filter_)
+    req = objects.QueryRequest(what=what, fields=fields, filter=filter_,
+                               limit=limit, cursor=cursor,
+                               live_data_max_age=live_data_max_age)
     result = self.CallMethod(REQ_QUERY, req.ToDict())
     return objects.QueryResponse.FromDict(result)
 
+  def QueryPages(self, what, fields, filter_, limit):
+    """Query for resources/items, retrieving the results in pages.
+
+    Only one page of results is transferred and kept in memory at a time.
+
+    @param what: One of L{constants.QR_VIA_LUXI}
+    @type fields: List of strings
+    @param fields: List of requested fields
+    @type filter_: None or list
+    @param filter_: Query filter
+    @type limit: int
+    @param limit: Maximum number of results per page
+    @rtype: generator of L{objects.QueryResponse}
+
+    """
+    cursor = None
+    while True:
+      response = self.Query(what, fields, filter_, limit=limit, cursor=cursor)
+      yield response
+
+      cursor = response.cursor
+      if cursor is None:
+        break
+
   def QueryFields(self, what, fields):
     """Query for available fields.
 
@@ -555,3 +591,9 @@ class Client(object):
     warnings.warn("This LUXI call is deprecated and will be removed, use"
                   " Query(\"%s\", ...) instead" % constants.QR_LOCK)
     return self.CallMethod(REQ_QUERY_LOCKS, (fields, sync))
+
+  def QueryQueueStats(self):
+    return self.CallMethod(REQ_QUERY_QUEUE_STATS, ())
+
+  def ResetLockStats(self):
+    return self.CallMethod(REQ_RESET_LOCK_STATS, ())
@@ -0,0 +1,404 @@
+#
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Persistent instance allocator processes.
+
+Allocators supporting it are kept running by the master daemon instead of
+being started for every request. They are started with C{--socket=PATH},
+listen on a Unix socket at C{PATH} and exchange JSON messages terminated by
+L{constants.LUXI_EOM} with the master daemon, like LUXI. The first request
+on a connection contains the complete cluster description, later requests
+only the parts which changed. See C{doc/iallocator.rst} for details.
+
+Allocators which exit or don't create the socket in time are assumed not to
+support this mode and are run once per request as before.
+
+"""
+
+import os
+import copy
+import errno
+import signal
+import socket
+import logging
+import threading
+import subprocess
+
+from ganeti import constants
+from ganeti import errors
+from ganeti import luxi
+from ganeti import serializer
+from ganeti import utils
+
+
+#: Version of the protocol spoken with persistent allocators
+PROTOCOL_VERSION = 1
+
+#: Top-level keys of the allocator input which are updated item by item
+_ITEMIZED_KEYS = frozenset([
+  "instances",
+  "nodegroups",
+  "nodes",
+  ])
+
+#: How long to wait for an allocator to accept connections (seconds)
+_STARTUP_TIMEOUT = 10
+
+#: How long to wait for a reply to a request (seconds)
+_REQUEST_TIMEOUT = 15 * 60
+
+
+class _NotSupported(Exception):
+  """Allocator doesn't support running persistently.
+
+  """
+
+
+def ComputeUpdate(old, new):
+  """Computes the message describing a changed cluster.
+
+  @type old: dict or None
+  @param old: Cluster description sent last, C{None} if there was none
+  @type new: dict
+  @param new: Current cluster description, without the request
+  @rtype: dict
+  @return: Message without the request
+
+  """
+  if old is None:
+    return {
+      "cluster": new,
+      }
+
+  update = {}
+  update_items = {}
+  remove_items = {}
+
+  for (key, value) in new.items():
+    if key in _ITEMIZED_KEYS and isinstance(old.get(key), dict):
+      old_items = old[key]
+      changed = dict((name, item) for (name, item) in value.items()
+                     if old_items.get(name) != item)
+      removed = [name for name in old_items if name not in value]
+      if changed:
+        update_items[key] = changed
+      if removed:
+        remove_items[key] = removed
+    elif key not in old or old[key] != value:
+      update[key] = value
+
+  return {
+    "update": update,
+    "update_items": update_items,
+    "remove_items": remove_items,
+    }
+
+
+class _AllocatorProcess(object):
+  """A persistent allocator.
+
+  """
+  def __init__(self, name, path, socket_path):
+    """Initializes this class.
+
+    @type name: string
+    @param name: Allocator name
+    @type path: string
+    @param path: Path to allocator executable
+    @type socket_path: string
+    @param socket_path: Path of the socket to be created by the allocator
+
+    """
+    self.name = name
+    self.path = path
+    self.lock = threading.Lock()
+    self._socket_path = socket_path
+    self._mtime = None
+    self._proc = None
+    self._transport = None
+    # Cluster description sent last
+    self._cluster = None
+
+  def _Start(self, mtime):
+    """Starts the allocator and connects to it.
+
+    @raise _NotSupported: if the allocator doesn't support persistent mode
+
+    """
+    utils.RemoveFile(self._socket_path)
+
+    null = open(os.devnull, "r+")
+    try:
+      self._proc = subprocess.Popen([self.path,
+                                     "--socket=%s" % self._socket_path],
+                                    stdin=null, stdout=null, stderr=null,
+                                    close_fds=True, cwd="/")
+    finally:
+      null.close()
+
+    self._mtime = mtime
+
+    def _Connect():
+      if self._proc.poll() is not None:
+        raise _NotSupported("Exited with code %s" % self._proc.returncode)
+
+      try:
+        return luxi.Transport(self._socket_path,
+                              timeouts=(_STARTUP_TIMEOUT, _REQUEST_TIMEOUT))
+      except luxi.NoMasterError:
+        raise utils.RetryAgain()
+
+    try:
+      try:
+        self._transport = utils.Retry(_Connect, (0.01, 1.5, 0.5),
+                                      _STARTUP_TIMEOUT)
+      except utils.RetryTimeout:
+        raise _NotSupported("Socket wasn't created in time")
+      except (luxi.ProtocolError, socket.error), err:
+        raise _NotSupported("Can't connect: %s" % err)
+
+      try:
+        reply = serializer.LoadJson(self._Call({
+          "protocol": PROTOCOL_VERSION,
+          }))
+      except (luxi.ProtocolError, socket.error, ValueError), err:
+        raise _NotSupported("Handshake failed: %s" % err)
+
+      if not (isinstance(reply, dict) and
+              reply.get("protocol") == PROTOCOL_VERSION):
+        raise _NotSupported("Unsupported protocol in reply %r" % (reply, ))
+    except _NotSupported:
+      self.Stop()
+      raise
+
+    logging.info("Started persistent iallocator '%s' (PID %s)",
+                 self.name, self._proc.pid)
+
+  def _Call(self, msg):
+    """Sends a message and returns the reply.
+
+    """
+    return self._transport.Call(serializer.DumpJson(msg, indent=False))
+
+  def Run(self, in_data, mtime):
+    """Runs an allocation request.
+
+    Must be called with L{lock} held.
+
+    @type in_data: dict
+    @param in_data: Allocator input, see L{cmdlib.IAllocator}
+    @param mtime: Modification time of the allocator executable; the
+      allocator is restarted if it changed
+    @rtype: string
+    @return: Serialized allocator result
+    @raise _NotSupported: if the allocator doesn't support persistent mode
+
+    """
+    if self._proc is not None and (self._mtime != mtime or
+                                   self._proc.poll() is not None):
+      self.Stop()
+
+    if self._proc is None:
+      self._Start(mtime)
+
+    cluster = dict((key, value) for (key, value) in in_data.items()
+                   if key != "request")
+
+    msg = ComputeUpdate(self._cluster, cluster)
+    msg["request"] = in_data["request"]
+
+    try:
+      result = self._Call(msg)
+    except (luxi.ProtocolError, socket.error), err:
+      # The allocator's state is unknown
+      self.Stop()
+      raise errors.OpExecError("Persistent iallocator '%s' failed: %s" %
+                               (self.name, err))
+
+    self._cluster = copy.deepcopy(cluster)
+
+    return result
+
+  def Stop(self):
+    """Stops the allocator.
+
+    """
+    if self._transport:
+      self._transport.Close()
+      self._transport = None
+
+    if self._proc:
+      if self._proc.poll() is None:
+        try:
+          os.kill(self._proc.pid, signal.SIGTERM)
+        except EnvironmentError, err:
+          if err.errno != errno.ESRCH:
+            raise
+        self._proc.wait()
+      self._proc = None
+
+    self._cluster = None
+    utils.RemoveFile(self._socket_path)
+
+
+class PersistentAllocators(object):
+  """Manages persistent allocators.
+
+  There is at most one process per allocator; its requests are serialized.
+
+  """
+  def __init__(self, socket_dir=constants.SOCKET_DIR,
+               search_path=constants.IALLOCATOR_SEARCH_PATH):
+    """Initializes this class.
+
+    @type socket_dir: string
+    @param socket_dir: Directory for the allocators' sockets
+    @type search_path: list of strings
+    @param search_path: Directories to search for allocators
+
+    """
+    self._socket_dir = socket_dir
+    self._search_path = search_path
+    self._lock = threading.Lock()
+    self._procs = {}
+    # Path to modification time of allocators without persistent mode
+    self._unsupported = {}
+
+  def Run(self, name, in_data):
+    """Runs an allocation request if the allocator supports it.
+
+    @type name: string
+    @param name: Allocator name
+    @type in_data: dict
+    @param in_data: Allocator input
+    @rtype: string or None
+    @return: Serialized allocator result, C{None} if the allocator must be
+      run once per request
+
+    """
+    path = utils.FindFile(name, self._search_path, os.path.isfile)
+    if path is None:
+      return None
+
+    try:
+      mtime = os.stat(path).st_mtime
+    except EnvironmentError:
+      return None
+
+    self._lock.acquire()
+    try:
+      if self._unsupported.get(path) == mtime:
+        return None
+
+      proc = self._procs.get(name)
+      if proc is None or proc.path != path:
+        old = proc
+        proc = _AllocatorProcess(name, path,
+                                 utils.PathJoin(self._socket_dir,
+                                                "iallocator-%s" % name))
+        self._procs[name] = proc
+      else:
+        old = None
+    finally:
+      self._lock.release()
+
+    if old:
+      old.lock.acquire()
+      try:
+        old.Stop()
+      finally:
+        old.lock.release()
+
+    proc.lock.acquire()
+    try:
+      try:
+        return proc.Run(in_data, mtime)
+      except _NotSupported, err:
+        logging.info("Iallocator '%s' doesn't support persistent mode: %s",
+                     name, err)
+    finally:
+      proc.lock.release()
+
+    self._lock.acquire()
+    try:
+      self._unsupported[path] = mtime
+    finally:
+      self._lock.release()
+
+    return None
+
+  def Shutdown(self):
+    """Stops all allocators.
+
+    """
+    self._lock.acquire()
+    try:
+      procs = self._procs.values()
+      self._procs.clear()
+    finally:
+      self._lock.release()
+
+    for proc in procs:
+      proc.lock.acquire()
+      try:
+        proc.Stop()
+      finally:
+        proc.lock.release()
+
+
+_allocators = None
+
+
+def Init():
+  """Enables persistent allocators.
+
+  Only called by the master daemon; elsewhere allocators are always run once
+  per request.
+
+  """
+  global _allocators # pylint: disable-msg=W0603
+
+  assert _allocators is None
+  _allocators = PersistentAllocators()
+
+
+def Shutdown():
+  """Stops all persistent allocators.
+
+  """
+  global _allocators # pylint: disable-msg=W0603
+
+  if _allocators is not None:
+    _allocators.Shutdown()
+    _allocators = None
+
+
+def Run(name, in_data):
+  """Runs an allocation request using a persistent allocator if possible.
+
+  @see: L{PersistentAllocators.Run}
+
+  """
+  allocators = _allocators
+  if allocators is None:
+    return None
+
+  return allocators.Run(name, in_data)
@@ -50,6 +50,16 @@ class LockAcquireTimeout(Exception):
   """Exception to report timeouts on acquiring locks.
 
   """
+  def __init__(self, release_notify=False):
+    """Initializes this class.
+
+    @type release_notify: bool
+    @param release_notify: Whether L{OpExecCbBase.NotifyLockRelease} is going
+        to be called once the lock which caused the timeout has been released
+
+    """
+    Exception.__init__(self)
+    self.release_notify = release_notify
 
 
 def _CalculateLockAttemptTimeouts():
@@ -144,6 +154,14 @@ class OpExecCbBase: # pylint: disable-msg=W0232
 
     """
 
+  def NotifyLockRelease(self):
+    """Called when a lock the opcode couldn't acquire has been released.
+
+    Only called after L{LockAcquireTimeout} was raised with C{release_notify}
+    set. Can be called from any thread, possibly while it holds locks.
+
+    """
+
   def SubmitManyJobs(self, jobs):
     """Submits jobs for processing.
 
@@ -188,7 +206,7 @@ class Processor(object):
     self.context = context
     self._ec_id = ec_id
     self._cbs = None
-    self.rpc = rpc.RpcRunner(context.cfg)
+    self.rpc = rpc.RpcRunner(context.cfg, live_data_cache=context.livedata)
     self.hmclass = HooksMaster
 
   def _AcquireLocks(self, level, names, shared, timeout, priority):
@@ -209,11 +227,17 @@ class Processor(object):
     if self._cbs:
       self._cbs.CheckCancel()
 
+    if self._cbs and timeout is not None:
+      release_fn = self._cbs.NotifyLockRelease
+    else:
+      release_fn = None
+
     acquired = self.context.glm.acquire(level, names, shared=shared,
-                                        timeout=timeout, priority=priority)
+                                        timeout=timeout, priority=priority,
+                                        release_fn=release_fn)
 
     if acquired is None:
-      raise LockAcquireTimeout()
+      raise LockAcquireTimeout(release_notify=(release_fn is not None))
 
     return acquired
 
@@ -588,7 +612,12 @@ class HooksMaster(object):
                            node_name, msg)
         continue
 
-      for script, hkr, output in res.payload:
+      timings = []
+      for entry in res.payload:
+        # Nodes running an older version don't report how long a script ran
+        (script, hkr, output) = entry[:3]
+        if len(entry) > 3 and entry[3] is not None:
+          timings.append("%s %.2fs" % (script, entry[3]))
         if hkr == constants.HKR_FAIL:
           if phase == constants.HOOKS_PHASE_PRE:
             errs.append((node_name, script, output))
@@ -598,6 +627,10 @@ class HooksMaster(object):
             self.lu.LogWarning("On %s script %s failed, output: %s" %
                                (node_name, script, output))
 
+      if timings:
+        self.lu.LogInfo("Hooks on %s: %s", node_name,
+                        utils.CommaJoin(timings))
+
     if errs and phase == constants.HOOKS_PHASE_PRE:
       raise errors.HooksAbort(errs)
 
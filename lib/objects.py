@@ -1465,6 +1465,9 @@ class QueryRequest(ConfigObject):
     "what",
     "fields",
     "filter",
+    "limit",
+    "cursor",
+    "live_data_max_age",
     ]
 
 
@@ -1473,10 +1476,13 @@ class QueryResponse(_QueryResponseBase):
 
   @ivar fields: List of L{QueryFieldDefinition} objects
   @ivar data: Requested data
+  @ivar cursor: Cursor for requesting the next page of a query with a limit,
+    C{None} if there are no more results
 
   """
   __slots__ = [
     "data",
+    "cursor",
     ]
 
 
@@ -99,6 +99,11 @@ _PStorageName = ("name", ht.NoDefault, ht.TMaybeString, "Storage name")
 _PUseLocking = ("use_locking", False, ht.TBool,
                 "Whether to use synchronization")
 
+_PLiveDataMaxAge = \
+  ("live_data_max_age", None, ht.TOr(ht.TNone, ht.TPositiveInt),
+   "Maximum age (in seconds) of cached live data of nodes to accept instead"
+   " of querying the nodes")
+
 _PNameCheck = ("name_check", True, ht.TBool, "Whether to check name")
 
 _PNodeGroupAllocPolicy = \
@@ -686,6 +691,8 @@ class OpQuery(OpCode):
   @ivar what: Resources to query for, must be one of L{constants.QR_VIA_OP}
   @ivar fields: List of fields to retrieve
   @ivar filter: Query filter
+  @ivar limit: Maximum number of results to return
+  @ivar cursor: Cursor returned with the previous page of results
 
   """
   OP_PARAMS = [
@@ -694,6 +701,11 @@ class OpQuery(OpCode):
      "Requested fields"),
     ("filter", None, ht.TOr(ht.TNone, ht.TListOf),
      "Query filter"),
+    ("limit", None, ht.TOr(ht.TNone, ht.TStrictPositiveInt),
+     "Maximum number of results to return"),
+    ("cursor", None, ht.TMaybeString,
+     "Cursor returned with the previous page of results"),
+    _PLiveDataMaxAge,
     ]
 
 
@@ -791,6 +803,7 @@ class OpNodeQuery(OpCode):
   OP_PARAMS = [
     _POutputFields,
     _PUseLocking,
+    _PLiveDataMaxAge,
     ("names", ht.EmptyList, ht.TListOf(ht.TNonEmptyString),
      "Empty list to query all nodes, node names otherwise"),
     ]
@@ -969,6 +982,67 @@ class OpInstanceCreate(OpCode):
     ]
 
 
+class OpInstanceMultiAlloc(OpCode):
+  """Allocates multiple instances in one iallocator request.
+
+  The instances are created by separate jobs, one per instance, submitted
+  once nodes have been found for all of them.
+
+  @ivar instances: Creation opcodes (L{OpInstanceCreate}) for the instances;
+    they must not specify nodes or an iallocator of their own
+
+  """
+  #: Result key listing the instances for which jobs were submitted
+  ALLOCATABLE_KEY = "allocatable"
+  #: Result key listing the instances which could not be allocated
+  FAILED_KEY = "failed"
+
+  OP_PARAMS = [
+    ("iallocator", None, ht.TMaybeString,
+     "Iallocator used to allocate all the instances"),
+    ("instances", ht.EmptyList, ht.TListOf(ht.TInstanceOf(OpInstanceCreate)),
+     "List of instance create opcodes describing the instances to allocate"),
+    ("allow_failure", False, ht.TBool,
+     "Whether to create the instances which could be allocated even if"
+     " others could not"),
+    ]
+
+  def __getstate__(self):
+    """Generic serializer.
+
+    The instance creation opcodes are serialized as well.
+
+    """
+    state = OpCode.__getstate__(self)
+    if isinstance(state.get("instances"), list):
+      state["instances"] = [op.__getstate__() for op in state["instances"]]
+    return state
+
+  def __setstate__(self, state):
+    """Generic unserializer.
+
+    @type state: dict
+    @param state: the serialized opcode data
+
+    """
+    if isinstance(state, dict) and isinstance(state.get("instances"), list):
+      state = state.copy()
+      state["instances"] = [OpCode.LoadOpCode(data)
+                            for data in state["instances"]]
+    OpCode.__setstate__(self, state)
+
+  def Validate(self, set_defaults):
+    """Validates this opcode and the instance creation opcodes.
+
+    @see: L{BaseOpCode.Validate}
+
+    """
+    OpCode.Validate(self, set_defaults)
+
+    for op in getattr(self, "instances", []):
+      op.Validate(set_defaults)
+
+
 class OpInstanceReinstall(OpCode):
   """Reinstall an instance's OS."""
   OP_DSC_FIELD = "instance_name"
@@ -1157,6 +1231,7 @@ class OpInstanceQuery(OpCode):
   OP_PARAMS = [
     _POutputFields,
     _PUseLocking,
+    _PLiveDataMaxAge,
     ("names", ht.EmptyList, ht.TListOf(ht.TNonEmptyString),
      "Empty list to query all instances, instance names otherwise"),
     ]
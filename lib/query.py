@@ -42,7 +42,7 @@ How it works:
   - Instantiate L{Query} with prepared field list definition and selected fields
   - Call L{Query.RequestedData} to determine what data to collect/compute
   - Call L{Query.Query} or L{Query.OldStyleQuery} with collected data and use
-    result
+    result; L{Query.QueryPage} returns only part of the result
       - Data container must support iteration using C{__iter__}
       - Items are passed to retrieval functions and can have any format
   - Call L{Query.GetFields} to get list of definitions for selected fields
@@ -55,6 +55,7 @@ How it works:
 import logging
 import operator
 import re
+import bisect
 
 from ganeti import constants
 from ganeti import errors
@@ -87,7 +88,8 @@ from ganeti.constants import (QFT_UNKNOWN, QFT_TEXT, QFT_BOOL, QFT_NUMBER,
 
 (LQ_MODE,
  LQ_OWNER,
- LQ_PENDING) = range(10, 13)
+ LQ_PENDING,
+ LQ_STATS) = range(10, 14)
 
 (GQ_CONFIG,
  GQ_NODE,
@@ -676,39 +678,159 @@ class Query:
       ordering
 
     """
-    sort = (self._name_fn and sort_by_name)
+    (result, _) = self.QueryPage(ctx, sort_by_name=sort_by_name)
+    return result
 
+  def QueryPage(self, ctx, sort_by_name=True, limit=None, cursor=None):
+    """Execute a query, returning a limited number of rows.
+
+    Rows are only computed for the items on the requested page. If the
+    result is sorted by name, the cursor refers to the name of the last
+    returned item, so that pages stay consistent while items are added or
+    removed. Otherwise it is the number of rows returned so far.
+
+    @param ctx: Data container passed to field retrieval functions, must
+      support iteration using C{__iter__}
+    @type sort_by_name: boolean
+    @param sort_by_name: Whether to sort by name or keep the input data's
+      ordering
+    @type limit: None or int
+    @param limit: Maximum number of rows to return
+    @type cursor: None or string
+    @param cursor: Cursor returned with the previous page
+    @rtype: tuple; (list, string or None)
+    @return: Result rows and cursor for the next page, C{None} if there are
+      no more rows
+
+    """
+    assert limit is None or limit > 0
+
+    if self._name_fn and sort_by_name:
+      return self._QuerySorted(ctx, limit, cursor)
+    else:
+      return self._QueryUnsorted(ctx, limit, cursor)
+
+  def _GetRow(self, ctx, item):
+    """Computes the result row for an item.
+
+    """
+    row = [_ProcessResult(fn(ctx, item)) for (_, _, _, fn) in self._fields]
+
+    # Verify result
+    if __debug__:
+      _VerifyResultRow(self._fields, row)
+
+    return row
+
+  def _QuerySorted(self, ctx, limit, cursor):
+    """Executes a query sorted by name.
+
+    The cursor consists of the name of the last returned item and the number
+    of returned items with that name, as names don't need to be unique.
+    Items with equal names are kept in input order.
+
+    See L{QueryPage}.
+
+    """
+    if cursor is None:
+      cursor_key = None
+    else:
+      (cursor_name, cursor_skip) = _ParseSortedCursor(cursor)
+      cursor_key = utils.NiceSortKey(cursor_name)
+
+    # Tuples of (sort key, index, name, row), kept sorted if there is a limit
     result = []
+    more = False
+    skipped = 0
 
     for idx, item in enumerate(ctx):
       if not (self._filter_fn is None or self._filter_fn(ctx, item)):
         continue
 
-      row = [_ProcessResult(fn(ctx, item)) for (_, _, _, fn) in self._fields]
+      (status, name) = _ProcessResult(self._name_fn(ctx, item))
+      assert status == constants.RS_NORMAL
+      # TODO: Are there cases where we wouldn't want to use NiceSort?
+      key = utils.NiceSortKey(name)
+
+      if cursor_key is not None:
+        if key < cursor_key:
+          # Returned with a previous page
+          continue
+        elif key == cursor_key and skipped < cursor_skip:
+          skipped += 1
+          continue
+
+      if limit is None:
+        result.append((key, idx, name, self._GetRow(ctx, item)))
+        continue
 
-      # Verify result
-      if __debug__:
-        _VerifyResultRow(self._fields, row)
+      if len(result) >= limit and (key, idx) > result[-1][:2]:
+        # Not on this page
+        more = True
+        continue
 
-      if sort:
-        (status, name) = _ProcessResult(self._name_fn(ctx, item))
-        assert status == constants.RS_NORMAL
-        # TODO: Are there cases where we wouldn't want to use NiceSort?
-        result.append((utils.NiceSortKey(name), idx, row))
-      else:
-        result.append(row)
+      bisect.insort(result, (key, idx, name, self._GetRow(ctx, item)))
+
+      if len(result) > limit:
+        result.pop()
+        more = True
+
+    if limit is None:
+      # Sorting in-place instead of using "sorted()"
+      result.sort()
+
+    if more:
+      (last_key, _, last_name, _) = result[-1]
+      count = len([key for (key, _, _, _) in result if key == last_key])
+      if last_key == cursor_key:
+        count += cursor_skip
+      next_cursor = "%d:%s" % (count, last_name)
+    else:
+      next_cursor = None
+
+    return (map(operator.itemgetter(3), result), next_cursor)
+
+  def _QueryUnsorted(self, ctx, limit, cursor):
+    """Executes a query keeping the input data's ordering.
+
+    See L{QueryPage}.
+
+    """
+    if cursor is None:
+      offset = 0
+    else:
+      try:
+        offset = int(cursor)
+      except (TypeError, ValueError):
+        raise errors.OpPrereqError("Invalid query cursor '%s'" % cursor,
+                                   errors.ECODE_INVAL)
 
-    if not sort:
-      return result
+    result = []
+    more = False
+    count = 0
 
-    # TODO: Would "heapq" be more efficient than sorting?
+    for item in ctx:
+      if not (self._filter_fn is None or self._filter_fn(ctx, item)):
+        continue
 
-    # Sorting in-place instead of using "sorted()"
-    result.sort()
+      count += 1
 
-    assert not result or (len(result[0]) == 3 and len(result[-1]) == 3)
+      if count <= offset:
+        # Returned with a previous page
+        continue
 
-    return map(operator.itemgetter(2), result)
+      if limit is not None and len(result) >= limit:
+        more = True
+        break
+
+      result.append(self._GetRow(ctx, item))
+
+    if more:
+      next_cursor = str(offset + len(result))
+    else:
+      next_cursor = None
+
+    return (result, next_cursor)
 
   def OldStyleQuery(self, ctx, sort_by_name=True):
     """Query with "old" query result format.
@@ -727,6 +849,29 @@ class Query:
             for row in self.Query(ctx, sort_by_name=sort_by_name)]
 
 
+def _ParseSortedCursor(cursor):
+  """Parses the cursor of a query sorted by name.
+
+  @type cursor: string
+  @rtype: tuple; (string, int)
+  @return: Name of the last returned item and the number of returned items
+    with that name
+
+  """
+  try:
+    (count, name) = cursor.split(":", 1)
+    count = int(count)
+  except (AttributeError, TypeError, ValueError):
+    raise errors.OpPrereqError("Invalid query cursor '%s'" % (cursor, ),
+                               errors.ECODE_INVAL)
+
+  if count < 1:
+    raise errors.OpPrereqError("Invalid query cursor '%s'" % (cursor, ),
+                               errors.ECODE_INVAL)
+
+  return (name, count)
+
+
 def _ProcessResult(value):
   """Converts result values into externally-visible ones.
 
@@ -819,7 +964,7 @@ def _PrepareFieldList(fields, aliases):
   return result
 
 
-def GetQueryResponse(query, ctx, sort_by_name=True):
+def GetQueryResponse(query, ctx, sort_by_name=True, limit=None, cursor=None):
   """Prepares the response for a query.
 
   @type query: L{Query}
@@ -827,10 +972,17 @@ def GetQueryResponse(query, ctx, sort_by_name=True):
   @type sort_by_name: boolean
   @param sort_by_name: Whether to sort by name or keep the input data's
     ordering
+  @type limit: None or int
+  @param limit: Maximum number of rows to return, see L{Query.QueryPage}
+  @type cursor: None or string
+  @param cursor: Cursor of the page to return, see L{Query.QueryPage}
 
   """
-  return objects.QueryResponse(data=query.Query(ctx, sort_by_name=sort_by_name),
-                               fields=query.GetFields()).ToDict()
+  (data, next_cursor) = query.QueryPage(ctx, sort_by_name=sort_by_name,
+                                        limit=limit, cursor=cursor)
+
+  return objects.QueryResponse(data=data, fields=query.GetFields(),
+                               cursor=next_cursor).ToDict()
 
 
 def QueryFields(fielddefs, selected):
@@ -966,12 +1118,14 @@ class NodeQueryData:
 
   """
   def __init__(self, nodes, live_data, master_name, node_to_primary,
-               node_to_secondary, groups, oob_support, cluster):
+               node_to_secondary, groups, oob_support, cluster,
+               live_data_age=None):
     """Initializes this class.
 
     """
     self.nodes = nodes
     self.live_data = live_data
+    self.live_data_age = live_data_age
     self.master_name = master_name
     self.node_to_primary = node_to_primary
     self.node_to_secondary = node_to_secondary
@@ -1139,6 +1293,26 @@ def _GetLiveNodeField(field, kind, ctx, node):
     return _FS_UNAVAIL
 
 
+def _GetNodeLiveDataAge(ctx, node):
+  """Returns how old a node's live data is.
+
+  @type ctx: L{NodeQueryData}
+  @type node: L{objects.Node}
+  @param node: Node object
+
+  """
+  if node.offline:
+    return _FS_OFFLINE
+
+  if not node.vm_capable:
+    return _FS_UNAVAIL
+
+  if not (ctx.curlive_data and ctx.live_data_age):
+    return _FS_NODATA
+
+  return int(ctx.live_data_age[node.name])
+
+
 def _BuildNodeFields():
   """Builds list of fields for node queries.
 
@@ -1211,6 +1385,11 @@ def _BuildNodeFields():
      compat.partial(_GetLiveNodeField, nfield, kind))
     for (name, (title, kind, nfield, doc)) in _NODE_LIVE_FIELDS.items()
     ])
+  fields.append(
+    (_MakeField("live_age", "LiveAge", QFT_NUMBER,
+                "Age of the live data in seconds, non-zero if it was taken"
+                " from the master daemon's cache"),
+     NQ_LIVE, 0, _GetNodeLiveDataAge))
 
   # Add timestamps
   fields.extend(_GetItemTimestampFields(NQ_CONFIG))
@@ -1223,7 +1402,7 @@ class InstanceQueryData:
 
   """
   def __init__(self, instances, cluster, disk_usage, offline_nodes, bad_nodes,
-               live_data, wrongnode_inst, console):
+               live_data, wrongnode_inst, console, live_data_age=None):
     """Initializes this class.
 
     @param instances: List of instance objects
@@ -1240,6 +1419,8 @@ class InstanceQueryData:
     @param wrongnode_inst: Set of instances running on wrong node(s)
     @type console: dict; instance name as key
     @param console: Per-instance console information
+    @type live_data_age: dict; node name as key
+    @param live_data_age: Age of the live data per node
 
     """
     assert len(set(bad_nodes) & set(offline_nodes)) == len(offline_nodes), \
@@ -1255,6 +1436,7 @@ class InstanceQueryData:
     self.live_data = live_data
     self.wrongnode_inst = wrongnode_inst
     self.console = console
+    self.live_data_age = live_data_age
 
     # Used for individual rows
     self.inst_hvparams = None
@@ -1701,6 +1883,22 @@ _INST_SIMPLE_FIELDS = {
   }
 
 
+def _GetInstLiveDataAge(ctx, inst):
+  """Returns how old the live data of an instance's primary node is.
+
+  @type ctx: L{InstanceQueryData}
+  @type inst: L{objects.Instance}
+  @param inst: Instance object
+
+  """
+  if (inst.primary_node in ctx.bad_nodes or
+      not ctx.live_data_age or
+      inst.primary_node not in ctx.live_data_age):
+    return _FS_NODATA
+
+  return int(ctx.live_data_age[inst.primary_node])
+
+
 def _BuildInstanceFields():
   """Builds list of fields for instance queries.
 
@@ -1739,6 +1937,10 @@ def _BuildInstanceFields():
     (_MakeField("oper_vcpus", "VCPUs", QFT_NUMBER,
                 "Actual number of VCPUs as seen by hypervisor"),
      IQ_LIVE, 0, _GetInstLiveData("vcpus")),
+    (_MakeField("live_age", "LiveAge", QFT_NUMBER,
+                "Age of the primary node's live data in seconds, non-zero if"
+                " it was taken from the master daemon's cache"),
+     IQ_LIVE, 0, _GetInstLiveDataAge),
     ])
 
   # Status field
@@ -1796,7 +1998,7 @@ def _GetLockOwners(_, data):
   """Returns a sorted list of a lock's current owners.
 
   """
-  (_, _, owners, _) = data
+  (_, _, owners, _, _) = data
 
   if owners:
     owners = utils.NiceSort(owners)
@@ -1808,7 +2010,7 @@ def _GetLockPending(_, data):
   """Returns a sorted list of a lock's pending acquires.
 
   """
-  (_, _, _, pending) = data
+  (_, _, _, pending, _) = data
 
   if pending:
     pending = [(mode, utils.NiceSort(names))
@@ -1817,24 +2019,61 @@ def _GetLockPending(_, data):
   return pending
 
 
+def _GetLockStatistic(name):
+  """Returns a function to get one of a lock's statistics.
+
+  @type name: string
+  @param name: Field name
+
+  """
+  return lambda _, data: data[4][name]
+
+
+#: Lock statistics, see L{locking._LockStats}
+_LOCK_STATS_FIELDS = [
+  ("acquired", "Acquired", QFT_NUMBER, "Number of times the lock was acquired"),
+  ("acquired_shared", "AcqShared", QFT_NUMBER,
+   "Number of times the lock was acquired in shared mode"),
+  ("acquired_exclusive", "AcqExclusive", QFT_NUMBER,
+   "Number of times the lock was acquired in exclusive mode"),
+  ("timeouts", "Timeouts", QFT_NUMBER,
+   "Number of acquires which timed out"),
+  ("wait_time", "WaitTime", QFT_OTHER,
+   "Total time spent waiting for the lock (in seconds)"),
+  ("wait_p99", "WaitP99", QFT_OTHER,
+   "Estimated 99th percentile of the time spent waiting for the lock"
+   " (in seconds)"),
+  ("hold_time", "HoldTime", QFT_OTHER,
+   "Total time the lock was held (in seconds)"),
+  ("hold_p99", "HoldP99", QFT_OTHER,
+   "Estimated 99th percentile of the time the lock was held (in seconds)"),
+  ]
+
+
 def _BuildLockFields():
   """Builds list of fields for lock queries.
 
   """
-  return _PrepareFieldList([
+  fields = [
     # TODO: Lock names are not always hostnames. Should QFF_HOSTNAME be used?
     (_MakeField("name", "Name", QFT_TEXT, "Lock name"), None, 0,
-     lambda ctx, (name, mode, owners, pending): name),
+     lambda ctx, (name, mode, owners, pending, stats): name),
     (_MakeField("mode", "Mode", QFT_OTHER,
                 "Mode in which the lock is currently acquired"
                 " (exclusive or shared)"),
-     LQ_MODE, 0, lambda ctx, (name, mode, owners, pending): mode),
+     LQ_MODE, 0, lambda ctx, (name, mode, owners, pending, stats): mode),
     (_MakeField("owner", "Owner", QFT_OTHER, "Current lock owner(s)"),
      LQ_OWNER, 0, _GetLockOwners),
     (_MakeField("pending", "Pending", QFT_OTHER,
                 "Threads waiting for the lock"),
      LQ_PENDING, 0, _GetLockPending),
-    ], [])
+    ]
+
+  fields.extend([(_MakeField(name, title, kind, doc), LQ_STATS, 0,
+                  _GetLockStatistic(name))
+                 for (name, title, kind, doc) in _LOCK_STATS_FIELDS])
+
+  return _PrepareFieldList(fields, [])
 
 
 class GroupQueryData:
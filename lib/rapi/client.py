@@ -682,6 +682,36 @@ class GanetiRapiClient(object): # pylint: disable-msg=R0904
     return self._SendRequest(HTTP_POST, "/%s/instances" % GANETI_RAPI_VERSION,
                              query, body)
 
+  def InstancesMultiAlloc(self, instances, **kwargs):
+    """Allocates multiple instances at once.
+
+    More details for parameters can be found in the RAPI documentation.
+
+    @type instances: list of dicts
+    @param instances: Instance definitions, as used by L{CreateInstance}
+      but without nodes or an iallocator
+    @type dry_run: bool
+    @keyword dry_run: whether to perform a dry run
+
+    @rtype: string
+    @return: job id of the allocation job, whose result lists the jobs
+      creating the instances
+
+    """
+    query = []
+    body = {
+      "instances": instances,
+      }
+
+    if kwargs.pop("dry_run", False):
+      query.append(("dry-run", 1))
+
+    body.update(kwargs)
+
+    return self._SendRequest(HTTP_POST,
+                             "/%s/instances-multi-alloc" % GANETI_RAPI_VERSION,
+                             query, body)
+
   def DeleteInstance(self, instance, dry_run=False):
     """Deletes an instance.
 
@@ -1713,7 +1743,7 @@ class GanetiRapiClient(object): # pylint: disable-msg=R0904
                              ("/%s/groups/%s/tags" %
                               (GANETI_RAPI_VERSION, group)), query, None)
 
-  def Query(self, what, fields, filter_=None):
+  def Query(self, what, fields, filter_=None, limit=None, cursor=None):
     """Retrieves information about resources.
 
     @type what: string
@@ -1722,6 +1752,10 @@ class GanetiRapiClient(object): # pylint: disable-msg=R0904
     @param fields: Requested fields
     @type filter_: None or list
     @param filter_: Query filter
+    @type limit: None or int
+    @param limit: Maximum number of results to return
+    @type cursor: None or string
+    @param cursor: Cursor returned with the previous page of results
 
     @rtype: string
     @return: job id
@@ -1734,6 +1768,12 @@ class GanetiRapiClient(object): # pylint: disable-msg=R0904
     if filter_ is not None:
       body["filter"] = filter_
 
+    if limit is not None:
+      body["limit"] = limit
+
+    if cursor is not None:
+      body["cursor"] = cursor
+
     return self._SendRequest(HTTP_PUT,
                              ("/%s/query/%s" %
                               (GANETI_RAPI_VERSION, what)), None, body)
@@ -185,6 +185,7 @@ def GetHandlers(node_name_pattern, instance_name_pattern,
       rlib2.R_2_nodes_name_storage_repair,
 
     "/2/instances": rlib2.R_2_instances,
+    "/2/instances-multi-alloc": rlib2.R_2_instances_multi_alloc,
     re.compile(r'^/2/instances/(%s)$' % instance_name_pattern):
       rlib2.R_2_instances_name,
     re.compile(r'^/2/instances/(%s)/info$' % instance_name_pattern):
@@ -107,6 +107,9 @@ _INST_REINSTALL_REQV1 = "instance-reinstall-reqv1"
 # Feature string for node migration version 1
 _NODE_MIGRATE_REQV1 = "node-migrate-reqv1"
 
+# Feature string for allocating multiple instances at once
+_INST_MULTI_ALLOC = "instance-multi-alloc"
+
 # Timeout for /2/jobs/[job_id]/wait. Gives job up to 10 seconds to change.
 _WFJC_TIMEOUT = 10
 
@@ -148,7 +151,8 @@ class R_2_features(baserlib.R_Generic):
     """Returns list of optional RAPI features implemented.
 
     """
-    return [_INST_CREATE_REQV1, _INST_REINSTALL_REQV1, _NODE_MIGRATE_REQV1]
+    return [_INST_CREATE_REQV1, _INST_REINSTALL_REQV1, _NODE_MIGRATE_REQV1,
+            _INST_MULTI_ALLOC]
 
 
 class R_2_os(baserlib.R_Generic):
@@ -792,6 +796,58 @@ class R_2_instances(baserlib.R_Generic):
     return baserlib.SubmitJob([op])
 
 
+def _ParseInstanceMultiAllocRequest(data, dry_run):
+  """Parses a request for allocating multiple instances.
+
+  @rtype: L{opcodes.OpInstanceMultiAlloc}
+  @return: Instance allocation opcode
+
+  """
+  instances = baserlib.CheckParameter(data, "instances", exptype=list)
+
+  ops = []
+  for inst in instances:
+    if not isinstance(inst, dict):
+      raise http.HttpBadRequest("Instance definitions must be dictionaries")
+
+    inst = inst.copy()
+    inst.pop(_REQ_DATA_VERSION, None)
+
+    # Only the allocation job can be a dry run
+    ops.append(_ParseInstanceCreateRequestVersion1(inst, False))
+
+  body = data.copy()
+  del body["instances"]
+
+  override = {
+    "instances": ops,
+    "dry_run": dry_run,
+    }
+
+  return baserlib.FillOpcode(opcodes.OpInstanceMultiAlloc, body, override)
+
+
+class R_2_instances_multi_alloc(baserlib.R_Generic):
+  """/2/instances-multi-alloc resource.
+
+  """
+  def POST(self):
+    """Allocates multiple instances at once.
+
+    The instances are created by separate jobs, which are listed in the
+    result of the allocation job.
+
+    @return: a job id
+
+    """
+    if not isinstance(self.request_body, dict):
+      raise http.HttpBadRequest("Invalid body contents, not a dictionary")
+
+    op = _ParseInstanceMultiAllocRequest(self.request_body, self.dryRun())
+
+    return baserlib.SubmitJob([op])
+
+
 class R_2_instances_name(baserlib.R_Generic):
   """/2/instances/[instance_name] resource.
 
@@ -1261,8 +1317,12 @@ class R_2_query(baserlib.R_Generic):
   # Results might contain sensitive information
   GET_ACCESS = [rapi.RAPI_ACCESS_WRITE]
 
-  def _Query(self, fields, filter_):
-    return baserlib.GetClient().Query(self.items[0], fields, filter_).ToDict()
+  def _Query(self, fields, filter_, limit, cursor):
+    if limit is not None and limit < 1:
+      raise http.HttpBadRequest("Invalid limit %s" % limit)
+
+    return baserlib.GetClient().Query(self.items[0], fields, filter_,
+                                      limit=limit, cursor=cursor).ToDict()
 
   def GET(self):
     """Returns resource information.
@@ -1270,7 +1330,13 @@ class R_2_query(baserlib.R_Generic):
     @return: Query result, see L{objects.QueryResponse}
 
     """
-    return self._Query(_GetQueryFields(self.queryargs), None)
+    if "limit" in self.queryargs:
+      limit = self._checkIntVariable("limit")
+    else:
+      limit = None
+
+    return self._Query(_GetQueryFields(self.queryargs), None, limit,
+                       self._checkStringVariable("cursor"))
 
   def PUT(self):
     """Submits job querying for resources.
@@ -1287,7 +1353,11 @@ class R_2_query(baserlib.R_Generic):
     except KeyError:
       fields = _GetQueryFields(self.queryargs)
 
-    return self._Query(fields, self.request_body.get("filter", None))
+    return self._Query(fields, self.request_body.get("filter", None),
+                       baserlib.CheckParameter(body, "limit", default=None,
+                                               exptype=int),
+                       baserlib.CheckParameter(body, "cursor", default=None,
+                                               exptype=basestring))
 
 
 class R_2_query_fields(baserlib.R_Generic):
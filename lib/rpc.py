@@ -31,6 +31,8 @@
 # R0904: Too many public methods
 
 import os
+import copy
+import time
 import logging
 import zlib
 import base64
@@ -54,6 +56,13 @@ import ganeti.http.client  # pylint: disable-msg=W0611
 # Timeout for connecting to nodes (seconds)
 _RPC_CONNECT_TIMEOUT = 5
 
+# How long idle connections to nodes are kept open (seconds); must be lower
+# than the keep-alive timeout of the node daemon's workers
+_RPC_MAX_IDLE_TIME = 50
+
+# How many idle connections are kept open per node
+_RPC_MAX_IDLE_CONNECTIONS = 2
+
 _RPC_CLIENT_HEADERS = [
   "Content-type: %s" % http.HTTP_APP_JSON,
   "Expect:",
@@ -77,6 +86,31 @@ _TMO_1DAY = 86400
 _TIMEOUTS = {
 }
 
+#: Calls whose results are kept in the live data cache
+_LIVE_DATA_CALLS = frozenset([
+  "all_instances_info",
+  "node_info",
+  ])
+
+#: Calls changing a node's memory or disk usage, after which its cached live
+#: data is discarded
+_LIVE_DATA_CHANGING_CALLS = frozenset([
+  "accept_instance",
+  "blockdev_create",
+  "blockdev_grow",
+  "blockdev_remove",
+  "blockdev_snapshot",
+  "finalize_migration",
+  "instance_migrate",
+  "instance_reboot",
+  "instance_shutdown",
+  "instance_start",
+  "node_powercycle",
+  "run_oob",
+  "storage_execute",
+  "storage_modify",
+  ])
+
 
 def Init():
   """Initializes the module-global HTTP client manager.
@@ -103,6 +137,11 @@ def Shutdown():
   running.
 
   """
+  global _http_pool # pylint: disable-msg=W0603
+
+  # All cURL objects must be gone before cleaning up
+  _http_pool = None
+
   pycurl.global_cleanup()
 
 
@@ -120,32 +159,31 @@ def _ConfigRpcCurl(curl):
   curl.setopt(pycurl.CONNECTTIMEOUT, _RPC_CONNECT_TIMEOUT)
 
 
-# Aliasing this module avoids the following warning by epydoc: "Warning: No
-# information available for ganeti.rpc._RpcThreadLocal's base threading.local"
-_threading = threading
-
-
-class _RpcThreadLocal(_threading.local):
-  def GetHttpClientPool(self):
-    """Returns a per-thread HTTP client pool.
+_http_pool = None
+_http_pool_lock = threading.Lock()
 
-    @rtype: L{http.client.HttpClientPool}
 
-    """
-    try:
-      pool = self.hcp
-    except AttributeError:
-      pool = http.client.HttpClientPool(_ConfigRpcCurl)
-      self.hcp = pool
+def _GetHttpClientPool():
+  """Returns the HTTP client pool shared by all threads.
 
-    return pool
+  Connections to nodes are kept open and used by whichever thread makes the
+  next call to the same node.
 
+  @rtype: L{http.client.HttpClientPool}
 
-# Remove module alias (see above)
-del _threading
-
+  """
+  global _http_pool # pylint: disable-msg=W0603
 
-_thread_local = _RpcThreadLocal()
+  _http_pool_lock.acquire()
+  try:
+    if _http_pool is None:
+      _http_pool = \
+        http.client.HttpClientPool(_ConfigRpcCurl,
+                                   max_idle_time=_RPC_MAX_IDLE_TIME,
+                                   max_idle_clients=_RPC_MAX_IDLE_CONNECTIONS)
+    return _http_pool
+  finally:
+    _http_pool_lock.release()
 
 
 def _RpcTimeout(secs):
@@ -195,13 +233,16 @@ class RpcResult(object):
       imply failed=True, in order to allow simpler checking if
       the user doesn't care about the exact failure mode
   @ivar fail_msg: the error message if the call failed
+  @ivar age: for results taken from the live data cache, how old the data is
+      (in seconds), otherwise zero
 
   """
   def __init__(self, data=None, failed=False, offline=False,
-               call=None, node=None):
+               call=None, node=None, age=0):
     self.offline = offline
     self.call = call
     self.node = node
+    self.age = age
 
     if offline:
       self.fail_msg = "Node is marked offline"
@@ -227,7 +268,7 @@ class RpcResult(object):
         self.fail_msg = None
         self.payload = data[1]
 
-    for attr_name in ["call", "data", "fail_msg",
+    for attr_name in ["age", "call", "data", "fail_msg",
                       "node", "offline", "payload"]:
       assert hasattr(self, attr_name), "Missing attribute %s" % attr_name
 
@@ -364,36 +405,65 @@ class Client:
                                     post_data=str(self.body),
                                     read_timeout=read_timeout)
 
-  def GetResults(self, http_pool=None):
+  def _GetResult(self, name, req):
+    """Converts a finished request to an RPC result.
+
+    @type name: string
+    @param name: Node name
+    @type req: L{http.client.HttpClientRequest}
+    @param req: Finished request
+    @rtype: L{RpcResult}
+
+    """
+    if req.success and req.resp_status_code == http.HTTP_OK:
+      return RpcResult(data=serializer.LoadJson(req.resp_body),
+                       node=name, call=self.procedure)
+
+    # TODO: Better error reporting
+    if req.error:
+      msg = req.error
+    else:
+      msg = req.resp_body
+
+    logging.error("RPC error in %s from node %s: %s",
+                  self.procedure, name, msg)
+    return RpcResult(data=msg, failed=True, node=name, call=self.procedure)
+
+  def GetResults(self, http_pool=None, result_fn=None, deadline=None):
     """Call nodes and return results.
 
-    @rtype: list
-    @return: List of RPC results
+    @type result_fn: callable or None
+    @param result_fn: Function called with every node's L{RpcResult} as
+        soon as the node has replied or failed
+    @type deadline: number or None
+    @param deadline: Absolute time (see C{time.time}) after which nodes
+        which haven't replied yet are reported as failed
+    @rtype: dict
+    @return: Dictionary of node name to L{RpcResult}
 
     """
     if not http_pool:
-      http_pool = _thread_local.GetHttpClientPool()
-
-    http_pool.ProcessRequests(self._request.values())
+      http_pool = _GetHttpClientPool()
 
     results = {}
 
-    for name, req in self._request.iteritems():
-      if req.success and req.resp_status_code == http.HTTP_OK:
-        results[name] = RpcResult(data=serializer.LoadJson(req.resp_body),
-                                  node=name, call=self.procedure)
-        continue
+    if result_fn is None:
+      done_fn = None
+    else:
+      req_to_name = dict((req, name)
+                         for (name, req) in self._request.iteritems())
 
-      # TODO: Better error reporting
-      if req.error:
-        msg = req.error
-      else:
-        msg = req.resp_body
+      def done_fn(req):
+        name = req_to_name[req]
+        results[name] = self._GetResult(name, req)
+        result_fn(results[name])
+
+    http_pool.ProcessRequests(self._request.values(), done_fn=done_fn,
+                              deadline=deadline)
 
-      logging.error("RPC error in %s from node %s: %s",
-                    self.procedure, name, msg)
-      results[name] = RpcResult(data=msg, failed=True, node=name,
-                                call=self.procedure)
+    for name, req in self._request.iteritems():
+      if name not in results:
+        results[name] = self._GetResult(name, req)
 
     return results
 
@@ -413,18 +483,144 @@ def _EncodeImportExportIO(ieio, ieioargs):
   return ieioargs
 
 
+class LiveDataCache(object):
+  """Cache for live data returned by nodes.
+
+  Keeps the successful results of the calls in L{_LIVE_DATA_CALLS} per node
+  and arguments for a limited time. A node's entries are discarded when a
+  call changing its memory or disk usage has been made, see
+  L{_LIVE_DATA_CHANGING_CALLS}. Results of calls started before that are not
+  stored.
+
+  """
+  def __init__(self, ttl, _time_fn=time.time):
+    """Initializes this class.
+
+    @type ttl: number
+    @param ttl: For how long (in seconds) results are kept; zero disables the
+        cache
+
+    """
+    assert ttl >= 0
+
+    self.ttl = ttl
+    self._time_fn = _time_fn
+    self._lock = threading.Lock()
+    # Node name to dictionary of (procedure, body) to (timestamp, data)
+    self._data = {}
+    # Node name to time of last invalidation
+    self._invalidated = {}
+
+  def Lookup(self, node, procedure, body, max_age):
+    """Returns a cached result.
+
+    @type node: string
+    @param node: Node name
+    @type procedure: string
+    @param procedure: Name of the remote procedure
+    @type body: string
+    @param body: Serialized arguments
+    @type max_age: number
+    @param max_age: Maximum age of the data (in seconds), limited by the
+        cache's time to live
+    @rtype: L{RpcResult} or None
+
+    """
+    max_age = min(max_age, self.ttl)
+
+    self._lock.acquire()
+    try:
+      try:
+        (timestamp, data) = self._data[node][(procedure, body)]
+      except KeyError:
+        return None
+    finally:
+      self._lock.release()
+
+    age = max(0, self._time_fn() - timestamp)
+    if age > max_age:
+      return None
+
+    # Callers may modify the payload
+    return RpcResult(data=copy.deepcopy(data), call=procedure, node=node,
+                     age=age)
+
+  def Store(self, result, body, started):
+    """Stores a result.
+
+    @type result: L{RpcResult}
+    @param result: Result of a call
+    @type body: string
+    @param body: Serialized arguments
+    @type started: number
+    @param started: When the call was started, used as the data's timestamp
+
+    """
+    if result.fail_msg or not self.ttl:
+      return
+
+    self._lock.acquire()
+    try:
+      if self._invalidated.get(result.node, 0) >= started:
+        # Node changed while the call was running
+        return
+
+      entries = self._data.setdefault(result.node, {})
+
+      # Drop expired entries
+      for (key, (timestamp, _)) in entries.items():
+        if timestamp + self.ttl < started:
+          del entries[key]
+
+      entries[(result.call, body)] = (started, copy.deepcopy(result.data))
+    finally:
+      self._lock.release()
+
+  def InvalidateNodes(self, nodes):
+    """Discards the cached data of nodes.
+
+    @type nodes: list of strings
+    @param nodes: Node names
+
+    """
+    now = self._time_fn()
+
+    self._lock.acquire()
+    try:
+      for node in nodes:
+        self._data.pop(node, None)
+        self._invalidated[node] = now
+    finally:
+      self._lock.release()
+
+  def Flush(self):
+    """Discards all cached data.
+
+    """
+    self._lock.acquire()
+    try:
+      self._data.clear()
+    finally:
+      self._lock.release()
+
+
 class RpcRunner(object):
   """RPC runner class"""
+  #: Value for C{max_age} accepting all cached live data which hasn't expired
+  LIVE_DATA_ANY_AGE = float("inf")
 
-  def __init__(self, cfg):
+  def __init__(self, cfg, live_data_cache=None):
     """Initialized the rpc runner.
 
     @type cfg:  C{config.ConfigWriter}
     @param cfg: the configuration object that will be used to get data
                 about the cluster
+    @type live_data_cache: L{LiveDataCache} or None
+    @param live_data_cache: cache for live data of nodes
 
     """
     self._cfg = cfg
+    self._live_data_cache = live_data_cache
     self.port = netutils.GetDaemonPort(constants.NODED)
 
   def _InstDict(self, instance, hvp=None, bep=None, osp=None):
@@ -521,16 +717,62 @@ class RpcRunner(object):
       addr = None
     client.ConnectNode(node, address=addr, read_timeout=read_timeout)
 
-  def _MultiNodeCall(self, node_list, procedure, args, read_timeout=None):
+  def _MultiNodeCall(self, node_list, procedure, args, read_timeout=None,
+                     result_fn=None, deadline=None, max_age=None):
     """Helper for making a multi-node call
 
+    @type result_fn: callable or None
+    @param result_fn: Function called with each node's result as soon as it
+        is available, including offline nodes' results
+    @type deadline: number or None
+    @param deadline: Absolute time after which nodes which haven't replied
+        are reported as failed
+    @type max_age: number or None
+    @param max_age: If set, results in the live data cache which are not
+        older than this (in seconds) are used instead of calling the nodes;
+        see L{RpcResult.age}
+
     """
+    cache = self._live_data_cache
     body = serializer.DumpJson(args, indent=False)
+
+    results = {}
+    if cache and max_age is not None:
+      assert procedure in _LIVE_DATA_CALLS
+      online_nodes = frozenset(self._cfg.GetOnlineNodeList())
+      query_nodes = []
+      for node in node_list:
+        if node in online_nodes:
+          result = cache.Lookup(node, procedure, body, max_age)
+          if result is not None:
+            results[node] = result
+            if result_fn:
+              result_fn(result)
+            continue
+        query_nodes.append(node)
+    else:
+      query_nodes = node_list
+
+    started = time.time()
+
     c = Client(procedure, body, self.port)
-    skip_dict = self._ConnectList(c, node_list, procedure,
+    skip_dict = self._ConnectList(c, query_nodes, procedure,
                                   read_timeout=read_timeout)
-    skip_dict.update(c.GetResults())
-    return skip_dict
+    if result_fn:
+      for result in skip_dict.values():
+        result_fn(result)
+    fresh = c.GetResults(result_fn=result_fn, deadline=deadline)
+
+    if cache:
+      if procedure in _LIVE_DATA_CALLS:
+        for result in fresh.values():
+          cache.Store(result, body, started)
+      elif procedure in _LIVE_DATA_CHANGING_CALLS:
+        cache.InvalidateNodes(node_list)
+
+    results.update(skip_dict)
+    results.update(fresh)
+    return results
 
   @classmethod
   def _StaticMultiNodeCall(cls, node_list, procedure, args,
@@ -554,6 +796,9 @@ class RpcRunner(object):
     if result is None:
       # we did connect, node is not offline
       result = c.GetResults()[node]
+      if (self._live_data_cache and
+          procedure in _LIVE_DATA_CHANGING_CALLS):
+        self._live_data_cache.InvalidateNodes([node])
     return result
 
   @classmethod
@@ -820,7 +1065,8 @@ class RpcRunner(object):
                                 [self._InstDict(instance)])
 
   @_RpcTimeout(_TMO_URGENT)
-  def call_all_instances_info(self, node_list, hypervisor_list):
+  def call_all_instances_info(self, node_list, hypervisor_list,
+                              result_fn=None, deadline=None, max_age=None):
     """Returns information about all instances on the given nodes.
 
     This is a multi-node call.
@@ -829,13 +1075,23 @@ class RpcRunner(object):
     @param node_list: the list of nodes to query
     @type hypervisor_list: list
     @param hypervisor_list: the hypervisors to query for instances
+    @type result_fn: callable or None
+    @param result_fn: called with each node's result as soon as it arrives
+    @type deadline: number or None
+    @param deadline: absolute time after which nodes which haven't replied
+        are reported as failed
+    @type max_age: number or None
+    @param max_age: if set, accept results from the live data cache which
+        are not older than this (in seconds)
 
     """
     return self._MultiNodeCall(node_list, "all_instances_info",
-                               [hypervisor_list])
+                               [hypervisor_list], result_fn=result_fn,
+                               deadline=deadline, max_age=max_age)
 
   @_RpcTimeout(_TMO_URGENT)
-  def call_instance_list(self, node_list, hypervisor_list):
+  def call_instance_list(self, node_list, hypervisor_list, result_fn=None,
+                         deadline=None):
     """Returns the list of running instances on a given node.
 
     This is a multi-node call.
@@ -844,9 +1100,15 @@ class RpcRunner(object):
     @param node_list: the list of nodes to query
     @type hypervisor_list: list
     @param hypervisor_list: the hypervisors to query for instances
+    @type result_fn: callable or None
+    @param result_fn: called with each node's result as soon as it arrives
+    @type deadline: number or None
+    @param deadline: absolute time after which nodes which haven't replied
+        are reported as failed
 
     """
-    return self._MultiNodeCall(node_list, "instance_list", [hypervisor_list])
+    return self._MultiNodeCall(node_list, "instance_list", [hypervisor_list],
+                               result_fn=result_fn, deadline=deadline)
 
   @_RpcTimeout(_TMO_FAST)
   def call_node_tcp_ping(self, node, source, target, port, timeout,
@@ -870,7 +1132,8 @@ class RpcRunner(object):
     return self._SingleNodeCall(node, "node_has_ip_address", [address])
 
   @_RpcTimeout(_TMO_URGENT)
-  def call_node_info(self, node_list, vg_name, hypervisor_type):
+  def call_node_info(self, node_list, vg_name, hypervisor_type,
+                     result_fn=None, deadline=None, max_age=None):
     """Return node information.
 
     This will return memory information and volume group size and free
@@ -886,10 +1149,20 @@ class RpcRunner(object):
     @type hypervisor_type: C{str}
     @param hypervisor_type: the name of the hypervisor to ask for
         memory information
+    @type result_fn: callable or None
+    @param result_fn: called with each node's result as soon as it arrives
+    @type deadline: number or None
+    @param deadline: absolute time after which nodes which haven't replied
+        are reported as failed
+    @type max_age: number or None
+    @param max_age: if set, accept results from the live data cache which
+        are not older than this (in seconds)
 
     """
     return self._MultiNodeCall(node_list, "node_info",
-                               [vg_name, hypervisor_type])
+                               [vg_name, hypervisor_type],
+                               result_fn=result_fn, deadline=deadline,
+                               max_age=max_age)
 
   @_RpcTimeout(_TMO_NORMAL)
   def call_etc_hosts_modify(self, node, mode, name, ip):
@@ -908,14 +1181,22 @@ class RpcRunner(object):
     return self._SingleNodeCall(node, "etc_hosts_modify", [mode, name, ip])
 
   @_RpcTimeout(_TMO_NORMAL)
-  def call_node_verify(self, node_list, checkdict, cluster_name):
+  def call_node_verify(self, node_list, checkdict, cluster_name,
+                       result_fn=None, deadline=None):
     """Request verification of given parameters.
 
     This is a multi-node call.
 
+    @type result_fn: callable or None
+    @param result_fn: called with each node's result as soon as it arrives
+    @type deadline: number or None
+    @param deadline: absolute time after which nodes which haven't replied
+        are reported as failed
+
     """
     return self._MultiNodeCall(node_list, "node_verify",
-                               [checkdict, cluster_name])
+                               [checkdict, cluster_name],
+                               result_fn=result_fn, deadline=deadline)
 
   @classmethod
   @_RpcTimeout(_TMO_FAST)
@@ -1184,6 +1465,41 @@ class RpcRunner(object):
     return cls._StaticMultiNodeCall(node_list, "upload_file", params,
                                     address_list=address_list)
 
+  @classmethod
+  @_RpcTimeout(_TMO_NORMAL)
+  def call_upload_config_delta(cls, node_list, file_name, base_serial, delta,
+                               checksum, address_list=None):
+    """Apply changes to the configuration file.
+
+    The node will refuse the operation if its copy of the configuration
+    doesn't have the serial number the changes are based on, or if the
+    result doesn't match the checksum.
+
+    This is a multi-node call.
+
+    @type node_list: list
+    @param node_list: the list of node names to upload to
+    @type file_name: str
+    @param file_name: the configuration file name
+    @type base_serial: int
+    @param base_serial: the serial number the changes are based on
+    @type delta: tuple
+    @param delta: the changes as computed by the configuration writer
+    @type checksum: str
+    @param checksum: the SHA1 checksum of the resulting file
+    @type address_list: list or None
+    @keyword address_list: an optional list of node addresses, in order
+        to optimize the RPC speed
+
+    """
+    data = cls._Compress(serializer.DumpJson(delta, indent=False))
+    st = os.stat(file_name)
+    getents = runtime.GetEnts()
+    params = [file_name, base_serial, data, checksum, st.st_mode,
+              getents.LookupUid(st.st_uid), getents.LookupGid(st.st_gid)]
+    return cls._StaticMultiNodeCall(node_list, "upload_config_delta", params,
+                                    address_list=address_list)
+
   @classmethod
   @_RpcTimeout(_TMO_NORMAL)
   def call_write_ssconf_files(cls, node_list, values):
@@ -1433,6 +1749,22 @@ class RpcRunner(object):
                                     [file_name, cls._Compress(content)],
                                     address_list=address_list)
 
+  @classmethod
+  @_RpcTimeout(_TMO_URGENT)
+  def call_jobqueue_update_multi(cls, node_list, address_list, files):
+    """Update multiple job queue files.
+
+    This is a multi-node call.
+
+    @type files: list of (string, string)
+    @param files: List of tuples containing file name and contents
+
+    """
+    return cls._StaticMultiNodeCall(node_list, "jobqueue_update_multi",
+                                    [(file_name, cls._Compress(content))
+                                     for (file_name, content) in files],
+                                    address_list=address_list)
+
   @classmethod
   @_RpcTimeout(_TMO_NORMAL)
   def call_jobqueue_purge(cls, node):
@@ -30,7 +30,6 @@ backend (currently json).
 # function and not a constant
 
 import simplejson
-import re
 
 from ganeti import errors
 from ganeti import utils
@@ -38,10 +37,45 @@ from ganeti import utils
 
 _JSON_INDENT = 2
 
-_RE_EOLSP = re.compile('[ \t]+$', re.MULTILINE)
+#: Separators for compact output, e.g. for RPC and LUXI messages
+_JSON_COMPACT_SEPARATORS = (",", ":")
 
+#: Separators for indented output; with indentation the item separator is
+#: followed by a newline, so it must not end in whitespace
+_JSON_INDENT_SEPARATORS = (",", ": ")
 
-def _GetJsonDumpers(_encoder_class=simplejson.JSONEncoder):
+
+def _HasCEncoder(module):
+  """Checks whether a JSON module's encoder is implemented in C.
+
+  """
+  encoder = getattr(module, "encoder", None)
+  return bool(getattr(encoder, "c_make_encoder", None))
+
+
+def _GetJsonEncoderClass():
+  """Returns the fastest available JSON encoder class.
+
+  simplejson is used if it has been built with its C extension. Otherwise the
+  standard library's json module (Python 2.6 and above) is used if its encoder
+  is accelerated, as it produces the same output for our data.
+
+  """
+  if _HasCEncoder(simplejson):
+    return simplejson.JSONEncoder
+
+  try:
+    import json # pylint: disable-msg=F0401
+  except ImportError:
+    return simplejson.JSONEncoder
+
+  if _HasCEncoder(json):
+    return json.JSONEncoder
+
+  return simplejson.JSONEncoder
+
+
+def _GetJsonDumpers(_encoder_class=None):
   """Returns two JSON functions to serialize data.
 
   @rtype: (callable, callable)
@@ -49,11 +83,16 @@ def _GetJsonDumpers(_encoder_class=simplejson.JSONEncoder):
            generate a more readable, indented form of JSON (if supported)
 
   """
-  plain_encoder = _encoder_class(sort_keys=True)
+  if _encoder_class is None:
+    _encoder_class = _GetJsonEncoderClass()
+
+  plain_encoder = _encoder_class(sort_keys=True,
+                                 separators=_JSON_COMPACT_SEPARATORS)
 
   # Check whether the simplejson module supports indentation
   try:
-    indent_encoder = _encoder_class(indent=_JSON_INDENT, sort_keys=True)
+    indent_encoder = _encoder_class(indent=_JSON_INDENT, sort_keys=True,
+                                    separators=_JSON_INDENT_SEPARATORS)
   except TypeError:
     # Indentation not supported
     indent_encoder = plain_encoder
@@ -67,6 +106,9 @@ def _GetJsonDumpers(_encoder_class=simplejson.JSONEncoder):
 def DumpJson(data, indent=True):
   """Serialize a given object.
 
+  Without indentation the output is as compact as possible, which should be
+  used for data sent over the network.
+
   @param data: the data to serialize
   @param indent: whether to indent output (depends on simplejson version)
 
@@ -78,11 +120,7 @@ def DumpJson(data, indent=True):
   else:
     fn = _DumpJson
 
-  txt = _RE_EOLSP.sub("", fn(data))
-  if not txt.endswith('\n'):
-    txt += '\n'
-
-  return txt
+  return fn(data) + "\n"
 
 
 def LoadJson(txt):
@@ -106,7 +144,23 @@ def DumpSignedJson(data, key, salt=None, key_selector=None):
   @return: the string representation of data signed by the hmac key
 
   """
-  txt = DumpJson(data, indent=False)
+  return SignSerialized(DumpJson(data, indent=False), key, salt=salt,
+                        key_selector=key_selector)
+
+
+def SignSerialized(txt, key, salt=None, key_selector=None):
+  """Authenticate an already serialized object.
+
+  Unlike L{DumpSignedJson}, the message doesn't need to be serialized for
+  every salt it is signed with.
+
+  @type txt: string
+  @param txt: the serialized data
+  @param key: shared hmac key
+  @param key_selector: name/id that identifies the key
+  @return: the string representation of data signed by the hmac key
+
+  """
   if salt is None:
     salt = ''
   signed_dict = {
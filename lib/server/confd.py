@@ -31,6 +31,10 @@ It uses UDP+HMAC for authentication with a global cluster key.
 
 import os
 import sys
+import errno
+import signal
+import socket
+import asyncore
 import logging
 import time
 
@@ -49,13 +53,33 @@ from ganeti import constants
 from ganeti import errors
 from ganeti import daemon
 from ganeti import netutils
+from ganeti import utils
+
+
+#: Not exported by the socket module of Python 2; value used by Linux
+SO_REUSEPORT = getattr(socket, "SO_REUSEPORT", 15)
+
+#: How often (in seconds) worker processes check whether the main process is
+#: still running
+_WORKER_PARENT_CHECK_INTERVAL = 5
+
+#: Worker processes exiting within this time (in seconds) after having been
+#: started are considered to have failed
+_WORKER_MIN_RUNTIME = 10
+
+#: Delay (in seconds) before restarting a worker after its first failure; the
+#: delay is doubled with every further failure in a row
+_WORKER_RESTART_DELAY = 1
+
+#: Maximum delay (in seconds) before restarting a failed worker
+_WORKER_MAX_RESTART_DELAY = 60
 
 
 class ConfdAsyncUDPServer(daemon.AsyncUDPSocket):
   """The confd udp server, suitable for use with asyncore.
 
   """
-  def __init__(self, bind_address, port, processor):
+  def __init__(self, bind_address, port, processor, reuse_port=False):
     """Constructor for ConfdAsyncUDPServer
 
     @type bind_address: string
@@ -64,6 +88,9 @@ class ConfdAsyncUDPServer(daemon.AsyncUDPSocket):
     @param port: udp port
     @type processor: L{confd.server.ConfdProcessor}
     @param processor: ConfdProcessor to use to handle queries
+    @type reuse_port: boolean
+    @param reuse_port: whether to share the port with other processes using
+        C{SO_REUSEPORT}; the kernel distributes the queries among them
 
     """
     family = netutils.IPAddress.GetAddressFamily(bind_address)
@@ -71,6 +98,8 @@ class ConfdAsyncUDPServer(daemon.AsyncUDPSocket):
     self.bind_address = bind_address
     self.port = port
     self.processor = processor
+    if reuse_port:
+      self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
     self.bind((bind_address, port))
     logging.debug("listening on ('%s':%d)", bind_address, port)
 
@@ -151,6 +180,7 @@ class ConfdConfigurationReloader(object):
     try:
       reloaded = self.processor.reader.Reload()
       if reloaded:
+        self._ConfigReloaded()
         logging.info("Reloaded ganeti config")
       else:
         logging.debug("Skipped double config reload")
@@ -163,6 +193,13 @@ class ConfdConfigurationReloader(object):
     # we're not it will delay it again to its base safe timeout.
     self._ResetTimer()
 
+  def _ConfigReloaded(self):
+    """Called after the configuration was reloaded.
+
+    """
+    self.processor.LogCacheStats()
+    self.processor.FlushCache()
+
   def _DisableTimer(self):
     if self.timer_handle is not None:
       self.mainloop.scheduler.cancel(self.timer_handle)
@@ -196,10 +233,14 @@ class ConfdConfigurationReloader(object):
         reloaded = True
       else:
         reloaded = self.processor.reader.Reload()
+        if reloaded:
+          self._ConfigReloaded()
     except errors.ConfigurationError:
       self.DisableConfd(silent=was_disabled)
       return
 
+    self.processor.LogCacheStats()
+
     if self.polling and reloaded:
       logging.info("Reloaded ganeti config")
     elif reloaded:
@@ -239,7 +280,175 @@ class ConfdConfigurationReloader(object):
     self._ResetTimer()
 
 
-def CheckConfd(_, args):
+class ConfdWorkers(object):
+  """Manages additional confd processes.
+
+  Every worker process answers queries on its own socket bound to the same
+  port using C{SO_REUSEPORT}, and has its own configuration reader and
+  reloader. Workers which exit are replaced; they exit by themselves if the
+  main process is gone. Workers which keep failing right after having been
+  started are restarted with an increasing delay.
+
+  """
+  def __init__(self, mainloop, options, count, _worker_fn=None,
+               _time_fn=time.time):
+    """Constructor for ConfdWorkers
+
+    @type mainloop: L{daemon.Mainloop}
+    @param mainloop: ganeti-confd mainloop
+    @param options: command line options
+    @type count: int
+    @param count: number of worker processes
+
+    """
+    self._mainloop = mainloop
+    self._options = options
+    self._count = count
+    self._time_fn = _time_fn
+
+    if _worker_fn is None:
+      self._worker_fn = _RunWorker
+    else:
+      self._worker_fn = _worker_fn
+
+    # PID -> start time
+    self._children = {}
+    self._stopping = False
+    self._failures = 0
+    self._restart_pending = False
+    mainloop.RegisterSignal(self)
+
+  def Start(self):
+    """Forks worker processes until the configured number is running.
+
+    """
+    while len(self._children) < self._count:
+      parent_pid = os.getpid()
+      pid = os.fork()
+      if pid == 0:
+        # Worker process
+        try:
+          self._worker_fn(self._options, parent_pid)
+        except Exception: # pylint: disable-msg=W0703
+          logging.exception("Error in confd worker process")
+          os._exit(1) # pylint: disable-msg=W0212
+        os._exit(0) # pylint: disable-msg=W0212
+      else:
+        self._children[pid] = self._time_fn()
+
+  def _CollectChildren(self):
+    """Removes workers which exited.
+
+    @rtype: bool
+    @return: Whether a worker failed shortly after having been started
+
+    """
+    now = self._time_fn()
+    failed = False
+
+    for (child, started) in self._children.items():
+      try:
+        (pid, _) = os.waitpid(child, os.WNOHANG)
+      except OSError, err:
+        if err.errno != errno.ECHILD:
+          raise
+        pid = child
+      if pid:
+        logging.warning("Confd worker process %s exited", child)
+        del self._children[child]
+        if now - started < _WORKER_MIN_RUNTIME:
+          failed = True
+
+    return failed
+
+  def _ScheduleRestart(self):
+    """Restarts workers after a delay growing with every failure in a row.
+
+    """
+    if self._restart_pending:
+      return
+
+    delay = min(_WORKER_MAX_RESTART_DELAY,
+                _WORKER_RESTART_DELAY * (2 ** (self._failures - 1)))
+    logging.error("Confd worker processes failed %s time(s) in a row,"
+                  " restarting them in %s seconds", self._failures, delay)
+
+    self._restart_pending = True
+    self._mainloop.scheduler.enter(delay, 1, self._DelayedStart, [])
+
+  def _DelayedStart(self):
+    """Restarts workers once the restart delay has passed.
+
+    """
+    self._restart_pending = False
+    if not self._stopping:
+      self.Start()
+
+  def OnSignal(self, signum):
+    if signum == signal.SIGCHLD:
+      running = len(self._children)
+      failed = self._CollectChildren()
+      if failed:
+        self._failures += 1
+      elif len(self._children) < running:
+        self._failures = 0
+
+      if not self._stopping and len(self._children) < self._count:
+        if self._failures:
+          self._ScheduleRestart()
+        else:
+          self.Start()
+    elif signum in (signal.SIGTERM, signal.SIGINT):
+      self._stopping = True
+      for pid in self._children:
+        utils.IgnoreProcessNotFound(os.kill, pid, signal.SIGTERM)
+
+
+def _StartServing(options, mainloop, reuse_port):
+  """Sets up query processing and configuration reloading.
+
+  """
+  processor = confd_server.ConfdProcessor()
+  try:
+    processor.Enable()
+  except errors.ConfigurationError:
+    # If enabling the processor has failed, we can still go on, but confd will
+    # be disabled
+    logging.warning("Confd is starting in disabled mode")
+
+  # Asyncronous confd UDP server, registered with asyncore
+  ConfdAsyncUDPServer(options.bind_address, options.port, processor,
+                      reuse_port=reuse_port)
+
+  # Configuration reloader, registered with the mainloop
+  ConfdConfigurationReloader(processor, mainloop)
+
+
+def _RunWorker(options, parent_pid):
+  """Main function of a worker process.
+
+  """
+  # Don't handle anything on the main process' sockets and inotify watches
+  asyncore.close_all()
+
+  mainloop = daemon.Mainloop()
+  _StartServing(options, mainloop, True)
+
+  def _CheckParent():
+    if os.getppid() != parent_pid:
+      logging.warning("Confd main process is gone, exiting")
+      os.kill(os.getpid(), signal.SIGTERM)
+    else:
+      mainloop.scheduler.enter(_WORKER_PARENT_CHECK_INTERVAL, 1,
+                               _CheckParent, [])
+
+  _CheckParent()
+
+  logging.info("Confd worker process started")
+  mainloop.Run()
+
+
+def CheckConfd(options, args):
   """Initial checks whether to run exit with a failure.
 
   """
@@ -247,6 +456,22 @@ def CheckConfd(_, args):
     print >> sys.stderr, ("Usage: %s [-f] [-d] [-b ADDRESS]" % sys.argv[0])
     sys.exit(constants.EXIT_FAILURE)
 
+  if options.workers < 1:
+    print >> sys.stderr, "At least one process must answer queries"
+    sys.exit(constants.EXIT_FAILURE)
+
+  if options.workers > 1:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+      try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+      except socket.error, err:
+        print >> sys.stderr, ("Multiple processes need SO_REUSEPORT, which is"
+                              " not supported: %s" % err)
+        sys.exit(constants.EXIT_FAILURE)
+    finally:
+      sock.close()
+
   # TODO: collapse HMAC daemons handling in daemons GenericMain, when we'll
   # have more than one.
   if not os.path.isfile(constants.CONFD_HMAC_KEY):
@@ -262,25 +487,14 @@ def PrepConfd(options, _):
   """Prep confd function, executed with PID file held
 
   """
-  # TODO: clarify how the server and reloader variables work (they are
-  # not used)
-
-  # pylint: disable-msg=W0612
   mainloop = daemon.Mainloop()
 
-  # Asyncronous confd UDP server
-  processor = confd_server.ConfdProcessor()
-  try:
-    processor.Enable()
-  except errors.ConfigurationError:
-    # If enabling the processor has failed, we can still go on, but confd will
-    # be disabled
-    logging.warning("Confd is starting in disabled mode")
-
-  server = ConfdAsyncUDPServer(options.bind_address, options.port, processor)
+  # The main process answers queries, too
+  _StartServing(options, mainloop, options.workers > 1)
 
-  # Configuration reloader
-  reloader = ConfdConfigurationReloader(processor, mainloop)
+  if options.workers > 1:
+    workers = ConfdWorkers(mainloop, options, options.workers - 1)
+    workers.Start()
 
   return mainloop
 
@@ -301,5 +515,9 @@ def Main():
                         usage="%prog [-f] [-d] [-b ADDRESS]",
                         version="%%prog (ganeti) %s" %
                         constants.RELEASE_VERSION)
+  parser.add_option("--workers", dest="workers", type="int", default=1,
+                    help=("Number of processes answering queries; with more"
+                          " than one, they share the port using"
+                          " SO_REUSEPORT (default: 1)"))
 
   daemon.GenericMain(constants.CONFD, parser, CheckConfd, PrepConfd, ExecConfd)
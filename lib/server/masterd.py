@@ -57,10 +57,14 @@ from ganeti import bootstrap
 from ganeti import netutils
 from ganeti import objects
 from ganeti import query
+from ganeti.masterd import iallocator
 
 
 CLIENT_REQUEST_WORKERS = 16
 
+#: Default time (in seconds) for which live data of nodes is cached
+LIVE_DATA_CACHE_TTL = 10
+
 EXIT_NOTMASTER = constants.EXIT_NOTMASTER
 EXIT_NODESETUP_ERROR = constants.EXIT_NODESETUP_ERROR
 
@@ -161,8 +165,8 @@ class MasterServer(daemon.AsyncStreamServer):
     # maximum number to avoid breaking for lack of file descriptors or memory.
     MasterClientHandler(self, connected_socket, client_address, self.family)
 
-  def setup_queue(self):
-    self.context = GanetiContext()
+  def setup_queue(self, live_data_ttl):
+    self.context = GanetiContext(live_data_ttl)
     self.request_workers = workerpool.WorkerPool("ClientReq",
                                                  CLIENT_REQUEST_WORKERS,
                                                  ClientRequestWorker)
@@ -233,12 +237,16 @@ class ClientOps:
       req = objects.QueryRequest.FromDict(args)
 
       if req.what in constants.QR_VIA_OP:
-        result = self._Query(opcodes.OpQuery(what=req.what, fields=req.fields,
-                                             filter=req.filter))
+        op = opcodes.OpQuery(what=req.what, fields=req.fields,
+                             filter=req.filter, limit=req.limit,
+                             cursor=req.cursor,
+                             live_data_max_age=req.live_data_max_age)
+        result = self._Query(op)
       elif req.what == constants.QR_LOCK:
         if req.filter is not None:
           raise errors.OpPrereqError("Lock queries can't be filtered")
-        return self.server.context.glm.QueryLocks(req.fields)
+        return self.server.context.glm.QueryLocks(req.fields, limit=req.limit,
+                                                  cursor=req.cursor)
       elif req.what in constants.QR_VIA_LUXI:
         raise NotImplementedError
       else:
@@ -329,6 +337,14 @@ class ClientOps:
         raise NotImplementedError("Synchronous queries are not implemented")
       return self.server.context.glm.OldStyleQueryLocks(fields)
 
+    elif method == luxi.REQ_QUERY_QUEUE_STATS:
+      logging.info("Received job queue statistics query request")
+      return queue.GetStats()
+
+    elif method == luxi.REQ_RESET_LOCK_STATS:
+      logging.info("Received lock statistics reset request")
+      return self.server.context.glm.ResetLockStats()
+
     elif method == luxi.REQ_QUEUE_SET_DRAIN_FLAG:
       drain_flag = args
       logging.info("Received queue drain flag change request to %s",
@@ -377,12 +393,15 @@ class GanetiContext(object):
   # we do want to ensure a singleton here
   _instance = None
 
-  def __init__(self):
+  def __init__(self, live_data_ttl=LIVE_DATA_CACHE_TTL):
     """Constructs a new GanetiContext object.
 
     There should be only a GanetiContext object at any time, so this
     function raises an error if this is not the case.
 
+    @type live_data_ttl: number
+    @param live_data_ttl: For how long live data of nodes is cached
+
     """
     assert self.__class__._instance is None, "double GanetiContext instance"
 
@@ -395,6 +414,9 @@ class GanetiContext(object):
                 self.cfg.GetNodeGroupList(),
                 self.cfg.GetInstanceList())
 
+    # Cache for live data of nodes
+    self.livedata = rpc.LiveDataCache(live_data_ttl)
+
     # Job queue
     self.jobqueue = jqueue.JobQueue(self)
 
@@ -428,6 +450,9 @@ class GanetiContext(object):
     # Synchronize the queue again
     self.jobqueue.AddNode(node)
 
+    # The node may have been reinstalled
+    self.livedata.InvalidateNodes([node.name])
+
   def RemoveNode(self, name):
     """Removes a node from the configuration and lock manager.
 
@@ -438,6 +463,9 @@ class GanetiContext(object):
     # Notify job queue
     self.jobqueue.RemoveNode(name)
 
+    # Forget the node's live data
+    self.livedata.InvalidateNodes([name])
+
     # Remove the node from the Ganeti Lock Manager
     self.glm.remove(locking.LEVEL_NODE, name)
 
@@ -537,6 +565,10 @@ def CheckMasterd(options, args):
     print >> sys.stderr, ("Usage: %s [-f] [-d]" % sys.argv[0])
     sys.exit(constants.EXIT_FAILURE)
 
+  if options.live_data_ttl < 0:
+    print >> sys.stderr, "The live data TTL can't be negative"
+    sys.exit(constants.EXIT_FAILURE)
+
   ssconf.CheckMaster(options.debug)
 
   try:
@@ -620,11 +652,15 @@ def ExecMasterd(options, args, prep_data): # pylint: disable-msg=W0613
   try:
     rpc.Init()
     try:
-      master.setup_queue()
+      iallocator.Init()
       try:
-        mainloop.Run()
+        master.setup_queue(options.live_data_ttl)
+        try:
+          mainloop.Run()
+        finally:
+          master.server_cleanup()
       finally:
-        master.server_cleanup()
+        iallocator.Shutdown()
     finally:
       rpc.Shutdown()
   finally:
@@ -644,5 +680,10 @@ def Main():
   parser.add_option("--yes-do-it", dest="yes_do_it",
                     help="Override interactive check for --no-voting",
                     default=False, action="store_true")
+  parser.add_option("--live-data-ttl", dest="live_data_ttl", type="int",
+                    default=LIVE_DATA_CACHE_TTL,
+                    help=("For how many seconds live data of nodes is cached,"
+                          " 0 disables the cache (default: %s)" %
+                          LIVE_DATA_CACHE_TTL))
   daemon.GenericMain(constants.MASTERD, parser, CheckMasterd, PrepMasterd,
                      ExecMasterd, multithreaded=True)
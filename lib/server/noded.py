@@ -54,6 +54,39 @@ import ganeti.http.server # pylint: disable-msg=W0611
 
 queue_lock = None
 
+#: How long (in seconds) pre-forked workers keep idle connections open
+_KEEP_ALIVE_TIMEOUT = 60
+
+#: Procedures which are handled in a separate child process even when running
+#: with pre-forked workers, either because they can take a long time or because
+#: they start other processes, daemons or otherwise modify the process state
+_ISOLATED_PROCEDURES = frozenset([
+  "accept_instance",
+  "blockdev_create",
+  "blockdev_export",
+  "blockdev_wipe",
+  "drbd_wait_sync",
+  "export_start",
+  "finalize_migration",
+  "hooks_runner",
+  "iallocator_runner",
+  "import_start",
+  "instance_migrate",
+  "instance_os_add",
+  "instance_reboot",
+  "instance_run_rename",
+  "instance_shutdown",
+  "instance_start",
+  "node_leave_cluster",
+  "node_powercycle",
+  "node_start_master",
+  "node_stop_master",
+  "os_validate",
+  "run_oob",
+  "storage_execute",
+  "test_delay",
+  ])
+
 
 def _PrepareQueueLock():
   """Try to prepare the queue lock.
@@ -131,9 +164,17 @@ class NodeHttpServer(http.server.HttpServer):
   # due to the API
   # pylint: disable-msg=R0904,W0613
   def __init__(self, *args, **kwargs):
+    self.hooks_parallel = kwargs.pop("hooks_parallel", 1)
+    self.hooks_timeout = kwargs.pop("hooks_timeout", None)
     http.server.HttpServer.__init__(self, *args, **kwargs)
     self.noded_pid = os.getpid()
 
+  def IsolateRequest(self, method, path):
+    """Returns whether a request must be handled in a separate process.
+
+    """
+    return path.lstrip("/") in _ISOLATED_PROCEDURES
+
   def HandleRequest(self, req):
     """Handle a request.
 
@@ -739,6 +780,13 @@ class NodeHttpServer(http.server.HttpServer):
     """
     return backend.UploadFile(*params)
 
+  @staticmethod
+  def perspective_upload_config_delta(params):
+    """Apply changes to the configuration file.
+
+    """
+    return backend.UploadConfigDelta(*params)
+
   @staticmethod
   def perspective_master_info(params):
     """Query master information.
@@ -794,13 +842,13 @@ class NodeHttpServer(http.server.HttpServer):
 
   # hooks -----------------------
 
-  @staticmethod
-  def perspective_hooks_runner(params):
+  def perspective_hooks_runner(self, params):
     """Run hook scripts.
 
     """
     hpath, phase, env = params
-    hr = backend.HooksRunner()
+    hr = backend.HooksRunner(max_parallel=self.hooks_parallel,
+                             timeout=self.hooks_timeout)
     return hr.RunHooks(hpath, phase, env)
 
   # iallocator -----------------
@@ -866,6 +914,15 @@ class NodeHttpServer(http.server.HttpServer):
     (file_name, content) = params
     return backend.JobQueueUpdate(file_name, content)
 
+  @staticmethod
+  @_RequireJobQueueLock
+  def perspective_jobqueue_update_multi(params):
+    """Update multiple job queue files.
+
+    """
+    return [backend.JobQueueUpdate(file_name, content)
+            for (file_name, content) in params]
+
   @staticmethod
   @_RequireJobQueueLock
   def perspective_jobqueue_purge(params):
@@ -967,7 +1024,7 @@ class NodeHttpServer(http.server.HttpServer):
     return backend.CleanupImportExport(params[0])
 
 
-def CheckNoded(_, args):
+def CheckNoded(options, args):
   """Initial checks whether to run or exit with a failure.
 
   """
@@ -975,6 +1032,12 @@ def CheckNoded(_, args):
     print >> sys.stderr, ("Usage: %s [-f] [-d] [-p port] [-b ADDRESS]" %
                           sys.argv[0])
     sys.exit(constants.EXIT_FAILURE)
+  if options.hooks_parallel < 1:
+    print >> sys.stderr, "At least one hook script must be run at a time"
+    sys.exit(constants.EXIT_FAILURE)
+  if options.hooks_timeout < 0:
+    print >> sys.stderr, "The hooks timeout can't be negative"
+    sys.exit(constants.EXIT_FAILURE)
   try:
     codecs.lookup("string-escape")
   except LookupError:
@@ -1012,10 +1075,21 @@ def PrepNoded(options, _):
     # startup of the whole node daemon because of this
     logging.critical("Can't init/verify the queue, proceeding anyway: %s", err)
 
+  if options.workers:
+    num_workers = options.workers
+    keep_alive_timeout = _KEEP_ALIVE_TIMEOUT
+  else:
+    num_workers = None
+    keep_alive_timeout = None
+
   mainloop = daemon.Mainloop()
   server = NodeHttpServer(mainloop, options.bind_address, options.port,
                           ssl_params=ssl_params, ssl_verify_peer=True,
-                          request_executor_class=request_executor_class)
+                          request_executor_class=request_executor_class,
+                          num_workers=num_workers,
+                          keep_alive_timeout=keep_alive_timeout,
+                          hooks_parallel=options.hooks_parallel,
+                          hooks_timeout=(options.hooks_timeout or None))
   server.Start()
   return (mainloop, server)
 
@@ -1042,6 +1116,18 @@ def Main():
   parser.add_option("--no-mlock", dest="mlock",
                     help="Do not mlock the node memory in ram",
                     default=True, action="store_false")
+  parser.add_option("--workers", dest="workers", type="int", default=0,
+                    help=("Number of long-lived worker processes handling"
+                          " requests over persistent connections (default:"
+                          " fork a new process for every connection)"))
+  parser.add_option("--hooks-parallel", dest="hooks_parallel", type="int",
+                    default=1,
+                    help=("Number of hook scripts run at the same time per"
+                          " hooks directory (default: 1)"))
+  parser.add_option("--hooks-timeout", dest="hooks_timeout", type="int",
+                    default=0,
+                    help=("Timeout in seconds after which a hook script is"
+                          " killed and reported as failed (default: none)"))
 
   daemon.GenericMain(constants.NODED, parser, CheckNoded, PrepNoded, ExecNoded,
                      default_ssl_cert=constants.NODED_CERT_FILE,
@@ -44,9 +44,89 @@ SSCONF_LOCK_TIMEOUT = 10
 RE_VALID_SSCONF_NAME = re.compile(r'^[-_a-z0-9]+$')
 
 
+class _NicIndex(object):
+  """Index of instance NIC IP addresses by link.
+
+  The index is updated incrementally: only instances whose NICs changed
+  since the last update are indexed again, and the lookup tables are only
+  rebuilt if anything changed.
+
+  @ivar ip_to_inst_by_link: dict of link to dict of IP address to instance
+      name
+  @ivar ips_by_link: dict of link to list of IP addresses
+
+  """
+  def __init__(self):
+    """Initializes this class.
+
+    """
+    self._default_nicparams = None
+    # Instance name -> (NICs as found in the configuration, tuple of
+    # (link, IP address))
+    self._instances = {}
+    self.ip_to_inst_by_link = {}
+    self.ips_by_link = {}
+
+  @staticmethod
+  def _GetAddresses(default_nicparams, nics):
+    """Returns the link and IP address of every NIC having an address.
+
+    """
+    return tuple((objects.FillDict(default_nicparams,
+                                   nic["nicparams"])[constants.NIC_LINK],
+                  nic["ip"])
+                 for nic in nics if nic.get("ip"))
+
+  def Update(self, default_nicparams, instances):
+    """Updates the index.
+
+    @type default_nicparams: dict
+    @param default_nicparams: cluster-wide default NIC parameters
+    @type instances: dict
+    @param instances: serialized instances from the configuration
+    @rtype: int
+    @return: number of instances which were indexed again
+
+    """
+    if default_nicparams != self._default_nicparams:
+      # Links of all NICs may have changed
+      self._default_nicparams = default_nicparams
+      self._instances = {}
+
+    old = self._instances
+    new = {}
+    reindexed = 0
+
+    for (name, instance) in instances.iteritems():
+      nics = instance["nics"]
+      entry = old.get(name, None)
+      if entry is None or entry[0] != nics:
+        entry = (nics, self._GetAddresses(default_nicparams, nics))
+        reindexed += 1
+      new[name] = entry
+
+    self._instances = new
+
+    if reindexed or len(new) != len(old):
+      ip_to_inst_by_link = {}
+      ips_by_link = {}
+      for (name, (_, addresses)) in new.iteritems():
+        for (link, ip) in addresses:
+          ip_to_inst_by_link.setdefault(link, {})[ip] = name
+          ips_by_link.setdefault(link, []).append(ip)
+      self.ip_to_inst_by_link = ip_to_inst_by_link
+      self.ips_by_link = ips_by_link
+
+    return reindexed
+
+
 class SimpleConfigReader(object):
   """Simple class to read configuration file.
 
+  Indexes over the configuration are built when they're first used after a
+  (re)load; the index of instance IP addresses is only updated for instances
+  whose NICs changed.
+
   """
   def __init__(self, file_name=constants.CLUSTER_CONF_FILE):
     """Initializes this class.
@@ -61,11 +141,9 @@ class SimpleConfigReader(object):
     self._last_size = None
 
     self._config_data = None
-    self._inst_ips_by_link = None
-    self._ip_to_inst_by_link = None
-    self._instances_ips = None
-    self._mc_primary_ips = None
-    self._nodes_primary_ips = None
+    self._nic_index = _NicIndex()
+    self._nic_index_stale = True
+    self._node_ips = None
 
     # we need a forced reload at class init time, to initialize _last_*
     self._Load(force=True)
@@ -100,7 +178,7 @@ class SimpleConfigReader(object):
       return False
 
     try:
-      self._config_data = serializer.Load(utils.ReadFile(self._file_name))
+      config_data = serializer.Load(utils.ReadFile(self._file_name))
     except EnvironmentError, err:
       raise errors.ConfigurationError("Cannot read config file %s: %s" %
                                       (self._file_name, err))
@@ -108,31 +186,49 @@ class SimpleConfigReader(object):
       raise errors.ConfigurationError("Cannot load config file %s: %s" %
                                       (self._file_name, err))
 
-    self._ip_to_inst_by_link = {}
-    self._instances_ips = []
-    self._inst_ips_by_link = {}
-    c_nparams = self._config_data['cluster']['nicparams'][constants.PP_DEFAULT]
-    for iname in self._config_data['instances']:
-      instance = self._config_data['instances'][iname]
-      for nic in instance['nics']:
-        if 'ip' in nic and nic['ip']:
-          params = objects.FillDict(c_nparams, nic['nicparams'])
-          if not params['link'] in self._inst_ips_by_link:
-            self._inst_ips_by_link[params['link']] = []
-            self._ip_to_inst_by_link[params['link']] = {}
-          self._ip_to_inst_by_link[params['link']][nic['ip']] = iname
-          self._inst_ips_by_link[params['link']].append(nic['ip'])
-
-    self._nodes_primary_ips = []
-    self._mc_primary_ips = []
-    for node_name in self._config_data["nodes"]:
-      node = self._config_data["nodes"][node_name]
-      self._nodes_primary_ips.append(node["primary_ip"])
-      if node["master_candidate"]:
-        self._mc_primary_ips.append(node["primary_ip"])
+    if not (isinstance(config_data, dict) and
+            isinstance(config_data.get("cluster"), dict) and
+            isinstance(config_data.get("nodes"), dict) and
+            isinstance(config_data.get("instances"), dict)):
+      raise errors.ConfigurationError("Invalid data in config file %s" %
+                                      self._file_name)
+
+    self._config_data = config_data
+
+    # Indexes are updated on their next use
+    self._nic_index_stale = True
+    self._node_ips = None
 
     return True
 
+  def _GetNicIndex(self):
+    """Returns the up-to-date index of instance IP addresses.
+
+    @rtype: L{_NicIndex}
+
+    """
+    if self._nic_index_stale:
+      self._nic_index.Update(self.GetDefaultNicParams(),
+                             self._config_data["instances"])
+      self._nic_index_stale = False
+    return self._nic_index
+
+  def _GetNodeIps(self):
+    """Returns the primary IP addresses of all nodes and master candidates.
+
+    @rtype: tuple; (list, list)
+
+    """
+    if self._node_ips is None:
+      nodes_primary_ips = []
+      mc_primary_ips = []
+      for node in self._config_data["nodes"].values():
+        nodes_primary_ips.append(node["primary_ip"])
+        if node["master_candidate"]:
+          mc_primary_ips.append(node["primary_ip"])
+      self._node_ips = (nodes_primary_ips, mc_primary_ips)
+    return self._node_ips
+
   # Clients can request a reload of the config file, so we export our internal
   # _Load function as Reload.
   Reload = _Load
@@ -203,11 +299,7 @@ class SimpleConfigReader(object):
     """
     if not link:
       link = self.GetDefaultNicLink()
-    if not link in self._ip_to_inst_by_link:
-      return None
-    if not ip in self._ip_to_inst_by_link[link]:
-      return None
-    return self._ip_to_inst_by_link[link][ip]
+    return self._GetNicIndex().ip_to_inst_by_link.get(link, {}).get(ip, None)
 
   def GetNodePrimaryIp(self, node):
     """Get a node's primary ip
@@ -236,10 +328,10 @@ class SimpleConfigReader(object):
     return self._config_data["instances"][instance]["primary_node"]
 
   def GetNodesPrimaryIps(self):
-    return self._nodes_primary_ips
+    return self._GetNodeIps()[0]
 
   def GetMasterCandidatesPrimaryIps(self):
-    return self._mc_primary_ips
+    return self._GetNodeIps()[1]
 
   def GetInstancesIps(self, link):
     """Get list of nic ips connected to a certain link.
@@ -253,10 +345,7 @@ class SimpleConfigReader(object):
     if not link:
       link = self.GetDefaultNicLink()
 
-    if link in self._inst_ips_by_link:
-      return self._inst_ips_by_link[link]
-    else:
-      return []
+    return self._GetNicIndex().ips_by_link.get(link, [])
 
 
 class SimpleStore(object):
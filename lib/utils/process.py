@@ -31,6 +31,8 @@ import select
 import logging
 import signal
 import resource
+import threading
+import time
 
 from cStringIO import StringIO
 
@@ -78,15 +80,21 @@ class RunResult(object):
   @ivar failed: True in case the program was
       terminated by a signal or exited with a non-zero exit code
   @ivar fail_reason: a string detailing the termination reason
+  @type timed_out: boolean
+  @ivar timed_out: whether the program was terminated after a timeout
+  @type duration: float or None
+  @ivar duration: how long the program ran (seconds), if known
 
   """
   __slots__ = ["exit_code", "signal", "stdout", "stderr",
-               "failed", "fail_reason", "cmd"]
+               "failed", "fail_reason", "cmd", "timed_out", "duration"]
 
 
   def __init__(self, exit_code, signal_, stdout, stderr, cmd, timeout_action,
-               timeout):
+               timeout, duration=None):
     self.cmd = cmd
+    self.timed_out = (timeout_action != _TIMEOUT_NONE)
+    self.duration = duration
     self.exit_code = exit_code
     self.signal = signal_
     self.stdout = stdout
@@ -198,6 +206,7 @@ def RunCmd(cmd, env=None, output=None, cwd="/", reset_env=False,
 
   cmd_env = _BuildCmdEnvironment(env, reset_env)
 
+  start = time.time()
   try:
     if output is None:
       out, err, status, timeout_action = _RunCmdPipe(cmd, cmd_env, shell, cwd,
@@ -224,7 +233,8 @@ def RunCmd(cmd, env=None, output=None, cwd="/", reset_env=False,
     exitcode = None
     signal_ = -status
 
-  return RunResult(exitcode, signal_, out, err, strcmd, timeout_action, timeout)
+  return RunResult(exitcode, signal_, out, err, strcmd, timeout_action, timeout,
+                   duration=(time.time() - start))
 
 
 def SetupDaemonEnv(cwd="/", umask=077):
@@ -662,7 +672,8 @@ def _RunCmdFile(cmd, env, via_shell, output, cwd, noclose_fds):
   return status
 
 
-def RunParts(dir_name, env=None, reset_env=False):
+def RunParts(dir_name, env=None, reset_env=False, timeout=None,
+             max_parallel=1):
   """Run Scripts or programs in a directory
 
   @type dir_name: string
@@ -671,6 +682,12 @@ def RunParts(dir_name, env=None, reset_env=False):
   @param env: The environment to use
   @type reset_env: boolean
   @param reset_env: whether to reset or keep the default os environment
+  @type timeout: int or None
+  @param timeout: if not None, timeout in seconds after which each script
+      gets killed (see L{RunCmd})
+  @type max_parallel: int
+  @param max_parallel: how many scripts may run at the same time; the
+      results are still returned in the order the scripts are sorted
   @rtype: list of tuples
   @return: list of (name, (one of RUNDIR_STATUS), RunResult)
 
@@ -683,18 +700,50 @@ def RunParts(dir_name, env=None, reset_env=False):
     logging.warning("RunParts: skipping %s (cannot list: %s)", dir_name, err)
     return rr
 
+  def _RunScript(idx):
+    (relname, fname) = rr[idx]
+    try:
+      result = RunCmd([fname], env=env, reset_env=reset_env, timeout=timeout)
+    except Exception, err: # pylint: disable-msg=W0703
+      rr[idx] = (relname, constants.RUNPARTS_ERR, str(err))
+    else:
+      rr[idx] = (relname, constants.RUNPARTS_RUN, result)
+
+  torun = []
+
   for relname in sorted(dir_contents):
     fname = utils_io.PathJoin(dir_name, relname)
     if not (os.path.isfile(fname) and os.access(fname, os.X_OK) and
             constants.EXT_PLUGIN_MASK.match(relname) is not None):
       rr.append((relname, constants.RUNPARTS_SKIP, None))
     else:
-      try:
-        result = RunCmd([fname], env=env, reset_env=reset_env)
-      except Exception, err: # pylint: disable-msg=W0703
-        rr.append((relname, constants.RUNPARTS_ERR, str(err)))
-      else:
-        rr.append((relname, constants.RUNPARTS_RUN, result))
+      # Replaced with the result by _RunScript
+      torun.append(len(rr))
+      rr.append((relname, fname))
+
+  if max_parallel > 1 and len(torun) > 1:
+    lock = threading.Lock()
+
+    def _Worker():
+      while True:
+        lock.acquire()
+        try:
+          if not torun:
+            return
+          idx = torun.pop(0)
+        finally:
+          lock.release()
+        _RunScript(idx)
+
+    threads = [threading.Thread(target=_Worker)
+               for _ in range(min(max_parallel, len(torun)))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+  else:
+    for idx in torun:
+      _RunScript(idx)
 
   return rr
 
@@ -69,6 +69,15 @@ ERROR = 'ERROR'
 KEY_RESTART_COUNT = "restart_count"
 KEY_RESTART_WHEN = "restart_when"
 KEY_BOOT_ID = "bootid"
+KEY_RESULT_OP = "op"
+KEY_RESULT_JOB = "job_id"
+KEY_RESULT_STATUS = "status"
+KEY_RESULT_MESSAGE = "message"
+KEY_RESULT_WHEN = "when"
+#: Default number of jobs run at the same time on each node
+JOBS_PER_NODE = 4
+#: Interval between checks for finished jobs
+JOB_POLL_INTERVAL = 1.0
 
 
 # Global LUXI client object
@@ -265,6 +274,8 @@ class WatcherState(object):
       self._data["instance"] = {}
     if "node" not in self._data:
       self._data["node"] = {}
+    if "result" not in self._data:
+      self._data["result"] = {}
 
     self._orig_data = serializer.Dump(self._data)
 
@@ -356,6 +367,47 @@ class WatcherState(object):
       logging.debug("Expiring record for instance %s", inst)
       del idict[inst]
 
+    # Last, the same for job results
+    rdict = self._data["result"]
+    for inst in set(rdict).difference(instances):
+      del rdict[inst]
+    for inst in [i for i in rdict if rdict[i][KEY_RESULT_WHEN] < earliest]:
+      del rdict[inst]
+
+  def GetJobResult(self, instance):
+    """Returns the result of the last job run for an instance or None.
+
+    @type instance: L{Instance}
+    @param instance: the instance to look up
+    @rtype: dict or None
+    @return: the operation, job ID, final job status, message and time
+
+    """
+    return self._data["result"].get(instance.name, None)
+
+  def RecordJobResult(self, instance, op_name, job_id, status, message):
+    """Record the result of a job run for an instance.
+
+    @type instance: L{Instance}
+    @param instance: the instance the job was run for
+    @type op_name: string
+    @param op_name: description of the operation
+    @type job_id: string or None
+    @param job_id: job ID, None if the job couldn't be submitted
+    @type status: string
+    @param status: final job status (one of L{constants.JOBS_FINALIZED})
+    @type message: string or None
+    @param message: error message if the job didn't succeed
+
+    """
+    self._data["result"][instance.name] = {
+      KEY_RESULT_OP: op_name,
+      KEY_RESULT_JOB: job_id,
+      KEY_RESULT_STATUS: status,
+      KEY_RESULT_MESSAGE: message,
+      KEY_RESULT_WHEN: time.time(),
+      }
+
   def RecordRestartAttempt(self, instance):
     """Record a restart attempt.
 
@@ -393,32 +445,139 @@ class Instance(object):
   """Abstraction for a Virtual Machine instance.
 
   """
-  def __init__(self, name, state, autostart, snodes):
+  def __init__(self, name, state, autostart, pnode, snodes):
     self.name = name
     self.state = state
     self.autostart = autostart
+    self.pnode = pnode
     self.snodes = snodes
 
-  def Restart(self):
+  def GetNodes(self):
+    """Returns the primary and secondary nodes of the instance.
+
+    """
+    return [self.pnode] + self.snodes
+
+  def GetRestartOp(self):
     """Encapsulates the start of an instance.
 
     """
-    op = opcodes.OpInstanceStartup(instance_name=self.name, force=False)
-    cli.SubmitOpCode(op, cl=client)
+    return opcodes.OpInstanceStartup(instance_name=self.name, force=False)
 
-  def ActivateDisks(self):
+  def GetActivateDisksOp(self):
     """Encapsulates the activation of all disks of an instance.
 
     """
-    op = opcodes.OpInstanceActivateDisks(instance_name=self.name)
-    cli.SubmitOpCode(op, cl=client)
+    return opcodes.OpInstanceActivateDisks(instance_name=self.name)
+
+
+def _GetJobError(opresult):
+  """Extracts the error message from the opcode results of a failed job.
+
+  """
+  for result in reversed(opresult or []):
+    error = errors.GetEncodedError(result)
+    if error:
+      (errcls, args) = error
+      return cli.FormatError(errcls(*args))[1]
+  return "Unknown error"
+
+
+def RunInstanceJobs(cl, jobs, jobs_per_node, _sleep_fn=time.sleep):
+  """Runs independent jobs for instances, limiting the jobs per node.
+
+  All jobs which can be started without exceeding the limit on any of the
+  instance's nodes are submitted at once, using L{luxi.Client.SubmitManyJobs},
+  and the running jobs are polled together. Whenever jobs finish, the next
+  jobs are submitted.
+
+  @type cl: L{luxi.Client}
+  @param cl: the LUXI client
+  @type jobs: list of tuples; (L{Instance}, L{opcodes.OpCode})
+  @param jobs: the jobs to run, one opcode per instance
+  @type jobs_per_node: int
+  @param jobs_per_node: maximum number of jobs running for the instances of a
+      node at the same time
+  @rtype: dict
+  @return: instance name as key, (job ID, final job status, error message or
+      None) as value; the job ID is None if the job couldn't be submitted
+
+  """
+  assert jobs_per_node > 0
+
+  pending = list(jobs)
+  # Job ID to instance
+  running = {}
+  # Node name to number of running jobs
+  node_jobs = {}
+  results = {}
+
+  def _Release(instance):
+    for node in instance.GetNodes():
+      node_jobs[node] -= 1
+
+  while pending or running:
+    submit = []
+    waiting = []
+    for (instance, op) in pending:
+      nodes = instance.GetNodes()
+      if compat.all(node_jobs.get(node, 0) < jobs_per_node for node in nodes):
+        for node in nodes:
+          node_jobs[node] = node_jobs.get(node, 0) + 1
+        submit.append((instance, op))
+      else:
+        waiting.append((instance, op))
+    pending = waiting
+
+    if submit:
+      submitted = cl.SubmitManyJobs([[op] for (_, op) in submit])
+      for ((instance, _), (success, data)) in zip(submit, submitted):
+        if success:
+          logging.debug("Submitted job %s for instance %s", data,
+                        instance.name)
+          running[data] = instance
+        else:
+          results[instance.name] = (None, constants.JOB_STATUS_ERROR,
+                                    "Can't submit job: %s" % data)
+          _Release(instance)
+
+    if not running:
+      continue
+
+    job_ids = running.keys()
+    finished = False
+    for (job_id, job_data) in zip(job_ids,
+                                  cl.QueryJobs(job_ids,
+                                               ["status", "opresult"])):
+      if job_data is None:
+        (status, message) = (constants.JOB_STATUS_ERROR, "Job was lost")
+      else:
+        (status, opresult) = job_data
+        if status not in constants.JOBS_FINALIZED:
+          continue
+        elif status == constants.JOB_STATUS_SUCCESS:
+          message = None
+        elif status == constants.JOB_STATUS_CANCELED:
+          message = "Job was canceled"
+        else:
+          message = _GetJobError(opresult)
+
+      instance = running.pop(job_id)
+      results[instance.name] = (job_id, status, message)
+      _Release(instance)
+      finished = True
+
+    if not finished:
+      _sleep_fn(JOB_POLL_INTERVAL)
+
+  return results
 
 
 def GetClusterData():
   """Get a list of instances on this cluster.
 
   """
-  op1_fields = ["name", "status", "admin_state", "snodes"]
+  op1_fields = ["name", "status", "admin_state", "pnode", "snodes"]
   op1 = opcodes.OpInstanceQuery(output_fields=op1_fields, names=[],
                                 use_locking=True)
   op2_fields = ["name", "bootid", "offline"]
@@ -441,7 +600,7 @@ def GetClusterData():
   utils.WriteFile(file_name=constants.INSTANCE_UPFILE, data=up_data)
 
   for fields in result:
-    (name, status, autostart, snodes) = fields
+    (name, status, autostart, pnode, snodes) = fields
 
     # update the secondary node map
     for node in snodes:
@@ -449,7 +608,7 @@ def GetClusterData():
         smap[node] = []
       smap[node].append(name)
 
-    instances[name] = Instance(name, status, autostart, snodes)
+    instances[name] = Instance(name, status, autostart, pnode, snodes)
 
   nodes =  dict([(name, (bootid, offline))
                  for name, bootid, offline in all_results[1]])
@@ -488,6 +647,33 @@ class Watcher(object):
     self.CheckDisks(notepad)
     self.VerifyDisks()
 
+  def _RunJobs(self, notepad, op_name, jobs):
+    """Runs jobs for instances and records their results.
+
+    @type op_name: string
+    @param op_name: description of the operation, used for logging
+    @type jobs: list of tuples; (L{Instance}, L{opcodes.OpCode})
+    @param jobs: the jobs to run
+    @rtype: list of L{Instance}
+    @return: the instances whose jobs succeeded
+
+    """
+    results = RunInstanceJobs(client, jobs, self.opts.jobs_per_node)
+
+    succeeded = []
+    for (instance, _) in jobs:
+      (job_id, status, message) = results[instance.name]
+      if status == constants.JOB_STATUS_SUCCESS:
+        logging.debug("Job %s (%s of instance %s) succeeded", job_id,
+                      op_name, instance.name)
+        succeeded.append(instance)
+      else:
+        logging.error("Error during %s of instance %s (job %s): %s",
+                      op_name, instance.name, job_id, message)
+      notepad.RecordJobResult(instance, op_name, job_id, status, message)
+
+    return succeeded
+
   @staticmethod
   def ArchiveJobs(age):
     """Archive old jobs.
@@ -516,6 +702,7 @@ class Watcher(object):
     if check_nodes:
       # Activate disks for all instances with any of the checked nodes as a
       # secondary node.
+      activate = []
       for node in check_nodes:
         if node not in self.smap:
           continue
@@ -531,12 +718,18 @@ class Watcher(object):
             logging.debug("Skipping disk activation for instance %s, as"
                           " it was already started", instance.name)
             continue
-          try:
-            logging.info("Activating disks for instance %s", instance.name)
-            instance.ActivateDisks()
-          except Exception: # pylint: disable-msg=W0703
-            logging.exception("Error while activating disks for instance %s",
-                              instance.name)
+          if instance in activate:
+            continue
+          logging.info("Activating disks for instance %s", instance.name)
+          activate.append(instance)
+
+      if activate:
+        try:
+          self._RunJobs(notepad, "disk activation",
+                        [(instance, instance.GetActivateDisksOp())
+                         for instance in activate])
+        except Exception: # pylint: disable-msg=W0703
+          logging.exception("Error while activating disks")
 
       # Keep changed boot IDs
       for name in check_nodes:
@@ -548,6 +741,7 @@ class Watcher(object):
     """
     notepad.MaintainInstanceList(self.instances.keys())
 
+    restart = []
     for instance in self.instances.values():
       if instance.state in BAD_STATES:
         n = notepad.NumberOfRestartAttempts(instance)
@@ -563,14 +757,8 @@ class Watcher(object):
           logging.error("Could not restart %s after %d attempts, giving up",
                         instance.name, MAXTRIES)
           continue
-        try:
-          logging.info("Restarting %s%s", instance.name, last)
-          instance.Restart()
-          self.started_instances.add(instance.name)
-        except Exception: # pylint: disable-msg=W0703
-          logging.exception("Error while restarting instance %s",
-                            instance.name)
-
+        logging.info("Restarting %s%s", instance.name, last)
+        restart.append(instance)
         notepad.RecordRestartAttempt(instance)
       elif instance.state in HELPLESS_STATES:
         if notepad.NumberOfRestartAttempts(instance):
@@ -580,6 +768,16 @@ class Watcher(object):
           notepad.RemoveInstance(instance)
           logging.info("Restart of %s succeeded", instance.name)
 
+    if restart:
+      try:
+        started = self._RunJobs(notepad, "restart",
+                                [(instance, instance.GetRestartOp())
+                                 for instance in restart])
+      except Exception: # pylint: disable-msg=W0703
+        logging.exception("Error while restarting instances")
+      else:
+        self.started_instances.update(instance.name for instance in started)
+
   def _CheckForOfflineNodes(self, instance):
     """Checks if given instances has any secondary in offline status.
 
@@ -700,11 +898,18 @@ def ParseOptions():
                           " 6 hours)")
   parser.add_option("--ignore-pause", dest="ignore_pause", default=False,
                     action="store_true", help="Ignore cluster pause setting")
+  parser.add_option("--jobs-per-node", dest="jobs_per_node", type="int",
+                    default=JOBS_PER_NODE,
+                    help=("Maximum number of instance restarts or disk"
+                          " activations run at the same time on each node"
+                          " (default %s)" % JOBS_PER_NODE))
   options, args = parser.parse_args()
   options.job_age = cli.ParseTimespec(options.job_age)
 
   if args:
     parser.error("No arguments expected")
+  if options.jobs_per_node < 1:
+    parser.error("Number of jobs per node must be at least 1")
 
   return (options, args)
 
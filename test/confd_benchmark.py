@@ -0,0 +1,319 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Load generator for the configuration daemon.
+
+Starts confd query processing on a generated configuration, either in one
+process or in several processes sharing the port using SO_REUSEPORT (as
+ganeti-confd started with "--workers"), and sends queries of every type from
+a number of client processes using L{confd.client.ConfdClient}. Requests per
+second and latencies are reported for each query type.
+
+The kernel distributes queries among the server processes by the clients'
+addresses, so there should be more clients than server processes.
+
+"""
+
+# pylint: disable-msg=C0103
+# C0103: Invalid name confd_benchmark
+
+import os
+import sys
+import time
+import signal
+import socket
+import shutil
+import optparse
+import tempfile
+
+from ganeti import constants
+from ganeti import daemon
+from ganeti import serializer
+from ganeti import ssconf
+from ganeti import utils
+from ganeti.confd import client as confd_client
+from ganeti.confd import server as confd_server
+from ganeti.server import confd as confd_daemon
+
+import serializer_benchmark
+
+
+_HMAC_KEY = "confd benchmark key"
+
+
+def _MakeConfig(num_nodes, num_instances):
+  """Generates a configuration with an IP address for every instance.
+
+  """
+  data = serializer_benchmark._MakeConfig(num_nodes, # pylint: disable-msg=W0212
+                                          num_instances)
+  for (idx, name) in enumerate(sorted(data["instances"])):
+    data["instances"][name]["nics"][0]["ip"] = _InstanceIp(idx)
+  return data
+
+
+def _InstanceIp(idx):
+  """Returns the IP address of an instance.
+
+  """
+  return "198.18.%d.%d" % (idx / 256, idx % 256)
+
+
+def _GetQueries(options):
+  """Returns the benchmarked query types.
+
+  @return: list of (title, request type, function returning the query for
+      the n-th request)
+
+  """
+  return [
+    ("ping", constants.CONFD_REQ_PING, lambda _: None),
+    ("node-role", constants.CONFD_REQ_NODE_ROLE_BYNAME,
+     lambda n: "node%d.example.com" % (n % options.nodes)),
+    ("node-pip-by-inst-ip", constants.CONFD_REQ_NODE_PIP_BY_INSTANCE_IP,
+     lambda n: { constants.CONFD_REQQ_IP:
+                   _InstanceIp(n % options.instances), }),
+    ("cluster-master", constants.CONFD_REQ_CLUSTER_MASTER,
+     lambda _: { constants.CONFD_REQQ_FIELDS:
+                   [constants.CONFD_REQFIELD_NAME,
+                    constants.CONFD_REQFIELD_IP], }),
+    ("node-pip-list", constants.CONFD_REQ_NODE_PIP_LIST, lambda _: None),
+    ("mc-pip-list", constants.CONFD_REQ_MC_PIP_LIST, lambda _: None),
+    ("instances-ips-list", constants.CONFD_REQ_INSTANCES_IPS_LIST,
+     lambda _: None),
+    ("batch", constants.CONFD_REQ_BATCH,
+     lambda n: [[constants.CONFD_REQ_NODE_ROLE_BYNAME,
+                 "node%d.example.com" % (n % options.nodes)],
+                [constants.CONFD_REQ_NODE_PIP_BY_INSTANCE_IP,
+                 { constants.CONFD_REQQ_IP:
+                     _InstanceIp(n % options.instances), }],
+                [constants.CONFD_REQ_CLUSTER_MASTER, None]]),
+    ]
+
+
+def _RunServer(port, cfg_file, reuse_port):
+  """Runs one server process, never returns.
+
+  """
+  try:
+    mainloop = daemon.Mainloop()
+    processor = confd_server.ConfdProcessor(hmac_key=_HMAC_KEY)
+    processor.reader = ssconf.SimpleConfigReader(file_name=cfg_file)
+    processor.disabled = False
+    confd_daemon.ConfdAsyncUDPServer("127.0.0.1", port, processor,
+                                     reuse_port=reuse_port)
+    mainloop.Run()
+  finally:
+    os._exit(0) # pylint: disable-msg=W0212
+
+
+def _StartServers(count, port, cfg_file):
+  """Starts server processes.
+
+  @rtype: list
+  @return: process IDs
+
+  """
+  pids = []
+  for _ in range(count):
+    pid = os.fork()
+    if pid == 0:
+      _RunServer(port, cfg_file, count > 1)
+    pids.append(pid)
+  return pids
+
+
+def _StopServers(pids):
+  """Stops server processes.
+
+  """
+  for pid in pids:
+    utils.IgnoreProcessNotFound(os.kill, pid, signal.SIGTERM)
+  for pid in pids:
+    os.waitpid(pid, 0)
+
+
+def _GetFreePort():
+  """Returns a currently unused UDP port.
+
+  """
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+  finally:
+    sock.close()
+
+
+def _Query(client, req_type, query, timeout=5):
+  """Sends one query and waits for its reply.
+
+  @rtype: bool
+  @return: whether a reply was received
+
+  """
+  req = confd_client.ConfdClientRequest(type=req_type, query=query)
+  client.SendRequest(req, async=False)
+  (timed_out, _, _) = client.WaitForReply(req.rsalt, timeout=timeout)
+  return not timed_out
+
+
+def _WaitForServer(port):
+  """Waits until the server answers queries.
+
+  """
+  client = confd_client.ConfdClient(_HMAC_KEY, ["127.0.0.1"],
+                                    lambda _: None, port=port)
+  for _ in range(20):
+    if _Query(client, constants.CONFD_REQ_PING, None, timeout=0.5):
+      return
+
+  raise Exception("Server didn't start")
+
+
+def _RunClient(port, req_type, query_fn, offset, count, wfd):
+  """Runs one client process and writes its latencies to a pipe.
+
+  """
+  try:
+    client = confd_client.ConfdClient(_HMAC_KEY, ["127.0.0.1"],
+                                      lambda _: None, port=port)
+    durations = []
+    failed = 0
+    for n in range(offset, offset + count):
+      start = time.time()
+      if _Query(client, req_type, query_fn(n)):
+        durations.append(time.time() - start)
+      else:
+        failed += 1
+    os.write(wfd, serializer.DumpJson((durations, failed), indent=False))
+  finally:
+    os._exit(0) # pylint: disable-msg=W0212
+
+
+def _Benchmark(title, req_type, query_fn, options, port):
+  """Sends one type of query from all clients and prints the results.
+
+  """
+  clients = []
+  start = time.time()
+  for idx in range(options.clients):
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      os.close(rfd)
+      _RunClient(port, req_type, query_fn, idx * options.requests,
+                 options.requests, wfd)
+    os.close(wfd)
+    clients.append((pid, rfd))
+
+  durations = []
+  failed = 0
+  for (pid, rfd) in clients:
+    data = []
+    while True:
+      buf = os.read(rfd, 4096)
+      if not buf:
+        break
+      data.append(buf)
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    (client_durations, client_failed) = serializer.LoadJson("".join(data))
+    durations.extend(client_durations)
+    failed += client_failed
+  total = time.time() - start
+
+  if not durations:
+    raise Exception("No replies received for %s" % title)
+
+  durations.sort()
+  print ("  %-20s %8.0f req/s   %6.2f ms median   %6.2f ms 99%%   %6.2f ms"
+         " max   %d lost" %
+         (title, len(durations) / total, durations[len(durations) / 2] * 1000,
+          durations[int(len(durations) * 0.99)] * 1000, durations[-1] * 1000,
+          failed))
+
+
+def ParseOptions():
+  """Parses the command line options.
+
+  """
+  parser = optparse.OptionParser(usage="%prog [options]")
+  parser.add_option("--nodes", dest="nodes", type="int", default=100,
+                    help="Number of nodes in the configuration [100]")
+  parser.add_option("--instances", dest="instances", type="int",
+                    default=1000,
+                    help="Number of instances in the configuration [1000]")
+  parser.add_option("--clients", dest="clients", type="int", default=8,
+                    help="Number of client processes [8]")
+  parser.add_option("--requests", dest="requests", type="int", default=500,
+                    help="Number of requests per client and query type [500]")
+  parser.add_option("--workers", dest="workers", type="int", default=4,
+                    help="Number of server processes compared to one [4]")
+
+  (options, args) = parser.parse_args()
+  if args:
+    parser.error("No arguments expected")
+  if options.nodes < 1 or options.nodes > 250:
+    parser.error("Number of nodes must be between 1 and 250")
+  if options.instances < 1 or options.instances > 65536:
+    parser.error("Number of instances must be between 1 and 65536")
+
+  return options
+
+
+def main():
+  """Main function.
+
+  """
+  options = ParseOptions()
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    cfg_file = utils.PathJoin(tmpdir, "config.data")
+    utils.WriteFile(cfg_file,
+                    data=serializer.DumpJson(_MakeConfig(options.nodes,
+                                                         options.instances)))
+
+    print ("%d clients sending %d requests each per query type, %d nodes,"
+           " %d instances" %
+           (options.clients, options.requests, options.nodes,
+            options.instances))
+
+    for count in utils.UniqueSequence([1, options.workers]):
+      port = _GetFreePort()
+      pids = _StartServers(count, port, cfg_file)
+      try:
+        _WaitForServer(port)
+
+        print "%d server process(es):" % count
+        for (title, req_type, query_fn) in _GetQueries(options):
+          _Benchmark(title, req_type, query_fn, options, port)
+      finally:
+        _StopServers(pids)
+  finally:
+    shutil.rmtree(tmpdir)
+
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -30,7 +30,10 @@ import unittest
 from ganeti import utils
 from ganeti import constants
 from ganeti import backend
+from ganeti import bdev
 from ganeti import netutils
+from ganeti import serializer
+from ganeti import compat
 
 import testutils
 
@@ -93,6 +96,143 @@ class TestNodeVerify(testutils.GanetiTestCase):
     self.failIf(result[constants.NV_MASTERIP],
                 "Result from netutils.TcpPing corrupted")
 
+  def testDrbdListInvalidMinor(self):
+    proc_data = bdev.BaseDRBD._GetProcData(
+      filename=self._TestDataFilename("proc_drbd83.txt"))
+    used_minors = bdev.DRBD8ProcSnapshot(proc_data).GetAllMinorsStatus()
+
+    orig_get_proc_data = bdev.BaseDRBD.__dict__["_GetProcData"]
+    bdev.BaseDRBD._GetProcData = \
+      staticmethod(lambda: proc_data + [" 99: cs:Unknown garbage"])
+    try:
+      result = backend.VerifyNode({constants.NV_DRBDLIST: None, }, None)
+    finally:
+      bdev.BaseDRBD._GetProcData = orig_get_proc_data
+
+    # A minor whose status can't be parsed doesn't hide the others
+    self.assertEqual(sorted(result[constants.NV_DRBDLIST]),
+                     sorted([minor for (minor, status) in used_minors.items()
+                             if status.is_in_use] + [99]))
+
+
+class _FakeCmdResult(object):
+  def __init__(self, stdout):
+    self.failed = False
+    self.fail_reason = None
+    self.stdout = stdout
+    self.output = stdout
+
+
+class TestVolumeLists(unittest.TestCase):
+  _LVS_OUTPUT = "\n".join([
+    "  xenvg|disk0|1024.00|-wi-ao|253|0|4.00|1|/dev/sda1(0)",
+    "  Couldn't find device with uuid 'AbC123'.",
+    "  xenvg|disk1|512.00|-wi-a-|253|1|4.00|1|/dev/sda1(256),/dev/sdb1(0)",
+    "  xenvg|snap|512.00|vwi-a-|-1|-1|4.00|1|",
+    ])
+
+  def setUp(self):
+    self.commands = []
+    self.orig_runcmd = utils.RunCmd
+    utils.RunCmd = self._RunCmd
+
+  def tearDown(self):
+    utils.RunCmd = self.orig_runcmd
+
+  def _RunCmd(self, cmd):
+    self.commands.append(cmd)
+    return _FakeCmdResult(self._LVS_OUTPUT)
+
+  def testGetVolumeList(self):
+    # The unparsable line is skipped
+    self.assertEqual(backend.GetVolumeList(["xenvg"]), {
+      "xenvg/disk0": ("1024.00", False, True),
+      "xenvg/disk1": ("512.00", False, False),
+      })
+
+    # Only the requested volume group is queried
+    self.assertEqual(len(self.commands), 1)
+    self.assertEqual(self.commands[0][0], "lvs")
+    self.assertEqual(self.commands[0][-1], "xenvg")
+
+  def testNodeVolumes(self):
+    self.assertEqual([(vol["vg"], vol["name"], vol["size"], vol["dev"])
+                      for vol in backend.NodeVolumes()], [
+      ("xenvg", "disk0", "1024.00", "/dev/sda1"),
+      ("xenvg", "disk1", "512.00", "/dev/sda1"),
+      ("xenvg", "disk1", "512.00", "/dev/sdb1"),
+      ("xenvg", "snap", "512.00", ""),
+      ])
+
+
+class TestUploadConfigDelta(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.cfg_file = utils.PathJoin(self.tmpdir, "config.data")
+    self.old_cfg_file = constants.CLUSTER_CONF_FILE
+    constants.CLUSTER_CONF_FILE = self.cfg_file
+
+    self.config = {
+      "serial_no": 10,
+      "cluster": { "cluster_name": "cluster.example.com", },
+      "nodes": {
+        "node1": { "name": "node1", "serial_no": 1, },
+        },
+      }
+    self.cfg_data = serializer.Dump(self.config)
+    utils.WriteFile(self.cfg_file, data=self.cfg_data)
+
+    new = serializer.Load(self.cfg_data)
+    new["serial_no"] = 11
+    new["nodes"]["node1"]["serial_no"] = 2
+    self.new_checksum = compat.sha1_hash(serializer.Dump(new)).hexdigest()
+    self.delta = (constants.RPC_ENCODING_NONE, serializer.DumpJson((
+      [("nodes", "node1", new["nodes"]["node1"]), ("serial_no", None, 11)],
+      [])))
+
+  def tearDown(self):
+    constants.CLUSTER_CONF_FILE = self.old_cfg_file
+    shutil.rmtree(self.tmpdir)
+
+  def _Upload(self, base_serial, checksum, file_name=None):
+    if file_name is None:
+      file_name = self.cfg_file
+    backend.UploadConfigDelta(file_name, base_serial, self.delta, checksum,
+                              0640, "root", "root")
+
+  def _CheckUnchanged(self):
+    self.assertEqual(utils.ReadFile(self.cfg_file), self.cfg_data)
+
+  def testWrongFile(self):
+    self.assertRaises(backend.RPCFail, self._Upload, 10, self.new_checksum,
+                      file_name=utils.PathJoin(self.tmpdir, "other"))
+    self._CheckUnchanged()
+
+  def testSerialMismatch(self):
+    # The node missed an update
+    for serial in [9, 11, None]:
+      self.assertRaises(backend.RPCFail, self._Upload, serial,
+                        self.new_checksum)
+      self._CheckUnchanged()
+
+  def testChecksumMismatch(self):
+    self.assertRaises(backend.RPCFail, self._Upload, 10, "0" * 40)
+    self._CheckUnchanged()
+
+    # The node's configuration differs even though the serial number matches
+    utils.WriteFile(self.cfg_file, data=serializer.Dump(dict(self.config,
+      cluster={ "cluster_name": "other.example.com", })))
+    self.assertRaises(backend.RPCFail, self._Upload, 10, self.new_checksum)
+    self.assertEqual(serializer.Load(utils.ReadFile(self.cfg_file))
+                     ["cluster"]["cluster_name"], "other.example.com")
+
+  def testBrokenFile(self):
+    utils.WriteFile(self.cfg_file, data="{ broken")
+    self.assertRaises(backend.RPCFail, self._Upload, 10, self.new_checksum)
+
+    os.unlink(self.cfg_file)
+    self.assertRaises(backend.RPCFail, self._Upload, 10, self.new_checksum)
+
 
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
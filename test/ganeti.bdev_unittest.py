@@ -251,5 +251,282 @@ class TestDRBD8Status(testutils.GanetiTestCase):
                       stats.rrole == 'Unknown' and
                       stats.is_disk_uptodate)
 
+  def testSnapshot(self):
+    """Test parsing a snapshot of /proc/drbd"""
+    for (data, mass_data) in [(self.proc_data, self.mass_data),
+                              (self.proc83_data, self.mass83_data)]:
+      snapshot = bdev.DRBD8ProcSnapshot(data)
+      self.assertEqual(snapshot.GetVersion()["k_major"], 8)
+      self.assertEqual(sorted(snapshot.GetMinors()), sorted(mass_data.keys()))
+      self.assertEqual(snapshot.GetMinorStatus(9), None)
+      self.failUnless(snapshot.GetMinorStatus(8).is_standalone)
+      self.failUnless(snapshot.GetMinorStatus(8) is
+                      snapshot.GetMinorStatus(8))
+
+      all_status = snapshot.GetAllMinorsStatus()
+      self.assertEqual(sorted(all_status.keys()), sorted(mass_data.keys()))
+      self.failUnless(all_status[8] is snapshot.GetMinorStatus(8))
+      self.failIf(all_status[2].is_in_use)
+      self.failUnless(all_status[6].is_diskless)
+
+  def testSnapshotInvalidMinor(self):
+    """Test a snapshot with a minor whose status can't be parsed"""
+    snapshot = bdev.DRBD8ProcSnapshot(self.proc83_data +
+                                      [" 99: cs:Unknown garbage"])
+    self.assertRaises(errors.BlockDeviceError, snapshot.GetMinorStatus, 99)
+    all_status = snapshot.GetAllMinorsStatus()
+    self.assertEqual(sorted(all_status.keys()),
+                     sorted(self.mass83_data.keys()))
+
+
+class TestSharedDRBDSnapshot(testutils.GanetiTestCase):
+  """Testing case for sharing /proc/drbd between devices"""
+
+  def setUp(self):
+    testutils.GanetiTestCase.setUp(self)
+    proc_file = self._TestDataFilename("proc_drbd83.txt")
+    self.proc_data = bdev.DRBD8._GetProcData(filename=proc_file)
+    self.reads = 0
+    self.orig_get_proc_data = bdev.BaseDRBD.__dict__["_GetProcData"]
+    bdev.BaseDRBD._GetProcData = staticmethod(self._GetProcData)
+
+  def tearDown(self):
+    bdev.BaseDRBD._GetProcData = self.orig_get_proc_data
+    testutils.GanetiTestCase.tearDown(self)
+
+  def _GetProcData(self):
+    self.reads += 1
+    return self.proc_data
+
+  def _ReadStatus(self):
+    return [bdev.DRBD8.GetAllMinorsStatus()[0],
+            sorted(bdev.DRBD8.GetUsedDevs().keys()),
+            bdev.DRBD8.GetAllMinorsStatus()[0]]
+
+  def testNotShared(self):
+    result = self._ReadStatus()
+    self.assertEqual(self.reads, 3)
+    self.failIf(result[0] is result[2])
+
+  def testShared(self):
+    fn = bdev.SharedDRBDSnapshot(self._ReadStatus)
+    result = fn()
+    self.assertEqual(self.reads, 1)
+    self.failUnless(result[0] is result[2])
+    self.assertEqual(result[1], [0, 1, 4, 5, 6, 7, 8])
+
+    # The snapshot is only used for the duration of the call
+    fn()
+    self.assertEqual(self.reads, 2)
+    self.failIf(fn()[0] is result[0])
+    self.failIf(bdev.BaseDRBD._shared_snapshot_active)
+
+  def testNested(self):
+    fn = bdev.SharedDRBDSnapshot(self._ReadStatus)
+    outer = bdev.SharedDRBDSnapshot(lambda: fn() + fn())
+    result = outer()
+    self.assertEqual(self.reads, 1)
+    self.failUnless(result[0] is result[3])
+
+  def testException(self):
+    def _Fail():
+      bdev.DRBD8.GetAllMinorsStatus()
+      raise errors.BlockDeviceError("test")
+    self.assertRaises(errors.BlockDeviceError, bdev.SharedDRBDSnapshot(_Fail))
+    self.failIf(bdev.BaseDRBD._shared_snapshot_active)
+    self.assertEqual(bdev.BaseDRBD._shared_snapshot, None)
+
+
+class _FakeCmdResult(object):
+  def __init__(self, failed=False, stdout=""):
+    self.failed = failed
+    self.fail_reason = None
+    self.stdout = stdout
+    self.output = stdout
+
+
+class TestLVMInventory(testutils.GanetiTestCase):
+  """Testing case for the shared LVM inventory"""
+
+  _LVS = [
+    ["xenvg", "disk0", "1024.00", "-wi-ao", "253", "0", "4.00", "1",
+     "/dev/sda1(0)"],
+    ["xenvg", "disk1", "2048.00", "-wi-a-", "253", "1", "4.00", "1",
+     "/dev/sda1(256)"],
+    ["xenvg", "disk1", "2048.00", "-wi-a-", "253", "1", "4.00", "2",
+     "/dev/sdb1(0),/dev/sdc1(0)"],
+    ["othervg", "disk0", "512.00", "vwi-a-", "-1", "-1", "4.00", "1", ""],
+    ]
+
+  def setUp(self):
+    testutils.GanetiTestCase.setUp(self)
+    self.commands = []
+    self.lvs_error = False
+    self.orig_get_info = bdev.LogicalVolume.__dict__["_GetVolumeInfo"]
+    self.orig_runcmd = bdev.utils.RunCmd
+    bdev.LogicalVolume._GetVolumeInfo = staticmethod(self._GetVolumeInfo)
+    bdev.utils.RunCmd = self._RunCmd
+
+  def tearDown(self):
+    bdev.LogicalVolume._GetVolumeInfo = self.orig_get_info
+    bdev.utils.RunCmd = self.orig_runcmd
+    testutils.GanetiTestCase.tearDown(self)
+
+  def _GetVolumeInfo(self, lvm_cmd, fields, names=None, skip_invalid=False):
+    if names:
+      self.commands.append("%s %s" % (lvm_cmd, " ".join(names)))
+    else:
+      self.commands.append(lvm_cmd)
+    if lvm_cmd == "lvs":
+      self.assertEqual(fields, bdev.LVMInventory.LV_FIELDS)
+      self.assertTrue(skip_invalid)
+      if self.lvs_error:
+        raise errors.CommandError("Can't run lvs")
+      return [row for row in self._LVS if not names or row[0] in names]
+    elif lvm_cmd == "vgs":
+      self.assertEqual(fields, bdev.LVMInventory.VG_FIELDS)
+      return [["xenvg", "1024.00", "wz--n-", "8192.00"]]
+    elif lvm_cmd == "pvs":
+      self.assertEqual(fields, bdev.LVMInventory.PV_FIELDS)
+      return [["/dev/sda1", "xenvg", "1024.00", "a-"]]
+    raise errors.CommandError("Unknown command %s" % lvm_cmd)
+
+  def _RunCmd(self, cmd):
+    if cmd[0] != "lvs":
+      self.commands.append(cmd[0])
+      return _FakeCmdResult()
+
+    # Lookup of a single logical volume
+    dev_path = cmd[-1]
+    self.commands.append("lvs %s" % dev_path)
+    lines = ["  %s," % ",".join(row[3:8]) for row in self._LVS
+             if dev_path == "/dev/%s/%s" % (row[0], row[1])]
+    if not lines:
+      return _FakeCmdResult(failed=True)
+    return _FakeCmdResult(stdout="\n".join(lines))
+
+  def testFindLV(self):
+    inventory = bdev.LVMInventory()
+    self.assertEqual(inventory.FindLV("xenvg", "disk0"), self._LVS[0])
+    self.assertEqual(inventory.FindLV("xenvg", "disk1"), self._LVS[2])
+    self.assertEqual(inventory.FindLV("othervg", "disk0"), self._LVS[3])
+    self.assertEqual(inventory.FindLV("xenvg", "missing"), None)
+    self.assertEqual(self.commands, ["lvs"])
+
+  def testGetLVsByVG(self):
+    inventory = bdev.LVMInventory()
+    self.assertEqual(inventory.GetLVs(["othervg"]), self._LVS[3:])
+    self.assertEqual(inventory.GetLVs(["xenvg"]), self._LVS[:3])
+    # Only the requested volume groups are queried
+    self.assertEqual(self.commands, ["lvs othervg", "lvs xenvg"])
+
+    # Once all volumes have been listed, they're filtered
+    self.assertEqual(inventory.GetLVs(), self._LVS)
+    self.assertEqual(inventory.GetLVs(["othervg"]), self._LVS[3:])
+    self.assertEqual(self.commands, ["lvs othervg", "lvs xenvg", "lvs"])
+
+  def testAttach(self):
+    lv = bdev.LogicalVolume(("xenvg", "disk1"), None, 2048)
+    self.failUnless(lv.attached)
+    self.assertEqual((lv.major, lv.minor, lv.pe_size, lv.stripe_count),
+                     (253, 1, 4, 2))
+    self.failIf(lv.GetSyncStatus().is_degraded)
+    self.failUnless(bdev.LogicalVolume(("othervg", "disk0"), None,
+                                       512).GetSyncStatus().is_degraded)
+    self.failIf(bdev.LogicalVolume(("xenvg", "missing"), None, 1).attached)
+    # Without a shared inventory only the requested volume is listed
+    self.assertEqual(self.commands, ["lvs /dev/xenvg/disk1",
+                                     "lvs /dev/othervg/disk0",
+                                     "lvs /dev/xenvg/missing"])
+
+  def testSharedListingFails(self):
+    self.lvs_error = True
+
+    def _Lookup():
+      lv = bdev.LogicalVolume(("xenvg", "disk1"), None, 2048)
+      self.failUnless(lv.attached)
+      self.assertEqual((lv.major, lv.minor, lv.pe_size, lv.stripe_count),
+                       (253, 1, 4, 2))
+      self.failUnless(bdev.LogicalVolume(("xenvg", "disk0"), None,
+                                         1024).attached)
+      self.failIf(bdev.LogicalVolume(("xenvg", "missing"), None, 1).attached)
+
+    bdev.SharedLVMInventory(_Lookup)()
+    # The full listing is tried once, then each volume is looked up alone
+    self.assertEqual(self.commands, ["lvs", "lvs /dev/xenvg/disk1",
+                                     "lvs /dev/xenvg/disk0",
+                                     "lvs /dev/xenvg/missing"])
+
+  def testShared(self):
+    def _Lookup():
+      for (vg_name, lv_name) in [("xenvg", "disk0"), ("xenvg", "disk1"),
+                                 ("othervg", "disk0")]:
+        self.failUnless(bdev.LogicalVolume((vg_name, lv_name), None,
+                                           1).attached)
+      bdev.LogicalVolume.GetVGInfo(["xenvg"])
+      bdev.LogicalVolume.GetPVInfo(["xenvg"])
+      return bdev.LogicalVolume.GetPVInfo(["xenvg"])
+
+    fn = bdev.SharedLVMInventory(_Lookup)
+    self.assertEqual(fn(), [(1024.0, "/dev/sda1", "xenvg")])
+    self.assertEqual(self.commands, ["lvs", "vgs", "pvs"])
+    self.failIf(bdev.LogicalVolume._shared_inventory_active)
+    self.assertEqual(bdev.LogicalVolume._shared_inventory, None)
+
+  def testInvalidation(self):
+    def _Modify():
+      lv = bdev.LogicalVolume(("xenvg", "disk0"), None, 1024)
+      lv.Rename(("xenvg", "disk0"))
+      lv.Attach()
+      lv.Grow(128, True)
+      lv.Attach()
+      lv.Assemble()
+      lv.Attach()
+
+    bdev.SharedLVMInventory(_Modify)()
+    self.assertEqual(self.commands, ["lvs", "lvrename", "lvs",
+                                     "lvextend", "lvchange", "lvs"])
+
+
+class TestGetVolumeInfo(testutils.GanetiTestCase):
+  """Testing case for parsing the output of LVM commands"""
+
+  def setUp(self):
+    testutils.GanetiTestCase.setUp(self)
+    self.commands = []
+    self.stdout = ""
+    self.orig_runcmd = bdev.utils.RunCmd
+    bdev.utils.RunCmd = self._RunCmd
+
+  def tearDown(self):
+    bdev.utils.RunCmd = self.orig_runcmd
+    testutils.GanetiTestCase.tearDown(self)
+
+  def _RunCmd(self, cmd):
+    self.commands.append(cmd)
+    return _FakeCmdResult(stdout=self.stdout)
+
+  def testNames(self):
+    self.stdout = "  xenvg|disk0\n  xenvg|disk1\n"
+    self.assertEqual(bdev.LogicalVolume._GetVolumeInfo("lvs",
+                                                       ["vg_name", "lv_name"],
+                                                       names=["xenvg"]),
+                     [["xenvg", "disk0"], ["xenvg", "disk1"]])
+    self.assertEqual(self.commands[0][0], "lvs")
+    self.assertEqual(self.commands[0][-2:], ["-ovg_name,lv_name", "xenvg"])
+
+  def testInvalidLine(self):
+    self.stdout = ("  xenvg|disk0\n"
+                   "  WARNING: something unexpected\n"
+                   "  xenvg|disk1|extra\n"
+                   "  xenvg|disk1\n")
+    self.assertRaises(errors.CommandError, bdev.LogicalVolume._GetVolumeInfo,
+                      "lvs", ["vg_name", "lv_name"])
+    self.assertEqual(bdev.LogicalVolume._GetVolumeInfo("lvs",
+                                                       ["vg_name", "lv_name"],
+                                                       skip_invalid=True),
+                     [["xenvg", "disk0"], ["xenvg", "disk1"]])
+
+
 if __name__ == '__main__':
   testutils.GanetiTestProgram()
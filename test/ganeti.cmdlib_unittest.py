@@ -37,6 +37,8 @@ from ganeti import utils
 from ganeti import luxi
 from ganeti import ht
 from ganeti import objects
+from ganeti import rpc
+from ganeti import serializer
 
 import testutils
 import mocks
@@ -132,6 +134,116 @@ class TestIAllocatorChecks(testutils.GanetiTestCase):
     self.assertRaises(errors.OpPrereqError, c_i)
 
 
+class _IAllocatorWithoutCluster(cmdlib.IAllocator):
+  def _ComputeClusterData(self):
+    self.in_data = {}
+
+
+class TestIAllocatorMultiAlloc(unittest.TestCase):
+  def _GetSpec(self, name, disk_template):
+    return {
+      "name": name,
+      "memory": 512,
+      "disks": [{ constants.IDISK_SIZE: 1024,
+                  constants.IDISK_MODE: constants.DISK_RDWR, }],
+      "disk_template": disk_template,
+      "os": "debootstrap",
+      "tags": [],
+      "nics": [{}],
+      "vcpus": 1,
+      "hypervisor": constants.HT_XEN_PVM,
+      }
+
+  def _Run(self, result):
+    ial = _IAllocatorWithoutCluster(mocks.FakeConfig(), None,
+      mode=constants.IALLOCATOR_MODE_MULTI_ALLOC,
+      instances=[self._GetSpec("inst1.example.com", constants.DT_DRBD8),
+                 self._GetSpec("inst2.example.com", constants.DT_PLAIN)])
+
+    def _Call(node, name, in_text):
+      self.assertEqual(node, mocks.FakeConfig().GetMasterNode())
+      self.assertEqual(name, "test")
+      self.assertEqual(serializer.LoadJson(in_text), ial.in_data)
+      return rpc.RpcResult(data=(True, serializer.DumpJson({
+        "success": True,
+        "info": "",
+        "result": result,
+        })), node=node)
+
+    ial.Run("test", call_fn=_Call)
+
+    return ial
+
+  def testRequest(self):
+    ial = self._Run([[], ["inst1.example.com", "inst2.example.com"]])
+    request = ial.in_data["request"]
+    self.assertEqual(request["type"], constants.IALLOCATOR_MODE_MULTI_ALLOC)
+    self.assertEqual([(inst["name"], inst["required_nodes"])
+                      for inst in request["instances"]],
+                     [("inst1.example.com", 2), ("inst2.example.com", 1)])
+    for inst in request["instances"]:
+      self.assertTrue(inst["disk_space_total"] >= 1024)
+
+  def testResult(self):
+    ial = self._Run([[["inst1.example.com", ["node1", "node2"]]],
+                     ["inst2.example.com"]])
+    self.assertTrue(ial.success)
+    self.assertEqual(ial.result, [[["inst1.example.com", ["node1", "node2"]]],
+                                  ["inst2.example.com"]])
+
+  def testInvalidResult(self):
+    for result in [
+      # Wrong format
+      [],
+      [["inst1.example.com", "inst2.example.com"]],
+      [[["inst1.example.com", "node1"]], ["inst2.example.com"]],
+      # Missing instance
+      [[["inst1.example.com", ["node1", "node2"]]], []],
+      # Duplicate instance
+      [[["inst1.example.com", ["node1", "node2"]],
+        ["inst2.example.com", ["node1"]]], ["inst2.example.com"]],
+      # Unknown instance
+      [[], ["inst1.example.com", "inst2.example.com", "inst3.example.com"]],
+      # Wrong number of nodes
+      [[["inst1.example.com", ["node1"]],
+        ["inst2.example.com", ["node1"]]], []],
+      ]:
+      self.assertRaises(errors.OpExecError, self._Run, result)
+
+
+class TestLUInstanceMultiAlloc(unittest.TestCase):
+  def _GetOp(self, name, hypervisor=None):
+    return opcodes.OpInstanceCreate(instance_name=name,
+                                    mode=constants.INSTANCE_CREATE,
+                                    disk_template=constants.DT_PLAIN,
+                                    disks=[{ constants.IDISK_SIZE: 1024, }],
+                                    nics=[], os_type="debootstrap",
+                                    hypervisor=hypervisor)
+
+  def _MakeLU(self, instances):
+    op = opcodes.OpInstanceMultiAlloc(instances=instances)
+    return cmdlib.LUInstanceMultiAlloc(mocks.FakeProc(), op,
+                                       mocks.FakeContext(), None)
+
+  def test(self):
+    lu = self._MakeLU([self._GetOp("inst1.example.com"),
+                       self._GetOp("inst2.example.com",
+                                   hypervisor=constants.HT_XEN_PVM)])
+    self.assertEqual(lu.op.iallocator,
+                     mocks.FakeConfig().GetDefaultIAllocator())
+
+  def testMixedHypervisors(self):
+    self.assertRaises(errors.OpPrereqError, self._MakeLU,
+                      [self._GetOp("inst1.example.com"),
+                       self._GetOp("inst2.example.com",
+                                   hypervisor=constants.HT_KVM)])
+
+  def testDuplicateNames(self):
+    self.assertRaises(errors.OpPrereqError, self._MakeLU,
+                      [self._GetOp("inst1.example.com"),
+                       self._GetOp("inst1.example.com")])
+
+
 class TestLUTestJqueue(unittest.TestCase):
   def test(self):
     self.assert_(cmdlib.LUTestJqueue._CLIENT_CONNECT_TIMEOUT <
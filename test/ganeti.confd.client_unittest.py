@@ -30,6 +30,7 @@ from ganeti import constants
 from ganeti import errors
 
 import ganeti.confd.client
+import ganeti.objects
 
 import testutils
 
@@ -188,6 +189,88 @@ class _BaseClientTest:
                       self.client._SetPeersAddressFamily)
 
 
+class TestBatch(unittest.TestCase):
+  def setUp(self):
+    self.requests = [
+      confd.client.ConfdClientRequest(type=constants.CONFD_REQ_PING),
+      confd.client.ConfdClientRequest(type=constants.CONFD_REQ_NODE_ROLE_BYNAME,
+                                      query="node1.example.com"),
+      ]
+    self.batch = confd.client.MakeBatchRequest(self.requests)
+
+  def _MakeUpcall(self, status, answer, serial=10):
+    reply = ganeti.objects.ConfdReply(protocol=constants.CONFD_PROTOCOL_VERSION,
+                                      status=status, answer=answer,
+                                      serial=serial)
+    return confd.client.ConfdUpcallPayload(salt=self.batch.rsalt,
+                                           type=confd.client.UPCALL_REPLY,
+                                           orig_request=self.batch,
+                                           server_reply=reply,
+                                           server_ip="192.0.2.1",
+                                           server_port=1814,
+                                           extra_args="args")
+
+  def testMakeBatchRequest(self):
+    self.assertEqual(self.batch.type, constants.CONFD_REQ_BATCH)
+    self.assertEqual(self.batch.query, [
+      [constants.CONFD_REQ_PING, None],
+      [constants.CONFD_REQ_NODE_ROLE_BYNAME, "node1.example.com"],
+      ])
+    self.assertRaises(errors.ConfdClientError,
+                      confd.client.MakeBatchRequest, [self.batch])
+
+  def testSplitBatchReply(self):
+    up = self._MakeUpcall(constants.CONFD_REPL_STATUS_OK, [
+      [constants.CONFD_REPL_STATUS_OK, None],
+      [constants.CONFD_REPL_STATUS_OK, constants.CONFD_NODE_ROLE_MASTER],
+      ])
+    result = confd.client.SplitBatchReply(up)
+    self.assertEqual(len(result), 2)
+    for (sub_up, req) in zip(result, self.requests):
+      self.assertEqual(sub_up.salt, self.batch.rsalt)
+      self.assertEqual(sub_up.type, confd.client.UPCALL_REPLY)
+      self.assertEqual(sub_up.orig_request.type, req.type)
+      self.assertEqual(sub_up.orig_request.query, req.query)
+      self.assertEqual(sub_up.server_reply.serial, 10)
+      self.assertEqual(sub_up.server_reply.status,
+                       constants.CONFD_REPL_STATUS_OK)
+      self.assertEqual(sub_up.server_ip, "192.0.2.1")
+      self.assertEqual(sub_up.extra_args, "args")
+    self.assertEqual(result[1].server_reply.answer,
+                     constants.CONFD_NODE_ROLE_MASTER)
+
+    # Failed batch requests are passed on unchanged
+    up = self._MakeUpcall(constants.CONFD_REPL_STATUS_ERROR,
+                          constants.CONFD_ERROR_ARGUMENT)
+    self.assertEqual(confd.client.SplitBatchReply(up), [up])
+
+  def testFilterCallback(self):
+    callback = MockCallback()
+    fcb = confd.client.ConfdFilterCallback(callback, split_batches=True)
+    answer = [
+      [constants.CONFD_REPL_STATUS_OK, None],
+      [constants.CONFD_REPL_STATUS_OK, constants.CONFD_NODE_ROLE_MASTER],
+      ]
+    fcb(self._MakeUpcall(constants.CONFD_REPL_STATUS_OK, answer))
+    self.assertEqual(callback.call_count, 2)
+    self.assertEqual(callback.last_up.orig_request.type,
+                     constants.CONFD_REQ_NODE_ROLE_BYNAME)
+
+    # Duplicate replies are filtered as a whole
+    fcb(self._MakeUpcall(constants.CONFD_REPL_STATUS_OK, answer))
+    fcb(self._MakeUpcall(constants.CONFD_REPL_STATUS_OK, answer, serial=11))
+    self.assertEqual(callback.call_count, 2)
+    self.assertTrue(fcb.consistent[self.batch.rsalt])
+
+    # Without splitting, the batch reply is passed on unchanged
+    callback = MockCallback()
+    fcb = confd.client.ConfdFilterCallback(callback)
+    up = self._MakeUpcall(constants.CONFD_REPL_STATUS_OK, answer)
+    fcb(up)
+    self.assertEqual(callback.call_count, 1)
+    self.assertEqual(callback.last_up, up)
+
+
 class TestIP4Client(unittest.TestCase, _BaseClientTest):
   """Client tests"""
   mc_list = ["192.0.2.1",
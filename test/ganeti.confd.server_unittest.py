@@ -0,0 +1,177 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for unittesting the confd server module"""
+
+
+import unittest
+
+from ganeti import constants
+from ganeti import errors
+from ganeti import objects
+from ganeti import serializer
+
+import ganeti.confd.server
+
+import testutils
+
+
+class _FakeReader(object):
+  def __init__(self):
+    self.serial = 1
+    self.master = "node1.example.com"
+    self.calls = 0
+
+  def GetConfigSerialNo(self):
+    return self.serial
+
+  def GetMasterNode(self):
+    self.calls += 1
+    return self.master
+
+  def GetMasterIP(self):
+    self.calls += 1
+    return "192.0.2.1"
+
+
+class TestNormalizeQuery(unittest.TestCase):
+  def test(self):
+    fn = ganeti.confd.server._NormalizeQuery
+    self.assertEqual(fn({"a": 1, "b": [1, 2]}), fn({"b": [1, 2], "a": 1}))
+    self.assertEqual(fn("x"), fn(u"x"))
+    self.assertEqual(fn(None), fn(None))
+    self.assertNotEqual(fn(1), fn(True))
+    self.assertNotEqual(fn([1]), fn(1))
+    self.assertNotEqual(fn({"a": [1]}), fn({"a": [2]}))
+    hash(fn({"a": [{"b": None}], "c": 1.5}))
+
+
+class TestConfdProcessor(unittest.TestCase):
+  def setUp(self):
+    self.reader = _FakeReader()
+    self.proc = ganeti.confd.server.ConfdProcessor(hmac_key="secret",
+                                                   cache_size=3)
+    self.proc.reader = self.reader
+    self.proc.disabled = False
+
+  def _Query(self, query, rsalt="salt"):
+    req = objects.ConfdRequest(protocol=constants.CONFD_PROTOCOL_VERSION,
+                               type=constants.CONFD_REQ_CLUSTER_MASTER,
+                               query=query, rsalt=rsalt)
+    (reply_txt, salt) = self.proc.ProcessRequest(req)
+    (reply, signed_salt) = \
+      serializer.LoadSigned(self.proc.PackReply(reply_txt, salt), "secret")
+    self.assertEqual(signed_salt, rsalt)
+    self.assertEqual(reply["serial"], self.reader.serial)
+    return (reply["status"], reply["answer"])
+
+  def testCache(self):
+    query = {
+      constants.CONFD_REQQ_FIELDS: [constants.CONFD_REQFIELD_NAME],
+      }
+    expected = (constants.CONFD_REPL_STATUS_OK, ["node1.example.com"])
+
+    self.assertEqual(self._Query(query), expected)
+    self.assertEqual(self.reader.calls, 1)
+
+    # Answered from the cache, but signed with the new salt
+    self.assertEqual(self._Query(query, rsalt="other"), expected)
+    self.assertEqual(self.reader.calls, 1)
+    self.assertEqual(self.proc.GetCacheStats(), (1, 1, 1))
+
+    # A new serial number results in a new reply
+    self.reader.serial = 2
+    self.reader.master = "node2.example.com"
+    self.assertEqual(self._Query(query),
+                     (constants.CONFD_REPL_STATUS_OK, ["node2.example.com"]))
+    self.assertEqual(self.reader.calls, 2)
+
+    self.proc.LogCacheStats()
+    self.assertEqual(self.proc.GetCacheStats(), (0, 0, 2))
+
+    self.proc.FlushCache()
+    self.assertEqual(self.proc.GetCacheStats(), (0, 0, 0))
+    self._Query(query)
+    self.assertEqual(self.reader.calls, 3)
+
+  def testCacheSize(self):
+    for field in [constants.CONFD_REQFIELD_NAME, constants.CONFD_REQFIELD_IP]:
+      for count in range(1, 4):
+        self._Query({ constants.CONFD_REQQ_FIELDS: [field] * count, })
+    self.assertEqual(self.reader.calls, 12)
+    (_, _, size) = self.proc.GetCacheStats()
+    self.assertTrue(size <= 3)
+
+  def _BatchQuery(self, query):
+    req = objects.ConfdRequest(protocol=constants.CONFD_PROTOCOL_VERSION,
+                               type=constants.CONFD_REQ_BATCH,
+                               query=query, rsalt="salt")
+    (reply_txt, salt) = self.proc.ProcessRequest(req)
+    (reply, _) = \
+      serializer.LoadSigned(self.proc.PackReply(reply_txt, salt), "secret")
+    self.assertEqual(reply["serial"], self.reader.serial)
+    return (reply["status"], reply["answer"])
+
+  def testBatch(self):
+    fields_query = {
+      constants.CONFD_REQQ_FIELDS: [constants.CONFD_REQFIELD_NAME,
+                                    constants.CONFD_REQFIELD_IP],
+      }
+    query = [
+      [constants.CONFD_REQ_PING, None],
+      [constants.CONFD_REQ_CLUSTER_MASTER, fields_query],
+      [constants.CONFD_REQ_CLUSTER_MASTER, None],
+      ]
+    expected = (constants.CONFD_REPL_STATUS_OK, [
+      [constants.CONFD_REPL_STATUS_OK, "ok"],
+      [constants.CONFD_REPL_STATUS_OK, ["node1.example.com", "192.0.2.1"]],
+      [constants.CONFD_REPL_STATUS_OK, "node1.example.com"],
+      ])
+    self.assertEqual(self._BatchQuery(query), expected)
+    self.assertEqual(self.reader.calls, 3)
+
+    # The whole batch is cached
+    self.assertEqual(self._BatchQuery(query), expected)
+    self.assertEqual(self.reader.calls, 3)
+    self.assertEqual(self.proc.GetCacheStats(), (1, 1, 1))
+
+    self.assertEqual(self._BatchQuery([]),
+                     (constants.CONFD_REPL_STATUS_OK, []))
+
+  def testInvalidBatch(self):
+    error = (constants.CONFD_REPL_STATUS_ERROR,
+             constants.CONFD_ERROR_ARGUMENT)
+    for query in [None, "x", [None], [[constants.CONFD_REQ_PING]],
+                  [[-1, None]],
+                  [[constants.CONFD_REQ_BATCH, []]],
+                  [[constants.CONFD_REQ_PING, None], [1, 2, 3]]]:
+      self.assertEqual(self._BatchQuery(query), error)
+
+  def testInvalidRequest(self):
+    req = objects.ConfdRequest(protocol=constants.CONFD_PROTOCOL_VERSION,
+                               type=constants.CONFD_REQ_PING, query=None,
+                               rsalt=None)
+    self.assertRaises(errors.ConfdRequestError, self.proc.ProcessRequest, req)
+    self.assertEqual(self.proc.GetCacheStats(), (0, 0, 0))
+
+
+if __name__ == "__main__":
+  testutils.GanetiTestProgram()
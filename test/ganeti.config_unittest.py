@@ -36,6 +36,10 @@ from ganeti import errors
 from ganeti import objects
 from ganeti import utils
 from ganeti import netutils
+from ganeti import serializer
+from ganeti import backend
+from ganeti import rpc
+from ganeti import compat
 
 from ganeti.config import TemporaryReservationManager
 
@@ -239,6 +243,264 @@ class TestConfigRunner(unittest.TestCase):
     cfg.AddNodeGroup(group, "my-job", check_uuid=False) # Does not raise.
     self.assertEqual(uuid, group.uuid)
 
+  @staticmethod
+  def _GetIndexErrors(cfg):
+    return [msg for msg in cfg.VerifyConfig()
+            if msg.startswith("configuration index")]
+
+  def _AddDrbdInstance(self, cfg, name, snode, minors):
+    pnode = cfg.GetMasterNode()
+    vg = cfg.GetVGName()
+    lvs = [objects.Disk(dev_type=constants.LD_LV, size=128,
+                        logical_id=(vg, "%s.%s" % (name, suffix)))
+           for suffix in ("data", "meta")]
+    disk = objects.Disk(dev_type=constants.LD_DRBD8, size=128,
+                        logical_id=(pnode, snode, 11000, minors[0],
+                                    minors[1], "secret"),
+                        children=lvs, iv_name="disk/0")
+    nic = objects.NIC(mac=cfg.GenerateMAC("my-job"))
+    inst = objects.Instance(name=name, disks=[disk], nics=[nic],
+                            disk_template=constants.DT_DRBD8,
+                            primary_node=pnode)
+    cfg.AddInstance(inst, "my-job")
+    return inst
+
+  def testIndex(self):
+    cfg = self._get_object()
+    master = cfg.GetMasterNode()
+    group = cfg.LookupNodeGroup(None)
+    node2 = objects.Node(name="node2.example.com", primary_ip="192.0.2.2",
+                         secondary_ip="192.0.2.2", group=group,
+                         ndparams={})
+    cfg.AddNode(node2, "my-job")
+
+    inst1 = self._AddDrbdInstance(cfg, "inst1.example.com", node2.name, (0, 0))
+    inst2 = self._AddDrbdInstance(cfg, "inst2.example.com", node2.name, (1, 1))
+    self.assertEqual(self._GetIndexErrors(cfg), [])
+
+    (pri, sec) = cfg.GetNodeInstances(master)
+    self.assertEqual(sorted(pri), [inst1.name, inst2.name])
+    self.assertEqual(sec, [])
+    (pri, sec) = cfg.GetNodeInstances(node2.name)
+    self.assertEqual(pri, [])
+    self.assertEqual(sorted(sec), [inst1.name, inst2.name])
+    self.assertEqual(cfg.GetNodeGroupInstances(group),
+                     frozenset([inst1.name, inst2.name]))
+
+    self.assertRaises(errors.ReservationError, cfg.ReserveMAC,
+                      inst1.nics[0].mac, "other-job")
+    self.assertRaises(errors.ReservationError, cfg.ReserveLV,
+                      "xenvg/inst2.example.com.meta", "other-job")
+    self.assertEqual(cfg.AllocateDRBDMinor([master, node2.name], "inst3"),
+                     [2, 2])
+    cfg.ReleaseDRBDMinors("inst3")
+    self.assertEqual(cfg.ComputeDRBDMap()[node2.name],
+                     { 0: inst1.name, 1: inst2.name, })
+
+    cfg.RenameInstance(inst1.name, "inst9.example.com")
+    cfg.RemoveInstance(inst2.name)
+    self.assertEqual(cfg.GetNodeInstances(node2.name),
+                     ([], ["inst9.example.com"]))
+    self.assertEqual(cfg.GetNodeGroupInstances(group, primary_only=True),
+                     frozenset(["inst9.example.com"]))
+    self.assertEqual(cfg.ComputeDRBDMap()[node2.name],
+                     { 0: "inst9.example.com", })
+    cfg.ReserveMAC(inst2.nics[0].mac, "other-job")
+    cfg.ReserveLV("xenvg/inst2.example.com.meta", "other-job")
+
+    # Modify an instance and save it
+    inst1.primary_node = node2.name
+    inst1.disks[0].logical_id = (node2.name, master, 11000, 0, 0, "secret")
+    cfg.Update(inst1, None)
+    self.assertEqual(cfg.GetNodeInstances(node2.name),
+                     (["inst9.example.com"], []))
+    self.assertEqual(self._GetIndexErrors(cfg), [])
+
+  def testIndexOutOfDate(self):
+    cfg = self._get_object()
+    inst = self._create_instance()
+    cfg.AddInstance(inst, "my-job")
+    self.assertEqual(self._GetIndexErrors(cfg), [])
+
+    # Modifications are only taken into account when saved
+    inst.primary_node = "other.example.com"
+    self.assertTrue(self._GetIndexErrors(cfg))
+
+    # Instance is saved as a side-effect of updating the cluster
+    cfg.Update(cfg.GetClusterInfo(), None)
+    self.assertEqual(self._GetIndexErrors(cfg), [])
+    self.assertEqual(cfg.GetNodeInstances("other.example.com"),
+                     ([inst.name], []))
+
+  def testSnapshot(self):
+    cfg = self._get_object()
+    master = cfg.GetMasterNode()
+    snap = cfg.GetConfigSnapshot()
+    self.assertTrue(cfg.GetConfigSnapshot() is snap)
+    self.assertEqual(snap.GetMasterNode(), master)
+    self.assertEqual(snap.GetNodeList(), [master])
+    self.assertEqual(snap.GetInstanceList(), [])
+    self.assertEqual(snap.GetNdParams(snap.GetNodeInfo(master)),
+                     cfg.GetNdParams(cfg.GetNodeInfo(master)))
+    group = snap.GetNodeGroup(cfg.LookupNodeGroup(None))
+    self.assertEqual(group.members, [master])
+
+    inst = self._create_instance()
+    cfg.AddInstance(inst, "my-job")
+
+    # Modifications are only visible in new snapshots
+    self.assertEqual(snap.GetInstanceList(), [])
+    new_snap = cfg.GetConfigSnapshot()
+    self.assertTrue(new_snap.serial_no > snap.serial_no)
+    self.assertEqual(new_snap.GetInstanceList(), [inst.name])
+    self.assertEqual(new_snap.ExpandInstanceName("test"), inst.name)
+    self.assertFalse(new_snap.GetInstanceInfo(inst.name) is inst)
+
+    inst.primary_node = "other.example.com"
+    self.assertEqual(new_snap.GetInstanceInfo(inst.name).primary_node, master)
+    self.assertTrue(cfg.GetConfigSnapshot() is new_snap)
+
+    cfg.Update(inst, None)
+    self.assertEqual(cfg.GetConfigSnapshot().GetInstanceInfo(inst.name)
+                     .primary_node, "other.example.com")
+
+  def testDistributeConfigDelta(self):
+    cfg = self._get_object()
+    group = cfg.LookupNodeGroup(None)
+    for (name, ip) in [("node2.example.com", "192.0.2.2"),
+                       ("node3.example.com", "192.0.2.3")]:
+      cfg.AddNode(objects.Node(name=name, primary_ip=ip, secondary_ip=ip,
+                               group=group, ndparams={},
+                               master_candidate=True), "my-job")
+    inst = self._create_instance()
+    cfg.AddInstance(inst, "my-job")
+
+    delta_calls = []
+    upload_calls = []
+    rejecting = set()
+
+    def _UploadConfigDelta(node_list, file_name, base_serial, delta, checksum,
+                           address_list=None):
+      delta_calls.append((node_list, address_list, base_serial, checksum))
+      result = {}
+      for name in node_list:
+        if name in rejecting:
+          result[name] = rpc.RpcResult(data=(False, "Serial number mismatch"),
+                                       node=name)
+        else:
+          result[name] = rpc.RpcResult(data=(True, None), node=name)
+      return result
+
+    def _UploadFile(node_list, file_name, address_list=None):
+      upload_calls.append((node_list, address_list))
+      return dict((name, rpc.RpcResult(data=(True, None), node=name))
+                  for name in node_list)
+
+    def _WriteSsconfFiles(node_list, values):
+      return {}
+
+    saved = [(name, rpc.RpcRunner.__dict__[name])
+             for name in ["call_upload_config_delta", "call_upload_file",
+                          "call_write_ssconf_files"]]
+    rpc.RpcRunner.call_upload_config_delta = staticmethod(_UploadConfigDelta)
+    rpc.RpcRunner.call_upload_file = staticmethod(_UploadFile)
+    rpc.RpcRunner.call_write_ssconf_files = staticmethod(_WriteSsconfFiles)
+    cfg._offline = False
+    try:
+      nodes = ["node2.example.com", "node3.example.com"]
+      addrs = ["192.0.2.2", "192.0.2.3"]
+
+      # The first distribution always uploads the full file
+      cfg.Update(inst, None)
+      self.assertEqual(delta_calls, [])
+      self.assertEqual(upload_calls, [(nodes, addrs)])
+      base_serial = serializer.Load(utils.ReadFile(self.cfg_file))["serial_no"]
+
+      # One node rejects the changes, e.g. because its serial number doesn't
+      # match or the result has a different checksum, and gets the full file
+      rejecting.add("node3.example.com")
+      cfg.Update(inst, None)
+      txt = utils.ReadFile(self.cfg_file)
+      self.assertEqual(delta_calls, [
+        (nodes, addrs, base_serial, compat.sha1_hash(txt).hexdigest()),
+        ])
+      self.assertEqual(upload_calls[1:], [
+        (["node3.example.com"], ["192.0.2.3"]),
+        ])
+
+      # All nodes accept the changes
+      rejecting.clear()
+      cfg.Update(inst, None)
+      self.assertEqual(len(delta_calls), 2)
+      self.assertEqual(delta_calls[1][2], base_serial + 1)
+      self.assertEqual(len(upload_calls), 2)
+    finally:
+      cfg._offline = True
+      for (name, value) in saved:
+        setattr(rpc.RpcRunner, name, value)
+
+
+class TestComputeConfigDelta(unittest.TestCase):
+  def _MakeConfig(self):
+    return {
+      "version": constants.CONFIG_VERSION,
+      "serial_no": 10,
+      "cluster": { "cluster_name": "cluster.example.com", },
+      "nodes": {
+        "node1": { "name": "node1", "serial_no": 1, },
+        "node2": { "name": "node2", "serial_no": 1, },
+        },
+      "instances": {
+        "inst1": { "name": "inst1", "serial_no": 1, },
+        },
+      "nodegroups": {},
+      }
+
+  def testNoChanges(self):
+    self.assertEqual(config._ComputeConfigDelta(self._MakeConfig(),
+                                                self._MakeConfig()),
+                     ([], []))
+
+  def testContainers(self):
+    old = self._MakeConfig()
+    new = self._MakeConfig()
+    new["serial_no"] = 11
+    new["nodes"]["node2"]["serial_no"] = 2
+    new["instances"]["inst2"] = { "name": "inst2", }
+    del new["instances"]["inst1"]
+
+    (changed, removed) = config._ComputeConfigDelta(old, new)
+    self.assertEqual(changed, [
+      ("instances", "inst2", { "name": "inst2", }),
+      ("nodes", "node2", { "name": "node2", "serial_no": 2, }),
+      ("serial_no", None, 11),
+      ])
+    self.assertEqual(removed, [("instances", "inst1")])
+
+  def testWholeEntries(self):
+    old = self._MakeConfig()
+    new = self._MakeConfig()
+    new["cluster"]["cluster_name"] = "other.example.com"
+    del new["nodegroups"]
+
+    (changed, removed) = config._ComputeConfigDelta(old, new)
+    self.assertEqual(changed, [("cluster", None, new["cluster"])])
+    self.assertEqual(removed, [("nodegroups", None)])
+
+  def testApply(self):
+    old = self._MakeConfig()
+    new = self._MakeConfig()
+    new["serial_no"] = 12
+    new["cluster"]["master_node"] = "node1"
+    new["nodes"]["node3"] = { "name": "node3", }
+    del new["nodes"]["node1"]
+    del new["nodegroups"]
+
+    delta = serializer.LoadJson(serializer.DumpJson(
+      config._ComputeConfigDelta(old, new)))
+    backend._ApplyConfigDelta(old, delta)
+    self.assertEqual(serializer.Dump(old), serializer.Dump(new))
+
 
 class TestTRM(unittest.TestCase):
   EC_ID = 1
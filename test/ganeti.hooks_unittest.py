@@ -36,6 +36,7 @@ from ganeti import constants
 from ganeti import cmdlib
 from ganeti import rpc
 from ganeti import compat
+from ganeti import utils
 from ganeti.constants import HKR_SUCCESS, HKR_FAIL, HKR_SKIP
 
 from mocks import FakeConfig, FakeProc, FakeContext
@@ -81,10 +82,26 @@ class TestHooksRunner(unittest.TestCase):
   def _rname(self, fname):
     return "/".join(fname.split("/")[-2:])
 
+  def _RunHooks(self, phase, env, hr=None):
+    """Runs hooks and checks and strips the durations from the results.
+
+    """
+    if hr is None:
+      hr = self.hr
+    result = []
+    for (script, hkr, output, duration) in hr.RunHooks(self.hpath, phase, env):
+      if hkr == HKR_SKIP:
+        self.assertEqual(duration, None)
+      else:
+        self.assertTrue(isinstance(duration, float))
+        self.assertTrue(duration >= 0)
+      result.append((script, hkr, output))
+    return result
+
   def testEmpty(self):
     """Test no hooks"""
     for phase in (constants.HOOKS_PHASE_PRE, constants.HOOKS_PHASE_POST):
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}), [])
+      self.failUnlessEqual(self._RunHooks(phase, {}), [])
 
   def testSkipNonExec(self):
     """Test skip non-exec file"""
@@ -93,7 +110,7 @@ class TestHooksRunner(unittest.TestCase):
       f = open(fname, "w")
       f.close()
       self.torm.append((fname, False))
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_SKIP, "")])
 
   def testSkipInvalidName(self):
@@ -105,7 +122,7 @@ class TestHooksRunner(unittest.TestCase):
       f.close()
       os.chmod(fname, 0700)
       self.torm.append((fname, False))
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_SKIP, "")])
 
   def testSkipDir(self):
@@ -114,7 +131,7 @@ class TestHooksRunner(unittest.TestCase):
       fname = "%s/testdir" % self.ph_dirs[phase]
       os.mkdir(fname)
       self.torm.append((fname, True))
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_SKIP, "")])
 
   def testSuccess(self):
@@ -126,7 +143,7 @@ class TestHooksRunner(unittest.TestCase):
       f.close()
       self.torm.append((fname, False))
       os.chmod(fname, 0700)
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_SUCCESS, "")])
 
   def testSymlink(self):
@@ -135,7 +152,7 @@ class TestHooksRunner(unittest.TestCase):
       fname = "%s/success" % self.ph_dirs[phase]
       os.symlink("/bin/true", fname)
       self.torm.append((fname, False))
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_SUCCESS, "")])
 
   def testFail(self):
@@ -147,7 +164,7 @@ class TestHooksRunner(unittest.TestCase):
       f.close()
       self.torm.append((fname, False))
       os.chmod(fname, 0700)
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}),
+      self.failUnlessEqual(self._RunHooks(phase, {}),
                            [(self._rname(fname), HKR_FAIL, "")])
 
   def testCombined(self):
@@ -165,7 +182,7 @@ class TestHooksRunner(unittest.TestCase):
         self.torm.append((fname, False))
         os.chmod(fname, 0700)
         expect.append((self._rname(fname), rs, ""))
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}), expect)
+      self.failUnlessEqual(self._RunHooks(phase, {}), expect)
 
   def testOrdering(self):
     for phase in (constants.HOOKS_PHASE_PRE, constants.HOOKS_PHASE_POST):
@@ -181,7 +198,7 @@ class TestHooksRunner(unittest.TestCase):
         self.torm.append((fname, False))
         expect.append((self._rname(fname), HKR_SUCCESS, ""))
       expect.sort()
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, {}), expect)
+      self.failUnlessEqual(self._RunHooks(phase, {}), expect)
 
   def testEnv(self):
     """Test environment execution"""
@@ -192,9 +209,44 @@ class TestHooksRunner(unittest.TestCase):
       self.torm.append((fname, False))
       env_snt = {"PHASE": phase}
       env_exp = "PHASE=%s" % phase
-      self.failUnlessEqual(self.hr.RunHooks(self.hpath, phase, env_snt),
+      self.failUnlessEqual(self._RunHooks(phase, env_snt),
                            [(self._rname(fname), HKR_SUCCESS, env_exp)])
 
+  def testParallel(self):
+    hr = backend.HooksRunner(hooks_base_dir=self.tmpdir, max_parallel=4)
+    for phase in (constants.HOOKS_PHASE_PRE, constants.HOOKS_PHASE_POST):
+      expect = []
+      for (fbase, ecode, rs) in [("00succ", 0, HKR_SUCCESS),
+                                 ("10fail", 1, HKR_FAIL),
+                                 ("20inv.", 0, HKR_SKIP),
+                                 ("30succ", 0, HKR_SUCCESS),
+                                 ("40fail", 1, HKR_FAIL),
+                                 ]:
+        fname = "%s/%s" % (self.ph_dirs[phase], fbase)
+        utils.WriteFile(fname, mode=0700,
+                        data="#!/bin/sh\necho %s\nexit %d\n" % (fbase, ecode))
+        self.torm.append((fname, False))
+        if rs == HKR_SKIP:
+          output = ""
+        else:
+          output = fbase
+        expect.append((self._rname(fname), rs, output))
+      self.failUnlessEqual(self._RunHooks(phase, {}, hr=hr), expect)
+
+  def testTimeout(self):
+    hr = backend.HooksRunner(hooks_base_dir=self.tmpdir, timeout=1)
+    for phase in (constants.HOOKS_PHASE_PRE, constants.HOOKS_PHASE_POST):
+      fname = "%s/slow" % self.ph_dirs[phase]
+      utils.WriteFile(fname, mode=0700, data="#!/bin/sh\nexec sleep 60\n")
+      self.torm.append((fname, False))
+      result = hr.RunHooks(self.hpath, phase, {})
+      self.assertEqual(len(result), 1)
+      (script, hkr, output, duration) = result[0]
+      self.assertEqual(script, self._rname(fname))
+      self.assertEqual(hkr, HKR_FAIL)
+      self.assertTrue("timeout" in output)
+      self.assertTrue(duration < 30)
+
 
 def FakeHooksRpcSuccess(node_list, hpath, phase, env):
   """Fake call_hooks_runner function.
@@ -209,6 +261,19 @@ def FakeHooksRpcSuccess(node_list, hpath, phase, env):
                for node in node_list])
 
 
+class _RecordingProc(FakeProc):
+  """Fake processor recording informational messages.
+
+  """
+  def __init__(self):
+    self.info = []
+
+  def LogInfo(self, msg, *args, **kwargs):
+    if args:
+      msg = msg % args
+    self.info.append(msg)
+
+
 class TestHooksMaster(unittest.TestCase):
   """Testing case for HooksMaster"""
 
@@ -275,6 +340,23 @@ class TestHooksMaster(unittest.TestCase):
     for phase in (constants.HOOKS_PHASE_PRE, constants.HOOKS_PHASE_POST):
       hm.RunPhase(phase)
 
+  def testTimings(self):
+    """Test reporting of script timings"""
+    def _CallFn(node_list, hpath, phase, env):
+      return dict((node, rpc.RpcResult((True, [
+        ("00skip", constants.HKR_SKIP, "", None),
+        ("10succ", constants.HKR_SUCCESS, "ok", 1.5),
+        ("20fail", constants.HKR_FAIL, "err", 0.25),
+        ]), node=node, call="FakeTimings"))
+        for node in node_list)
+
+    proc = _RecordingProc()
+    lu = FakeLU(proc, self.op, self.context, None)
+    mcpu.HooksMaster(_CallFn, lu).RunPhase(constants.HOOKS_PHASE_POST)
+    self.assertEqual(proc.info, [
+      "Hooks on localhost: 10succ 1.50s, 20fail 0.25s",
+      ])
+
 
 class FakeEnvLU(cmdlib.LogicalUnit):
   HPATH = "env_test_lu"
@@ -120,6 +120,13 @@ class TestTypeChecks(unittest.TestCase):
     for val in [False, True, None, [], 0, 1, 5, -193, 93.8582]:
       self.assertFalse(ht.TDict(val))
 
+  def testInstanceOf(self):
+    fn = ht.TInstanceOf(Exception)
+    self.assertTrue(fn(Exception()))
+    self.assertTrue(fn(ValueError("")))
+    for val in [None, [], {}, 0, "", Exception]:
+      self.assertFalse(fn(val))
+
   def testIsLength(self):
     fn = ht.TIsLength(10)
     self.assertTrue(fn(range(10)))
@@ -25,7 +25,10 @@
 import os
 import unittest
 import time
+import socket
+import signal
 import tempfile
+import threading
 from cStringIO import StringIO
 
 from ganeti import http
@@ -387,6 +390,343 @@ class TestClient(unittest.TestCase):
     pool = http.client.HttpClientPool(None)
     self.assertFalse(pool._pool)
 
+  def testDeadline(self):
+    # Accepts connections, but never replies
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(5)
+
+    # Nothing is listening on this port
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    closed_port = sock.getsockname()[1]
+    sock.close()
+
+    try:
+      hanging = http.client.HttpClientRequest("127.0.0.1",
+                                              listener.getsockname()[1],
+                                              "GET", "/hanging")
+      refused = http.client.HttpClientRequest("127.0.0.1", closed_port,
+                                              "GET", "/refused")
+      done = []
+      pool = http.client.HttpClientPool(None)
+      pool.ProcessRequests([hanging, refused], done_fn=done.append,
+                           deadline=time.time() + 0.5)
+    finally:
+      listener.close()
+
+    self.assertEqual(done, [refused, hanging])
+    self.assertFalse(refused.success)
+    self.assertFalse(hanging.success)
+    self.assertTrue("deadline" in hanging.error)
+
+    # Neither connection is reused
+    self.assertFalse(pool._pool)
+
+  def testReuse(self):
+    pool = http.client.HttpClientPool(None, max_idle_clients=2)
+
+    pclients = [pool._Get("node1") for _ in range(3)]
+    self.assertEqual(len(set(pclients)), 3)
+
+    pmulti1 = pool._GetMulti()
+    pmulti2 = pool._GetMulti()
+    self.assertNotEqual(pmulti1, pmulti2)
+
+    pool._Return(pmulti1, pclients)
+    pool._Return(pmulti2, [])
+
+    # Only the most recently used clients and multi handles are kept
+    self.assertEqual(pool._pool, { "node1": pclients[1:], })
+    self.assertEqual(pool._multis, [pmulti1, pmulti2])
+
+    self.assertEqual(pool._Get("node1"), pclients[2])
+    self.assertEqual(pool._Get("node1"), pclients[1])
+    self.assertFalse(pool._pool)
+    self.assertFalse(pool._Get("node1") in pclients)
+
+    self.assertEqual(pool._GetMulti(), pmulti2)
+    self.assertEqual(pool._GetMulti(), pmulti1)
+    self.assertFalse(pool._multis)
+
+  def testMaxIdleTime(self):
+    pool = http.client.HttpClientPool(None, max_idle_time=30,
+                                      max_idle_clients=2)
+
+    pclient1 = pool._Get("node1")
+    pclient2 = pool._Get("node2")
+    pmulti1 = pool._GetMulti()
+    pmulti2 = pool._GetMulti()
+    pool._Return(pmulti1, [pclient1, pclient2])
+
+    # Let the connection to node1 and the first multi handle time out
+    pclient1.lastused_time -= 60
+    pmulti1.lastused_time -= 60
+
+    pool._Return(pmulti2, [])
+
+    self.assertEqual(pool._pool, { "node2": [pclient2], })
+    self.assertEqual(pool._multis, [pmulti2])
+
+
+class _TestClientConnection:
+  """Minimal HTTP client sending requests over a single connection.
+
+  """
+  def __init__(self, port):
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.sock.settimeout(10)
+    self.sock.connect(("127.0.0.1", port))
+    self._buf = ""
+
+  def Close(self):
+    self.sock.close()
+
+  def _Recv(self):
+    data = self.sock.recv(4096)
+    if not data:
+      raise AssertionError("Connection closed by server")
+    self._buf += data
+
+  def Request(self, path, headers=None, body="null"):
+    # Without a Content-Length header the server assumes the client closes
+    # the connection after the request
+    lines = ["%s %s %s" % (http.HTTP_PUT, path, http.HTTP_1_1),
+             "Host: localhost",
+             "%s: %s" % (http.HTTP_CONTENT_LENGTH, len(body))]
+    if headers:
+      lines.extend("%s: %s" % (name, value)
+                   for (name, value) in headers.items())
+    self.sock.sendall("\r\n".join(lines) + "\r\n\r\n" + body)
+
+    while "\r\n\r\n" not in self._buf:
+      self._Recv()
+
+    (head, self._buf) = self._buf.split("\r\n\r\n", 1)
+    head_lines = head.split("\r\n")
+    code = int(head_lines[0].split()[1])
+    resp_headers = dict((name.lower(), value.strip())
+                        for (name, value) in
+                          [line.split(":", 1) for line in head_lines[1:]])
+
+    length = int(resp_headers.get(http.HTTP_CONTENT_LENGTH.lower(), 0))
+    while len(self._buf) < length:
+      self._Recv()
+
+    body = self._buf[:length]
+    self._buf = self._buf[length:]
+
+    return (code, resp_headers[http.HTTP_CONNECTION.lower()], body)
+
+  def IsClosed(self):
+    return self.sock.recv(1) == ""
+
+
+class _FakeServerForExecutor:
+  def __init__(self, worker_process=True, keep_alive_timeout=10):
+    self.using_ssl = False
+    self.worker_process = worker_process
+    self.keep_alive_timeout = keep_alive_timeout
+    self.requests = []
+
+  def IsolateRequest(self, method, path):
+    return False
+
+  def PreHandleRequest(self, req):
+    pass
+
+  def HandleRequest(self, req):
+    self.requests.append(req.request_path)
+    return "Reply to %s" % req.request_path
+
+
+class _ShortKeepAliveExecutor(http.server.HttpServerRequestExecutor):
+  MAX_KEEP_ALIVE_REQUESTS = 3
+
+
+class TestServerKeepAlive(unittest.TestCase):
+  def setUp(self):
+    self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.listener.bind(("127.0.0.1", 0))
+    self.listener.listen(5)
+    self.conn = None
+    self.thread = None
+
+  def tearDown(self):
+    if self.conn:
+      self.conn.Close()
+    if self.thread:
+      self.thread.join(10)
+      self.assertFalse(self.thread.isAlive())
+    self.listener.close()
+
+  def _Connect(self, server, executor=http.server.HttpServerRequestExecutor):
+    self.conn = _TestClientConnection(self.listener.getsockname()[1])
+    (sock, client_addr) = self.listener.accept()
+
+    self.thread = threading.Thread(target=executor,
+                                   args=(server, sock, client_addr))
+    self.thread.start()
+
+    return self.conn
+
+  def testSeveralRequests(self):
+    server = _FakeServerForExecutor()
+    conn = self._Connect(server)
+
+    for path in ["/a", "/b", "/c"]:
+      self.assertEqual(conn.Request(path),
+                       (http.HTTP_OK, "keep-alive", "Reply to %s" % path))
+
+    self.assertEqual(server.requests, ["/a", "/b", "/c"])
+
+    # The server stops waiting once the client closes the connection
+    conn.Close()
+    self.conn = None
+    self.thread.join(10)
+    self.assertFalse(self.thread.isAlive())
+
+  def testClientCloses(self):
+    server = _FakeServerForExecutor()
+    conn = self._Connect(server)
+
+    self.assertEqual(conn.Request("/a"),
+                     (http.HTTP_OK, "keep-alive", "Reply to /a"))
+    self.assertEqual(conn.Request("/b", headers={ "Connection": "close", }),
+                     (http.HTTP_OK, "close", "Reply to /b"))
+    self.assertTrue(conn.IsClosed())
+
+  def testMaxKeepAliveRequests(self):
+    server = _FakeServerForExecutor()
+    conn = self._Connect(server, executor=_ShortKeepAliveExecutor)
+
+    for path in ["/a", "/b"]:
+      self.assertEqual(conn.Request(path),
+                       (http.HTTP_OK, "keep-alive", "Reply to %s" % path))
+    self.assertEqual(conn.Request("/c"),
+                     (http.HTTP_OK, "close", "Reply to /c"))
+    self.assertTrue(conn.IsClosed())
+    self.assertEqual(server.requests, ["/a", "/b", "/c"])
+
+  def testKeepAliveTimeout(self):
+    server = _FakeServerForExecutor(keep_alive_timeout=0.1)
+    conn = self._Connect(server)
+
+    self.assertEqual(conn.Request("/a"),
+                     (http.HTTP_OK, "keep-alive", "Reply to /a"))
+
+    start = time.time()
+    self.assertTrue(conn.IsClosed())
+    self.assertTrue(time.time() - start < 5)
+
+    self.thread.join(10)
+    self.assertFalse(self.thread.isAlive())
+
+  def testNoWorker(self):
+    server = _FakeServerForExecutor(worker_process=False)
+    conn = self._Connect(server)
+
+    self.assertEqual(conn.Request("/a"),
+                     (http.HTTP_OK, "close", "Reply to /a"))
+    self.assertTrue(conn.IsClosed())
+
+  def testNoKeepAliveTimeout(self):
+    server = _FakeServerForExecutor(keep_alive_timeout=None)
+    conn = self._Connect(server)
+
+    self.assertEqual(conn.Request("/a"),
+                     (http.HTTP_OK, "close", "Reply to /a"))
+    self.assertTrue(conn.IsClosed())
+
+
+class _FakeMainloop:
+  def RegisterSignal(self, owner):
+    pass
+
+
+class _PreforkTestServer(http.server.HttpServer):
+  MAX_WORKER_CONNECTIONS = 3
+
+  def IsolateRequest(self, method, path):
+    return path == "/isolated"
+
+  def HandleRequest(self, req):
+    return str(os.getpid())
+
+
+class TestServerWorkers(unittest.TestCase):
+  def setUp(self):
+    self.server = _PreforkTestServer(_FakeMainloop(), "127.0.0.1", 0,
+                                     num_workers=1, keep_alive_timeout=10)
+    self.server.Start()
+    self.port = self.server.socket.getsockname()[1]
+
+  def tearDown(self):
+    children = self.server._children[:]
+    self.server.Stop()
+    self.server.del_channel()
+
+    for pid in children:
+      (_, status) = os.waitpid(pid, 0)
+      self.assertTrue(os.WIFSIGNALED(status))
+      self.assertEqual(os.WTERMSIG(status), signal.SIGTERM)
+
+  def _Request(self, path):
+    conn = _TestClientConnection(self.port)
+    try:
+      return conn.Request(path, headers={ "Connection": "close", })
+    finally:
+      conn.Close()
+
+  def _WaitForWorkerExit(self, pid):
+    for _ in range(1000):
+      # Called by the main loop when a child process exits
+      self.server.OnSignal(signal.SIGCHLD)
+      if pid not in self.server._children:
+        return
+      time.sleep(0.01)
+
+    self.fail("Worker %s didn't exit" % pid)
+
+  def testWorkerReplaced(self):
+    self.assertEqual(len(self.server._children), 1)
+    worker = self.server._children[0]
+
+    for _ in range(self.server.MAX_WORKER_CONNECTIONS):
+      self.assertEqual(self._Request("/"),
+                       (http.HTTP_OK, "close", str(worker)))
+
+    # The worker exits after its last connection and is replaced
+    self._WaitForWorkerExit(worker)
+    self.assertEqual(len(self.server._children), 1)
+    newworker = self.server._children[0]
+    self.assertNotEqual(newworker, worker)
+
+    self.assertEqual(self._Request("/"),
+                     (http.HTTP_OK, "close", str(newworker)))
+
+  def testIsolatedRequest(self):
+    worker = self.server._children[0]
+
+    conn = _TestClientConnection(self.port)
+    try:
+      self.assertEqual(conn.Request("/"),
+                       (http.HTTP_OK, "keep-alive", str(worker)))
+
+      # Handled by a child process of the worker, which closes the connection
+      # afterwards
+      (code, connection, body) = conn.Request("/isolated")
+      self.assertEqual((code, connection), (http.HTTP_OK, "close"))
+      self.assertNotEqual(body, str(worker))
+      self.assertTrue(conn.IsClosed())
+    finally:
+      conn.Close()
+
+    # The worker keeps serving connections
+    self.assertEqual(self._Request("/"),
+                     (http.HTTP_OK, "close", str(worker)))
+    self.assertEqual(self.server._children, [worker])
+
 
 if __name__ == '__main__':
   testutils.GanetiTestProgram()
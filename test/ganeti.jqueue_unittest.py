@@ -28,6 +28,7 @@ import tempfile
 import shutil
 import errno
 import itertools
+import time
 
 from ganeti import constants
 from ganeti import utils
@@ -36,6 +37,7 @@ from ganeti import jqueue
 from ganeti import opcodes
 from ganeti import compat
 from ganeti import mcpu
+from ganeti import serializer
 
 import testutils
 
@@ -842,6 +844,53 @@ class TestJobProcessor(unittest.TestCase, _JobProcessorTestUtils):
                      [[constants.OP_STATUS_CANCELED for _ in job.ops],
                       ["Job canceled by request" for _ in job.ops]])
 
+  def testLockWaitNotification(self):
+    queue = _FakeQueueForProc()
+    enqueued = []
+    queue.lock_waits = jqueue._LockWaitRegistry(enqueued.extend)
+
+    ops = [opcodes.OpTestDummy(result="Res%s" % i, fail=False)
+           for i in range(2)]
+
+    # Create job
+    job_id = 7150
+    job = self._CreateJob(queue, job_id, ops)
+
+    cbs_list = []
+
+    def _ExecOp(op, cbs, timeout=None, priority=None):
+      self.assertFalse(queue.IsAcquired())
+      cbs_list.append(cbs)
+      raise mcpu.LockAcquireTimeout(release_notify=(len(cbs_list) > 1))
+
+    # Without a notification the job must be retried right away
+    self.assertFalse(jqueue._JobProcessor(queue, _ExecOp, job)())
+    self.assertEqual(job.CalcStatus(), constants.JOB_STATUS_WAITLOCK)
+    self.assertFalse(job.cur_opctx.lock_wait)
+
+    self.assertFalse(jqueue._JobProcessor(queue, _ExecOp, job)())
+    self.assertEqual(job.CalcStatus(), constants.JOB_STATUS_WAITLOCK)
+    lock_wait = job.cur_opctx.lock_wait
+    self.assertTrue(lock_wait)
+    self.assertFalse(lock_wait.released)
+
+    self.assertTrue(queue.lock_waits.Park(lock_wait))
+    self.assertFalse(enqueued)
+
+    # Lock is released
+    cbs_list[-1].NotifyLockRelease()
+    self.assertTrue(lock_wait.released)
+    self.assertEqual(enqueued, [job])
+    self.assertEqual(queue.lock_waits.GetStats(),
+                     { "parked": 0, "parks": 1, "wakeups": 1, })
+
+    # Released before the job could be parked
+    self.assertFalse(jqueue._JobProcessor(queue, _ExecOp, job)())
+    lock_wait = job.cur_opctx.lock_wait
+    cbs_list[-1].NotifyLockRelease()
+    self.assertFalse(queue.lock_waits.Park(lock_wait))
+    self.assertEqual(enqueued, [job])
+
   def testCancelWhileRunning(self):
     # Tests canceling a job with finished opcodes and more, unprocessed ones
     queue = _FakeQueueForProc()
@@ -1412,5 +1461,479 @@ class TestJobProcessorTimeouts(unittest.TestCase, _JobProcessorTestUtils):
     self.assertRaises(IndexError, self.queue.GetNextUpdate)
 
 
+class TestLockWaitRegistry(unittest.TestCase):
+  def setUp(self):
+    self.enqueued = []
+    self.registry = jqueue._LockWaitRegistry(self.enqueued.extend)
+
+  def testParkAndRelease(self):
+    job = _FakeJob("1", constants.JOB_STATUS_WAITLOCK)
+    lock_wait = jqueue._LockWait(job)
+
+    self.assertTrue(self.registry.Park(lock_wait))
+    self.assertEqual(self.registry.GetStats()["parked"], 1)
+    self.assertFalse(self.enqueued)
+
+    self.registry.Release(lock_wait)
+    self.assertEqual(self.enqueued, [job])
+    self.assertEqual(self.registry.GetStats(),
+                     { "parked": 0, "parks": 1, "wakeups": 1, })
+
+    # Only one wakeup per wait
+    self.registry.Release(lock_wait)
+    self.assertEqual(self.enqueued, [job])
+
+  def testReleaseBeforePark(self):
+    job = _FakeJob("2", constants.JOB_STATUS_WAITLOCK)
+    lock_wait = jqueue._LockWait(job)
+
+    self.registry.Release(lock_wait)
+    self.assertFalse(self.enqueued)
+    self.assertFalse(self.registry.Park(lock_wait))
+    self.assertEqual(self.registry.GetStats(),
+                     { "parked": 0, "parks": 0, "wakeups": 0, })
+
+  def testStaleRelease(self):
+    job = _FakeJob("3", constants.JOB_STATUS_WAITLOCK)
+    old_wait = jqueue._LockWait(job)
+    lock_wait = jqueue._LockWait(job)
+
+    self.assertTrue(self.registry.Park(lock_wait))
+
+    # Notification for an earlier attempt
+    self.registry.Release(old_wait)
+    self.assertFalse(self.enqueued)
+
+    self.registry.Release(lock_wait)
+    self.assertEqual(self.enqueued, [job])
+
+  def testCancel(self):
+    job = _FakeJob("4", constants.JOB_STATUS_CANCELING)
+    self.assertFalse(self.registry.Park(jqueue._LockWait(job)))
+
+    job.SetStatus(constants.JOB_STATUS_WAITLOCK)
+    lock_wait = jqueue._LockWait(job)
+    self.assertTrue(self.registry.Park(lock_wait))
+
+    self.registry.Wakeup("5")
+    self.assertFalse(self.enqueued)
+
+    self.registry.Wakeup("4")
+    self.assertEqual(self.enqueued, [job])
+
+    # Lock released after job was cancelled
+    self.registry.Release(lock_wait)
+    self.assertEqual(self.enqueued, [job])
+    self.assertEqual(self.registry.GetStats(),
+                     { "parked": 0, "parks": 1, "wakeups": 1, })
+
+
+class TestJobFileReplicator(unittest.TestCase):
+  def setUp(self):
+    self.calls = []
+    self.checked = []
+    self.nodes = (["node1", "node2"], ["192.0.2.1", "192.0.2.2"])
+
+  def _GetNodes(self):
+    return self.nodes
+
+  def _Update(self, names, addrs, files):
+    self.calls.append((names, addrs, files))
+    return dict((name, None) for name in names)
+
+  def _Check(self, result, nodes, failmsg):
+    self.checked.append(sorted(nodes))
+
+  def _Create(self, delay=60.0):
+    return jqueue._JobFileReplicator(self._GetNodes, self._Check, delay=delay,
+                                     _update_fn=self._Update)
+
+  def testSync(self):
+    repl = self._Create()
+    repl.Update("/queue/job-1", "data1", True)
+    self.assertEqual(self.calls, [
+      (["node1", "node2"], ["192.0.2.1", "192.0.2.2"],
+       [("/queue/job-1", "data1")]),
+      ])
+    self.assertEqual(self.checked, [["node1", "node2"]])
+
+    stats = repl.GetStats()
+    self.assertEqual(stats["updates"], 1)
+    self.assertEqual(stats["rpc_calls"], 1)
+    self.assertEqual(stats["files_sent"], 1)
+    self.assertEqual(stats["pending"], 0)
+
+  def testCoalesceAndBatch(self):
+    repl = self._Create()
+    repl.Update("/queue/job-1", "log1", False)
+    repl.Update("/queue/job-2", "log1", False)
+    repl.Update("/queue/job-1", "log2", False)
+    self.assertEqual(self.calls, [])
+    self.assertEqual(repl.GetStats()["pending"], 2)
+
+    # A synchronous update sends all pending files at once
+    repl.Update("/queue/job-1", "status", True)
+    self.assertEqual(self.calls, [
+      (["node1", "node2"], ["192.0.2.1", "192.0.2.2"],
+       [("/queue/job-1", "status"), ("/queue/job-2", "log1")]),
+      ])
+
+    stats = repl.GetStats()
+    self.assertEqual(stats["updates"], 4)
+    self.assertEqual(stats["coalesced"], 2)
+    self.assertEqual(stats["rpc_calls"], 1)
+    self.assertEqual(stats["files_sent"], 2)
+    self.assertEqual(stats["pending"], 0)
+    self.assertTrue(stats["max_lag"] >= stats["last_lag"] >= 0.0)
+
+  def testNoNodes(self):
+    self.nodes = ([], [])
+    repl = self._Create()
+    repl.Update("/queue/job-1", "data", True)
+    self.assertEqual(self.calls, [])
+    self.assertEqual(repl.GetStats()["pending"], 0)
+
+  def testFlushEmpty(self):
+    repl = self._Create()
+    repl.Flush()
+    self.assertEqual(self.calls, [])
+
+  def testAsync(self):
+    repl = self._Create(delay=0.01)
+    repl.Start()
+    try:
+      repl.Update("/queue/job-1", "data", False)
+
+      for _ in range(500):
+        if self.calls:
+          break
+        time.sleep(0.01)
+    finally:
+      repl.Shutdown()
+
+    self.assertEqual(self.calls, [
+      (["node1", "node2"], ["192.0.2.1", "192.0.2.2"],
+       [("/queue/job-1", "data")]),
+      ])
+
+  def testShutdownFlushes(self):
+    repl = self._Create()
+    repl.Start()
+    repl.Update("/queue/job-1", "data", False)
+    repl.Shutdown()
+    self.assertEqual(self.calls, [
+      (["node1", "node2"], ["192.0.2.1", "192.0.2.2"],
+       [("/queue/job-1", "data")]),
+      ])
+
+
+class TestFinishedJobsCache(unittest.TestCase):
+  def _MakeJobs(self, count):
+    return [_FakeJob(str(idx), constants.JOB_STATUS_SUCCESS)
+            for idx in range(count)]
+
+  def testEntryLimit(self):
+    cache = jqueue._FinishedJobsCache(max_entries=3, max_bytes=1000)
+    jobs = self._MakeJobs(4)
+    for job in jobs[:3]:
+      cache.Add(job, 10, cache.GetGeneration())
+
+    # Make job 0 the most recently used one
+    self.assertEqual(cache.Get("0"), jobs[0])
+    cache.Add(jobs[3], 10, cache.GetGeneration())
+
+    self.assertEqual(cache.Get("1"), None)
+    for job in [jobs[0], jobs[2], jobs[3]]:
+      self.assertEqual(cache.Get(job.id), job)
+
+    self.assertEqual(cache.GetStats(), {
+      "hits": 4,
+      "misses": 1,
+      "evictions": 1,
+      "entries": 3,
+      "bytes": 30,
+      })
+
+  def testByteLimit(self):
+    cache = jqueue._FinishedJobsCache(max_entries=100, max_bytes=100)
+    jobs = self._MakeJobs(3)
+    cache.Add(jobs[0], 40, cache.GetGeneration())
+    cache.Add(jobs[1], 40, cache.GetGeneration())
+    cache.Add(jobs[2], 40, cache.GetGeneration())
+    self.assertEqual(cache.Get("0"), None)
+    self.assertEqual(cache.GetStats()["bytes"], 80)
+
+    # Too large to be cached at all
+    big = _FakeJob("big", constants.JOB_STATUS_ERROR)
+    cache.Add(big, 101, cache.GetGeneration())
+    self.assertEqual(cache.Get("big"), None)
+    self.assertEqual(cache.GetStats()["entries"], 2)
+
+  def testManyAccesses(self):
+    cache = jqueue._FinishedJobsCache(max_entries=10, max_bytes=1000)
+    jobs = self._MakeJobs(20)
+    for job in jobs[:10]:
+      cache.Add(job, 1, cache.GetGeneration())
+    for _ in range(100):
+      for job in jobs[5:10]:
+        self.assertEqual(cache.Get(job.id), job)
+    for job in jobs[10:15]:
+      cache.Add(job, 1, cache.GetGeneration())
+    for job in jobs[5:15]:
+      self.assertEqual(cache.Get(job.id), job)
+    for job in jobs[:5]:
+      self.assertEqual(cache.Get(job.id), None)
+
+  def testRemove(self):
+    cache = jqueue._FinishedJobsCache(max_entries=10, max_bytes=1000)
+    jobs = self._MakeJobs(3)
+    cache.Add(jobs[0], 10, cache.GetGeneration())
+    cache.Add(jobs[1], 10, cache.GetGeneration())
+
+    generation = cache.GetGeneration()
+    cache.Remove(["0", "unknown"])
+    self.assertEqual(cache.Get("0"), None)
+    self.assertEqual(cache.Get("1"), jobs[1])
+    self.assertEqual(cache.GetStats()["bytes"], 10)
+
+    # Read before the removal, e.g. while the job was being archived
+    cache.Add(jobs[2], 10, generation)
+    self.assertEqual(cache.Get("2"), None)
+    cache.Add(jobs[2], 10, cache.GetGeneration())
+    self.assertEqual(cache.Get("2"), jobs[2])
+
+
+def _MakeIndexJob(job_id, finished):
+  job = jqueue._QueuedJob(None, job_id,
+                          [opcodes.OpTestDelay(duration=1),
+                           opcodes.OpTagsGet()])
+  if finished:
+    job.MarkUnfinishedOps(constants.OP_STATUS_SUCCESS, None)
+    job.start_timestamp = job.received_timestamp
+    job.Finalize()
+  return job
+
+
+class TestJobIndex(unittest.TestCase):
+  _FIELDS = ["id", "status", "priority", "received_ts", "start_ts", "end_ts",
+             "summary"]
+
+  def _MakeJob(self, job_id, finished):
+    return _MakeIndexJob(job_id, finished)
+
+  def testUpdate(self):
+    index = jqueue._JobIndex()
+    job = self._MakeJob("1", False)
+    self.assertTrue(index.Update(job))
+    self.assertFalse(index.Update(job))
+    self.assertEqual(index.GetInfo("1", self._FIELDS),
+                     job.GetInfo(self._FIELDS))
+    self.assertFalse(index.IsFinalized("1"))
+
+    job.MarkUnfinishedOps(constants.OP_STATUS_ERROR, "error")
+    job.Finalize()
+    self.assertTrue(index.Update(job))
+    self.assertTrue(index.IsFinalized("1"))
+    self.assertEqual(index.GetInfo("1", ["status", "id"]),
+                     [constants.JOB_STATUS_ERROR, "1"])
+
+    self.assertEqual(index.GetInfo("2", ["id"]), None)
+    self.assertFalse(index.IsFinalized("2"))
+    self.assertEqual(len(index), 1)
+
+  def testRemove(self):
+    index = jqueue._JobIndex()
+    for job_id in ["1", "2", "3"]:
+      index.Update(self._MakeJob(job_id, False))
+    index.Remove(["2", "4"])
+    self.assertEqual(sorted(index.GetJobIDs()), ["1", "3"])
+    self.assertEqual(len(index), 2)
+
+  def testSaveAndLoad(self):
+    index = jqueue._JobIndex()
+    jobs = [self._MakeJob("1", True), self._MakeJob("2", False),
+            self._MakeJob("3", True)]
+    for job in jobs:
+      index.Update(job)
+
+    loaded = jqueue._JobIndex()
+    # Job 3 has been archived in the meantime
+    loaded.Load(index.Serialize(), ["1", "2"])
+
+    # Only finished jobs are saved
+    self.assertEqual(loaded.GetJobIDs(), ["1"])
+    self.assertTrue(loaded.IsFinalized("1"))
+    self.assertEqual(loaded.GetInfo("1", ["id", "status"]),
+                     ["1", constants.JOB_STATUS_SUCCESS])
+    self.assertEqual(loaded.GetInfo("1", ["summary"]),
+                     jobs[0].GetInfo(["summary"]))
+
+  def testLoadInvalid(self):
+    index = jqueue._JobIndex()
+    self.assertRaises(errors.JobQueueError, index.Load,
+                      serializer.DumpJson({ "version": 999, "jobs": {}, }),
+                      [])
+    self.assertRaises(errors.JobQueueError, index.Load,
+                      serializer.DumpJson({
+                        "version": 1,
+                        "jobs": {
+                          "1": { "status": constants.JOB_STATUS_SUCCESS, },
+                          },
+                        }), ["1"])
+    self.assertEqual(len(index), 0)
+
+
+class TestDelayedFlusher(unittest.TestCase):
+  def setUp(self):
+    self.flushes = 0
+
+  def _Flush(self):
+    self.flushes += 1
+    if self.flushes == 1:
+      raise errors.GenericError("First flush fails")
+
+  def testFlushError(self):
+    flusher = jqueue._DelayedFlusher(self._Flush, 0.01, "TestFlusher")
+    flusher.Start()
+    try:
+      flusher.Update(False)
+
+      for _ in range(500):
+        if self.flushes:
+          break
+        time.sleep(0.01)
+
+      # The background thread keeps running after an error
+      flusher.Update(False)
+
+      for _ in range(500):
+        if self.flushes > 1:
+          break
+        time.sleep(0.01)
+    finally:
+      flusher.Shutdown()
+
+    self.assertEqual(self.flushes, 2)
+
+
+class TestJobIndexWriter(unittest.TestCase):
+  def setUp(self):
+    self.writes = 0
+
+  def _Write(self):
+    self.writes += 1
+
+  def testSync(self):
+    writer = jqueue._JobIndexWriter(self._Write, delay=3600.0)
+    for _ in range(10):
+      writer.Update(False)
+    self.assertEqual(self.writes, 0)
+    writer.Update(True)
+    self.assertEqual(self.writes, 1)
+
+    # Nothing changed since
+    writer.Flush()
+    self.assertEqual(self.writes, 1)
+
+  def testAsync(self):
+    writer = jqueue._JobIndexWriter(self._Write, delay=0.05)
+    writer.Start()
+    try:
+      for _ in range(100):
+        writer.Update(False)
+
+      for _ in range(500):
+        if self.writes:
+          break
+        time.sleep(0.01)
+    finally:
+      writer.Shutdown()
+
+    self.assertEqual(self.writes, 1)
+
+  def testShutdownFlushes(self):
+    writer = jqueue._JobIndexWriter(self._Write, delay=3600.0)
+    writer.Start()
+    writer.Shutdown()
+    self.assertEqual(self.writes, 0)
+
+    writer = jqueue._JobIndexWriter(self._Write, delay=3600.0)
+    writer.Start()
+    writer.Update(False)
+    writer.Update(False)
+    writer.Shutdown()
+    self.assertEqual(self.writes, 1)
+
+
+class _FakeQueueForIndex(jqueue.JobQueue):
+  def __init__(self):
+    # pylint: disable-msg=W0231
+    self._lock = jqueue.locking.SharedLock("FakeQueue")
+    self._queue_filelock = object()
+    self._finished_jobs = jqueue._FinishedJobsCache()
+    self._index = jqueue._JobIndex()
+    self._index_writer = jqueue._JobIndexWriter(self._WriteJobIndexUnlocked,
+                                                delay=3600.0)
+    self._queue_size = 0
+    self.renames = []
+    self.index_writes = 0
+
+  def _UpdateJobQueueFile(self, file_name, data, replicate):
+    pass
+
+  def _RenameFilesUnlocked(self, rename):
+    self.renames.append(rename)
+
+  def _WriteJobIndexUnlocked(self):
+    self.index_writes += 1
+
+
+class TestJobQueueIndexWrites(unittest.TestCase):
+  def _MakeJob(self, job_id, finished):
+    return _MakeIndexJob(job_id, finished)
+
+  def testJobCompletion(self):
+    queue = _FakeQueueForIndex()
+
+    for job_id in range(1, 21):
+      job = self._MakeJob(str(job_id), False)
+      queue.UpdateJobUnlocked(job)
+      job.MarkUnfinishedOps(constants.OP_STATUS_SUCCESS, None)
+      job.Finalize()
+      queue.UpdateJobUnlocked(job)
+
+    # Writes of finished jobs are deferred
+    self.assertEqual(queue.index_writes, 0)
+    queue._index_writer.Flush()
+    self.assertEqual(queue.index_writes, 1)
+
+  def testAutoArchive(self):
+    queue = _FakeQueueForIndex()
+    for job_id in range(1, 26):
+      queue._index.Update(self._MakeJob(str(job_id), job_id != 7))
+
+    self.assertEqual(queue.AutoArchiveJobs(-1, 60), (24, 0))
+    self.assertEqual(len(queue.renames), 3)
+    self.assertEqual(queue.index_writes, 1)
+    self.assertEqual(queue._GetJobIDsUnlocked(), ["7"])
+
+    # Nothing left to archive
+    self.assertEqual(queue.AutoArchiveJobs(-1, 60), (0, 0))
+    self.assertEqual(queue.index_writes, 1)
+
+  def testArchiveJobs(self):
+    queue = _FakeQueueForIndex()
+    jobs = [self._MakeJob(str(job_id), True) for job_id in range(1, 6)]
+    jobs.append(self._MakeJob("6", False))
+    for job in jobs:
+      queue._index.Update(job)
+
+    self.assertEqual(queue._ArchiveJobsUnlocked(jobs), 5)
+    self.assertEqual(queue.index_writes, 1)
+
+    self.assertEqual(queue._ArchiveJobsUnlocked(jobs[5:]), 0)
+    self.assertEqual(queue.index_writes, 1)
+
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
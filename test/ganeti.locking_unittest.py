@@ -289,6 +289,143 @@ class TestSharedLock(_ThreadedTestCase):
     self.sl.release()
     self.assertFalse(self.sl._is_owned())
 
+  def testTryAcquire(self):
+    self.assertTrue(self.sl._try_acquire(1, time.time()))
+    self.assertTrue(self.sl._is_owned(shared=1))
+
+    # Another shared acquire doesn't have to wait
+    result = []
+    self._addThread(target=lambda: result.append(
+      self.sl._try_acquire(1, time.time()) and self.sl.release()))
+    self._addThread(target=lambda: result.append(
+      self.sl._try_acquire(0, time.time())))
+    self._waitThreads()
+    self.assertEqual(result, [None, False])
+
+    self.sl.release()
+    self.assertTrue(self.sl._try_acquire(0, time.time()))
+    self.assertTrue(self.sl._is_owned(shared=0))
+    self.assertEqual(self._GetStats()["acquired"], 3)
+
+    # Pending acquires go first
+    self._addThread(target=lambda: self.sl.acquire(shared=1) and
+                    self.done.put(self.sl.release()))
+    while self.sl._count_pending() == 0:
+      time.sleep(0.001)
+    self.sl.release()
+    self._waitThreads()
+    self.assertEqual(self.done.get_nowait(), None)
+
+    self.sl.delete()
+    self.assertFalse(self.sl._try_acquire(0, time.time()))
+
+  def _GetStats(self):
+    (_, _, _, _, stats) = self.sl.GetInfo(set([query.LQ_STATS]))
+    return stats
+
+  def testStats(self):
+    stats = self._GetStats()
+    self.assertEqual(stats["acquired"], 0)
+    self.assertEqual(stats["wait_p99"], 0.0)
+    self.assertEqual(stats["hold_time"], 0.0)
+
+    self.sl.acquire(shared=1)
+    self.sl.release()
+    self.sl.acquire()
+    self.assertFalse(self._TimedAcquire(self.sl, None, shared=1))
+    SafeSleep(0.01)
+    self.sl.release()
+
+    stats = self._GetStats()
+    self.assertEqual(stats["acquired"], 2)
+    self.assertEqual(stats["acquired_shared"], 1)
+    self.assertEqual(stats["acquired_exclusive"], 1)
+    self.assertEqual(stats["timeouts"], 1)
+    self.assertTrue(stats["wait_time"] >= 0.01)
+    self.assertTrue(stats["wait_p99"] >= 0.01)
+    self.assertTrue(stats["hold_time"] >= 0.02)
+    self.assertTrue(stats["hold_p99"] >= 0.02)
+    self.assertTrue(stats["hold_p99"] <= stats["hold_time"])
+
+    self.sl.ResetStats()
+    stats = self._GetStats()
+    self.assertEqual(stats["acquired"], 0)
+    self.assertEqual(stats["timeouts"], 0)
+    self.assertEqual(stats["wait_time"], 0.0)
+
+  def _TimedAcquire(self, lock, release_fn, shared=0):
+    result = []
+    self._addThread(target=lambda: result.append(
+      lock.acquire(shared=shared, timeout=0.01, release_fn=release_fn)))
+    self._waitThreads()
+    return result[0]
+
+  def testReleaseFn(self):
+    released = []
+
+    self.sl.acquire(shared=1)
+    self.assertFalse(self._TimedAcquire(self.sl,
+                                        compat.partial(released.append, 1)))
+    self.assertFalse(released)
+
+    self.sl.release()
+    self.assertEqual(released, [1])
+
+    # Functions are only called once
+    self.sl.acquire()
+    self.sl.release()
+    self.assertEqual(released, [1])
+
+  def testReleaseFnNotUsedOnSuccess(self):
+    released = []
+    self.assertTrue(self.sl.acquire(timeout=0.01,
+                                    release_fn=compat.partial(released.append,
+                                                              1)))
+    self.sl.release()
+    self.assertFalse(released)
+
+  def testReleaseFnDelete(self):
+    released = []
+
+    self.sl.acquire()
+    self.assertFalse(self._TimedAcquire(self.sl,
+                                        compat.partial(released.append, 1),
+                                        shared=1))
+    self.assertFalse(released)
+
+    self.sl.delete()
+    self.assertEqual(released, [1])
+
+  def testReleaseFnDowngrade(self):
+    released = []
+
+    self.sl.acquire()
+    self.assertFalse(self._TimedAcquire(self.sl,
+                                        compat.partial(released.append, 1),
+                                        shared=1))
+    self.assertFalse(released)
+
+    self.sl.downgrade()
+    self.assertEqual(released, [1])
+    self.assertTrue(self._TimedAcquire(self.sl, None, shared=1))
+    self.sl.release()
+
+  def testReleaseFnError(self):
+    released = []
+
+    def _Fail():
+      raise Exception("Notification failed")
+
+    self.sl.acquire()
+    self.assertFalse(self._TimedAcquire(self.sl, _Fail))
+    self.assertFalse(self._TimedAcquire(self.sl,
+                                        compat.partial(released.append, 2)))
+
+    # Errors must not prevent the release or other notifications
+    self.sl.release()
+    self.assertEqual(released, [2])
+    self.assertFalse(self.sl._is_owned())
+
   def testBooleanValue(self):
     # semaphores are supposed to return a true value on a successful acquire
     self.assert_(self.sl.acquire(shared=1))
@@ -690,8 +827,9 @@ class TestSharedLock(_ThreadedTestCase):
 
     # Check lock information
     self.assertEqual(self.sl.GetInfo(set([query.LQ_MODE, query.LQ_OWNER])),
-                     (self.sl.name, "exclusive", [th_excl1.getName()], None))
-    (_, _, _, pending) = self.sl.GetInfo(set([query.LQ_PENDING]))
+                     (self.sl.name, "exclusive", [th_excl1.getName()], None,
+                      None))
+    (_, _, _, pending, _) = self.sl.GetInfo(set([query.LQ_PENDING]))
     self.assertEqual([(pendmode, sorted(waiting))
                       for (pendmode, waiting) in pending],
                      [("exclusive", [th_excl2.getName()]),
@@ -707,8 +845,8 @@ class TestSharedLock(_ThreadedTestCase):
     # Check lock information again
     self.assertEqual(self.sl.GetInfo(set([query.LQ_MODE, query.LQ_PENDING])),
                      (self.sl.name, "shared", None,
-                      [("exclusive", [th_excl2.getName()])]))
-    (_, _, owner, _) = self.sl.GetInfo(set([query.LQ_OWNER]))
+                      [("exclusive", [th_excl2.getName()])], None))
+    (_, _, owner, _, _) = self.sl.GetInfo(set([query.LQ_OWNER]))
     self.assertEqual(set(owner), set([th_excl1.getName()] +
                                      [th.getName() for th in th_shared]))
 
@@ -720,7 +858,7 @@ class TestSharedLock(_ThreadedTestCase):
 
     self.assertEqual(self.sl.GetInfo(set([query.LQ_MODE, query.LQ_OWNER,
                                           query.LQ_PENDING])),
-                     (self.sl.name, None, None, []))
+                     (self.sl.name, None, None, [], None))
 
   @_Repeat
   def testMixedAcquireTimeout(self):
@@ -887,10 +1025,11 @@ class TestSharedLock(_ThreadedTestCase):
     prev.wait()
 
     # Check lock information
-    self.assertEqual(self.sl.GetInfo(set()), (self.sl.name, None, None, None))
+    self.assertEqual(self.sl.GetInfo(set()),
+                     (self.sl.name, None, None, None, None))
     self.assertEqual(self.sl.GetInfo(set([query.LQ_MODE, query.LQ_OWNER])),
                      (self.sl.name, "exclusive",
-                      [threading.currentThread().getName()], None))
+                      [threading.currentThread().getName()], None, None))
 
     self._VerifyPrioPending(self.sl.GetInfo(set([query.LQ_PENDING])), perprio)
 
@@ -913,7 +1052,7 @@ class TestSharedLock(_ThreadedTestCase):
 
     self.assertRaises(Queue.Empty, self.done.get_nowait)
 
-  def _VerifyPrioPending(self, (name, mode, owner, pending), perprio):
+  def _VerifyPrioPending(self, (name, mode, owner, pending, _), perprio):
     self.assertEqual(name, self.sl.name)
     self.assert_(mode is None)
     self.assert_(owner is None)
@@ -927,6 +1066,31 @@ class TestSharedLock(_ThreadedTestCase):
                       for (shared, _, threads) in acquires])
 
 
+class TestTimeHistogram(unittest.TestCase):
+  def testEmpty(self):
+    hist = locking._TimeHistogram()
+    self.assertEqual(hist.count, 0)
+    self.assertEqual(hist.GetPercentile(0.99), 0.0)
+
+  def testPercentile(self):
+    hist = locking._TimeHistogram()
+    for _ in range(99):
+      hist.Add(0.0001)
+    self.assertEqual(hist.GetPercentile(0.99), 0.0001)
+
+    hist.Add(0.01)
+    self.assertEqual(hist.GetPercentile(0.99), 0.001)
+    self.assertEqual(hist.GetPercentile(1.0), 0.01)
+    self.assertEqual(hist.count, 100)
+    self.assertAlmostEqual(hist.total, 0.0199)
+
+    # Beyond the largest bucket
+    for _ in range(100):
+      hist.Add(5000.0)
+    self.assertEqual(hist.GetPercentile(0.99), 5000.0)
+    self.assertEqual(hist.maximum, 5000.0)
+
+
 class TestSharedLockInCondition(_ThreadedTestCase):
   """SharedLock as a condition lock tests"""
 
@@ -1027,6 +1191,85 @@ class TestLockSet(_ThreadedTestCase):
     self.resources = ['one', 'two', 'three']
     self.ls = locking.LockSet(self.resources, "TestLockSet")
 
+  def testReleaseFn(self):
+    released = []
+    result = []
+
+    self.assertEqual(self.ls.acquire(["two"]), set(["two"]))
+
+    self._addThread(target=lambda: result.append(
+      self.ls.acquire(["one", "two", "three"], timeout=0.01,
+                      release_fn=compat.partial(released.append, 1))))
+    self._waitThreads()
+
+    self.assertEqual(result, [None])
+    self.assertFalse(released)
+
+    self.ls.release()
+    self.assertEqual(released, [1])
+
+  def testContendedAcquire(self):
+    ev_acquired = threading.Event()
+    ev_release = threading.Event()
+
+    def _HoldLock():
+      self.ls.acquire(["two"], shared=1)
+      ev_acquired.set()
+      ev_release.wait()
+      self.ls.release()
+
+    self._addThread(target=_HoldLock)
+    ev_acquired.wait()
+
+    # "one" is granted right away, but "two" is contended
+    self.assertEqual(self.ls.acquire(["one", "two", "three"], timeout=0.01),
+                     None)
+    self.assertFalse(self.ls._is_owned())
+    self.assertEqual(self.ls.acquire(["one", "three"], timeout=0),
+                     set(["one", "three"]))
+    self.ls.release()
+
+    self.assertEqual(self.ls.acquire(["one", "two", "three"], shared=1,
+                                     timeout=0),
+                     set(["one", "two", "three"]))
+    self.ls.release()
+
+    self._addThread(target=lambda: self.done.put(
+      self.ls.acquire(None, shared=0) and self.ls.release()))
+    ev_release.set()
+    self._waitThreads()
+    self.assertEqual(self.done.get_nowait(), None)
+
+  def testStats(self):
+    (name, mode, owners, pending, stats) = \
+      self.ls.GetInfo(set([query.LQ_MODE, query.LQ_STATS]))
+    self.assertEqual((name, mode, owners, pending),
+                     (self.ls.name, None, None, None))
+    self.assertEqual(stats["acquired"], 0)
+
+    self.ls.acquire(["one", "two"])
+    self.ls.release(["one"])
+    SafeSleep(0.01)
+    self.ls.release()
+
+    self.ls.acquire(None, shared=1)
+    self._addThread(target=lambda: self.done.put(self.ls.acquire(["two"],
+                                                                 timeout=0)))
+    self._waitThreads()
+    self.assertEqual(self.done.get_nowait(), None)
+    self.ls.release()
+
+    (_, _, _, _, stats) = self.ls.GetInfo(set([query.LQ_STATS]))
+    self.assertEqual(stats["acquired"], 2)
+    self.assertEqual(stats["acquired_shared"], 1)
+    self.assertEqual(stats["timeouts"], 1)
+    self.assertTrue(stats["hold_time"] >= 0.01)
+
+    # Statistics are kept per set, member locks have their own
+    self.ls.ResetStats()
+    (_, _, _, _, stats) = self.ls.GetInfo(set([query.LQ_STATS]))
+    self.assertEqual(stats["acquired"], 0)
+
   def testResources(self):
     self.assertEquals(self.ls._names(), set(self.resources))
     newls = locking.LockSet([], "TestLockSet.testResources")
@@ -2155,5 +2398,33 @@ class TestLockMonitor(_ThreadedTestCase):
     self.assertEqual(objects.QueryResponse.FromDict(result).data, [])
 
 
+  def testLockSetStats(self):
+    ls = locking.LockSet(["a", "b"], "set", monitor=self.lm)
+
+    ls.acquire(["a"])
+    ls.release()
+    ls.acquire(None, shared=1)
+    ls.release()
+
+    result = self.lm.QueryLocks(["name", "acquired", "acquired_shared"])
+    self.assertEqual(objects.QueryResponse.FromDict(result).data,
+                     [[(constants.RS_NORMAL, name),
+                       (constants.RS_NORMAL, acquired),
+                       (constants.RS_NORMAL, shared)]
+                      for (name, acquired, shared) in [
+                        ("set", 2, 1),
+                        ("set/[lockset]", 1, 1),
+                        ("set/a", 2, 1),
+                        ("set/b", 1, 1),
+                        ]])
+
+    self.lm.ResetLockStats()
+
+    result = self.lm.QueryLocks(["acquired", "timeouts", "wait_time"])
+    self.assertEqual(objects.QueryResponse.FromDict(result).data,
+                     [[(constants.RS_NORMAL, 0), (constants.RS_NORMAL, 0),
+                       (constants.RS_NORMAL, 0.0)]] * 4)
+
+
 if __name__ == '__main__':
   testutils.GanetiTestProgram()
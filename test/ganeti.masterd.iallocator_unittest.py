@@ -0,0 +1,238 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for testing ganeti.masterd.iallocator"""
+
+import os
+import sys
+import signal
+import shutil
+import tempfile
+import unittest
+
+from ganeti import serializer
+from ganeti import utils
+from ganeti.masterd import iallocator
+
+import testutils
+
+
+_PERSISTENT_ALLOCATOR = """#!%(python)s
+import os
+import sys
+import json
+import socket
+
+path = sys.argv[1][len("--socket="):]
+sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+sock.bind(path)
+sock.listen(1)
+(conn, _) = sock.accept()
+
+buf = ""
+state = None
+count = 0
+while True:
+  data = conn.recv(4096)
+  if not data:
+    break
+  buf += data
+  while "\\3" in buf:
+    (msg, buf) = buf.split("\\3", 1)
+    req = json.loads(msg)
+    if "protocol" in req:
+      reply = { "protocol": 1, }
+    else:
+      if "cluster" in req:
+        state = req["cluster"]
+      else:
+        state.update(req["update"])
+        for (key, items) in req["update_items"].items():
+          state[key].update(items)
+        for (key, names) in req["remove_items"].items():
+          for name in names:
+            del state[key][name]
+      count += 1
+      reply = {
+        "success": True,
+        "info": "",
+        "result": {
+          "state": state,
+          "count": count,
+          "full": "cluster" in req,
+          "pid": os.getpid(),
+          "request": req["request"],
+          },
+        }
+    conn.sendall(json.dumps(reply) + "\\3")
+"""
+
+_ONESHOT_ALLOCATOR = """#!/bin/sh
+echo x >> %(counter)s
+exit 1
+"""
+
+
+class TestComputeUpdate(unittest.TestCase):
+  def testFull(self):
+    data = {
+      "cluster_name": "cluster.example.com",
+      "nodes": { "node1": {}, },
+      }
+    self.assertEqual(iallocator.ComputeUpdate(None, data), {
+      "cluster": data,
+      })
+
+  def testUnchanged(self):
+    data = {
+      "cluster_name": "cluster.example.com",
+      "nodes": { "node1": { "free_memory": 1024, }, },
+      }
+    self.assertEqual(iallocator.ComputeUpdate(data, data), {
+      "update": {},
+      "update_items": {},
+      "remove_items": {},
+      })
+
+  def testChanges(self):
+    old = {
+      "cluster_tags": [],
+      "cluster_name": "cluster.example.com",
+      "nodes": {
+        "node1": { "free_memory": 1024, },
+        "node2": { "free_memory": 2048, },
+        "node3": { "free_memory": 4096, },
+        },
+      "instances": {
+        "inst1": { "memory": 128, },
+        },
+      }
+    new = {
+      "cluster_tags": ["tag"],
+      "cluster_name": "cluster.example.com",
+      "nodes": {
+        "node1": { "free_memory": 512, },
+        "node3": { "free_memory": 4096, },
+        "node4": { "free_memory": 8192, },
+        },
+      "instances": {
+        "inst1": { "memory": 128, },
+        },
+      "nodegroups": {},
+      }
+    self.assertEqual(iallocator.ComputeUpdate(old, new), {
+      "update": {
+        "cluster_tags": ["tag"],
+        "nodegroups": {},
+        },
+      "update_items": {
+        "nodes": {
+          "node1": { "free_memory": 512, },
+          "node4": { "free_memory": 8192, },
+          },
+        },
+      "remove_items": {
+        "nodes": ["node2"],
+        },
+      })
+
+
+class TestPersistentAllocators(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.counter = utils.PathJoin(self.tmpdir, "counter")
+
+    utils.WriteFile(utils.PathJoin(self.tmpdir, "persistent"), mode=0700,
+                    data=_PERSISTENT_ALLOCATOR % { "python": sys.executable, })
+    utils.WriteFile(utils.PathJoin(self.tmpdir, "oneshot"), mode=0700,
+                    data=_ONESHOT_ALLOCATOR % { "counter": self.counter, })
+
+    self.allocators = \
+      iallocator.PersistentAllocators(socket_dir=self.tmpdir,
+                                      search_path=[self.tmpdir])
+
+  def tearDown(self):
+    self.allocators.Shutdown()
+    shutil.rmtree(self.tmpdir)
+
+  def _Run(self, name, cluster, request):
+    data = cluster.copy()
+    data["request"] = request
+    result = self.allocators.Run(name, data)
+    if result is None:
+      return None
+    return serializer.LoadJson(result)["result"]
+
+  def test(self):
+    cluster = {
+      "cluster_name": "cluster.example.com",
+      "nodes": {
+        "node1": { "free_memory": 1024, },
+        "node2": { "free_memory": 2048, },
+        },
+      }
+
+    result = self._Run("persistent", cluster, { "type": "allocate", })
+    self.assertEqual(result["count"], 1)
+    self.assertTrue(result["full"])
+    self.assertEqual(result["state"], cluster)
+    self.assertEqual(result["request"], { "type": "allocate", })
+    pid = result["pid"]
+
+    cluster["nodes"]["node1"] = { "free_memory": 512, }
+    del cluster["nodes"]["node2"]
+    cluster["cluster_tags"] = ["tag"]
+
+    result = self._Run("persistent", cluster, { "type": "relocate", })
+    self.assertEqual(result["count"], 2)
+    self.assertFalse(result["full"])
+    self.assertEqual(result["state"], cluster)
+    self.assertEqual(result["request"], { "type": "relocate", })
+    self.assertEqual(result["pid"], pid)
+
+    # Allocator is restarted if it died
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+    result = self._Run("persistent", cluster, { "type": "allocate", })
+    self.assertEqual(result["count"], 1)
+    self.assertTrue(result["full"])
+    self.assertEqual(result["state"], cluster)
+    self.assertNotEqual(result["pid"], pid)
+
+  def testNotSupported(self):
+    for _ in range(3):
+      self.assertEqual(self._Run("oneshot", {}, {}), None)
+
+    # Only tried once
+    self.assertEqual(utils.ReadFile(self.counter), "x\n")
+
+  def testNotFound(self):
+    self.assertEqual(self._Run("missing", {}, {}), None)
+
+
+class TestNotInitialized(unittest.TestCase):
+  def test(self):
+    self.assertEqual(iallocator.Run("hail", {}), None)
+
+
+if __name__ == "__main__":
+  testutils.GanetiTestProgram()
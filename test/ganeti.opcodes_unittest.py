@@ -31,6 +31,7 @@ from ganeti import ht
 from ganeti import constants
 from ganeti import errors
 from ganeti import compat
+from ganeti import serializer
 
 import testutils
 
@@ -273,5 +274,56 @@ class TestOpcodes(unittest.TestCase):
     self.assertEqual(op.debug_level, 123)
 
 
+
+class TestOpInstanceMultiAlloc(unittest.TestCase):
+  def testSerialization(self):
+    inst1 = opcodes.OpInstanceCreate(instance_name="inst1.example.com",
+                                     mode=constants.INSTANCE_CREATE,
+                                     disk_template=constants.DT_PLAIN,
+                                     disks=[{ constants.IDISK_SIZE: 1024, }],
+                                     nics=[{}])
+    inst2 = opcodes.OpInstanceCreate(instance_name="inst2.example.com",
+                                     mode=constants.INSTANCE_CREATE,
+                                     disk_template=constants.DT_DRBD8,
+                                     disks=[], nics=[], start=False)
+    op = opcodes.OpInstanceMultiAlloc(iallocator="hail",
+                                      instances=[inst1, inst2])
+    op.Validate(True)
+
+    state = op.__getstate__()
+    self.assertEqual(state["instances"],
+                     [inst1.__getstate__(), inst2.__getstate__()])
+
+    # Must be serializable
+    state = serializer.LoadJson(serializer.DumpJson(state))
+
+    restored = opcodes.OpCode.LoadOpCode(state)
+    self.assertTrue(isinstance(restored, opcodes.OpInstanceMultiAlloc))
+    self.assertEqual(restored.iallocator, "hail")
+    self.assertFalse(restored.allow_failure)
+    self.assertEqual(len(restored.instances), 2)
+    for (orig, inst) in zip([inst1, inst2], restored.instances):
+      self.assertTrue(isinstance(inst, opcodes.OpInstanceCreate))
+      self.assertEqual(inst.__getstate__(), orig.__getstate__())
+    restored.Validate(False)
+
+  def testValidate(self):
+    op = opcodes.OpInstanceMultiAlloc(instances=[opcodes.OpTestDelay()])
+    self.assertRaises(errors.OpPrereqError, op.Validate, True)
+
+    # Creation opcodes are validated too
+    inst = opcodes.OpInstanceCreate(instance_name="inst1.example.com")
+    op = opcodes.OpInstanceMultiAlloc(instances=[inst])
+    self.assertRaises(errors.OpPrereqError, op.Validate, False)
+
+    inst = opcodes.OpInstanceCreate(instance_name="inst1.example.com",
+                                    mode=constants.INSTANCE_CREATE,
+                                    disk_template=constants.DT_PLAIN,
+                                    disks=[], nics=[])
+    op = opcodes.OpInstanceMultiAlloc(instances=[inst])
+    op.Validate(True)
+    self.assertEqual(inst.iallocator, None)
+    self.assertEqual(inst.start, True)
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
@@ -548,6 +548,30 @@ class TestNodeQuery(unittest.TestCase):
                                              ctx, nodes[4]),
                      query._FS_UNAVAIL, None)
 
+  def testLiveDataAge(self):
+    nodes = [
+      objects.Node(name="node1", offline=False, vm_capable=True),
+      objects.Node(name="node2", offline=False, vm_capable=True),
+      objects.Node(name="node3", offline=True, vm_capable=True),
+      ]
+    live_data = {
+      "node1": { "mfree": 1024, },
+      }
+    live_data_age = {
+      "node1": 12.5,
+      }
+
+    q = query.Query(query.NODE_FIELDS, ["name", "live_age"])
+    self.assertEqual(q.RequestedData(), set([query.NQ_CONFIG, query.NQ_LIVE]))
+
+    nqd = query.NodeQueryData(nodes, live_data, None, None, None, None, None,
+                              None, live_data_age=live_data_age)
+    self.assertEqual(q.Query(nqd), [
+      [(constants.RS_NORMAL, "node1"), (constants.RS_NORMAL, 12)],
+      [(constants.RS_NORMAL, "node2"), (constants.RS_NODATA, None)],
+      [(constants.RS_NORMAL, "node3"), (constants.RS_OFFLINE, None)],
+      ])
+
 
 class TestInstanceQuery(unittest.TestCase):
   def _Create(self, selected):
@@ -1626,5 +1650,91 @@ class TestQueryFilter(unittest.TestCase):
                       filter_=["=~", "name", r"["])
 
 
+class TestQueryPage(unittest.TestCase):
+  def setUp(self):
+    self.fielddefs = query._PrepareFieldList([
+      (query._MakeField("name", "Name", constants.QFT_TEXT, "Name"),
+       None, 0, lambda ctx, item: item["name"]),
+      (query._MakeField("num", "Num", constants.QFT_NUMBER, "Num"),
+       None, 0, lambda ctx, item: item["num"]),
+      ], [])
+
+    self.data = [{ "name": "node%s" % (idx % 17), "num": idx, }
+                 for idx in range(50)]
+    random.shuffle(self.data)
+
+  def _GetAllPages(self, q, limit, sort_by_name):
+    result = []
+    cursor = None
+    while True:
+      (rows, cursor) = q.QueryPage(self.data, sort_by_name=sort_by_name,
+                                   limit=limit, cursor=cursor)
+      self.assertTrue(len(rows) <= limit)
+      result.extend(rows)
+      if cursor is None:
+        break
+      self.assertEqual(len(rows), limit)
+    return result
+
+  def testPages(self):
+    for namefield in ["name", None]:
+      for sort_by_name in [False, True]:
+        for filter_ in [None, ["!", ["=", "name", "node3"]]]:
+          q = query.Query(self.fielddefs, ["name", "num"], filter_=filter_,
+                          namefield=namefield)
+          expected = q.Query(self.data, sort_by_name=sort_by_name)
+          self.assertTrue(expected)
+          for limit in [1, 2, 3, 7, 17, 39, 40, 50, 100]:
+            self.assertEqual(self._GetAllPages(q, limit, sort_by_name),
+                             expected)
+
+  def testNoLimit(self):
+    q = query.Query(self.fielddefs, ["num"], namefield="name")
+    self.assertEqual(q.QueryPage(self.data), (q.Query(self.data), None))
+
+    (first, cursor) = q.QueryPage(self.data, limit=10)
+    (rest, next_cursor) = q.QueryPage(self.data, cursor=cursor)
+    self.assertEqual(next_cursor, None)
+    self.assertEqual(first + rest, q.Query(self.data))
+
+  def testItemsChanged(self):
+    data = [{ "name": "node%s" % idx, "num": idx, } for idx in range(10)]
+    q = query.Query(self.fielddefs, ["name"], namefield="name")
+
+    (rows, cursor) = q.QueryPage(data, limit=5)
+    self.assertEqual([row[0][1] for row in rows],
+                     ["node0", "node1", "node2", "node3", "node4"])
+
+    # Items before the cursor were removed or added
+    del data[1]
+    data.append({ "name": "node2a", "num": 100, })
+
+    (rows, cursor) = q.QueryPage(data, limit=5, cursor=cursor)
+    self.assertEqual([row[0][1] for row in rows],
+                     ["node5", "node6", "node7", "node8", "node9"])
+    self.assertEqual(cursor, None)
+
+  def testInvalidCursor(self):
+    q = query.Query(self.fielddefs, ["name"], namefield="name")
+    for cursor in ["node1", "x:node1", "0:node1", "-1:node1"]:
+      self.assertRaises(errors.OpPrereqError, q.QueryPage, self.data,
+                        cursor=cursor)
+    self.assertRaises(errors.OpPrereqError, q.QueryPage, self.data,
+                      sort_by_name=False, cursor="node1")
+
+  def testResponse(self):
+    q = query.Query(self.fielddefs, ["name"], namefield="name")
+
+    response = objects.QueryResponse.FromDict(query.GetQueryResponse(q,
+                                                                     self.data))
+    self.assertEqual(len(response.data), len(self.data))
+    self.assertEqual(response.cursor, None)
+
+    response = objects.QueryResponse.FromDict(query.GetQueryResponse(q,
+      self.data, limit=20))
+    self.assertEqual(len(response.data), 20)
+    self.assertTrue(response.cursor)
+
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
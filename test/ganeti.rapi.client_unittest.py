@@ -555,6 +555,29 @@ class GanetiRapiClientTests(testutils.GanetiTestCase):
     self.assertEqualValues(data["disks"], [{"size": 100,}])
     self.assertEqualValues(data["nics"], [{}, {"bridge": "br1", }])
 
+  def testInstancesMultiAlloc(self):
+    instances = [
+      { "mode": "create", "name": "inst1.example.com",
+        "disk_template": "plain", "disks": [{"size": 1024, }], "nics": [],
+        },
+      { "mode": "create", "name": "inst2.example.com",
+        "disk_template": "drbd", "disks": [], "nics": [{}],
+        },
+      ]
+
+    self.rapi.AddResponse("9123")
+    job_id = self.client.InstancesMultiAlloc(instances, iallocator="hail",
+                                             dry_run=True)
+    self.assertEqual(job_id, 9123)
+    self.assertHandler(rlib2.R_2_instances_multi_alloc)
+    self.assertDryRun()
+
+    data = serializer.LoadJson(self.rapi.GetLastRequestData())
+    self.assertEqual(data, {
+      "instances": instances,
+      "iallocator": "hail",
+      })
+
   def testDeleteInstance(self):
     self.rapi.AddResponse("1234")
     self.assertEqual(1234, self.client.DeleteInstance("instance", dry_run=True))
@@ -1165,6 +1188,16 @@ class GanetiRapiClientTests(testutils.GanetiTestCase):
           self.assertEqual(data["filter"], filter_)
         self.assertEqual(self.rapi.CountPending(), 0)
 
+  def testQueryPage(self):
+    self.rapi.AddResponse("{}")
+    self.client.Query(constants.QR_INSTANCE, ["name"], limit=100,
+                      cursor="1:inst1.example.com")
+    self.assertHandler(rlib2.R_2_query)
+    data = serializer.LoadJson(self.rapi.GetLastRequestData())
+    self.assertEqual(data["limit"], 100)
+    self.assertEqual(data["cursor"], "1:inst1.example.com")
+    self.assertEqual(self.rapi.CountPending(), 0)
+
   def testQueryFields(self):
     exp_result = objects.QueryFieldsResponse(fields=[
       objects.QueryFieldDefinition(name="pnode", title="PNode",
@@ -229,6 +229,63 @@ class TestParseInstanceCreateRequestVersion1(testutils.GanetiTestCase):
         self.assertRaises(http.HttpBadRequest, self.Parse, data, False)
 
 
+class TestParseInstanceMultiAllocRequest(unittest.TestCase):
+  def setUp(self):
+    self.Parse = rlib2._ParseInstanceMultiAllocRequest
+
+  def test(self):
+    instances = [{
+      "name": "inst%s.example.com" % i,
+      "mode": constants.INSTANCE_CREATE,
+      "disk_template": constants.DT_PLAIN,
+      "os": "debootstrap",
+      "disks": [{ "size": 1024, }],
+      "nics": [{}],
+      "beparams": { "memory": 512 * i, },
+      } for i in range(1, 4)]
+    instances[0][rlib2._REQ_DATA_VERSION] = 1
+
+    for dry_run in [False, True]:
+      op = self.Parse({
+        "instances": instances,
+        "iallocator": "hail",
+        "allow_failure": True,
+        }, dry_run)
+      self.assertTrue(isinstance(op, opcodes.OpInstanceMultiAlloc))
+      self.assertEqual(op.iallocator, "hail")
+      self.assertTrue(op.allow_failure)
+      self.assertEqual(op.dry_run, dry_run)
+      self.assertEqual(len(op.instances), len(instances))
+      for (i, inst) in enumerate(op.instances):
+        self.assertTrue(isinstance(inst, opcodes.OpInstanceCreate))
+        self.assertEqual(inst.instance_name, "inst%s.example.com" % (i + 1))
+        self.assertEqual(inst.os_type, "debootstrap")
+        self.assertEqual(inst.beparams, { "memory": 512 * (i + 1), })
+        self.assertFalse(inst.dry_run)
+
+  def testDefaults(self):
+    op = self.Parse({
+      "instances": [{
+        "name": "inst1.example.com",
+        "mode": constants.INSTANCE_CREATE,
+        "disk_template": constants.DT_DISKLESS,
+        "disks": [],
+        "nics": [],
+        }],
+      }, False)
+    self.assertTrue(isinstance(op, opcodes.OpInstanceMultiAlloc))
+    self.assertEqual(len(op.instances), 1)
+    self.assertFalse(hasattr(op, "iallocator"))
+    self.assertFalse(hasattr(op, "allow_failure"))
+
+  def testErrors(self):
+    for data in [{}, { "instances": None, }, { "instances": {}, },
+                 { "instances": ["inst1.example.com"], },
+                 { "instances": [{ "name": "inst1.example.com", }], },
+                 { "instances": [], "unknown": True, }]:
+      self.assertRaises(http.HttpBadRequest, self.Parse, data, False)
+
+
 class TestParseExportInstanceRequest(testutils.GanetiTestCase):
   def setUp(self):
     testutils.GanetiTestCase.setUp(self)
@@ -50,10 +50,12 @@ class FakeHttpPool:
     self._response_fn = response_fn
     self.reqcount = 0
 
-  def ProcessRequests(self, reqs):
+  def ProcessRequests(self, reqs, done_fn=None, deadline=None):
     for req in reqs:
       self.reqcount += 1
       self._response_fn(req)
+      if done_fn:
+        done_fn(req)
 
 
 def GetFakeSimpleStoreClass(fn):
@@ -121,6 +123,27 @@ class TestClient(unittest.TestCase):
 
     self.assertEqual(pool.reqcount, len(nodes))
 
+  def testMultiVersionCallback(self):
+    nodes = ["node%s" % i for i in range(10)]
+    fn = self._FakeAddressLookup(dict(zip(nodes, nodes)))
+    client = rpc.Client("version", None, 23245, address_lookup_fn=fn)
+    client.ConnectList(nodes)
+
+    received = []
+
+    def _Check(result):
+      # Results are passed on before all requests are finished
+      self.assertEqual(pool.reqcount, len(received) + 1)
+      received.append(result)
+
+    pool = FakeHttpPool(self._GetMultiVersionResponse)
+    result = client.GetResults(http_pool=pool, result_fn=_Check)
+    self.assertEqual(sorted(result.keys()), sorted(nodes))
+    self.assertEqual(sorted(r.node for r in received), sorted(nodes))
+    for lhresp in received:
+      self.assertTrue(result[lhresp.node] is lhresp)
+      self.assertEqual(lhresp.payload, 987)
+
   def _GetVersionResponseFail(self, req):
     self.assertEqual(req.path, "/version")
     req.success = True
@@ -273,5 +296,105 @@ class TestClient(unittest.TestCase):
     self.assertEqual(result, addr_list)
 
 
+class _FakeTime:
+  def __init__(self, now):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+class TestLiveDataCache(unittest.TestCase):
+  def setUp(self):
+    self.time_fn = _FakeTime(1000.0)
+    self.cache = rpc.LiveDataCache(30, _time_fn=self.time_fn)
+
+  def _Result(self, node, payload, call="node_info"):
+    return rpc.RpcResult(data=(True, payload), call=call, node=node)
+
+  def testLookup(self):
+    self.assertEqual(self.cache.Lookup("node1", "node_info", "[]", 10), None)
+
+    self.cache.Store(self._Result("node1", { "memory_free": 1024, }), "[]",
+                     995.0)
+    self.cache.Store(self._Result("node2", { "memory_free": 2048, }),
+                     "[\"xenvg\"]", 990.0)
+
+    result = self.cache.Lookup("node1", "node_info", "[]", 10)
+    self.assertEqual(result.node, "node1")
+    self.assertEqual(result.call, "node_info")
+    self.assertEqual(result.payload, { "memory_free": 1024, })
+    self.assertEqual(result.age, 5.0)
+    self.assertFalse(result.fail_msg)
+
+    # Arguments must match
+    self.assertEqual(self.cache.Lookup("node2", "node_info", "[]", 20), None)
+    self.assertEqual(self.cache.Lookup("node2", "all_instances_info",
+                                       "[\"xenvg\"]", 20), None)
+    self.assertEqual(self.cache.Lookup("node2", "node_info", "[\"xenvg\"]",
+                                       5), None)
+    self.assertEqual(self.cache.Lookup("node2", "node_info", "[\"xenvg\"]",
+                                       20).age, 10.0)
+
+    # Callers can modify the payload
+    result.payload["memory_free"] = 0
+    self.assertEqual(self.cache.Lookup("node1", "node_info", "[]",
+                                       10).payload,
+                     { "memory_free": 1024, })
+
+  def testExpiry(self):
+    self.cache.Store(self._Result("node1", {}), "[]", 1000.0)
+    self.assertTrue(self.cache.Lookup("node1", "node_info", "[]",
+                                      rpc.RpcRunner.LIVE_DATA_ANY_AGE))
+
+    # The time to live limits the maximum age
+    self.time_fn.now = 1031.0
+    self.assertEqual(self.cache.Lookup("node1", "node_info", "[]",
+                                       rpc.RpcRunner.LIVE_DATA_ANY_AGE), None)
+
+  def testFailedResults(self):
+    self.cache.Store(rpc.RpcResult(data="Error", failed=True, call="node_info",
+                                   node="node1"), "[]", 1000.0)
+    self.cache.Store(rpc.RpcResult(offline=True, call="node_info",
+                                   node="node2"), "[]", 1000.0)
+    self.cache.Store(self._Result("node3", None), "[]", 1000.0)
+    self.cache.Store(rpc.RpcResult(data=(False, "Error"), call="node_info",
+                                   node="node3"), "[]", 1000.0)
+
+    for node in ["node1", "node2"]:
+      self.assertEqual(self.cache.Lookup(node, "node_info", "[]", 10), None)
+
+    # The failed result didn't replace the successful one
+    self.assertEqual(self.cache.Lookup("node3", "node_info", "[]",
+                                       10).payload, None)
+
+  def testInvalidate(self):
+    for node in ["node1", "node2"]:
+      self.cache.Store(self._Result(node, {}), "[]", 1000.0)
+
+    self.time_fn.now = 1005.0
+    self.cache.InvalidateNodes(["node1"])
+    self.assertEqual(self.cache.Lookup("node1", "node_info", "[]", 10), None)
+    self.assertTrue(self.cache.Lookup("node2", "node_info", "[]", 10))
+
+    # A call started before the node was changed
+    self.cache.Store(self._Result("node1", {}), "[]", 1003.0)
+    self.assertEqual(self.cache.Lookup("node1", "node_info", "[]", 10), None)
+
+    # A call started afterwards
+    self.cache.Store(self._Result("node1", {}), "[]", 1006.0)
+    self.assertTrue(self.cache.Lookup("node1", "node_info", "[]", 10))
+
+    self.cache.Flush()
+    for node in ["node1", "node2"]:
+      self.assertEqual(self.cache.Lookup(node, "node_info", "[]", 10), None)
+
+  def testDisabled(self):
+    cache = rpc.LiveDataCache(0, _time_fn=self.time_fn)
+    cache.Store(self._Result("node1", {}), "[]", 1000.0)
+    self.assertEqual(cache.Lookup("node1", "node_info", "[]",
+                                  rpc.RpcRunner.LIVE_DATA_ANY_AGE), None)
+
+
 if __name__ == "__main__":
   testutils.GanetiTestProgram()
@@ -22,7 +22,14 @@
 """Script for unittesting the serializer module"""
 
 
+import re
 import unittest
+import simplejson
+
+try:
+  import json # pylint: disable-msg=F0401
+except ImportError:
+  json = None
 
 from ganeti import serializer
 from ganeti import errors
@@ -66,9 +73,42 @@ class TestSerializer(testutils.GanetiTestCase):
   def testJson(self):
     self._TestSerializer(serializer.DumpJson, serializer.LoadJson)
 
+  def testCompact(self):
+    self.assertEqual(serializer.DumpJson({ "b": [1, 2], "a": None, },
+                                         indent=False),
+                     "{\"a\":null,\"b\":[1,2]}\n")
+
+  def testIndent(self):
+    for data in self._TESTDATA:
+      txt = serializer.DumpJson(data, indent=True)
+      self.assertFalse(re.search(r"[ \t]+$", txt, re.MULTILINE))
+
+  def testEncoders(self):
+    encoders = [simplejson.JSONEncoder]
+    if json:
+      encoders.append(json.JSONEncoder)
+
+    for indent in [True, False]:
+      for data in self._TESTDATA:
+        expected = serializer.DumpJson(data, indent=indent)
+        for encoder_class in encoders:
+          dumpers = serializer._GetJsonDumpers(_encoder_class=encoder_class)
+          if indent:
+            fn = dumpers[1]
+          else:
+            fn = dumpers[0]
+          self.assertEqual(fn(data) + "\n", expected)
+
   def testSignedJson(self):
     self._TestSigned(serializer.DumpSignedJson, serializer.LoadSignedJson)
 
+  def testSignSerialized(self):
+    def _DumpFn(data, key, salt=None, key_selector=None):
+      return serializer.SignSerialized(serializer.DumpJson(data, indent=False),
+                                       key, salt=salt,
+                                       key_selector=key_selector)
+    self._TestSigned(_DumpFn, serializer.LoadSignedJson)
+
   def _TestSigned(self, dump_fn, load_fn):
     for data in self._TESTDATA:
       self.assertEqualValues(load_fn(dump_fn(data, "mykey"), "mykey"),
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for unittesting the ganeti.server.confd module"""
+
+
+import os
+import signal
+import time
+import unittest
+
+from ganeti.server import confd
+
+import testutils
+
+
+class _FakeScheduler:
+  def __init__(self):
+    self.events = []
+
+  def enter(self, delay, priority, action, argument):
+    self.events.append((delay, action, argument))
+
+
+class _FakeMainloop:
+  def __init__(self):
+    self.scheduler = _FakeScheduler()
+    self.signal_owners = []
+
+  def RegisterSignal(self, owner):
+    self.signal_owners.append(owner)
+
+
+def _SleepingWorker(options, parent_pid):
+  time.sleep(300)
+
+
+def _FailingWorker(options, parent_pid):
+  pass
+
+
+class TestConfdWorkers(unittest.TestCase):
+  def setUp(self):
+    self.mainloop = _FakeMainloop()
+    self.now = 1000.0
+    self.workers = None
+
+  def tearDown(self):
+    if self.workers:
+      for pid in self.workers._children:
+        try:
+          os.kill(pid, signal.SIGKILL)
+          os.waitpid(pid, 0)
+        except OSError:
+          pass
+
+  def _GetTime(self):
+    return self.now
+
+  def _Create(self, count, worker_fn):
+    self.workers = confd.ConfdWorkers(self.mainloop, None, count,
+                                      _worker_fn=worker_fn,
+                                      _time_fn=self._GetTime)
+    self.assertEqual(self.mainloop.signal_owners, [self.workers])
+    return self.workers
+
+  def _WaitForExit(self, workers, pid):
+    for _ in range(1000):
+      # Called by the main loop when a child process exits
+      workers.OnSignal(signal.SIGCHLD)
+      if pid not in workers._children:
+        return
+      time.sleep(0.01)
+
+    self.fail("Worker %s didn't exit" % pid)
+
+  def testReplaceWorker(self):
+    workers = self._Create(2, _SleepingWorker)
+    workers.Start()
+    children = sorted(workers._children)
+    self.assertEqual(len(children), 2)
+
+    # Running for a while before exiting
+    self.now += 3600
+    os.kill(children[0], signal.SIGKILL)
+    self._WaitForExit(workers, children[0])
+
+    # The worker was reaped and replaced immediately
+    self.assertRaises(OSError, os.waitpid, children[0], os.WNOHANG)
+    self.assertEqual(len(workers._children), 2)
+    self.assertTrue(children[1] in workers._children)
+    self.assertFalse(self.mainloop.scheduler.events)
+
+  def testUnrelatedSignal(self):
+    workers = self._Create(1, _SleepingWorker)
+    workers.Start()
+    children = workers._children.keys()
+
+    workers.OnSignal(signal.SIGCHLD)
+    workers.OnSignal(signal.SIGHUP)
+    self.assertEqual(workers._children.keys(), children)
+    self.assertFalse(self.mainloop.scheduler.events)
+
+  def testRestartBackoff(self):
+    workers = self._Create(1, _FailingWorker)
+
+    workers.Start()
+
+    delays = []
+    for _ in range(9):
+      self.assertEqual(len(workers._children), 1)
+      self._WaitForExit(workers, workers._children.keys()[0])
+
+      # Nothing is restarted before the delay has passed
+      self.assertFalse(workers._children)
+      workers.OnSignal(signal.SIGCHLD)
+      self.assertEqual(len(self.mainloop.scheduler.events), 1)
+
+      (delay, fn, args) = self.mainloop.scheduler.events.pop()
+      delays.append(delay)
+
+      # Restarts the worker
+      self.now += delay
+      fn(*args)
+
+    self.assertEqual(delays, [1, 2, 4, 8, 16, 32, 60, 60, 60])
+
+    # Once a worker ran for a while, it's restarted immediately again
+    self.assertEqual(len(workers._children), 1)
+    self.now += 3600
+    self._WaitForExit(workers, workers._children.keys()[0])
+    self.assertEqual(len(workers._children), 1)
+    self.assertFalse(self.mainloop.scheduler.events)
+
+  def testSigterm(self):
+    workers = self._Create(3, _SleepingWorker)
+    workers.Start()
+    children = workers._children.keys()
+    self.assertEqual(len(children), 3)
+
+    workers.OnSignal(signal.SIGTERM)
+
+    for pid in children:
+      (_, status) = os.waitpid(pid, 0)
+      self.assertTrue(os.WIFSIGNALED(status))
+      self.assertEqual(os.WTERMSIG(status), signal.SIGTERM)
+
+    # Workers aren't restarted while stopping
+    workers.OnSignal(signal.SIGCHLD)
+    self.assertFalse(workers._children)
+    self.assertFalse(self.mainloop.scheduler.events)
+
+  def testStoppingDuringDelay(self):
+    workers = self._Create(1, _FailingWorker)
+    workers.Start()
+    self._WaitForExit(workers, workers._children.keys()[0])
+
+    (_, fn, args) = self.mainloop.scheduler.events.pop()
+    workers.OnSignal(signal.SIGTERM)
+    fn(*args)
+    self.assertFalse(workers._children)
+
+
+if __name__ == "__main__":
+  testutils.GanetiTestProgram()
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for unittesting the ganeti.server.noded module"""
+
+
+import unittest
+
+from ganeti import http
+from ganeti.server import noded
+
+import testutils
+
+
+class _FakeMainloop:
+  def RegisterSignal(self, owner):
+    pass
+
+
+class TestIsolatedProcedures(unittest.TestCase):
+  def setUp(self):
+    self.server = noded.NodeHttpServer(_FakeMainloop(), "127.0.0.1", 0,
+                                       num_workers=2, keep_alive_timeout=60)
+
+  def tearDown(self):
+    self.server.del_channel()
+    self.server.socket.close()
+
+  def testProceduresExist(self):
+    for name in noded._ISOLATED_PROCEDURES:
+      self.assertTrue(callable(getattr(self.server, "perspective_%s" % name,
+                                       None)),
+                      msg="Isolated procedure %s doesn't exist" % name)
+
+  def testIsolateRequest(self):
+    for name in ["instance_start", "instance_os_add", "hooks_runner",
+                 "node_leave_cluster"]:
+      self.assertTrue(self.server.IsolateRequest(http.HTTP_PUT, "/%s" % name))
+
+    for name in ["version", "node_info", "blockdev_find", "all_instances_info",
+                 "instance_start_foo"]:
+      self.assertFalse(self.server.IsolateRequest(http.HTTP_PUT, "/%s" % name))
+
+
+if __name__ == "__main__":
+  testutils.GanetiTestProgram()
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for unittesting the ssconf module"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ganeti import constants
+from ganeti import errors
+from ganeti import serializer
+from ganeti import ssconf
+from ganeti import utils
+
+import testutils
+
+
+def _MakeNic(ip, link=None):
+  if link is None:
+    nicparams = {}
+  else:
+    nicparams = { constants.NIC_LINK: link, }
+  return { "mac": "aa:00:00:00:00:01", "ip": ip, "nicparams": nicparams, }
+
+
+class TestNicIndex(unittest.TestCase):
+  def test(self):
+    default = { constants.NIC_LINK: "br0", }
+    instances = {
+      "inst1": { "nics": [_MakeNic("192.0.2.1"),
+                          _MakeNic("198.51.100.1", link="br1")], },
+      "inst2": { "nics": [_MakeNic(None), _MakeNic("192.0.2.2")], },
+      "inst3": { "nics": [], },
+      }
+
+    index = ssconf._NicIndex()
+    self.assertEqual(index.Update(default, instances), 3)
+    self.assertEqual(index.ip_to_inst_by_link, {
+      "br0": { "192.0.2.1": "inst1", "192.0.2.2": "inst2", },
+      "br1": { "198.51.100.1": "inst1", },
+      })
+    self.assertEqual(sorted(index.ips_by_link["br0"]),
+                     ["192.0.2.1", "192.0.2.2"])
+    self.assertEqual(index.ips_by_link["br1"], ["198.51.100.1"])
+
+    # Unchanged NICs are not indexed again
+    self.assertEqual(index.Update(dict(default), instances), 0)
+
+    instances["inst2"] = { "nics": [_MakeNic("192.0.2.3", link="br1")], }
+    del instances["inst3"]
+    self.assertEqual(index.Update(default, instances), 1)
+    self.assertEqual(index.ip_to_inst_by_link, {
+      "br0": { "192.0.2.1": "inst1", },
+      "br1": { "198.51.100.1": "inst1", "192.0.2.3": "inst2", },
+      })
+
+    # Removing an instance updates the index
+    del instances["inst2"]
+    self.assertEqual(index.Update(default, instances), 0)
+    self.assertEqual(index.ips_by_link, {
+      "br0": ["192.0.2.1"],
+      "br1": ["198.51.100.1"],
+      })
+
+    # Changed default parameters affect all instances
+    self.assertEqual(index.Update({ constants.NIC_LINK: "br2", }, instances),
+                     1)
+    self.assertEqual(index.ips_by_link, {
+      "br2": ["192.0.2.1"],
+      "br1": ["198.51.100.1"],
+      })
+
+
+class TestSimpleConfigReader(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.cfg_file = utils.PathJoin(self.tmpdir, "config.data")
+    self.data = {
+      "serial_no": 1,
+      "cluster": {
+        "cluster_name": "cluster.example.com",
+        "master_node": "node1.example.com",
+        "nicparams": {
+          constants.PP_DEFAULT: { constants.NIC_LINK: "br0", },
+          },
+        },
+      "nodes": {
+        "node1.example.com": {
+          "primary_ip": "192.0.2.1",
+          "master_candidate": True,
+          },
+        "node2.example.com": {
+          "primary_ip": "192.0.2.2",
+          "master_candidate": False,
+          },
+        },
+      "instances": {
+        "inst1.example.com": {
+          "primary_node": "node1.example.com",
+          "nics": [_MakeNic("198.51.100.1")],
+          },
+        },
+      }
+    self._Write()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _Write(self):
+    utils.WriteFile(self.cfg_file, data=serializer.DumpJson(self.data))
+    # Make sure the reader notices the change
+    os.utime(self.cfg_file, (0, self.data["serial_no"]))
+
+  def test(self):
+    reader = ssconf.SimpleConfigReader(file_name=self.cfg_file)
+    self.assertEqual(reader.GetConfigSerialNo(), 1)
+    self.assertEqual(reader.GetMasterNode(), "node1.example.com")
+    self.assertEqual(sorted(reader.GetNodesPrimaryIps()),
+                     ["192.0.2.1", "192.0.2.2"])
+    self.assertEqual(reader.GetMasterCandidatesPrimaryIps(), ["192.0.2.1"])
+    self.assertEqual(reader.GetNodePrimaryIp("node2.example.com"),
+                     "192.0.2.2")
+    self.assertEqual(reader.GetInstancePrimaryNode("inst1.example.com"),
+                     "node1.example.com")
+    self.assertEqual(reader.GetInstanceByLinkIp("198.51.100.1", None),
+                     "inst1.example.com")
+    self.assertEqual(reader.GetInstanceByLinkIp("198.51.100.1", "br1"), None)
+    self.assertEqual(reader.GetInstancesIps(None), ["198.51.100.1"])
+    self.assertEqual(reader.GetInstancesIps("br1"), [])
+
+    self.assertFalse(reader.Reload())
+
+    self.data["serial_no"] = 2
+    self.data["nodes"]["node2.example.com"]["master_candidate"] = True
+    self.data["instances"]["inst2.example.com"] = {
+      "primary_node": "node2.example.com",
+      "nics": [_MakeNic("198.51.100.2", link="br1")],
+      }
+    self._Write()
+
+    self.assertTrue(reader.Reload())
+    self.assertEqual(reader.GetConfigSerialNo(), 2)
+    self.assertEqual(sorted(reader.GetMasterCandidatesPrimaryIps()),
+                     ["192.0.2.1", "192.0.2.2"])
+    self.assertEqual(reader.GetInstanceByLinkIp("198.51.100.2", "br1"),
+                     "inst2.example.com")
+    self.assertEqual(reader.GetInstancesIps("br1"), ["198.51.100.2"])
+    self.assertEqual(reader.GetInstancesIps("br0"), ["198.51.100.1"])
+
+  def testInvalid(self):
+    utils.WriteFile(self.cfg_file, data=serializer.DumpJson([]))
+    self.assertRaises(errors.ConfigurationError, ssconf.SimpleConfigReader,
+                      file_name=self.cfg_file)
+
+    utils.WriteFile(self.cfg_file, data="{")
+    self.assertRaises(errors.ConfigurationError, ssconf.SimpleConfigReader,
+                      file_name=self.cfg_file)
+
+  def testMissing(self):
+    self.assertRaises(errors.ConfigurationError, ssconf.SimpleConfigReader,
+                      file_name=utils.PathJoin(self.tmpdir, "missing"))
+
+
+if __name__ == "__main__":
+  testutils.GanetiTestProgram()
@@ -509,6 +509,42 @@ class TestRunParts(testutils.GanetiTestCase):
     nosuchdir = utils.PathJoin(self.rundir, "no/such/directory")
     self.assertEqual(utils.RunParts(nosuchdir), [])
 
+  def testParallel(self):
+    """Test scripts which only finish when run at the same time"""
+    names = ["00test", "10test", "20test"]
+    for name in names:
+      others = [utils.PathJoin(self.rundir, "%s.started" % other)
+                for other in names if other != name]
+      utils.WriteFile(os.path.join(self.rundir, name), mode=0700,
+                      data=("#!/bin/sh\ntouch %s\n"
+                            "until [ -e %s ] && [ -e %s ]; do sleep 0.1; done\n"
+                            "echo -n %s\n" %
+                            (utils.PathJoin(self.rundir, "%s.started" % name),
+                             others[0], others[1], name)))
+    utils.WriteFile(os.path.join(self.rundir, "30test.skip"), data="")
+
+    results = utils.RunParts(self.rundir, reset_env=True, timeout=20,
+                             max_parallel=5)
+    self.assertEqual(len(results), 4)
+    for (name, (relname, status, runresult)) in zip(names, results):
+      self.assertEqual(relname, name)
+      self.assertEqual(status, constants.RUNPARTS_RUN)
+      self.assertFalse(runresult.failed)
+      self.assertEqual(runresult.output, name)
+      self.assertTrue(runresult.duration >= 0)
+    self.assertEqual(results[3], ("30test.skip", constants.RUNPARTS_SKIP, None))
+
+  def testTimeout(self):
+    fname = os.path.join(self.rundir, "00test")
+    utils.WriteFile(fname, mode=0700, data="#!/bin/sh\nexec sleep 60\n")
+    ((relname, status, runresult), ) = \
+      utils.RunParts(self.rundir, reset_env=True, timeout=1)
+    self.assertEqual(relname, "00test")
+    self.assertEqual(status, constants.RUNPARTS_RUN)
+    self.assertTrue(runresult.failed)
+    self.assertTrue(runresult.timed_out)
+    self.assertTrue(runresult.duration < 30)
+
 
 class TestStartDaemon(testutils.GanetiTestCase):
   def setUp(self):
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Script for testing ganeti.watcher"""
+
+import tempfile
+import unittest
+
+from ganeti import constants
+from ganeti import errors
+from ganeti import watcher
+
+import testutils
+
+
+class _FakeClient(object):
+  """Fake LUXI client running every job for a number of polls.
+
+  """
+  def __init__(self, polls=2, failing=None, unsubmittable=None):
+    self.polls = polls
+    self.failing = frozenset(failing or [])
+    self.unsubmittable = frozenset(unsubmittable or [])
+    self.submit_calls = 0
+    self.max_node_jobs = {}
+    self._jobs = {}
+    self._next_id = 100
+
+  def _NodeJobs(self):
+    result = {}
+    for (instance, _, remaining) in self._jobs.values():
+      if remaining > 0:
+        for node in instance.GetNodes():
+          result[node] = result.get(node, 0) + 1
+    return result
+
+  def SubmitManyJobs(self, jobs):
+    self.submit_calls += 1
+    result = []
+    for ops in jobs:
+      self.assertEqual(len(ops), 1)
+      name = ops[0].instance_name
+      if name in self.unsubmittable:
+        result.append((False, "Queue is full"))
+        continue
+      job_id = str(self._next_id)
+      self._next_id += 1
+      self._jobs[job_id] = (self.instances[name], ops[0], self.polls)
+      result.append((True, job_id))
+
+    for (node, count) in self._NodeJobs().items():
+      self.max_node_jobs[node] = max(count, self.max_node_jobs.get(node, 0))
+
+    return result
+
+  def QueryJobs(self, job_ids, fields):
+    self.assertEqual(fields, ["status", "opresult"])
+    result = []
+    for job_id in job_ids:
+      (instance, op, remaining) = self._jobs[job_id]
+      if remaining > 0:
+        remaining -= 1
+        self._jobs[job_id] = (instance, op, remaining)
+      if remaining > 0:
+        result.append([constants.JOB_STATUS_RUNNING, [None]])
+      elif instance.name == "lost":
+        result.append(None)
+      elif instance.name in self.failing:
+        err = errors.OpExecError("Start of %s failed" % instance.name)
+        result.append([constants.JOB_STATUS_ERROR,
+                       [errors.EncodeException(err)]])
+      else:
+        result.append([constants.JOB_STATUS_SUCCESS, [None]])
+    return result
+
+  @staticmethod
+  def assertEqual(first, second):
+    assert first == second, "%r != %r" % (first, second)
+
+
+class TestRunInstanceJobs(unittest.TestCase):
+  def setUp(self):
+    self.sleeps = 0
+
+  def _Sleep(self, _):
+    self.sleeps += 1
+
+  def _Run(self, cl, instances, jobs_per_node):
+    cl.instances = dict((inst.name, inst) for inst in instances)
+    return watcher.RunInstanceJobs(cl, [(inst, inst.GetRestartOp())
+                                        for inst in instances],
+                                   jobs_per_node, _sleep_fn=self._Sleep)
+
+  def test(self):
+    instances = [watcher.Instance("inst%d" % i, constants.INSTST_ERRORDOWN,
+                                  True, "node%d" % (i % 3),
+                                  ["node%d" % ((i + 1) % 3)])
+                 for i in range(20)]
+    cl = _FakeClient()
+    results = self._Run(cl, instances, 4)
+
+    self.assertEqual(sorted(results), sorted(i.name for i in instances))
+    for (job_id, status, message) in results.values():
+      self.assertTrue(job_id)
+      self.assertEqual(status, constants.JOB_STATUS_SUCCESS)
+      self.assertEqual(message, None)
+
+    # The limit was reached on every node but never exceeded
+    self.assertEqual(cl.max_node_jobs,
+                     { "node0": 4, "node1": 4, "node2": 4, })
+    # Jobs were submitted in batches
+    self.assertTrue(cl.submit_calls < len(instances))
+    self.assertTrue(self.sleeps > 0)
+
+  def testNoLimit(self):
+    instances = [watcher.Instance("inst%d" % i, constants.INSTST_ERRORDOWN,
+                                  True, "node1", []) for i in range(10)]
+    cl = _FakeClient()
+    self._Run(cl, instances, len(instances))
+    self.assertEqual(cl.submit_calls, 1)
+    self.assertEqual(cl.max_node_jobs, { "node1": len(instances), })
+
+  def testErrors(self):
+    instances = [watcher.Instance(name, constants.INSTST_ERRORDOWN, True,
+                                  "node1", [])
+                 for name in ["good", "failing", "lost", "unsubmittable"]]
+    cl = _FakeClient(polls=1, failing=["failing"],
+                     unsubmittable=["unsubmittable"])
+    results = self._Run(cl, instances, 1)
+
+    self.assertEqual(results["good"][1], constants.JOB_STATUS_SUCCESS)
+    (_, status, message) = results["failing"]
+    self.assertEqual(status, constants.JOB_STATUS_ERROR)
+    self.assertTrue("Start of failing failed" in message)
+    self.assertEqual(results["lost"][1], constants.JOB_STATUS_ERROR)
+    self.assertEqual(results["unsubmittable"],
+                     (None, constants.JOB_STATUS_ERROR,
+                      "Can't submit job: Queue is full"))
+    self.assertEqual(cl.max_node_jobs, { "node1": 1, })
+
+  def testEmpty(self):
+    self.assertEqual(self._Run(_FakeClient(), [], 1), {})
+
+
+class TestWatcherState(unittest.TestCase):
+  def test(self):
+    state = watcher.WatcherState(tempfile.TemporaryFile())
+    inst1 = watcher.Instance("inst1", constants.INSTST_ERRORDOWN, True,
+                             "node1", [])
+    inst2 = watcher.Instance("inst2", constants.INSTST_ERRORDOWN, True,
+                             "node1", [])
+
+    self.assertEqual(state.GetJobResult(inst1), None)
+    state.RecordJobResult(inst1, "restart", "123",
+                          constants.JOB_STATUS_SUCCESS, None)
+    state.RecordJobResult(inst2, "restart", None, constants.JOB_STATUS_ERROR,
+                          "Can't submit job")
+
+    result = state.GetJobResult(inst1)
+    self.assertEqual(result[watcher.KEY_RESULT_OP], "restart")
+    self.assertEqual(result[watcher.KEY_RESULT_JOB], "123")
+    self.assertEqual(result[watcher.KEY_RESULT_STATUS],
+                     constants.JOB_STATUS_SUCCESS)
+    self.assertEqual(state.GetJobResult(inst2)[watcher.KEY_RESULT_MESSAGE],
+                     "Can't submit job")
+
+    # Results for removed instances are forgotten
+    state.MaintainInstanceList(["inst1"])
+    self.assertTrue(state.GetJobResult(inst1))
+    self.assertEqual(state.GetJobResult(inst2), None)
+
+    # Expired results are forgotten
+    state.GetJobResult(inst1)[watcher.KEY_RESULT_WHEN] = 0
+    state.MaintainInstanceList(["inst1"])
+    self.assertEqual(state.GetJobResult(inst1), None)
+
+
+if __name__ == "__main__":
+  testutils.GanetiTestProgram()
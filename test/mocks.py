@@ -26,6 +26,7 @@ import os
 
 from ganeti import utils
 from ganeti import netutils
+from ganeti import constants
 
 
 FAKE_CLUSTER_KEY = ("AAAAB3NzaC1yc2EAAAABIwAAAQEAsuGLw70et3eApJ/ZEJkAVZogIrm"
@@ -58,6 +59,9 @@ class FakeConfig:
   def GetDefaultIAllocator(Self):
     return "testallocator"
 
+  def GetHypervisorType(self):
+    return constants.HT_XEN_PVM
+
 
 class FakeProc:
   """Fake processor object"""
@@ -81,6 +85,7 @@ class FakeContext:
   def __init__(self):
     self.cfg = FakeConfig()
     self.glm = None
+    self.livedata = None
 
 
 class FakeGetentResolver:
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Benchmark for RPC connections to nodes.
+
+Starts an HTTPS server with pre-forked workers, as used by the node daemon
+when started with "--workers", and makes multi-node calls to it from a number
+of threads. Nodes are simulated using different loopback addresses. The
+following connection handling modes are compared:
+
+  - a new connection for every call, as with a node daemon forking for every
+    connection
+  - one connection pool per thread
+  - one connection pool shared by all threads, as used by the master daemon
+
+"""
+
+# pylint: disable-msg=C0103
+# C0103: Invalid name rpc_benchmark
+
+import os
+import sys
+import time
+import signal
+import socket
+import shutil
+import optparse
+import tempfile
+import threading
+
+import pycurl
+
+from ganeti import daemon
+from ganeti import errors
+from ganeti import http
+from ganeti import rpc
+from ganeti import serializer
+from ganeti import utils
+
+import ganeti.http.client # pylint: disable-msg=W0611
+import ganeti.http.server # pylint: disable-msg=W0611
+
+
+#: Payload similar to the one returned by a node for "node_info"
+_NODE_INFO = {
+  "vg_size": 1024 * 1024,
+  "vg_free": 512 * 1024,
+  "memory_total": 32768,
+  "memory_free": 16384,
+  "memory_dom0": 1024,
+  "cpu_total": 16,
+  "bootid": "fe3ff8d8-fb33-4a0b-ae67-b1f5c1c4b0c4",
+  }
+
+
+class _BenchmarkServer(http.server.HttpServer):
+  def HandleRequest(self, req): # pylint: disable-msg=W0613
+    return serializer.DumpJson((True, _NODE_INFO), indent=False)
+
+
+def _RunServer(port, cert_file, num_workers):
+  """Runs the HTTPS server, never returns.
+
+  """
+  try:
+    mainloop = daemon.Mainloop()
+    ssl_params = http.HttpSslParams(ssl_key_path=cert_file,
+                                    ssl_cert_path=cert_file)
+    server = _BenchmarkServer(mainloop, "0.0.0.0", port,
+                              ssl_params=ssl_params, ssl_verify_peer=True,
+                              num_workers=num_workers,
+                              keep_alive_timeout=60)
+    server.Start()
+    try:
+      mainloop.Run()
+    finally:
+      server.Stop()
+  finally:
+    os._exit(0) # pylint: disable-msg=W0212
+
+
+def _WaitForServer(port, curl_config_fn):
+  """Waits until the server answers calls.
+
+  """
+  for _ in range(100):
+    try:
+      _Call(["127.0.0.1"], port, http.client.HttpClientPool(curl_config_fn))
+      return
+    except errors.OpExecError:
+      time.sleep(0.1)
+
+  raise Exception("Server didn't start")
+
+
+def _GetFreePort():
+  """Returns a currently unused TCP port.
+
+  """
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  try:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+  finally:
+    sock.close()
+
+
+def _GetCurlConfigFn(cert_file):
+  """Returns a function configuring cURL like L{rpc._ConfigRpcCurl}.
+
+  """
+  def fn(curl):
+    curl.setopt(pycurl.FOLLOWLOCATION, False)
+    curl.setopt(pycurl.CAINFO, cert_file)
+    curl.setopt(pycurl.SSL_VERIFYHOST, 0)
+    curl.setopt(pycurl.SSL_VERIFYPEER, True)
+    curl.setopt(pycurl.SSLCERTTYPE, "PEM")
+    curl.setopt(pycurl.SSLCERT, cert_file)
+    curl.setopt(pycurl.SSLKEYTYPE, "PEM")
+    curl.setopt(pycurl.SSLKEY, cert_file)
+    curl.setopt(pycurl.CONNECTTIMEOUT, rpc._RPC_CONNECT_TIMEOUT)
+  return fn
+
+
+def _Call(nodes, port, pool):
+  """Makes one multi-node call.
+
+  """
+  client = rpc.Client("node_info", serializer.DumpJson(["xenvg", "xen-pvm"],
+                                                       indent=False),
+                      port)
+  client.ConnectList(nodes, address_list=nodes)
+  for (node, result) in client.GetResults(http_pool=pool).items():
+    result.Raise("Call to %s failed" % node)
+
+
+def _Benchmark(title, get_pool_fn, options, nodes, port):
+  """Runs the calls from all threads and prints the results.
+
+  """
+  durations = []
+  errs = []
+
+  def _Worker():
+    try:
+      pool = None
+      for _ in range(options.calls):
+        pool = get_pool_fn(pool)
+        start = time.time()
+        _Call(nodes, port, pool)
+        durations.append(time.time() - start)
+    except Exception, err: # pylint: disable-msg=W0703
+      errs.append(err)
+
+  start = time.time()
+  threads = [threading.Thread(target=_Worker)
+             for _ in range(options.threads)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  total = time.time() - start
+
+  if errs:
+    raise errs[0]
+
+  durations.sort()
+  print ("%-20s %8.2f s total   %8.2f ms/call   %8.2f ms median   %8.2f ms"
+         " max" %
+         (title, total, sum(durations) * 1000 / len(durations),
+          durations[len(durations) / 2] * 1000, durations[-1] * 1000))
+
+
+def ParseOptions():
+  """Parses the command line options.
+
+  """
+  parser = optparse.OptionParser(usage="%prog [options]")
+  parser.add_option("--nodes", dest="nodes", type="int", default=20,
+                    help="Number of simulated nodes [20]")
+  parser.add_option("--threads", dest="threads", type="int", default=4,
+                    help="Number of threads making calls [4]")
+  parser.add_option("--calls", dest="calls", type="int", default=25,
+                    help="Number of calls per thread [25]")
+  parser.add_option("--workers", dest="workers", type="int", default=0,
+                    help=("Number of server worker processes [one per"
+                          " thread and node]"))
+
+  (options, args) = parser.parse_args()
+  if args:
+    parser.error("No arguments expected")
+  if options.nodes < 1 or options.nodes > 250:
+    parser.error("Number of nodes must be between 1 and 250")
+
+  return options
+
+
+def main():
+  """Main function.
+
+  """
+  options = ParseOptions()
+
+  # Every connection kept open by a client occupies a worker
+  num_workers = options.workers or (options.threads * options.nodes)
+
+  nodes = ["127.0.0.%d" % (idx + 1) for idx in range(options.nodes)]
+  port = _GetFreePort()
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    cert_file = utils.PathJoin(tmpdir, "server.pem")
+    utils.GenerateSelfSignedSslCert(cert_file)
+
+    pid = os.fork()
+    if pid == 0:
+      _RunServer(port, cert_file, num_workers)
+
+    try:
+      rpc.Init()
+      try:
+        curl_config_fn = _GetCurlConfigFn(cert_file)
+
+        _WaitForServer(port, curl_config_fn)
+
+        print ("%d threads making %d calls each to %d nodes, %d server"
+               " workers" %
+               (options.threads, options.calls, options.nodes, num_workers))
+
+        _Benchmark("new connections",
+                   lambda _: http.client.HttpClientPool(curl_config_fn),
+                   options, nodes, port)
+
+        _Benchmark("per-thread pools",
+                   lambda pool: (pool or
+                                 http.client.HttpClientPool(curl_config_fn)),
+                   options, nodes, port)
+
+        shared_pool = \
+          http.client.HttpClientPool(curl_config_fn,
+                                     max_idle_time=rpc._RPC_MAX_IDLE_TIME,
+                                     max_idle_clients=
+                                       rpc._RPC_MAX_IDLE_CONNECTIONS)
+        _Benchmark("shared pool", lambda _: shared_pool, options, nodes, port)
+
+        # Connections must be closed before cleaning up cURL
+        shared_pool = None
+      finally:
+        rpc.Shutdown()
+    finally:
+      os.kill(pid, signal.SIGTERM)
+      os.waitpid(pid, 0)
+  finally:
+    shutil.rmtree(tmpdir)
+
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Benchmark for the serializer module.
+
+Measures serializing and loading a generated configuration of a large
+cluster and of job files, both indented (as written to disk) and compact
+(as sent over the network).
+
+"""
+
+# pylint: disable-msg=C0103
+# C0103: Invalid name serializer_benchmark
+
+import sys
+import time
+import optparse
+
+from ganeti import constants
+from ganeti import objects
+from ganeti import opcodes
+from ganeti import serializer
+from ganeti import utils
+
+
+def _MakeConfig(num_nodes, num_instances):
+  """Generates the configuration data of a cluster.
+
+  @rtype: dict
+  @return: serialized form of an L{objects.ConfigData} object
+
+  """
+  group_uuid = utils.NewUUID()
+
+  cluster = objects.Cluster(
+    serial_no=1,
+    rsahostkeypub="ssh-rsa " + ("A" * 372),
+    highest_used_port=constants.FIRST_DRBD_PORT + num_instances,
+    mac_prefix="aa:00:00",
+    volume_group_name="xenvg",
+    drbd_usermode_helper="/bin/true",
+    nicparams={ constants.PP_DEFAULT: constants.NICC_DEFAULTS, },
+    ndparams=constants.NDC_DEFAULTS,
+    tcpudp_port_pool=set(),
+    enabled_hypervisors=[constants.HT_XEN_PVM],
+    master_node="node0.example.com",
+    master_ip="192.0.2.1",
+    master_netdev=constants.DEFAULT_BRIDGE,
+    cluster_name="cluster.example.com",
+    file_storage_dir="/srv/ganeti/file-storage",
+    uid_pool=[],
+    uuid=utils.NewUUID(),
+    )
+  cluster.UpgradeConfig()
+
+  nodes = {}
+  for idx in range(num_nodes):
+    name = "node%d.example.com" % idx
+    nodes[name] = objects.Node(name=name, primary_ip="192.0.2.%d" % idx,
+                               secondary_ip="198.51.100.%d" % idx,
+                               master_candidate=(idx < 10), offline=False,
+                               drained=False, group=group_uuid, ndparams={},
+                               uuid=utils.NewUUID(), serial_no=1,
+                               ctime=time.time(), mtime=time.time())
+
+  instances = {}
+  for idx in range(num_instances):
+    name = "instance%d.example.com" % idx
+    pnode = "node%d.example.com" % (idx % num_nodes)
+    snode = "node%d.example.com" % ((idx + 1) % num_nodes)
+    disks = []
+    for disk_idx in range(2):
+      lvs = [objects.Disk(dev_type=constants.LD_LV, size=size,
+                          logical_id=("xenvg", "%s.disk%d_%s" %
+                                      (utils.NewUUID(), disk_idx, suffix)))
+             for (size, suffix) in [(10240, "data"), (128, "meta")]]
+      disks.append(objects.Disk(dev_type=constants.LD_DRBD8, size=10240,
+                                logical_id=(pnode, snode,
+                                            constants.FIRST_DRBD_PORT + idx,
+                                            disk_idx, disk_idx,
+                                            utils.GenerateSecret()),
+                                children=lvs, iv_name="disk/%d" % disk_idx,
+                                mode=constants.DISK_RDWR))
+    nics = [objects.NIC(mac="aa:00:00:%02x:%02x:%02x" %
+                        (idx >> 16, (idx >> 8) & 0xff, idx & 0xff),
+                        ip=None, nicparams={})]
+    instances[name] = objects.Instance(name=name, primary_node=pnode,
+                                       os="debootstrap+default",
+                                       hypervisor=constants.HT_XEN_PVM,
+                                       hvparams={}, beparams={}, osparams={},
+                                       admin_up=True, nics=nics, disks=disks,
+                                       disk_template=constants.DT_DRBD8,
+                                       network_port=None,
+                                       uuid=utils.NewUUID(), serial_no=1,
+                                       ctime=time.time(), mtime=time.time())
+
+  nodegroups = {
+    group_uuid: objects.NodeGroup(name="default", uuid=group_uuid,
+                                  members=nodes.keys(), ndparams={},
+                                  alloc_policy=constants.ALLOC_POLICY_PREFERRED,
+                                  serial_no=1),
+    }
+
+  data = objects.ConfigData(version=constants.CONFIG_VERSION,
+                            cluster=cluster, nodes=nodes,
+                            instances=instances, nodegroups=nodegroups,
+                            serial_no=1)
+
+  return data.ToDict()
+
+
+def _MakeJob(job_id, num_log_entries):
+  """Generates the serialized form of a finished job.
+
+  """
+  now = utils.SplitTime(time.time())
+  op = opcodes.OpInstanceCreate(instance_name="instance1.example.com",
+                                mode=constants.INSTANCE_CREATE,
+                                disk_template=constants.DT_DRBD8,
+                                disks=[{ constants.IDISK_SIZE: 10240, }],
+                                nics=[{}], os_type="debootstrap+default",
+                                pnode="node1.example.com",
+                                snode="node2.example.com", beparams={},
+                                hvparams={})
+  log = [(serial, now, constants.ELOG_MESSAGE,
+          "* disk %d: syncing, %0.2f%% done, estimated %d seconds remaining" %
+          (serial % 2, serial * 100.0 / num_log_entries, num_log_entries))
+         for serial in range(num_log_entries)]
+
+  return {
+    "id": job_id,
+    "ops": [{
+      "input": op.__getstate__(),
+      "status": constants.OP_STATUS_SUCCESS,
+      "result": ["instance1.example.com"],
+      "log": log,
+      "start_timestamp": now,
+      "exec_timestamp": now,
+      "end_timestamp": now,
+      "priority": constants.OP_PRIO_DEFAULT,
+      }],
+    "start_timestamp": now,
+    "end_timestamp": now,
+    "received_timestamp": now,
+    }
+
+
+def _Measure(fn, repeat):
+  """Calls a function repeatedly and returns the best time per call.
+
+  """
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    fn()
+    duration = time.time() - start
+    if best is None or duration < best:
+      best = duration
+  return best
+
+
+def _Benchmark(title, data, repeat):
+  """Runs and prints the measurements for one data set.
+
+  """
+  for indent in [True, False]:
+    txt = serializer.DumpJson(data, indent=indent)
+    dump_time = _Measure(lambda: serializer.DumpJson(data, indent=indent),
+                         repeat)
+    load_time = _Measure(lambda: serializer.LoadJson(txt), repeat)
+
+    if indent:
+      mode = "indented"
+    else:
+      mode = "compact"
+
+    print ("%-24s %-8s %10d bytes   dump %8.2f ms   load %8.2f ms" %
+           (title, mode, len(txt), dump_time * 1000, load_time * 1000))
+
+
+def ParseOptions():
+  """Parses the command line options.
+
+  """
+  parser = optparse.OptionParser(usage="%prog [options]")
+  parser.add_option("--nodes", dest="nodes", type="int", default=200,
+                    help="Number of nodes in the configuration [200]")
+  parser.add_option("--instances", dest="instances", type="int",
+                    default=5000,
+                    help="Number of instances in the configuration [5000]")
+  parser.add_option("--log-entries", dest="log_entries", type="int",
+                    default=1000,
+                    help="Number of log entries in the large job [1000]")
+  parser.add_option("--repeat", dest="repeat", type="int", default=5,
+                    help="Number of repetitions, the best time is shown [5]")
+
+  (options, args) = parser.parse_args()
+  if args:
+    parser.error("No arguments expected")
+
+  return options
+
+
+def main():
+  """Main function.
+
+  """
+  options = ParseOptions()
+
+  encoder = serializer._GetJsonEncoderClass() # pylint: disable-msg=W0212
+  print "Encoder: %s.%s" % (encoder.__module__, encoder.__name__)
+
+  _Benchmark("configuration", _MakeConfig(options.nodes, options.instances),
+             options.repeat)
+  _Benchmark("job (small)", _MakeJob(1, 10), options.repeat)
+  _Benchmark("job (large)", _MakeJob(2, options.log_entries), options.repeat)
+
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+#
+
+# Copyright (C) 2011 Google Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+
+
+"""Benchmark for reloading the configuration in ssconf.SimpleConfigReader.
+
+Measures, on a generated configuration of a large cluster, how long the
+reader takes to reload the configuration file and to answer the first
+lookup by instance IP address afterwards, for changes not touching any
+instance NIC and for a change of one NIC.
+
+"""
+
+# pylint: disable-msg=C0103
+# C0103: Invalid name ssconf_benchmark
+
+import os
+import sys
+import time
+import shutil
+import optparse
+import tempfile
+
+from ganeti import serializer
+from ganeti import ssconf
+from ganeti import utils
+
+import confd_benchmark
+
+
+def _WriteConfig(cfg_file, data):
+  """Writes the configuration, making sure the reader notices the change.
+
+  """
+  utils.WriteFile(cfg_file, data=serializer.DumpJson(data))
+  # The file's modification time may not have changed within one second
+  now = time.time()
+  os.utime(cfg_file, (now, now + data["serial_no"]))
+
+
+def _Measure(reader, cfg_file, data, change_fn, repeat):
+  """Changes and reloads the configuration repeatedly.
+
+  @return: best times for reloading and for the first IP lookup
+
+  """
+  best_reload = None
+  best_lookup = None
+  for _ in range(repeat):
+    change_fn(data)
+    data["serial_no"] += 1
+    _WriteConfig(cfg_file, data)
+
+    start = time.time()
+    assert reader.Reload()
+    reload_time = time.time() - start
+
+    start = time.time()
+    assert reader.GetInstanceByLinkIp(confd_benchmark._InstanceIp(0), None)
+    lookup_time = time.time() - start
+
+    if best_reload is None or reload_time < best_reload:
+      best_reload = reload_time
+    if best_lookup is None or lookup_time < best_lookup:
+      best_lookup = lookup_time
+
+  return (best_reload, best_lookup)
+
+
+def _ChangeSerial(_):
+  """Change only affecting the serial number.
+
+  """
+
+
+def _ChangeInstanceStatus(data):
+  """Changes an instance's status.
+
+  """
+  instance = data["instances"][sorted(data["instances"])[-1]]
+  instance["admin_up"] = not instance["admin_up"]
+
+
+def _ChangeNic(data):
+  """Changes an instance's NIC.
+
+  """
+  nic = data["instances"][sorted(data["instances"])[-1]]["nics"][0]
+  nic["nicparams"]["link"] = "%s-x" % nic["nicparams"].get("link", "br")
+
+
+def ParseOptions():
+  """Parses the command line options.
+
+  """
+  parser = optparse.OptionParser(usage="%prog [options]")
+  parser.add_option("--nodes", dest="nodes", type="int", default=200,
+                    help="Number of nodes in the configuration [200]")
+  parser.add_option("--instances", dest="instances", type="int",
+                    default=5000,
+                    help="Number of instances in the configuration [5000]")
+  parser.add_option("--repeat", dest="repeat", type="int", default=5,
+                    help="Number of repetitions, the best time is shown [5]")
+
+  (options, args) = parser.parse_args()
+  if args:
+    parser.error("No arguments expected")
+  if options.nodes < 1 or options.nodes > 250:
+    parser.error("Number of nodes must be between 1 and 250")
+  if options.instances < 1 or options.instances > 65536:
+    parser.error("Number of instances must be between 1 and 65536")
+
+  return options
+
+
+def main():
+  """Main function.
+
+  """
+  options = ParseOptions()
+
+  data = confd_benchmark._MakeConfig(options.nodes, # pylint: disable-msg=W0212
+                                     options.instances)
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    cfg_file = utils.PathJoin(tmpdir, "config.data")
+    _WriteConfig(cfg_file, data)
+
+    start = time.time()
+    reader = ssconf.SimpleConfigReader(file_name=cfg_file)
+    load_time = time.time() - start
+    start = time.time()
+    reader.GetInstanceByLinkIp(confd_benchmark._InstanceIp(0), None)
+    index_time = time.time() - start
+
+    print ("%d nodes, %d instances: initial load %.2f ms, building IP index"
+           " %.2f ms" %
+           (options.nodes, options.instances, load_time * 1000,
+            index_time * 1000))
+
+    for (title, change_fn) in [("serial number", _ChangeSerial),
+                               ("instance status", _ChangeInstanceStatus),
+                               ("instance NIC", _ChangeNic)]:
+      (reload_time, lookup_time) = \
+        _Measure(reader, cfg_file, data, change_fn, options.repeat)
+      print ("Changed %-16s reload %8.2f ms   first IP lookup %8.2f ms" %
+             (title, reload_time * 1000, lookup_time * 1000))
+  finally:
+    shutil.rmtree(tmpdir)
+
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())